@@ -4,17 +4,32 @@
 
 """
 import concurrent.futures
-import copy
 import datetime
 from enum import IntEnum
 import json
 import os
+import threading
 
 from qgis.PyQt import QtCore
 from qgis.core import QgsTask
 
 from .request import CplusApiRequest
+from ..conf import settings_manager, Settings
+from ..definitions.defaults import DEFAULT_DOWNLOAD_WORKERS
+from ..lib.fingerprint import file_fingerprint
 from ..models.base import Scenario, ScenarioResult, NcsPathway, Activity
+from ..utils import log
+
+
+# Records the outputs verified in a scenario directory so that they are
+# not downloaded again when the scenario outputs are fetched again.
+DOWNLOAD_MANIFEST_FILE_NAME = "download_manifest.json"
+
+# Number of attempts to download an output, partial downloads are resumed.
+MAX_DOWNLOAD_ATTEMPTS = 3
+
+# Output list keys of the file checksums, by hashlib algorithm name
+CHECKSUM_KEYS = ("sha256", "md5")
 
 
 class BaseScenarioTask(QgsTask):
@@ -35,6 +50,7 @@ class BaseFetchScenarioOutput:
         self.downloaded_output = 0
         self.total_file_output = 0
         self.created_datetime = datetime.datetime.now()
+        self._manifest_lock = threading.Lock()
 
     def is_download_cancelled(self):
         """Check if download is cancelled.
@@ -45,6 +61,14 @@ class BaseFetchScenarioOutput:
         """
         return False
 
+    def output_downloaded(self):
+        """Called once an output has been downloaded and verified, with
+        the updated count of downloaded outputs.
+
+        This method should be overriden by child class.
+        """
+        pass
+
     def __create_activity(self, activity: dict, download_dict: list):
         """
         Create activity object from activity and downloaded file dictionary.
@@ -123,26 +147,176 @@ class BaseFetchScenarioOutput:
         )
         return scenario
 
-    def __validate_output_paths(self, download_paths):
-        """Validate whether all output paths exist.
+    def get_download_workers_count(self) -> int:
+        """Gets the maximum number of output files downloaded concurrently.
 
-        :param download_paths: Output file paths
-        :type download_paths: list
+        :returns: Number of download worker threads, at least one.
+        :rtype: int
+        """
+        workers_count = settings_manager.get_value(
+            Settings.DOWNLOAD_WORKERS,
+            default=DEFAULT_DOWNLOAD_WORKERS,
+            setting_type=int,
+        )
+        try:
+            return max(1, int(workers_count))
+        except (TypeError, ValueError):
+            return DEFAULT_DOWNLOAD_WORKERS
+
+    @staticmethod
+    def _output_checksum(output: dict) -> tuple:
+        """Returns the checksum of an output provided by the API.
+
+        :param output: Output from the scenario output list.
+        :type output: dict
+
+        :returns: Hash algorithm and hex digest or None for both if
+        the API does not provide one.
+        :rtype: tuple
+        """
+        for algorithm in CHECKSUM_KEYS:
+            if output.get(algorithm):
+                return algorithm, str(output[algorithm]).lower()
+        return None, None
 
-        :return: True if all paths exist
+    @staticmethod
+    def _file_checksum(path: str, algorithm: str) -> str:
+        """Returns the hex digest of a file with the given algorithm."""
+        return file_fingerprint(path, algorithm)
+
+    @staticmethod
+    def _output_signature(output: dict) -> dict:
+        """Returns the size and checksum of an output provided by the API."""
+        algorithm, checksum = BaseFetchScenarioOutput._output_checksum(output)
+        return {
+            "size": output.get("size"),
+            "algorithm": algorithm,
+            "checksum": checksum,
+        }
+
+    def _read_manifest(self, scenario_directory: str) -> dict:
+        """Reads the outputs verified in a previous fetch.
+
+        :param scenario_directory: Scenario output directory.
+        :type scenario_directory: str
+
+        :returns: Verified output details by path relative to the directory.
+        :rtype: dict
+        """
+        manifest_path = os.path.join(scenario_directory, DOWNLOAD_MANIFEST_FILE_NAME)
+        try:
+            with open(manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, scenario_directory: str, manifest: dict):
+        """Saves the verified outputs of the scenario directory."""
+        manifest_path = os.path.join(scenario_directory, DOWNLOAD_MANIFEST_FILE_NAME)
+        try:
+            os.makedirs(scenario_directory, exist_ok=True)
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+        except OSError as e:
+            log(f"Unable to save the download manifest, {e}", info=False)
+
+    def _verify_output(self, output: dict, path: str, entry: dict = None) -> bool:
+        """Checks whether a downloaded output matches the size and checksum
+        provided by the API.
+
+        :param output: Output from the scenario output list.
+        :type output: dict
+
+        :param path: Local path of the output.
+        :type path: str
+
+        :param entry: Manifest entry of an earlier verification of the file,
+        the checksum is not computed again if the file has not changed.
+        :type entry: dict
+
+        :returns: True if the file is valid. A file without size and
+        checksum from the API is only valid if it has a manifest entry.
         :rtype: bool
         """
-        invalid_indexes = []
-        for idx, path in enumerate(download_paths):
-            if not os.path.exists(path):
-                invalid_indexes.append(idx)
-        return len(invalid_indexes) == 0, invalid_indexes
+        if not os.path.exists(path):
+            return False
+
+        stat = os.stat(path)
+        signature = self._output_signature(output)
+        if signature["size"] is not None and stat.st_size != int(signature["size"]):
+            return False
+
+        if entry is not None:
+            return (
+                entry.get("local_size") == stat.st_size
+                and entry.get("mtime_ns") == stat.st_mtime_ns
+                and entry.get("signature") == signature
+            )
+
+        if signature["checksum"] is not None:
+            return (
+                self._file_checksum(path, signature["algorithm"])
+                == signature["checksum"]
+            )
+
+        return signature["size"] is not None
+
+    def _record_verified_output(
+        self, scenario_directory: str, manifest: dict, output: dict, path: str
+    ):
+        """Adds a verified output to the manifest and saves it."""
+        stat = os.stat(path)
+        with self._manifest_lock:
+            manifest[os.path.relpath(path, scenario_directory)] = {
+                "local_size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "signature": self._output_signature(output),
+            }
+            self._write_manifest(scenario_directory, manifest)
+
+    def __download_output(
+        self, output: dict, path: str, scenario_directory: str, manifest: dict
+    ) -> bool:
+        """Downloads an output and verifies it.
+
+        :returns: True if the output was downloaded and is valid.
+        :rtype: bool
+        """
+        size = output.get("size")
+        try:
+            result = self.download_file(
+                output["url"], path, None if size is None else int(size)
+            )
+        except Exception as e:
+            log(f"Error downloading {output['filename']}, {e}", info=False)
+            return False
+
+        if result is False or not os.path.exists(path):
+            return False
+
+        signature = self._output_signature(output)
+        if signature["checksum"] is not None and not self._verify_output(output, path):
+            log(f"Checksum mismatch of {output['filename']}", info=False)
+            os.remove(path)
+            return False
+
+        self._record_verified_output(scenario_directory, manifest, output, path)
+        # Outputs are downloaded concurrently and failed ones are retried,
+        # each output is counted once after it has been verified.
+        with self._manifest_lock:
+            self.downloaded_output += 1
+            self.output_downloaded()
+        return True
 
     def fetch_scenario_output(
         self, original_scenario, scenario_detail, output_list, scenario_directory
     ):
         """Fetch scenario outputs from API.
 
+        Outputs verified in a previous fetch of the scenario directory
+        are not downloaded again. Failed downloads are retried, resuming
+        from the downloaded content.
+
         :param original_scenario: Original scenario
         :type original_scenario: Scenario
 
@@ -160,7 +334,7 @@ class BaseFetchScenarioOutput:
         self.total_file_output = len(output_list["results"])
         self.downloaded_output = 0
 
-        urls_to_download = []
+        outputs = []
         download_paths = []
         final_output = None
         for output in output_list["results"]:
@@ -173,33 +347,54 @@ class BaseFetchScenarioOutput:
                 download_path = os.path.join(
                     scenario_directory, output["group"], output["filename"]
                 )
-            urls_to_download.append(output["url"])
+            outputs.append(output)
             download_paths.append(download_path)
 
-        download_paths_copy = copy.deepcopy(download_paths)
+        manifest = self._read_manifest(scenario_directory)
+        pending = []
+        for idx, (output, path) in enumerate(zip(outputs, download_paths)):
+            entry = manifest.get(os.path.relpath(path, scenario_directory))
+            if self._verify_output(output, path, entry):
+                if entry is None:
+                    self._record_verified_output(
+                        scenario_directory, manifest, output, path
+                    )
+                self.downloaded_output += 1
+            else:
+                manifest.pop(os.path.relpath(path, scenario_directory), None)
+                pending.append(idx)
+
+        if len(pending) < len(outputs):
+            log(
+                f"Skipping {len(outputs) - len(pending)} scenario outputs "
+                f"already downloaded"
+            )
 
-        # configure max number of iteration
-        max_iteration = len(download_paths_copy * 2)
-        iteration = 0
-        while len(urls_to_download) > 0:
+        attempt = 0
+        while len(pending) > 0 and attempt < MAX_DOWNLOAD_ATTEMPTS:
             with concurrent.futures.ThreadPoolExecutor(
-                max_workers=3 if os.cpu_count() > 3 else 1
+                max_workers=min(self.get_download_workers_count(), len(pending))
             ) as executor:
-                executor.map(self.download_file, urls_to_download, download_paths_copy)
+                results = list(
+                    executor.map(
+                        lambda idx: self.__download_output(
+                            outputs[idx],
+                            download_paths[idx],
+                            scenario_directory,
+                            manifest,
+                        ),
+                        pending,
+                    )
+                )
             if self.is_download_cancelled():
                 return None, None
-            is_valid, invalid_indexes = self.__validate_output_paths(download_paths)
-            if len(invalid_indexes) <= len(urls_to_download):
-                urls_to_download = [urls_to_download[idx] for idx in invalid_indexes]
-                download_paths_copy = [
-                    download_paths_copy[idx] for idx in invalid_indexes
-                ]
-            if iteration == max_iteration:
-                break
-            iteration += 1
-
-        if not self.__validate_output_paths(download_paths):
+            pending = [idx for idx, result in zip(pending, results) if not result]
+            attempt += 1
+
+        if len(pending) > 0:
+            log(f"Unable to download {len(pending)} scenario outputs", info=False)
             return None, None
+
         scenario = self.__create_scenario(
             original_scenario, scenario_detail, output_list, download_paths
         )
@@ -6,7 +6,6 @@
 from datetime import datetime
 import os
 import json
-import time
 import traceback
 import typing
 
@@ -45,6 +44,7 @@ from .request import (
     CplusApiRequestError,
     CplusApiUrl,
     JOB_COMPLETED_STATUS,
+    status_poller,
 )
 
 
@@ -904,6 +904,8 @@ class CalculateNatureBaseZonalStatsTask(QgsTask):
         )
 
         polling = self.request.fetch_zonal_statistics_progress(task_uuid)
+        polling.interval = self.polling_interval
+        polling.cancel_check = self.isCanceled
 
         # Repeatedly poll until final status
         status = True
@@ -926,7 +928,7 @@ class CalculateNatureBaseZonalStatsTask(QgsTask):
                         f"Error while polling zonal statistics progress: {ex}",
                         info=False,
                     )
-                    time.sleep(self.polling_interval)
+                    polling.wait_next()
                     continue
 
                 status_str = response.get("status")
@@ -951,8 +953,9 @@ class CalculateNatureBaseZonalStatsTask(QgsTask):
                     self.result = response
                     break
 
-                # Sleep between poll iterations so that we can control the frequency
-                time.sleep(self.polling_interval)
+                # Wait between poll iterations, the interval adapts to the
+                # job progress and grows while the status is unchanged.
+                polling.wait_next()
 
             return status
         except Exception as ex:
@@ -961,6 +964,8 @@ class CalculateNatureBaseZonalStatsTask(QgsTask):
                 info=False,
             )
             return False
+        finally:
+            status_poller.untrack(polling)
 
     def finished(self, result: bool):
         """Emit signals and persist results in settings."""
@@ -3,17 +3,17 @@ import io
 import json
 import math
 import os
+import random
+import threading
 import time
 import typing
 import uuid
 
-from qgis import processing
 from qgis.PyQt import QtCore
 from qgis.PyQt.QtNetwork import QNetworkRequest, QNetworkReply
 from qgis.core import (
     QgsNetworkAccessManager,
     QgsNetworkReplyContent,
-    QgsProcessingFeedback,
 )
 
 from ..models.base import Scenario, SpatialExtent, Activity, LayerSource
@@ -28,6 +28,7 @@ JOB_CANCELLED_STATUS = "Cancelled"
 JOB_RUNNING_STATUS = "Running"
 JOB_STOPPED_STATUS = "Stopped"
 CHUNK_SIZE = 100 * 1024 * 1024
+PARTIAL_DOWNLOAD_SUFFIX = ".part"
 
 
 def debug_log(message: str, data: dict = {}):
@@ -64,11 +65,142 @@ class CplusApiRequestError(Exception):
         super().__init__(self.message)
 
 
+class CplusStatusPoller:
+    """Schedules the status requests of all the tracked online jobs,
+    i.e. scenario analyses and zonal statistics calculations.
+
+    Requests of the jobs are spaced so that the overall request rate
+    does not grow with the number of jobs, and a status fetched for a
+    job is shared with the other pollers of the same URL instead of
+    requesting it again.
+    """
+
+    # Minimum time in seconds between any two status requests
+    MIN_REQUEST_SPACING = 0.25
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tracked: typing.Dict[int, str] = {}
+        # URL and the time, response and id of the poller that fetched it
+        self._responses: typing.Dict[str, typing.Tuple[float, dict, int]] = {}
+        self._next_request_time = 0.0
+
+    @property
+    def tracked_count(self) -> int:
+        """Returns the number of jobs being polled."""
+        with self._lock:
+            return len(self._tracked)
+
+    def track(self, pooling: "CplusApiPooling"):
+        """Adds a poller to the tracked jobs.
+
+        :param pooling: Poller of a job status
+        :type pooling: CplusApiPooling
+        """
+        with self._lock:
+            self._tracked[id(pooling)] = pooling.url
+
+    def untrack(self, pooling: "CplusApiPooling"):
+        """Removes a poller from the tracked jobs.
+
+        :param pooling: Poller of a job status
+        :type pooling: CplusApiPooling
+        """
+        with self._lock:
+            self._tracked.pop(id(pooling), None)
+            if pooling.url not in self._tracked.values():
+                self._responses.pop(pooling.url, None)
+
+    def reserve_request(self) -> float:
+        """Reserves the next request slot.
+
+        :returns: Time in seconds to wait before sending the request.
+        :rtype: float
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_request_time)
+            self._next_request_time = slot + self.MIN_REQUEST_SPACING
+
+        return slot - now
+
+    def reset(self):
+        """Removes the tracked jobs, shared statuses and request slots."""
+        with self._lock:
+            self._tracked.clear()
+            self._responses.clear()
+            self._next_request_time = 0.0
+
+    def shared_response(
+        self, pooling: "CplusApiPooling", since: float
+    ) -> typing.Optional[dict]:
+        """Returns the status of the poller URL if it was fetched by
+        another poller after the given time.
+
+        :param pooling: Poller of a job status
+        :type pooling: CplusApiPooling
+
+        :param since: Monotonic time of the last poll of the poller.
+        :type since: float
+
+        :returns: The shared status or None if there is no newer status.
+        :rtype: dict
+        """
+        with self._lock:
+            entry = self._responses.get(pooling.url)
+
+        if entry is None:
+            return None
+
+        fetched_time, response, owner = entry
+        if owner == id(pooling) or fetched_time <= since:
+            return None
+
+        return response
+
+    def store_response(self, pooling: "CplusApiPooling", response: dict):
+        """Shares a status fetched by a poller.
+
+        :param pooling: Poller of a job status
+        :type pooling: CplusApiPooling
+
+        :param response: Fetched status
+        :type response: dict
+        """
+        with self._lock:
+            if id(pooling) in self._tracked:
+                self._responses[pooling.url] = (
+                    time.monotonic(),
+                    response,
+                    id(pooling),
+                )
+
+
+status_poller = CplusStatusPoller()
+
+
 class CplusApiPooling:
-    """Fetch/Post url with pooling."""
+    """Fetch/Post url with pooling.
+
+    The status is requested at intervals starting at `interval` seconds
+    that grow exponentially, up to `max_interval`, while it does not
+    change. When the job reports its progress the interval follows the
+    estimated remaining time and a Retry-After header sent by the server
+    takes precedence. GET requests are conditional so that an unchanged
+    status is not sent again when the server supports ETags.
+    """
 
     DEFAULT_LIMIT = 3600  # Check result maximum 3600 times
     DEFAULT_INTERVAL = 1  # Interval of check results
+    DEFAULT_MAX_INTERVAL = 30  # Maximum interval of check results
+    BACKOFF_FACTOR = 1.5
+    # Random variation of the intervals so that jobs started together
+    # are not polled at the same time.
+    JITTER = 0.2
+    # Share of the estimated remaining time of a job waited between checks
+    PROGRESS_INTERVAL_FRACTION = 0.25
+    # Longest sleep before checking for cancellation
+    CANCEL_CHECK_INTERVAL = 0.5
     FINAL_STATUS_LIST = [JOB_COMPLETED_STATUS, JOB_CANCELLED_STATUS, JOB_STOPPED_STATUS]
 
     def __init__(
@@ -81,6 +213,7 @@ class CplusApiPooling:
         max_limit=None,
         interval=None,
         on_response_fetched=None,
+        max_interval=None,
     ):
         """Create Cplus API Pooling for fetching status.
 
@@ -102,11 +235,14 @@ class CplusApiPooling:
         :param max_limit: maximum retries when pooling, defaults to None
         :type max_limit: int, optional
 
-        :param interval: interval for pooling, defaults to None
+        :param interval: initial interval for pooling, defaults to None
         :type interval: int, optional
 
         :param on_response_fetched: callback when response is fetched, defaults to None
         :type on_response_fetched: any, optional
+
+        :param max_interval: maximum interval for pooling, defaults to None
+        :type max_interval: int, optional
         """
         self.context = context
         self.url = url
@@ -116,85 +252,208 @@ class CplusApiPooling:
         self.data = data
         self.limit = max_limit or self.DEFAULT_LIMIT
         self.interval = interval or self.DEFAULT_INTERVAL
+        self.max_interval = max_interval or self.DEFAULT_MAX_INTERVAL
         self.on_response_fetched = on_response_fetched
+        # Optional function returning True when the polling should stop
+        self.cancel_check = None
         self.cancelled = False
 
+        self.etag = None
+        self.last_response = None
+        self._response_headers = {}
+        self._last_poll_time = 0.0
+        self._current_interval = None
+        # Time and progress of the first status reporting the progress
+        self._progress_start = None
+
     def __call_api(self) -> typing.Tuple[dict, int]:
         """Trigger the api call to fetch the status.
 
         :return: tuple of response dictionary and HTTP status code
         :rtype: typing.Tuple[dict, int]
         """
+        self._response_headers = {}
         if self.method == "GET":
-            return self.context.get(self.url)
+            return self.context.get(
+                self.url, etag=self.etag, response_headers=self._response_headers
+            )
         return self.context.post(self.url, self.data)
 
+    def is_cancelled(self) -> bool:
+        """Checks whether the polling has been cancelled.
+
+        :returns: True if the polling has been cancelled.
+        :rtype: bool
+        """
+        if not self.cancelled and self.cancel_check is not None:
+            self.cancelled = bool(self.cancel_check())
+
+        return self.cancelled
+
+    def wait(self, seconds: float):
+        """Sleeps for the given time or until the polling is cancelled.
+
+        :param seconds: Time to wait in seconds.
+        :type seconds: float
+        """
+        remaining = max(seconds, 0.0)
+        while remaining > 0 and not self.is_cancelled():
+            step = min(remaining, self.CANCEL_CHECK_INTERVAL)
+            time.sleep(step)
+            remaining -= step
+
+    def next_interval(self) -> float:
+        """Returns the time to wait before the next status check.
+
+        :returns: Interval in seconds, with jitter.
+        :rtype: float
+        """
+        interval = self._current_interval or self.interval
+        return interval * random.uniform(1.0 - self.JITTER, 1.0 + self.JITTER)
+
+    def wait_next(self):
+        """Waits for the next status check."""
+        self.wait(self.next_interval())
+
+    def _server_interval(self) -> typing.Optional[float]:
+        """Returns the interval requested by the server, if any."""
+        retry_after = self._response_headers.get("retry-after")
+        try:
+            return float(retry_after) if retry_after else None
+        except ValueError:
+            return None
+
+    def _update_interval(
+        self, response: dict, changed: bool, server_interval: float = None
+    ):
+        """Updates the interval of the next check from the last status.
+
+        :param response: Last status.
+        :type response: dict
+
+        :param changed: Whether the status changed since the previous check.
+        :type changed: bool
+
+        :param server_interval: Interval requested by the server.
+        :type server_interval: float
+        """
+        now = time.monotonic()
+        try:
+            progress = float(response.get("progress"))
+        except (TypeError, ValueError):
+            progress = None
+
+        if server_interval is not None:
+            interval = server_interval
+        elif (
+            changed
+            and progress is not None
+            and self._progress_start is not None
+            and progress > self._progress_start[1]
+            and now > self._progress_start[0]
+        ):
+            start_time, start_progress = self._progress_start
+            rate = (progress - start_progress) / (now - start_time)
+            remaining_time = max(100.0 - progress, 0.0) / rate
+            interval = remaining_time * self.PROGRESS_INTERVAL_FRACTION
+        elif changed:
+            interval = self.interval
+        else:
+            interval = (self._current_interval or self.interval) * self.BACKOFF_FACTOR
+
+        self._current_interval = min(max(interval, self.interval), self.max_interval)
+
+        if progress is not None and self._progress_start is None:
+            self._progress_start = (now, progress)
+
     def poll_once(self) -> dict:
         """Perform a single API call to the network resource
         and returns the response dict.
 
-        This does not sleep or recurse. It increments the
+        This does not sleep between checks. It increments the
         retry counter and enforces cancellation / timeout rules.
-        Use this from external loops to control the
-        loop frequency and update dependencies
+        Use this from external loops to control the loop
+        frequency, e.g. with `wait_next`, and update dependencies
         after each response.
 
         :returns: Dictionary containing the response details.
         :rtype: dict
         """
-        if self.cancelled:
+        if self.is_cancelled():
+            status_poller.untrack(self)
             return {"status": JOB_CANCELLED_STATUS}
 
         if self.limit != -1 and self.current_repeat >= self.limit:
+            status_poller.untrack(self)
             raise CplusApiRequestError("Request Timeout when fetching status!")
 
         self.current_repeat += 1
+        status_poller.track(self)
 
-        response, status_code = self.__call_api()
-        if status_code != 200:
-            error_detail = response.get("detail", "Unknown Error!")
-            raise CplusApiRequestError(f"{status_code} - {error_detail}")
+        server_interval = None
+        response = status_poller.shared_response(self, self._last_poll_time)
+        if response is None:
+            self.wait(status_poller.reserve_request())
+
+            try:
+                response, status_code = self.__call_api()
+            except Exception:
+                self._update_interval({}, False)
+                raise
+
+            if status_code == 304 and self.last_response is not None:
+                # Status not modified since the previous check
+                response = self.last_response
+            elif status_code != 200:
+                self._update_interval({}, False)
+                error_detail = response.get("detail", "Unknown Error!")
+                raise CplusApiRequestError(f"{status_code} - {error_detail}")
+            else:
+                self.etag = self._response_headers.get("etag")
+                status_poller.store_response(self, response)
+
+            server_interval = self._server_interval()
+
+        self._last_poll_time = time.monotonic()
+        changed = response != self.last_response
+        self._update_interval(response, changed, server_interval)
+        self.last_response = response
 
-        if self.on_response_fetched:
+        if response.get("status") in self.FINAL_STATUS_LIST:
+            status_poller.untrack(self)
+
+        if changed and self.on_response_fetched:
             self.on_response_fetched(response)
 
         return response
 
     def results(self) -> dict:
-        """Fetch the results from API every X seconds and stop when status is in the final status list.
+        """Fetch the results from API at adaptive intervals and stop when status is in the final status list.
 
-        :raises CplusApiRequestError: raisess when max limit is reached or server returns non 200 status code.
+        :raises CplusApiRequestError: raisess when max limit is reached.
 
         :return: response dictionary
         :rtype: dict
         """
-        if self.cancelled:
-            return {"status": JOB_CANCELLED_STATUS}
-
-        if self.limit != -1 and self.current_repeat >= self.limit:
-            raise CplusApiRequestError("Request Timeout when fetching status!")
-
-        self.current_repeat += 1
-
         try:
-            response, status_code = self.__call_api()
-            if status_code != 200:
-                error_detail = response.get("detail", "Unknown Error!")
-                raise CplusApiRequestError(f"{status_code} - {error_detail}")
+            while True:
+                if self.is_cancelled():
+                    return {"status": JOB_CANCELLED_STATUS}
 
-            if self.on_response_fetched:
-                self.on_response_fetched(response)
+                if self.limit != -1 and self.current_repeat >= self.limit:
+                    raise CplusApiRequestError("Request Timeout when fetching status!")
 
-            if response["status"] in self.FINAL_STATUS_LIST:
-                return response
-            else:
-                time.sleep(self.interval)
-                return self.results()
+                try:
+                    response = self.poll_once()
+                    if response.get("status") in self.FINAL_STATUS_LIST:
+                        return response
+                except Exception as ex:
+                    log(f"Error when fetching results {ex}", info=False)
 
-        except Exception as ex:
-            log(f"Error when fetching results {ex}", info=False)
-            time.sleep(self.interval)
-            return self.results()
+                self.wait_next()
+        finally:
+            # The job is no longer polled however the loop ends
+            status_poller.untrack(self)
 
 
 class TrendsApiUrl:
@@ -514,6 +773,9 @@ class CplusApiRequest:
                     json_response = {}
                 else:
                     json_response = self._read_json_response(reply)
+            elif http_status == 304:
+                # Not modified since the request ETag
+                json_response = {}
             else:
                 log(f"HTTP Error: {http_status} from request {url}")
                 json_response = self._read_json_response(reply)
@@ -556,7 +818,13 @@ class CplusApiRequest:
             json.dumps(data, cls=CustomJsonEncoder).encode("utf-8")
         )
 
-    def get(self, url: str, headers: dict = {}) -> typing.Tuple[dict, int]:
+    def get(
+        self,
+        url: str,
+        headers: dict = {},
+        etag: str = None,
+        response_headers: dict = None,
+    ) -> typing.Tuple[dict, int]:
         """Trigger a GET request.
 
         :param url: Cplus API URL
@@ -565,13 +833,29 @@ class CplusApiRequest:
         :param headers: header dictionary, defaults to {}
         :type headers: dict
 
+        :param etag: ETag of the previous response, the request is then
+        conditional and the status code is 304 if the resource has not changed.
+        :type etag: str
+
+        :param response_headers: Dictionary that is filled with the
+        response headers, with lower case names.
+        :type response_headers: dict
+
         :return: tuple of response dictionary and HTTP status code
         :rtype: typing.Tuple[dict, int]
         """
         nam = QgsNetworkAccessManager.instance()
         headers = headers or self._default_headers()
+        if etag:
+            headers = dict(headers)
+            headers["If-None-Match"] = etag
         request = self._generate_request(url, headers)
         reply = nam.blockingGet(request, forceRefresh=True)
+        if response_headers is not None:
+            for name, value in reply.rawHeaderPairs():
+                response_headers[bytes(name).decode("utf-8").lower()] = bytes(
+                    value
+                ).decode("utf-8")
         return self._handle_response(url, reply)
 
     def post(
@@ -689,24 +973,126 @@ class CplusApiRequest:
         """
         log(f"Finished downloading file to {filename}")
 
-    def download_file(self, url: str, file_path: str, on_download_progress):
+    def download_file(
+        self,
+        url: str,
+        file_path: str,
+        on_download_progress=None,
+        expected_size: int = None,
+    ) -> bool:
         """Download a file from url and save into output file in file_path.
 
+        The content is written to a partial file next to the output which
+        is renamed once the download is complete. The partial file of an
+        interrupted download is resumed with an HTTP Range request, it is
+        downloaded again from the start if the server does not support ranges.
+        A partial file that is already complete is kept when the server
+        rejects the range as starting at the end of the file.
+
         :param url: Download URL
         :type url: str
 
         :param file_path: Path to the output file
         :type file_path: str
 
-        :param on_download_progress: callback for download progress signal
+        :param on_download_progress: callback with the download percentage
         :type on_download_progress: any
+
+        :param expected_size: Size of the file in bytes, if known.
+        :type expected_size: int
+
+        :returns: True if the file was downloaded completely else False.
+        :rtype: bool
         """
+        partial_path = f"{file_path}{PARTIAL_DOWNLOAD_SUFFIX}"
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if expected_size is not None and offset > expected_size:
+            os.remove(partial_path)
+            offset = 0
+        if expected_size and offset == expected_size:
+            os.replace(partial_path, file_path)
+            return True
 
-        feedback = QgsProcessingFeedback()
-        params = {"URL": url, "OUTPUT": file_path}
-        feedback.progressChanged.connect(on_download_progress)
+        request = QNetworkRequest(QtCore.QUrl(url))
+        if offset > 0:
+            request.setRawHeader(b"Range", f"bytes={offset}-".encode("utf-8"))
+        nam = QgsNetworkAccessManager.instance()
+        reply = nam.get(request)
+        # Output file and the number of bytes kept from the partial file
+        state = {"file": None, "offset": offset}
+
+        def write_content():
+            if state["file"] is None:
+                status_code = reply.attribute(
+                    QNetworkRequest.Attribute.HttpStatusCodeAttribute
+                )
+                if status_code is None or not 200 <= status_code < 300:
+                    return
+                if status_code != 206:
+                    # Range not supported, the whole content is sent
+                    state["offset"] = 0
+                state["file"] = open(partial_path, "ab" if state["offset"] else "wb")
+            state["file"].write(reply.readAll().data())
+
+        def report_progress(received: int, total: int):
+            if on_download_progress is None:
+                return
+            total_size = expected_size or (state["offset"] + total if total > 0 else 0)
+            if total_size > 0:
+                on_download_progress((state["offset"] + received) * 100 / total_size)
+
+        reply.readyRead.connect(write_content)
+        reply.downloadProgress.connect(report_progress)
+        try:
+            self._make_request(reply)
+            write_content()
+            status_code = reply.attribute(
+                QNetworkRequest.Attribute.HttpStatusCodeAttribute
+            )
+            error = reply.error()
+            content_length = reply.header(
+                QNetworkRequest.KnownHeaders.ContentLengthHeader
+            )
+            content_range = bytes(reply.rawHeader(b"Content-Range")).decode(
+                "utf-8", "replace"
+            )
+        finally:
+            if state["file"] is not None:
+                state["file"].close()
+            reply.deleteLater()
+
+        if error != QNetworkReply.NetworkError.NoError:
+            if status_code == 416 and os.path.exists(partial_path):
+                if content_range.strip() == f"bytes */{offset}":
+                    # The partial file is already complete
+                    os.replace(partial_path, file_path)
+                    self._on_download_finished(file_path)
+                    return True
+                # The partial file is not a prefix of the current file
+                os.remove(partial_path)
+            log(f"Error downloading {url}: {reply.errorString()}", info=False)
+            return False
+
+        if not os.path.exists(partial_path):
+            return False
+
+        size = os.path.getsize(partial_path)
+        total_size = expected_size
+        if total_size is None and content_length is not None:
+            total_size = state["offset"] + int(content_length)
+        if total_size is not None and size != total_size:
+            log(
+                f"Incomplete download of {url}, {size} of {total_size} bytes",
+                info=False,
+            )
+            if size > total_size:
+                os.remove(partial_path)
+            return False
+
+        os.replace(partial_path, file_path)
+        self._on_download_finished(file_path)
 
-        processing.run("qgis:filedownloader", params, feedback=feedback)
+        return True
 
     def _do_upload_file_part(
         self, url: str, chunk: typing.Union[bytes, bytearray], file_part_number: int
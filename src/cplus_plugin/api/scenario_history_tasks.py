@@ -5,13 +5,16 @@
 """
 import datetime
 import os
-import shutil
 from typing import List
 
 from qgis.PyQt import QtCore
 
-from .base import BaseScenarioTask
-from .request import CplusApiRequest, CplusApiRequestError
+from .base import BaseScenarioTask, DOWNLOAD_MANIFEST_FILE_NAME
+from .request import (
+    CplusApiRequest,
+    CplusApiRequestError,
+    PARTIAL_DOWNLOAD_SUFFIX,
+)
 from .scenario_task_api_client import ScenarioAnalysisTaskApiClient
 from ..conf import settings_manager
 from ..models.base import Scenario
@@ -185,13 +188,7 @@ class FetchScenarioOutputTask(ScenarioAnalysisTaskApiClient):
             )
             self.scenario_directory = self.get_scenario_directory()
             if os.path.exists(self.scenario_directory):
-                for file in os.listdir(self.scenario_directory):
-                    if file != "processing.log":
-                        path = os.path.join(self.scenario_directory, file)
-                        if os.path.isdir(path):
-                            shutil.rmtree(os.path.join(self.scenario_directory, file))
-                        else:
-                            os.remove(path)
+                self.remove_stale_files()
             if self.processing_cancelled:
                 # Will not proceed if processing has been cancelled by the user
                 return False
@@ -217,6 +214,28 @@ class FetchScenarioOutputTask(ScenarioAnalysisTaskApiClient):
             log("Failed download scenario outputs!", info=False)
         self.task_finished.emit()
 
+    def remove_stale_files(self):
+        """Removes the files of the scenario directory except the log, the
+        outputs verified in a previous fetch and the partial downloads,
+        which are checked against the output list and resumed.
+        """
+        manifest = self._read_manifest(self.scenario_directory)
+        kept_files = {"processing.log", DOWNLOAD_MANIFEST_FILE_NAME}
+        kept_files.update(os.path.normpath(path) for path in manifest)
+        for root, dirs, files in os.walk(self.scenario_directory, topdown=False):
+            for file in files:
+                path = os.path.join(root, file)
+                relative_path = os.path.relpath(path, self.scenario_directory)
+                if relative_path in kept_files or file.endswith(
+                    PARTIAL_DOWNLOAD_SUFFIX
+                ):
+                    continue
+                os.remove(path)
+            for directory in dirs:
+                path = os.path.join(root, directory)
+                if not os.listdir(path):
+                    os.rmdir(path)
+
     def fetch_scenario_detail(self):
         """Fetch scenario detail from API.
 
@@ -1,6 +1,7 @@
 import concurrent.futures
 import json
 import os
+import threading
 import traceback
 import typing
 from zipfile import ZipFile
@@ -19,7 +20,9 @@ from ..models.base import Activity, NcsPathway, Scenario
 from ..tasks import ScenarioAnalysisTask
 from ..utils import FileUtils, CustomJsonEncoder, todict
 from ..definitions.constants import NO_DATA_VALUE
+from ..definitions.defaults import DEFAULT_UPLOAD_WORKERS
 from ..lib.constant_raster import constant_raster_registry
+from ..lib.fingerprint import FAST_ALGORITHM, file_fingerprint, fingerprint_index
 
 
 def clean_filename(filename):
@@ -88,6 +91,9 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
         self.total_file_upload_size = 0
         self.total_file_upload_chunks = 0
         self.uploaded_chunks = 0
+        # Guards the upload progress and state shared by the upload workers
+        self._upload_lock = threading.RLock()
+        self._resumed_uploads = set()
         self.path_to_layer_mapping = {}
         self.scenario_api_uuid = None
         self.status_pooling = None
@@ -120,8 +126,9 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
         """Function to call when the task is terminated."""
 
         hide_task = getattr(self, "hide_task", False)
-        if not hide_task:
-            # check if there is ongoing upload
+        if not hide_task and self.error is None:
+            # Ongoing uploads are aborted when cancelled by the user, uploads
+            # interrupted by an error are kept so that they can be resumed.
             layer_mapping = settings_manager.get_all_layer_mapping()
             for identifier, layer in layer_mapping.items():
                 if "upload_id" not in layer:
@@ -132,6 +139,7 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
                     settings_manager.remove_layer_mapping(identifier)
                 except Exception as ex:
                     self.log_message(f"Problem aborting upload layer: {ex}")
+        if not hide_task:
             self.log_message(f"Cancel scenario {self.scenario_api_uuid}")
             if self.scenario_api_uuid and self.scenario_status not in [
                 JOB_COMPLETED_STATUS,
@@ -185,76 +193,255 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
             return False
         return not self.processing_cancelled
 
-    def run_upload(self, file_path, component_type) -> typing.Dict:
-        """Upload a file as component type to the S3.
+    def get_upload_workers_count(self) -> int:
+        """Gets the maximum number of file parts uploaded concurrently.
+
+        :returns: Number of upload worker threads, at least one.
+        :rtype: int
+        """
+        workers_count = self.get_settings_value(
+            Settings.UPLOAD_WORKERS, default=DEFAULT_UPLOAD_WORKERS, setting_type=int
+        )
+        try:
+            return max(1, int(workers_count))
+        except (TypeError, ValueError):
+            return DEFAULT_UPLOAD_WORKERS
+
+    @staticmethod
+    def _file_modified_time(file_path: str) -> int:
+        return os.stat(file_path).st_mtime_ns
+
+    def _save_upload_state(self, upload_state: dict):
+        """Saves the state of an unfinished upload in the layer mapping,
+        it is used to resume the upload if it is interrupted.
+        """
+        with self._upload_lock:
+            settings_manager.save_layer_mapping(upload_state)
+
+    def prepare_upload(self, file_path: str, component_type: str) -> dict:
+        """Gets the state of the upload of a file. An unfinished upload of
+        the same file is resumed, also when the file was modified without
+        changing its content, otherwise a new upload is started.
 
         :param file_path: Path of the file to be uploaded
         :type file_path: str
 
-        :param component_type: Input layer type of the upload file (ncs_pathway, ncs_carbon, etc.)
+        :param component_type: Input layer type of the upload file
         :type component_type: str
 
-        :return: result, containing UUID of the uploaded file, size, and final filename
-        :rtype: typing.Dict
+        :return: Upload state with the layer UUID, upload ID, upload URLs
+            and the parts that have been confirmed by the server
+        :rtype: dict
         """
+        file_size = os.stat(file_path).st_size
+        modified_time = self._file_modified_time(file_path)
+
+        identifier = file_path.replace(os.sep, "--")
+        upload_state = settings_manager.get_layer_mapping(identifier)
+        if (
+            upload_state.get("upload_id")
+            and upload_state.get("upload_urls")
+            and upload_state.get("size") == file_size
+            and upload_state.get("component_type") == component_type
+            and (
+                upload_state.get("mtime_ns") == modified_time
+                or (
+                    upload_state.get("digest")
+                    and fingerprint_index().is_unchanged(
+                        file_path, upload_state["digest"]
+                    )
+                )
+            )
+        ):
+            if upload_state.get("mtime_ns") != modified_time:
+                upload_state["mtime_ns"] = modified_time
+                self._save_upload_state(upload_state)
+            self._resumed_uploads.add(file_path)
+            self.log_message(
+                f"Resuming upload of {file_path}, "
+                f"{len(upload_state.get('parts', []))} of "
+                f"{len(upload_state['upload_urls'])} parts already uploaded"
+            )
+            return upload_state
+
+        if upload_state.get("upload_id") and upload_state.get("uuid"):
+            # The file has changed since the upload was started
+            self.abort_upload(upload_state)
 
         self.log_message(f"Uploading {file_path} as {component_type}")
         upload_params = self.request.start_upload_layer(file_path, component_type)
-        upload_id = upload_params["multipart_upload_id"]
-        layer_uuid = upload_params["uuid"]
-        upload_urls = upload_params["upload_urls"]
-        if self.processing_cancelled:
-            return False
-        # store temporary layer
-        temp_layer = {
-            "uuid": layer_uuid,
-            "size": os.stat(file_path).st_size,
+        upload_state = {
+            "uuid": upload_params["uuid"],
+            "size": file_size,
+            "mtime_ns": modified_time,
+            "digest": file_fingerprint(file_path, FAST_ALGORITHM),
             "name": os.path.basename(file_path),
-            "upload_id": upload_id,
+            "upload_id": upload_params["multipart_upload_id"],
+            "upload_urls": upload_params["upload_urls"],
+            "component_type": component_type,
+            "parts": [],
             "path": file_path,
         }
-        settings_manager.save_layer_mapping(temp_layer)
-
-        # do upload by chunks
-        items = []
-        idx = 0
-        with open(file_path, "rb") as f:
-            while True:
-                if self.processing_cancelled:
-                    break
-                chunk = f.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                url_item = upload_urls[idx]
-                part_item = self.request.upload_file_part(
-                    url_item["url"], chunk, url_item["part_number"]
-                )
-                if part_item:
-                    items.append(part_item)
-                else:
-                    raise Exception(
-                        f"Error while uploading {file_path} as " f"{component_type}"
-                    )
-                self.uploaded_chunks += 1
-                self._update_scenario_status(
-                    {
-                        "progress_text": "Uploading layers with concurrent request",
-                        "progress": int(
-                            (self.uploaded_chunks / self.total_file_upload_chunks) * 100
-                        ),
-                    }
-                )
-                idx += 1
+        self._save_upload_state(upload_state)
+
+        return upload_state
+
+    def abort_upload(self, upload_state: dict):
+        """Aborts an unfinished upload and removes its state.
 
-        # finish upload
-        result = {"uuid": None}
+        :param upload_state: Upload state from `prepare_upload`
+        :type upload_state: dict
+        """
+        try:
+            self.request.abort_upload_layer(
+                upload_state["uuid"], upload_state["upload_id"]
+            )
+        except Exception as ex:
+            self.log_message(f"Problem aborting upload layer: {ex}")
+        with self._upload_lock:
+            settings_manager.remove_layer_mapping(
+                upload_state["path"].replace(os.sep, "--")
+            )
+
+    def upload_part(self, upload_state: dict, part_index: int) -> typing.Dict:
+        """Reads and uploads a single part of a file. The request
+        is retried with an exponential backoff if it fails.
+
+        :param upload_state: Upload state from `prepare_upload`
+        :type upload_state: dict
+
+        :param part_index: Index of the part in the upload URLs
+        :type part_index: int
+
+        :return: Dictionary of part_number and etag, None if cancelled
+        :rtype: typing.Dict
+        """
         if self.processing_cancelled:
-            return result
-        result = self.request.finish_upload_layer(layer_uuid, upload_id, items)
+            return None
+
+        url_item = upload_state["upload_urls"][part_index]
+        with open(upload_state["path"], "rb") as f:
+            f.seek(part_index * CHUNK_SIZE)
+            chunk = f.read(CHUNK_SIZE)
+
+        part_item = self.request.upload_file_part(
+            url_item["url"], chunk, url_item["part_number"]
+        )
+        if not part_item:
+            raise Exception(
+                f"Error while uploading part {url_item['part_number']} "
+                f"of {upload_state['path']}"
+            )
+
+        with self._upload_lock:
+            upload_state["parts"].append(part_item)
+            settings_manager.save_layer_mapping(upload_state)
+            self.uploaded_chunks += 1
+            progress = (
+                int((self.uploaded_chunks / self.total_file_upload_chunks) * 100)
+                if self.total_file_upload_chunks
+                else 0
+            )
+        self._update_scenario_status(
+            {
+                "progress_text": "Uploading layers with concurrent request",
+                "progress": progress,
+            }
+        )
+
+        return part_item
+
+    def upload_pending_parts(
+        self, upload_states: typing.List[dict]
+    ) -> typing.List[dict]:
+        """Uploads the parts that have not been confirmed for all the files
+        using a single pool of workers.
+
+        :param upload_states: Upload states from `prepare_upload`
+        :type upload_states: typing.List[dict]
+
+        :return: Upload states whose parts could not all be uploaded
+        :rtype: typing.List[dict]
+        """
+        failed_states = []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.get_upload_workers_count()
+        ) as executor:
+            futures = {}
+            for upload_state in upload_states:
+                uploaded_parts = {
+                    item["part_number"] for item in upload_state.get("parts", [])
+                }
+                for part_index, url_item in enumerate(upload_state["upload_urls"]):
+                    if url_item["part_number"] in uploaded_parts:
+                        continue
+                    future = executor.submit(self.upload_part, upload_state, part_index)
+                    futures[future] = upload_state
+
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    upload_state = futures[future]
+                    try:
+                        future.result()
+                    except Exception as ex:
+                        self.log_message(
+                            f"Problem uploading {upload_state['path']}: {ex}"
+                        )
+                        if upload_state not in failed_states:
+                            failed_states.append(upload_state)
+                    if self.processing_cancelled:
+                        break
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return failed_states
+
+    def finish_upload(self, upload_state: dict) -> typing.Dict:
+        """Completes the multipart upload of a file once all its parts
+        have been uploaded.
+
+        :param upload_state: Upload state from `prepare_upload`
+        :type upload_state: dict
+
+        :return: result, containing UUID of the uploaded file, size, final
+            filename and the digest of the local file
+        :rtype: typing.Dict
+        """
+        items = sorted(upload_state["parts"], key=lambda item: item["part_number"])
+        if len(items) != len(upload_state["upload_urls"]):
+            return {"uuid": None}
+
+        result = self.request.finish_upload_layer(
+            upload_state["uuid"], upload_state["upload_id"], items
+        )
+        if result.get("uuid") and upload_state.get("digest"):
+            # Used to check whether the uploaded layer has changed
+            result["digest"] = upload_state["digest"]
+
         return result
 
+    def run_upload(self, file_path, component_type) -> typing.Dict:
+        """Upload a file as component type to the S3.
+
+        :param file_path: Path of the file to be uploaded
+        :type file_path: str
+
+        :param component_type: Input layer type of the upload file (ncs_pathway, ncs_carbon, etc.)
+        :type component_type: str
+
+        :return: result, containing UUID of the uploaded file, size, and final filename
+        :rtype: typing.Dict
+        """
+        return self.run_parallel_upload({file_path: component_type})[0]
+
     def run_parallel_upload(self, upload_dict) -> typing.List[typing.Dict]:
-        """Upload file concurrently using ThreadPoolExecutor
+        """Upload files with the parts of all the files uploaded concurrently.
+
+        Confirmed parts are saved in the layer mapping so that an interrupted
+        upload continues from the parts that were not uploaded. If a resumed
+        upload fails, e.g. because its upload URLs have expired, it is
+        aborted and started again.
 
         :param upload_dict: Dictionary with file path as key and component type
         (ncs_pathway, ncs_carbon, etc.) as value.
@@ -271,17 +458,52 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
                 "progress": 0,
             }
         )
-        file_paths = list(upload_dict.keys())
-        component_types = list(upload_dict.values())
 
-        final_result = []
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=3 if os.cpu_count() > 3 else 1
-        ) as executor:
-            final_result.extend(
-                list(executor.map(self.run_upload, file_paths, component_types))
+        upload_states = []
+        for file_path, component_type in upload_dict.items():
+            if self.processing_cancelled:
+                return [{"uuid": None} for _ in upload_dict]
+            upload_state = self.prepare_upload(file_path, component_type)
+            self.uploaded_chunks += len(upload_state.get("parts", []))
+            upload_states.append(upload_state)
+
+        failed_states = self.upload_pending_parts(upload_states)
+
+        restarted_states = {}
+        for upload_state in failed_states:
+            if (
+                upload_state["path"] not in self._resumed_uploads
+                or self.processing_cancelled
+            ):
+                raise Exception(
+                    f"Error while uploading {upload_state['path']} as "
+                    f"{upload_state['component_type']}"
+                )
+            self.log_message(f"Restarting upload of {upload_state['path']}")
+            self._resumed_uploads.discard(upload_state["path"])
+            self.uploaded_chunks -= len(upload_state["parts"])
+            self.abort_upload(upload_state)
+            restarted_states[upload_state["path"]] = self.prepare_upload(
+                upload_state["path"], upload_state["component_type"]
             )
-        return list(final_result)
+
+        if restarted_states:
+            failed_states = self.upload_pending_parts(list(restarted_states.values()))
+            if failed_states:
+                raise Exception(
+                    f"Error while uploading {failed_states[0]['path']} as "
+                    f"{failed_states[0]['component_type']}"
+                )
+
+        final_result = []
+        for upload_state in upload_states:
+            upload_state = restarted_states.get(upload_state["path"], upload_state)
+            if self.processing_cancelled:
+                final_result.append({"uuid": None})
+                continue
+            final_result.append(self.finish_upload(upload_state))
+
+        return final_result
 
     def __zip_shapefiles(self, shapefile_path: str) -> str:
         """Zip shapefiles to an object with same name.
@@ -439,6 +661,7 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
             )
 
         files_to_upload.update(self.check_layer_uploaded(items_to_check))
+        fingerprint_index().flush()
         if self.processing_cancelled:
             return False
 
@@ -477,7 +700,8 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
             settings_manager.save_layer_mapping(uploaded_layer, identifier)
 
     def check_layer_uploaded(self, items_to_check: typing.List[dict]) -> dict:
-        """Check whether a layer has been uploaded to CPLUS API
+        """Check whether a layer has been uploaded to CPLUS API, layers
+        whose content has changed since they were uploaded are uploaded again.
 
         :param items_to_check: Dictionary with file path as key and group as value
         :type items_to_check: typing.List[dict]
@@ -495,14 +719,17 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
                 existing_upload_id = uploaded_layer_dict.get("upload_id", None)
                 existing_uuid = uploaded_layer_dict.get("uuid", None)
                 if existing_upload_id and existing_uuid:
-                    # if upload_id exists, then upload is not finished
-                    try:
-                        self.request.abort_upload_layer(
-                            existing_uuid, existing_upload_id
-                        )
-                    except Exception as ex:
-                        pass
+                    # if upload_id exists, then upload is not finished and
+                    # will be resumed by run_parallel_upload
+                    output[layer_path] = items_to_check[layer_path]
+                    continue
+                uploaded_digest = uploaded_layer_dict.get("digest", None)
+                if uploaded_digest and not fingerprint_index().is_unchanged(
+                    layer_path, uploaded_digest
+                ):
+                    # The layer has changed since it was uploaded
                     output[layer_path] = items_to_check[layer_path]
+                    continue
                 if layer_path == uploaded_layer_dict["path"]:
                     uuid_to_path[uploaded_layer_dict["uuid"]] = layer_path
                     self.path_to_layer_mapping[layer_path] = uploaded_layer_dict
@@ -865,19 +1092,41 @@ class ScenarioAnalysisTaskApiClient(ScenarioAnalysisTask, BaseFetchScenarioOutpu
             }
         )
 
-    def download_file(self, url: str, local_filename: str) -> None:
+    def is_download_cancelled(self):
+        """Check if download is cancelled.
+
+        :return: True if task has been cancelled
+        :rtype: bool
+        """
+        return self.processing_cancelled
+
+    def download_file(
+        self, url: str, local_filename: str, expected_size: int = None
+    ) -> bool:
         """Download an output file from S3 to the local destination
 
         :param url: URL of the file to download
         :type url: str
         :param local_filename: str
         :type local_filename: str
+        :param expected_size: Size of the file in bytes, if known
+        :type expected_size: int
+        :return: True if the file was downloaded completely
+        :rtype: bool
         """
         parent_dir = os.path.dirname(local_filename)
         if not os.path.exists(parent_dir):
-            os.makedirs(parent_dir)
-        self.request.download_file(url, local_filename, self._download_progress)
-        self.downloaded_output += 1
+            os.makedirs(parent_dir, exist_ok=True)
+        if not self.request.download_file(
+            url, local_filename, self._download_progress, expected_size
+        ):
+            return False
+        return True
+
+    def output_downloaded(self):
+        """Updates the download progress once an output has been
+        downloaded and verified.
+        """
         self._update_scenario_status(
             {
                 "progress_text": "Downloading output files",
@@ -4,11 +4,13 @@ Handles storage and retrieval of the plugin QgsSettings.
 """
 
 import contextlib
+import copy
 import dataclasses
 import datetime
 import enum
 import json
 import os.path
+import threading
 import typing
 import uuid
 from pathlib import Path
@@ -231,6 +233,15 @@ class Settings(enum.Enum):
     # Processing option
     PROCESSING_TYPE = "processing_type"
 
+    # Performance options
+    BLOCK_PROCESSING_ENABLED = "performance/block_processing_enabled"
+    INTERMEDIATE_CACHE_ENABLED = "performance/intermediate_cache_enabled"
+    INTERMEDIATE_CACHE_SIZE = "performance/intermediate_cache_size"
+    PARALLEL_JOBS = "performance/parallel_jobs"
+    UPLOAD_WORKERS = "performance/upload_workers"
+    DOWNLOAD_WORKERS = "performance/download_workers"
+    MEMORY_BUDGET = "performance/memory_budget"
+
     # REPORT OPTIONS
     USE_CUSTOM_METRICS = "use_custom_metrics"
 
@@ -304,6 +315,95 @@ class SettingsManager(QtCore.QObject):
     priority_layers_changed = QtCore.pyqtSignal()
     settings_updated = QtCore.pyqtSignal([str, object], [Settings, object])
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Parsed priority layers, NCS pathways and activities keyed by
+        # the settings group and then by their UUID. Each group is loaded
+        # in bulk on first use and kept up to date when its entries are
+        # saved or removed through the manager.
+        self._model_cache: typing.Dict[str, typing.Dict[str, dict]] = {}
+        # Tasks look up the models from background threads
+        self._cache_lock = threading.RLock()
+
+    def _cached_entries(
+        self, group: str, loader: typing.Callable[[], typing.Dict[str, dict]]
+    ) -> typing.Dict[str, dict]:
+        """Returns the cached entries of a settings group, loading
+        them with the given function if they are not cached.
+
+        :param group: Settings group of the entries.
+        :type group: str
+
+        :param loader: Function that reads all the entries of the group.
+        :type loader: typing.Callable
+
+        :returns: Entries of the group keyed by their UUID.
+        :rtype: dict
+        """
+        with self._cache_lock:
+            entries = self._model_cache.get(group)
+            if entries is None:
+                entries = loader()
+                self._model_cache[group] = entries
+
+            return entries
+
+    def _update_cached_entry(self, group: str, identifier, entry: dict = None):
+        """Updates an entry of a cached settings group, the entry is
+        removed if it is None. Groups that are not cached are left as is
+        since they are loaded from the settings on first use.
+        """
+        with self._cache_lock:
+            entries = self._model_cache.get(group)
+            if entries is None:
+                return
+            if entry is None:
+                entries.pop(str(identifier), None)
+            else:
+                entries[str(identifier)] = entry
+
+    def clear_cache(self, group: str = None):
+        """Discards the cached settings so that they are read again
+        on next use, e.g. if the settings were changed outside the manager.
+
+        :param group: Settings group to discard, all groups if not set.
+        :type group: str
+        """
+        with self._cache_lock:
+            if group is None:
+                self._model_cache.clear()
+            else:
+                self._model_cache.pop(group, None)
+
+    def _invalidate_cached_name(self, name: str, removed: bool = False):
+        """Updates the cache after a setting has been set or removed
+        directly using its name.
+
+        :param name: Name of the setting key
+        :type name: str
+
+        :param removed: Whether the setting was removed.
+        :type removed: bool
+        """
+        if not isinstance(name, str):
+            return
+
+        with self._cache_lock:
+            for group in list(self._model_cache):
+                if name != group and not name.startswith(f"{group}/"):
+                    continue
+                # Removed NCS pathways and activities are single keys
+                identifier = name[len(group) + 1 :]
+                if (
+                    removed
+                    and identifier
+                    and "/" not in identifier
+                    and group != self.PRIORITY_LAYERS_GROUP_NAME
+                ):
+                    self._update_cached_entry(group, identifier)
+                else:
+                    self.clear_cache(group)
+
     def set_value(self, name: str, value):
         """Adds a new setting key and value on the plugin specific settings.
 
@@ -314,6 +414,7 @@ class SettingsManager(QtCore.QObject):
         :type value: Any
         """
         self.settings.setValue(f"{self.BASE_GROUP_NAME}/{name}", value)
+        self._invalidate_cached_name(name)
         if isinstance(name, Settings):
             name = name.value
 
@@ -365,10 +466,12 @@ class SettingsManager(QtCore.QObject):
         :type name: str
         """
         self.settings.remove(f"{self.BASE_GROUP_NAME}/{name}")
+        self._invalidate_cached_name(name, removed=True)
 
     def delete_settings(self):
         """Deletes the all the plugin settings."""
         self.settings.remove(f"{self.BASE_GROUP_NAME}")
+        self.clear_cache()
 
     def _get_scenario_settings_base(self, identifier):
         """Gets the scenario settings base url.
@@ -675,8 +778,9 @@ class SettingsManager(QtCore.QObject):
             f"{str(identifier)}"
         )
 
-    def get_priority_layer(self, identifier) -> typing.Dict:
-        """Retrieves the priority layer that matches the passed identifier.
+    def _read_priority_layer(self, identifier) -> typing.Optional[dict]:
+        """Reads the priority layer that matches the passed identifier
+        from the settings.
 
         :param identifier: Priority layers identifier
         :type identifier: uuid.UUID
@@ -684,15 +788,13 @@ class SettingsManager(QtCore.QObject):
         :returns: Priority layer dict or None if not found.
         :rtype: dict
         """
-        priority_layer = None
-
         settings_key = self._get_priority_layers_settings_base(identifier)
         with qgis_settings(settings_key) as settings:
             groups_key = f"{settings_key}/groups"
             groups = []
 
             if len(settings.childKeys()) <= 0:
-                return priority_layer
+                return None
 
             with qgis_settings(groups_key) as groups_settings:
                 for name in groups_settings.childGroups():
@@ -719,50 +821,58 @@ class SettingsManager(QtCore.QObject):
             priority_layer["groups"] = groups
         return priority_layer
 
+    def _load_priority_layers(self) -> typing.Dict[str, dict]:
+        """Reads all the priority layers from the settings.
+
+        :returns: Priority layers keyed by their UUID
+        :rtype: dict
+        """
+        priority_layers = {}
+        with qgis_settings(
+            f"{self.BASE_GROUP_NAME}/" f"{self.PRIORITY_LAYERS_GROUP_NAME}"
+        ) as settings:
+            for identifier in settings.childGroups():
+                priority_layer = self._read_priority_layer(identifier)
+                if priority_layer is not None:
+                    priority_layers[identifier] = priority_layer
+
+        return priority_layers
+
+    def _priority_layer_entries(self) -> typing.Dict[str, dict]:
+        """Returns the cached priority layers keyed by their UUID."""
+        return self._cached_entries(
+            self.PRIORITY_LAYERS_GROUP_NAME, self._load_priority_layers
+        )
+
+    def get_priority_layer(self, identifier) -> typing.Dict:
+        """Retrieves the priority layer that matches the passed identifier.
+
+        :param identifier: Priority layers identifier
+        :type identifier: uuid.UUID
+
+        :returns: Priority layer dict or None if not found.
+        :rtype: dict
+        """
+        if identifier is None:
+            return None
+
+        with self._cache_lock:
+            priority_layer = self._priority_layer_entries().get(str(identifier))
+            return copy.deepcopy(priority_layer)
+
     def get_priority_layers(self) -> typing.List:
         """Gets all the available priority layers in the plugin.
 
         :returns: Priority layers list
         :rtype: list
         """
-        priority_layer_list = []
-        with qgis_settings(
-            f"{self.BASE_GROUP_NAME}/" f"{self.PRIORITY_LAYERS_GROUP_NAME}"
-        ) as settings:
-            for uuid in settings.childGroups():
-                priority_layer_settings = self._get_priority_layers_settings_base(uuid)
-                with qgis_settings(priority_layer_settings) as priority_settings:
-                    groups_key = f"{priority_layer_settings}/groups"
-                    groups = []
-
-                    with qgis_settings(groups_key) as groups_settings:
-                        for name in groups_settings.childGroups():
-                            group_settings_key = f"{groups_key}/{name}"
-                            with qgis_settings(group_settings_key) as group_settings:
-                                stored_group = {}
-                                stored_group["uuid"] = group_settings.value("uuid")
-                                stored_group["name"] = group_settings.value("name")
-                                stored_group["value"] = group_settings.value("value")
-                                groups.append(stored_group)
-                    layer = {
-                        "uuid": uuid,
-                        "name": priority_settings.value("name"),
-                        "description": priority_settings.value("description"),
-                        "path": priority_settings.value("path"),
-                        "selected": priority_settings.value("selected", type=bool),
-                        "user_defined": priority_settings.value(
-                            "user_defined", defaultValue=True, type=bool
-                        ),
-                        "type": priority_settings.value(
-                            "type", defaultValue=0, type=int
-                        ),
-                        "groups": groups,
-                        "is_carbon": priority_settings.value(
-                            "is_carbon", defaultValue=True, type=bool
-                        ),
-                    }
-                    priority_layer_list.append(layer)
-        return priority_layer_list
+        with self._cache_lock:
+            priority_layers = self._priority_layer_entries()
+            # Same order as the settings groups
+            return [
+                copy.deepcopy(priority_layers[identifier])
+                for identifier in sorted(priority_layers)
+            ]
 
     def find_layer_by_name(self, name: str) -> typing.Dict:
         """Finds a priority layer setting inside
@@ -774,19 +884,11 @@ class SettingsManager(QtCore.QObject):
         :returns: Priority layers dict
         :rtype: dict
         """
-        found_id = None
-        with qgis_settings(
-            f"{self.BASE_GROUP_NAME}/" f"{self.PRIORITY_LAYERS_GROUP_NAME}"
-        ) as settings:
-            for layer_id in settings.childGroups():
-                layer_settings_key = self._get_priority_layers_settings_base(layer_id)
-                with qgis_settings(layer_settings_key) as layer_settings:
-                    layer_name = layer_settings.value("name")
-                    if layer_name == name:
-                        found_id = uuid.UUID(layer_id)
-                        break
+        for priority_layer in self.get_priority_layers():
+            if priority_layer.get("name") == name:
+                return priority_layer
 
-        return self.get_priority_layer(found_id) if found_id is not None else None
+        return None
 
     def find_layers_by_group(self, group: str) -> typing.List:
         """Finds priority layers inside the plugin QgsSettings
@@ -799,22 +901,10 @@ class SettingsManager(QtCore.QObject):
         :rtype: list
         """
         layers = []
-        with qgis_settings(
-            f"{self.BASE_GROUP_NAME}/" f"{self.PRIORITY_LAYERS_GROUP_NAME}"
-        ) as settings:
-            for layer_id in settings.childGroups():
-                priority_layer_settings = self._get_priority_layers_settings_base(
-                    layer_id
-                )
-                with qgis_settings(priority_layer_settings) as priority_settings:
-                    groups_key = f"{priority_layer_settings}/groups"
-
-                    with qgis_settings(groups_key) as groups_settings:
-                        for name in groups_settings.childGroups():
-                            group_settings_key = f"{groups_key}/{name}"
-                            with qgis_settings(group_settings_key) as group_settings:
-                                if group == group_settings.value("name"):
-                                    layers.append(self.get_priority_layer(layer_id))
+        for priority_layer in self.get_priority_layers():
+            for layer_group in priority_layer.get("groups", []):
+                if group == layer_group.get("name"):
+                    layers.append(priority_layer)
         return layers
 
     def save_priority_layer(self, priority_layer):
@@ -848,6 +938,12 @@ class SettingsManager(QtCore.QObject):
                     group_settings.setValue("name", group["name"])
                     group_settings.setValue("value", group["value"])
 
+        self._update_cached_entry(
+            self.PRIORITY_LAYERS_GROUP_NAME,
+            priority_layer["uuid"],
+            self._read_priority_layer(priority_layer["uuid"]),
+        )
+
         self.priority_layers_changed.emit()
 
     def set_current_priority_layer(self, identifier: str):
@@ -866,6 +962,8 @@ class SettingsManager(QtCore.QObject):
                         "selected", str(priority_layer) == str(identifier)
                     )
 
+        self.clear_cache(self.PRIORITY_LAYERS_GROUP_NAME)
+
     def delete_priority_layers(self):
         """Deletes all the plugin priority weighting layers settings."""
         with qgis_settings(
@@ -874,6 +972,8 @@ class SettingsManager(QtCore.QObject):
             for priority_layer in settings.childGroups():
                 settings.remove(priority_layer)
 
+        self.clear_cache(self.PRIORITY_LAYERS_GROUP_NAME)
+
     def delete_priority_layer(self, identifier):
         """Removes priority layer that match the passed identifier
 
@@ -887,6 +987,8 @@ class SettingsManager(QtCore.QObject):
                 if str(priority_layer) == str(identifier):
                     settings.remove(priority_layer)
 
+        self._update_cached_entry(self.PRIORITY_LAYERS_GROUP_NAME, identifier)
+
     def _get_priority_groups_settings_base(self, identifier) -> str:
         """Gets the priority group settings base url.
 
@@ -1169,6 +1271,8 @@ class SettingsManager(QtCore.QObject):
         with qgis_settings(ncs_root) as settings:
             settings.setValue(ncs_uuid, ncs_str)
 
+        self._update_cached_entry(NCS_PATHWAY_SEGMENT, ncs_uuid, json.loads(ncs_str))
+
     def get_ncs_pathway(self, ncs_uuid: str) -> typing.Union[NcsPathway, None]:
         """Gets an NCS pathway object matching the given unique identified.
 
@@ -1189,29 +1293,45 @@ class SettingsManager(QtCore.QObject):
 
         return ncs_pathway
 
-    def get_ncs_pathway_dict(self, ncs_uuid: str) -> dict:
-        """Gets an NCS pathway attribute values as a dictionary.
-
-        :param ncs_uuid: Unique identifier for the NCS pathway object.
-        :type ncs_uuid: str
+    def _load_ncs_pathways(self) -> typing.Dict[str, dict]:
+        """Reads the attribute values of all the NCS pathways
+        from the settings.
 
-        :returns: Returns the NCS pathway attribute values matching the given
-        identifier else an empty dictionary if not found.
+        :returns: NCS pathway attribute values keyed by their UUID.
         :rtype: dict
         """
-        ncs_pathway_dict = {}
+        ncs_pathways = {}
 
         ncs_root = self._get_ncs_pathway_settings_base()
 
         with qgis_settings(ncs_root) as settings:
-            ncs_model = settings.value(ncs_uuid, dict())
-            if len(ncs_model) > 0:
+            for ncs_uuid in settings.childKeys():
+                ncs_model = settings.value(ncs_uuid, dict())
+                if len(ncs_model) == 0:
+                    continue
                 try:
-                    ncs_pathway_dict = json.loads(ncs_model)
+                    ncs_pathways[ncs_uuid] = json.loads(ncs_model)
                 except json.JSONDecodeError:
                     log("NCS pathway JSON is invalid")
 
-        return ncs_pathway_dict
+        return ncs_pathways
+
+    def get_ncs_pathway_dict(self, ncs_uuid: str) -> dict:
+        """Gets an NCS pathway attribute values as a dictionary.
+
+        :param ncs_uuid: Unique identifier for the NCS pathway object.
+        :type ncs_uuid: str
+
+        :returns: Returns the NCS pathway attribute values matching the given
+        identifier else an empty dictionary if not found.
+        :rtype: dict
+        """
+        with self._cache_lock:
+            ncs_pathways = self._cached_entries(
+                NCS_PATHWAY_SEGMENT, self._load_ncs_pathways
+            )
+            # Copied as the models share the lists and dictionaries
+            return copy.deepcopy(ncs_pathways.get(str(ncs_uuid), {}))
 
     def get_all_ncs_pathways(self) -> typing.List[NcsPathway]:
         """Get all the NCS pathway objects stored in settings.
@@ -1221,14 +1341,15 @@ class SettingsManager(QtCore.QObject):
         """
         ncs_pathways = []
 
-        ncs_root = self._get_ncs_pathway_settings_base()
+        with self._cache_lock:
+            ncs_uuids = list(
+                self._cached_entries(NCS_PATHWAY_SEGMENT, self._load_ncs_pathways)
+            )
 
-        with qgis_settings(ncs_root) as settings:
-            keys = settings.childKeys()
-            for k in keys:
-                ncs_pathway = self.get_ncs_pathway(k)
-                if ncs_pathway is not None:
-                    ncs_pathways.append(ncs_pathway)
+        for ncs_uuid in ncs_uuids:
+            ncs_pathway = self.get_ncs_pathway(ncs_uuid)
+            if ncs_pathway is not None:
+                ncs_pathways.append(ncs_pathway)
 
         return sorted(ncs_pathways, key=lambda ncs: ncs.name)
 
@@ -1353,6 +1474,34 @@ class SettingsManager(QtCore.QObject):
         with qgis_settings(activity_root) as settings:
             settings.setValue(activity_uuid, activity_str)
 
+        self._update_cached_entry(
+            self.ACTIVITY_BASE, activity_uuid, json.loads(activity_str)
+        )
+
+    def _load_activities(self) -> typing.Dict[str, dict]:
+        """Reads the attribute values of all the activities
+        from the settings.
+
+        :returns: Activity attribute values keyed by their UUID.
+        :rtype: dict
+        """
+        activities = {}
+
+        activity_root = self._get_activity_settings_base()
+
+        with qgis_settings(activity_root) as settings:
+            for activity_uuid in settings.childKeys():
+                activity = settings.value(activity_uuid, None)
+                if activity is None:
+                    continue
+                try:
+                    activities[activity_uuid] = json.loads(activity)
+                except json.JSONDecodeError:
+                    log("Activity JSON is invalid.")
+                    activities[activity_uuid] = {}
+
+        return activities
+
     def get_activity(self, activity_uuid: str) -> typing.Union[Activity, None]:
         """Gets an activity object matching the given unique
         identifier.
@@ -1365,29 +1514,21 @@ class SettingsManager(QtCore.QObject):
         identifier else None if not found.
         :rtype: Activity
         """
-        activity = None
-
-        activity_root = self._get_activity_settings_base()
-
-        with qgis_settings(activity_root) as settings:
-            activity = settings.value(activity_uuid, None)
-            ncs_uuids = []
-            if activity is not None:
-                activity_dict = {}
-                try:
-                    activity_dict = json.loads(activity)
-                except json.JSONDecodeError:
-                    log("Activity JSON is invalid.")
+        with self._cache_lock:
+            activities = self._cached_entries(self.ACTIVITY_BASE, self._load_activities)
+            activity_dict = activities.get(str(activity_uuid))
+            if activity_dict is None:
+                return None
+            activity_dict = copy.deepcopy(activity_dict)
 
-                if PATHWAYS_ATTRIBUTE in activity_dict:
-                    ncs_uuids = activity_dict[PATHWAYS_ATTRIBUTE]
+        ncs_uuids = activity_dict.get(PATHWAYS_ATTRIBUTE, [])
 
-                activity = create_activity(activity_dict)
-                if activity is not None:
-                    for ncs_uuid in ncs_uuids:
-                        ncs = self.get_ncs_pathway(ncs_uuid)
-                        if ncs is not None:
-                            activity.add_ncs_pathway(ncs)
+        activity = create_activity(activity_dict)
+        if activity is not None:
+            for ncs_uuid in ncs_uuids:
+                ncs = self.get_ncs_pathway(ncs_uuid)
+                if ncs is not None:
+                    activity.add_ncs_pathway(ncs)
 
         return activity
 
@@ -1417,14 +1558,15 @@ class SettingsManager(QtCore.QObject):
         """
         activities = []
 
-        activity_root = self._get_activity_settings_base()
+        with self._cache_lock:
+            activity_uuids = list(
+                self._cached_entries(self.ACTIVITY_BASE, self._load_activities)
+            )
 
-        with qgis_settings(activity_root) as settings:
-            keys = settings.childKeys()
-            for k in keys:
-                activity = self.get_activity(k)
-                if activity is not None:
-                    activities.append(activity)
+        for activity_uuid in activity_uuids:
+            activity = self.get_activity(activity_uuid)
+            if activity is not None:
+                activities.append(activity)
 
         return sorted(activities, key=lambda activity: activity.name)
 
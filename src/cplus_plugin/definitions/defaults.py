@@ -291,3 +291,18 @@ IMPACT_MATRIX_COLORS = {
 # Online stored carbon config values
 STORED_CARBON_ID = "e7c3f70f-91a1-4cde-8c77-f09e93acf811"
 STORED_CARBON_NAME = "Biomass AGB BGB"
+
+# Number of activities or pathways processed concurrently in the scenario
+# analysis, one core is left for QGIS.
+DEFAULT_PARALLEL_JOBS = max(1, min(8, (os.cpu_count() or 1) - 1))
+
+# Number of file parts uploaded concurrently to the CPLUS API, each worker
+# holds one part in memory.
+DEFAULT_UPLOAD_WORKERS = 4
+
+# Number of scenario output files downloaded concurrently from the CPLUS API.
+DEFAULT_DOWNLOAD_WORKERS = 3
+
+# Memory budget in megabytes of the raster processing, zero uses half of
+# the physical memory.
+DEFAULT_MEMORY_BUDGET_MB = 0
@@ -51,10 +51,15 @@ from ...conf import (
 )
 from ...definitions.constants import CPLUS_OPTIONS_KEY, NO_DATA_VALUE
 from ...definitions.defaults import (
+    DEFAULT_PARALLEL_JOBS,
+    DEFAULT_UPLOAD_WORKERS,
+    DEFAULT_DOWNLOAD_WORKERS,
+    DEFAULT_MEMORY_BUDGET_MB,
     GENERAL_OPTIONS_TITLE,
     ICON_PATH,
     OPTIONS_TITLE,
 )
+from ...lib.raster.cache import DEFAULT_CACHE_SIZE_MB
 from ...lib.validation.configs import (
     no_data_validation_config,
     projected_crs_validation_config,
@@ -736,6 +741,32 @@ class CplusSettings(Ui_DlgSettings, QgsOptionsPageWidget):
             Settings.SIEVE_THRESHOLD, self.pixel_size_box.value()
         )
 
+        # Performance settings
+        settings_manager.set_value(
+            Settings.BLOCK_PROCESSING_ENABLED,
+            self.block_processing_enabled.isChecked(),
+        )
+        settings_manager.set_value(
+            Settings.INTERMEDIATE_CACHE_ENABLED,
+            self.intermediate_cache_enabled.isChecked(),
+        )
+        settings_manager.set_value(
+            Settings.INTERMEDIATE_CACHE_SIZE,
+            self.intermediate_cache_size_box.value(),
+        )
+        settings_manager.set_value(
+            Settings.PARALLEL_JOBS, self.parallel_jobs_box.value()
+        )
+        settings_manager.set_value(
+            Settings.UPLOAD_WORKERS, self.upload_workers_box.value()
+        )
+        settings_manager.set_value(
+            Settings.DOWNLOAD_WORKERS, self.download_workers_box.value()
+        )
+        settings_manager.set_value(
+            Settings.MEMORY_BUDGET, self.memory_budget_box.value()
+        )
+
         # Mask layers settings
         mask_paths = ""
         for row in range(0, self.lst_mask_layers.count()):
@@ -787,6 +818,63 @@ class CplusSettings(Ui_DlgSettings, QgsOptionsPageWidget):
             int(settings_manager.get_value(Settings.RESAMPLING_METHOD, default=0))
         )
 
+        # Performance settings
+        self.block_processing_enabled.setChecked(
+            settings_manager.get_value(
+                Settings.BLOCK_PROCESSING_ENABLED, default=False, setting_type=bool
+            )
+        )
+        self.intermediate_cache_enabled.setChecked(
+            settings_manager.get_value(
+                Settings.INTERMEDIATE_CACHE_ENABLED, default=False, setting_type=bool
+            )
+        )
+        self.intermediate_cache_size_box.setValue(
+            int(
+                settings_manager.get_value(
+                    Settings.INTERMEDIATE_CACHE_SIZE,
+                    default=DEFAULT_CACHE_SIZE_MB,
+                    setting_type=int,
+                )
+            )
+        )
+        self.parallel_jobs_box.setValue(
+            int(
+                settings_manager.get_value(
+                    Settings.PARALLEL_JOBS,
+                    default=DEFAULT_PARALLEL_JOBS,
+                    setting_type=int,
+                )
+            )
+        )
+        self.upload_workers_box.setValue(
+            int(
+                settings_manager.get_value(
+                    Settings.UPLOAD_WORKERS,
+                    default=DEFAULT_UPLOAD_WORKERS,
+                    setting_type=int,
+                )
+            )
+        )
+        self.download_workers_box.setValue(
+            int(
+                settings_manager.get_value(
+                    Settings.DOWNLOAD_WORKERS,
+                    default=DEFAULT_DOWNLOAD_WORKERS,
+                    setting_type=int,
+                )
+            )
+        )
+        self.memory_budget_box.setValue(
+            int(
+                settings_manager.get_value(
+                    Settings.MEMORY_BUDGET,
+                    default=DEFAULT_MEMORY_BUDGET_MB,
+                    setting_type=int,
+                )
+            )
+        )
+
         # Sieve settings
         self.sieve_group_box.setChecked(
             settings_manager.get_value(
@@ -3,12 +3,16 @@
 Contains functions for carbon calculations.
 """
 
+from collections import OrderedDict
 from dataclasses import dataclass
 import math
 from numbers import Number
 import os
+import threading
 import typing
 
+import numpy as np
+
 from qgis.core import (
     QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
@@ -16,8 +20,6 @@ from qgis.core import (
     QgsProcessing,
     QgsProcessingContext,
     QgsProcessingException,
-    QgsRasterBlock,
-    QgsRasterIterator,
     QgsRasterLayer,
     QgsRectangle,
     QgsVectorLayer,
@@ -32,7 +34,10 @@ from ..models.base import (
     NcsPathway,
     NcsPathwayType,
 )
-from ..utils import calculate_raster_area, log, transform_extent
+from ..utils import log, transform_extent
+from .raster.area import calculate_raster_areas
+from .raster.blocks import AlignedRaster, RasterGrid
+from .raster.coverage import iter_grid_coverage
 
 
 # For now, will set this manually but for future implementation, consider
@@ -42,6 +47,9 @@ MEAN_REFERENCE_LAYER_AREA = 9.0
 
 LOG_PREFIX = "Carbon Calculation"
 
+# Maximum number of prepared protect pathway layers that are kept
+MAX_PREPARED_PROTECT_LAYERS = 64
+
 
 def _validate_and_transform_extent(
     scenario_extent: typing.Tuple, reference_extent_crs_str: str
@@ -95,13 +103,15 @@ def _get_intersecting_pixel_values(
     reference_layer_path: str,
     reference_layer_name: str,
     calculation_type: str,
+    minimum_coverage: float = 0.0,
 ) -> typing.List[float]:
     """Extracts pixel values from a reference layer that intersect with NCS pathways.
 
-    This is a manual, pixel-by-pixel analysis that overcomes the limitations
-    of the raster calculator and zonal statistics tools, which use the intersection
-    of the center point of the reference pixel to determine whether the reference
-    pixel will be considered in the computation.
+    This overcomes the limitations of the raster calculator and zonal statistics
+    tools, which use the intersection of the center point of the reference pixel
+    to determine whether the reference pixel will be considered in the computation.
+    The NCS layer is read in windows at its own resolution and reduced to the
+    reference pixels instead of querying the NCS layer for each reference pixel.
 
     :param ncs_protect_pathways_layer: Layer containing an aggregate of protect NCS pathways.
     The CRS needs to be WGS84 otherwise the result will be incorrect. In addition,
@@ -118,6 +128,11 @@ def _get_intersecting_pixel_values(
     :param calculation_type: Type of calculation (e.g., "Irrecoverable Carbon", "Stored Carbon").
     :type calculation_type: str
 
+    :param minimum_coverage: Fraction of the reference pixel that needs to be
+    covered by the NCS pathways for the pixel to be included. The default value
+    of zero includes the pixel if there is any overlap.
+    :type minimum_coverage: float
+
     :returns: List of intersecting pixel values. Returns an empty list if there are
     any errors during the operation or no intersections are found.
     :rtype: typing.List[float]
@@ -219,106 +234,52 @@ def _get_intersecting_pixel_values(
         )
         return []
 
-    # Constants for NCS pathway layer
-    ncs_pixel_width = ncs_protect_pathways_layer.rasterUnitsPerPixelX()
-    ncs_pixel_height = ncs_protect_pathways_layer.rasterUnitsPerPixelY()
-    ncs_provider = ncs_protect_pathways_layer.dataProvider()
-
-    # Reference extent properties
-    ref_width = reference_extent.width()
-    ref_height = reference_extent.height()
-    ref_x_min = reference_extent.xMinimum()
-    ref_y_max = reference_extent.yMaximum()
-
-    # Specify extents for reading the reference layer
-    reference_num_cols = math.floor(ref_width / reference_layer.rasterUnitsPerPixelX())
-    reference_num_rows = math.floor(ref_height / reference_layer.rasterUnitsPerPixelY())
-
-    # Initialize iterator
-    reference_provider = reference_layer.dataProvider()
-    reference_layer_iterator = QgsRasterIterator(reference_provider)
-    reference_layer_iterator.startRasterRead(
-        1, reference_num_cols, reference_num_rows, reference_extent
+    # Specify the reference grid i.e. reference layer pixels within the extent
+    reference_num_cols = math.floor(
+        reference_extent.width() / reference_layer.rasterUnitsPerPixelX()
     )
+    reference_num_rows = math.floor(
+        reference_extent.height() / reference_layer.rasterUnitsPerPixelY()
+    )
+    if reference_num_cols == 0 or reference_num_rows == 0:
+        log(
+            f"{LOG_PREFIX} - The reference extent is smaller than a pixel of the "
+            f"reference {calculation_type} layer.",
+            info=False,
+        )
+        return []
 
-    intersecting_pixel_values = []
-
-    # Process reference layer blocks
-    while True:
-        result = reference_layer_iterator.readNextRasterPart(1)
-        success, columns, rows, block, left, top = result
-
-        if not success:
-            break
+    reference_grid = RasterGrid.from_extent(
+        reference_extent,
+        reference_extent.width() / reference_num_cols,
+        reference_extent.height() / reference_num_rows,
+        reference_layer.crs(),
+    )
 
-        if not block.isValid():
-            log(
-                f"{LOG_PREFIX} - Invalid {calculation_type} layer raster block.",
-                info=False,
+    # Read the NCS layer once at its own resolution and reduce it to the
+    # reference grid, a reference pixel is selected if any of the NCS pixels
+    # within it (or the minimum coverage fraction) has a valid value.
+    intersecting_pixel_values = []
+    reference_raster = None
+    try:
+        reference_raster = AlignedRaster(norm_source_path, reference_grid)
+        for window, coverage in iter_grid_coverage(
+            ncs_protect_pathways_layer.source(), reference_grid
+        ):
+            reference_values = reference_raster.read(window)
+            selected = ~np.isnan(reference_values) & (
+                np.nan_to_num(coverage, nan=0.0) > minimum_coverage
             )
-            break
-
-        col_step = ref_width / columns
-        row_step = ref_height / rows
-
-        # Set invalid data bytes once per block
-        invalid_data = None
-
-        for r in range(rows):
-            # Calculate y bounds once per row
-            block_part_y_max = ref_y_max - r * row_step
-            block_part_y_min = block_part_y_max - row_step
-
-            for c in range(columns):
-                if block.isNoData(r, c):
-                    continue
-
-                # Calculate x bounds
-                block_part_x_min = ref_x_min + c * col_step
-                block_part_x_max = block_part_x_min + col_step
-
-                # Create analysis extent
-                analysis_extent = QgsRectangle(
-                    block_part_x_min,
-                    block_part_y_min,
-                    block_part_x_max,
-                    block_part_y_max,
-                )
-
-                # Calculate required dimensions for NCS block
-                ncs_cols = math.ceil(analysis_extent.width() / ncs_pixel_width)
-                ncs_rows = math.ceil(analysis_extent.height() / ncs_pixel_height)
-
-                # Get NCS block
-                ncs_block = ncs_provider.block(1, analysis_extent, ncs_cols, ncs_rows)
-                if not ncs_block.isValid():
-                    log(
-                        f"{LOG_PREFIX} - Invalid aggregated NCS pathway raster block.",
-                        info=False,
-                    )
-                    continue
-
-                # Initialization invalid data once
-                if invalid_data is None:
-                    invalid_data = QgsRasterBlock.valueBytes(ncs_block.dataType(), 0.0)
-
-                ncs_block_data = ncs_block.data()
-
-                # Check if the NCS block contains any valid data i.e. if the NCS
-                # block within the reference block contains any other value
-                # apart from the invalid value i.e. 0 pixel value.
-                ncs_ba_set = set(
-                    ncs_block_data[i] for i in range(ncs_block_data.size())
-                )
-                invalid_ba_set = set(
-                    invalid_data[i] for i in range(invalid_data.size())
-                )
-
-                if ncs_ba_set - invalid_ba_set:
-                    # We have valid overlapping pixels, store the reference value
-                    intersecting_pixel_values.append(block.value(r, c))
-
-    reference_layer_iterator.stopRasterRead(1)
+            intersecting_pixel_values.extend(reference_values[selected].tolist())
+    except IOError as ex:
+        log(
+            f"{LOG_PREFIX} - Unable to read the {calculation_type} layers, {ex}",
+            info=False,
+        )
+        return []
+    finally:
+        if reference_raster is not None:
+            reference_raster.close()
 
     if len(intersecting_pixel_values) == 0:
         log(
@@ -467,15 +428,106 @@ def calculate_pathway_carbon_by_area(
 
     log("Calculating carbon impact for pathways...")
 
+    # Scan all the pathway layers in one pass
+    area_infos = calculate_raster_areas(
+        [carbon_info.layer for carbon_info in ncs_pathways_carbon_info], 1
+    )
+
     total_carbon = 0.0
-    for carbon_info in ncs_pathways_carbon_info:
-        area = calculate_raster_area(carbon_info.layer, 1)
-        if area != -1.0:
-            total_carbon += area * carbon_info.carbon_impact_per_ha
+    for carbon_info, area_info in zip(ncs_pathways_carbon_info, area_infos):
+        if area_info is None or area_info.valid_pixel_count == 0:
+            continue
+        total_carbon += area_info.total_area * carbon_info.carbon_impact_per_ha
 
     return total_carbon
 
 
+# Paths of the binary protect pathway layers, keyed by the identity of the
+# protect pathway layers they were prepared from.
+_prepared_protect_layers: "OrderedDict[tuple, str]" = OrderedDict()
+_pending_protect_layers: typing.Dict[tuple, threading.Event] = {}
+_prepared_protect_layers_lock = threading.Lock()
+
+
+def protect_pathways_key(data_sources: typing.Iterable[str]) -> tuple:
+    """Returns the identity of a set of protect pathway layers, which
+    changes when the layers are changed or when their files are modified.
+
+    :param data_sources: Paths of the protect pathway layers.
+    :type data_sources: Iterable
+
+    :returns: Path, size and modification time of each layer.
+    :rtype: tuple
+    """
+    identities = []
+    for data_source in sorted(set(data_sources)):
+        path = os.path.normcase(os.path.abspath(data_source))
+        try:
+            stat = os.stat(path)
+            identities.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            identities.append((data_source, None, None))
+
+    return tuple(identities)
+
+
+def prepared_protect_pathways_path(
+    data_sources: typing.List[str],
+    prepare: typing.Callable[[typing.List[str]], typing.Optional[str]],
+) -> typing.Optional[str]:
+    """Returns the path of the binary layer prepared from protect pathway
+    layers, the layer is only prepared once for the calculators of all
+    the activities with the same protect pathways.
+
+    :param data_sources: Paths of the protect pathway layers.
+    :type data_sources: list
+
+    :param prepare: Callable creating the binary layer from the protect
+    pathway layers and returning its path or None if an error occurs.
+    :type prepare: Callable
+
+    :returns: Path of the binary layer or None if it could not
+    be prepared.
+    :rtype: str
+    """
+    key = protect_pathways_key(data_sources)
+    while True:
+        with _prepared_protect_layers_lock:
+            path = _prepared_protect_layers.get(key)
+            if path is not None:
+                if os.path.exists(path):
+                    _prepared_protect_layers.move_to_end(key)
+                    return path
+                # Temporary files could have been removed
+                del _prepared_protect_layers[key]
+
+            pending = _pending_protect_layers.get(key)
+            if pending is None:
+                pending = _pending_protect_layers[key] = threading.Event()
+                break
+        # Being prepared by another calculator
+        pending.wait()
+
+    try:
+        path = prepare(data_sources)
+        if path is not None:
+            with _prepared_protect_layers_lock:
+                _prepared_protect_layers[key] = path
+                while len(_prepared_protect_layers) > MAX_PREPARED_PROTECT_LAYERS:
+                    _prepared_protect_layers.popitem(last=False)
+    finally:
+        with _prepared_protect_layers_lock:
+            _pending_protect_layers.pop(key).set()
+
+    return path
+
+
+def clear_prepared_protect_layers():
+    """Removes the references to the prepared protect pathway layers."""
+    with _prepared_protect_layers_lock:
+        _prepared_protect_layers.clear()
+
+
 class BasePathwaysCarbonCalculator:
     """Base class for carbon calculators for NCS pathways.
 
@@ -615,8 +667,38 @@ class BaseProtectPathwaysCarbonCalculator(BasePathwaysCarbonCalculator):
                 info=False,
             )
 
-        processing_context = QgsProcessingContext()
         protect_data_sources = [layer.source() for layer in valid_protect_layers]
+        prepared_layer_path = prepared_protect_pathways_path(
+            protect_data_sources, self._create_protect_pathways_layer
+        )
+        if prepared_layer_path is None:
+            return None
+
+        reprojected_protect_layer = QgsRasterLayer(
+            prepared_layer_path, "reprojected_protect_pathway"
+        )
+        if not reprojected_protect_layer.isValid():
+            log(
+                f"{LOG_PREFIX} - Reprojected protect pathways layer is invalid.",
+                info=False,
+            )
+            return None
+
+        return reprojected_protect_layer
+
+    def _create_protect_pathways_layer(
+        self, protect_data_sources: typing.List[str]
+    ) -> typing.Optional[str]:
+        """Merges the protect pathways into a binary layer reprojected to
+        the CRS of the reference carbon datasets.
+
+        :param protect_data_sources: Paths of the protect pathway layers.
+        :type protect_data_sources: list
+
+        :returns: Path of the binary layer or None if an error occurs.
+        :rtype: str
+        """
+        processing_context = QgsProcessingContext()
 
         # First merge the protect NCS pathways into one raster
         merge_args = {
@@ -719,17 +801,7 @@ class BaseProtectPathwaysCarbonCalculator(BasePathwaysCarbonCalculator):
 
             binary_layer_path = reproject_result["OUTPUT"]
 
-        reprojected_protect_layer = QgsRasterLayer(
-            binary_layer_path, "reprojected_protect_pathway"
-        )
-        if not reprojected_protect_layer.isValid():
-            log(
-                f"{LOG_PREFIX} - Reprojected protect pathways layer is invalid.",
-                info=False,
-            )
-            return None
-
-        return reprojected_protect_layer
+        return binary_layer_path
 
     def _calculate_carbon(self, prepared_layer: QgsRasterLayer) -> float:
         """Performs the actual carbon calculation. Should be overridden by subclasses.
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprints of files used to detect changes and verify transfers.
+
+Files are hashed with large memory-mapped or buffered reads and the digests
+are saved in a persistent index together with the size, modification time
+and inode of the file, so an unchanged file is never read twice. The index
+file is saved at most once per interval while digests are being computed.
+A fast non-cryptographic hash is used for local change detection, such as
+checking whether an uploaded layer has changed, when the xxhash package is
+available, BLAKE2 otherwise, while MD5 and SHA-256 digests can be requested
+to compare against digests provided by a server.
+"""
+
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import typing
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from ..conf import settings_manager, Settings
+from ..utils import log
+
+
+# Version of the index format, to be increased when the way the
+# digests are computed changes so that previous entries are not reused.
+FINGERPRINT_VERSION = 1
+
+FINGERPRINT_INDEX_FILE_NAME = "fingerprints.json"
+
+# Size of the reads, large enough for hashing to not be bound by the
+# Python overhead of each read.
+READ_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Maximum number of files in the index, the least recently used
+# entries are removed first.
+MAX_INDEX_ENTRIES = 10000
+
+# Minimum interval, in seconds, between saves of the index file when
+# digests are added, the remaining ones are saved by `flush`.
+SAVE_INTERVAL = 10.0
+
+# Algorithm used for local change detection
+FAST_ALGORITHM = "xxh3_128" if xxhash is not None else "blake2b"
+
+
+def _new_hash(algorithm: str):
+    """Returns a hash object of the given algorithm name."""
+    if algorithm.startswith("xxh"):
+        if xxhash is None:
+            raise ValueError(f"Hash algorithm {algorithm} requires xxhash")
+        return getattr(xxhash, algorithm)()
+
+    return hashlib.new(algorithm)
+
+
+def file_digest(path: str, algorithm: str = FAST_ALGORITHM) -> str:
+    """Computes the digest of a file without using the index.
+
+    :param path: File path.
+    :type path: str
+
+    :param algorithm: Hash algorithm, a hashlib algorithm name or
+    an xxhash one if the package is available.
+    :type algorithm: str
+
+    :returns: Hexadecimal digest of the file content.
+    :rtype: str
+    """
+    file_hash = _new_hash(algorithm)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return file_hash.hexdigest()
+
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, READ_BUFFER_SIZE):
+                        file_hash.update(view[offset : offset + READ_BUFFER_SIZE])
+                finally:
+                    view.release()
+            return file_hash.hexdigest()
+        except (OSError, ValueError, OverflowError):
+            # Memory mapping is not available for the file
+            file_hash = _new_hash(algorithm)
+            f.seek(0)
+
+        buffer = bytearray(READ_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            read_size = f.readinto(buffer)
+            if not read_size:
+                break
+            file_hash.update(view[:read_size])
+
+    return file_hash.hexdigest()
+
+
+class FingerprintIndex:
+    """Persistent index of the digests of files."""
+
+    def __init__(self, path: str = None):
+        """
+        :param path: Path of the index file, the index is only
+        kept in memory if not specified.
+        :type path: str
+        """
+        self._path = path
+        self._entries: typing.Dict[str, dict] = {}
+        self._lock = threading.RLock()
+        # Paths being hashed, to avoid hashing a file concurrently
+        self._pending: typing.Dict[tuple, threading.Event] = {}
+        # Order in which the entries were used
+        self._use_counter = 0
+        # Whether there are entries that have not been saved
+        self._modified = False
+        self._saved_time = time.monotonic()
+
+        if self._path:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            self._load()
+
+    @property
+    def path(self) -> typing.Optional[str]:
+        """Returns the path of the index file."""
+        return self._path
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if content.get("version") == FINGERPRINT_VERSION:
+            self._entries = content.get("entries", {})
+            self._use_counter = max(
+                (entry.get("used", 0) for entry in self._entries.values()),
+                default=0,
+            )
+
+    def save(self):
+        """Saves the index file."""
+        if not self._path:
+            return
+
+        with self._lock:
+            if len(self._entries) > MAX_INDEX_ENTRIES:
+                entries = sorted(
+                    self._entries.items(), key=lambda item: item[1].get("used", 0)
+                )
+                self._entries = dict(entries[-MAX_INDEX_ENTRIES:])
+            content = {"version": FINGERPRINT_VERSION, "entries": self._entries}
+            self._modified = False
+            self._saved_time = time.monotonic()
+            temporary_path = f"{self._path}.{threading.get_ident()}.tmp"
+            try:
+                with open(temporary_path, "w") as f:
+                    json.dump(content, f)
+                os.replace(temporary_path, self._path)
+            except OSError as e:
+                log(f"Unable to save the file fingerprints, {e}", info=False)
+
+    def flush(self):
+        """Saves the index file if digests have been added since it
+        was last saved.
+        """
+        with self._lock:
+            if self._modified:
+                self.save()
+
+    @staticmethod
+    def _identity(stat: os.stat_result) -> dict:
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "inode": stat.st_ino,
+        }
+
+    def fingerprint(self, path: str, algorithm: str = FAST_ALGORITHM) -> str:
+        """Returns the digest of a file, from the index if the file size,
+        modification time and inode have not changed.
+
+        :param path: File path.
+        :type path: str
+
+        :param algorithm: Hash algorithm, see `file_digest`.
+        :type algorithm: str
+
+        :returns: Hexadecimal digest of the file content.
+        :rtype: str
+        """
+        key = os.path.normcase(os.path.abspath(path))
+        while True:
+            identity = self._identity(os.stat(key))
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry["identity"] == identity:
+                    digest = entry["digests"].get(algorithm)
+                    if digest is not None:
+                        entry["used"] = self._next_use()
+                        return digest
+
+                pending = self._pending.get((key, algorithm))
+                if pending is None:
+                    pending = self._pending[(key, algorithm)] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            digest = file_digest(key, algorithm)
+            # The file could have been modified while it was read
+            if self._identity(os.stat(key)) == identity:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is None or entry["identity"] != identity:
+                        entry = self._entries[key] = {
+                            "identity": identity,
+                            "digests": {},
+                        }
+                    entry["digests"][algorithm] = digest
+                    entry["used"] = self._next_use()
+                    self._modified = True
+                    if time.monotonic() - self._saved_time >= SAVE_INTERVAL:
+                        self.save()
+        finally:
+            with self._lock:
+                self._pending.pop((key, algorithm)).set()
+
+        return digest
+
+    def _next_use(self) -> int:
+        self._use_counter += 1
+        return self._use_counter
+
+    def is_unchanged(
+        self, path: str, digest: str, algorithm: str = FAST_ALGORITHM
+    ) -> bool:
+        """Checks whether a file still has the given digest.
+
+        :param path: File path.
+        :type path: str
+
+        :param digest: Expected hexadecimal digest.
+        :type digest: str
+
+        :param algorithm: Hash algorithm of the digest.
+        :type algorithm: str
+
+        :returns: True if the file exists and has the digest.
+        :rtype: bool
+        """
+        try:
+            return self.fingerprint(path, algorithm) == digest.lower()
+        except OSError:
+            return False
+
+    def clear(self):
+        """Removes all the entries."""
+        with self._lock:
+            self._entries = {}
+        self.save()
+
+
+_fingerprint_index: typing.Optional[FingerprintIndex] = None
+_fingerprint_index_lock = threading.Lock()
+
+
+def fingerprint_index() -> FingerprintIndex:
+    """Returns the shared fingerprint index, saved under the base directory
+    when it has been set.
+
+    :returns: The fingerprint index.
+    :rtype: FingerprintIndex
+    """
+    global _fingerprint_index
+
+    base_dir = settings_manager.get_value(Settings.BASE_DIR, default="")
+    path = (
+        os.path.join(base_dir, "cache", FINGERPRINT_INDEX_FILE_NAME)
+        if base_dir and os.path.exists(base_dir)
+        else None
+    )
+    with _fingerprint_index_lock:
+        if _fingerprint_index is None or _fingerprint_index.path != path:
+            try:
+                _fingerprint_index = FingerprintIndex(path)
+                atexit.register(_fingerprint_index.flush)
+            except OSError as e:
+                log(f"Unable to create the file fingerprint index, {e}", info=False)
+                _fingerprint_index = FingerprintIndex()
+
+    return _fingerprint_index
+
+
+def file_fingerprint(path: str, algorithm: str = FAST_ALGORITHM) -> str:
+    """Returns the digest of a file from the shared index,
+    see `FingerprintIndex.fingerprint`.
+
+    :param path: File path.
+    :type path: str
+
+    :param algorithm: Hash algorithm, see `file_digest`.
+    :type algorithm: str
+
+    :returns: Hexadecimal digest of the file content.
+    :rtype: str
+    """
+    return fingerprint_index().fingerprint(path, algorithm)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the scenario analysis stages.
+
+Records the wall time, CPU time, bytes read and written, peak memory and
+output raster size of the analysis stages and processing algorithms so
+that runs can be compared and the dominant steps identified. Process-wide
+counters are used, stages running concurrently are therefore attributed
+the activity of all the running stages.
+"""
+
+import contextlib
+import csv
+import dataclasses
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import typing
+
+from osgeo import gdal
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from ..utils import log
+
+
+PROFILE_FILE_NAME = "scenario_profile"
+
+
+@dataclasses.dataclass
+class ProfileRecord:
+    """Measurements of a single stage or processing algorithm run."""
+
+    name: str
+    kind: str = "stage"
+    algorithm: str = ""
+    parent: str = ""
+    started: str = ""
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    bytes_read: typing.Optional[int] = None
+    bytes_written: typing.Optional[int] = None
+    peak_rss: typing.Optional[int] = None
+    raster_width: typing.Optional[int] = None
+    raster_height: typing.Optional[int] = None
+    success: bool = True
+
+
+def io_counters() -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    """Returns the total bytes read and written by the process.
+
+    :returns: Bytes read and written or None if not available
+    on the platform.
+    :rtype: tuple
+    """
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (AttributeError, psutil.Error):
+            pass
+
+    try:
+        values = {}
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                values[key.strip()] = int(value)
+        return values["read_bytes"], values["write_bytes"]
+    except (OSError, KeyError, ValueError):
+        pass
+
+    return None, None
+
+
+def peak_rss() -> typing.Optional[int]:
+    """Returns the peak resident memory of the process in bytes.
+
+    :returns: Peak resident set size or None if not available.
+    :rtype: int
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+    if psutil is not None:
+        try:
+            memory = psutil.Process().memory_info()
+            return getattr(memory, "peak_wset", memory.rss)
+        except psutil.Error:
+            pass
+
+    return None
+
+
+def raster_size(
+    path: typing.Any,
+) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    """Returns the width and height of a raster output, if it is one."""
+    if not isinstance(path, str) or not os.path.exists(path):
+        return None, None
+
+    gdal.PushErrorHandler("CPLQuietErrorHandler")
+    try:
+        dataset = gdal.OpenEx(path, gdal.OF_RASTER | gdal.OF_READONLY)
+    finally:
+        gdal.PopErrorHandler()
+    if dataset is None:
+        return None, None
+
+    return dataset.RasterXSize, dataset.RasterYSize
+
+
+class ScenarioProfiler:
+    """Collects the measurements of the stages of a scenario analysis."""
+
+    def __init__(self):
+        self._records: typing.List[ProfileRecord] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def records(self) -> typing.List[ProfileRecord]:
+        """Returns the records in the order in which they completed."""
+        with self._lock:
+            return list(self._records)
+
+    def _current_stage(self) -> str:
+        stack = getattr(self._local, "stack", [])
+        return stack[-1] if stack else ""
+
+    @contextlib.contextmanager
+    def measure(self, name: str, kind: str = "stage", algorithm: str = ""):
+        """Measures the code run in the context.
+
+        :param name: Name of the stage or algorithm.
+        :type name: str
+
+        :param kind: Either "stage" or "algorithm".
+        :type kind: str
+
+        :param algorithm: Processing algorithm id, if any.
+        :type algorithm: str
+
+        :returns: The record, whose output size and success can be
+        updated in the context.
+        :rtype: ProfileRecord
+        """
+        record = ProfileRecord(
+            name=name,
+            kind=kind,
+            algorithm=algorithm,
+            parent=self._current_stage(),
+            started=datetime.datetime.now().isoformat(timespec="milliseconds"),
+        )
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(name)
+
+        read_start, written_start = io_counters()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        except BaseException:
+            record.success = False
+            raise
+        finally:
+            record.wall_time = time.perf_counter() - wall_start
+            record.cpu_time = time.process_time() - cpu_start
+            read_end, written_end = io_counters()
+            if read_start is not None and read_end is not None:
+                record.bytes_read = read_end - read_start
+                record.bytes_written = written_end - written_start
+            record.peak_rss = peak_rss()
+            stack.pop()
+
+            with self._lock:
+                self._records.append(record)
+
+    def summary(self) -> typing.List[dict]:
+        """Aggregates the records by kind and name.
+
+        :returns: Count, total wall and CPU time and bytes of each stage
+        and algorithm, sorted by decreasing wall time.
+        :rtype: list
+        """
+        totals = {}
+        for record in self.records:
+            key = (record.kind, record.algorithm or record.name)
+            total = totals.setdefault(
+                key,
+                {
+                    "kind": record.kind,
+                    "name": key[1],
+                    "count": 0,
+                    "wall_time": 0.0,
+                    "cpu_time": 0.0,
+                    "bytes_read": 0,
+                    "bytes_written": 0,
+                },
+            )
+            total["count"] += 1
+            total["wall_time"] += record.wall_time
+            total["cpu_time"] += record.cpu_time
+            total["bytes_read"] += record.bytes_read or 0
+            total["bytes_written"] += record.bytes_written or 0
+
+        return sorted(totals.values(), key=lambda item: -item["wall_time"])
+
+    def summary_text(self) -> str:
+        """Returns the summary formatted for the log."""
+        lines = ["Scenario analysis profile:"]
+        for item in self.summary():
+            lines.append(
+                f"  {item['kind']:<9} {item['name']:<45} "
+                f"x{item['count']:<4} wall {item['wall_time']:9.2f}s "
+                f"cpu {item['cpu_time']:9.2f}s "
+                f"read {item['bytes_read'] / 1048576:9.1f}MB "
+                f"written {item['bytes_written'] / 1048576:9.1f}MB"
+            )
+        rss = [r.peak_rss for r in self.records if r.peak_rss is not None]
+        if rss:
+            lines.append(f"  peak memory {max(rss) / 1048576:.1f}MB")
+
+        return "\n".join(lines)
+
+    def write(self, directory: str, metadata: dict = None) -> typing.List[str]:
+        """Writes the records as JSON and CSV files in the given directory.
+
+        :param directory: Output directory, e.g. the scenario directory.
+        :type directory: str
+
+        :param metadata: Additional information saved in the JSON file
+        such as the plugin version.
+        :type metadata: dict
+
+        :returns: Paths of the written files.
+        :rtype: list
+        """
+        records = [dataclasses.asdict(record) for record in self.records]
+        json_path = os.path.join(directory, f"{PROFILE_FILE_NAME}.json")
+        csv_path = os.path.join(directory, f"{PROFILE_FILE_NAME}.csv")
+        try:
+            with open(json_path, "w") as f:
+                json.dump(
+                    {
+                        "metadata": metadata or {},
+                        "summary": self.summary(),
+                        "records": records,
+                    },
+                    f,
+                    indent=2,
+                )
+
+            with open(csv_path, "w", newline="") as f:
+                writer = csv.DictWriter(
+                    f,
+                    fieldnames=[
+                        field.name for field in dataclasses.fields(ProfileRecord)
+                    ],
+                )
+                writer.writeheader()
+                writer.writerows(records)
+        except OSError as e:
+            log(f"Unable to save the scenario analysis profile, {e}", info=False)
+            return []
+
+        return [json_path, csv_path]
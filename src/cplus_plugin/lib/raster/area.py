@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming calculation of pixel counts and areas of raster layers.
+
+Layers are read window by window using GDAL and the histogram of the pixel
+values, the number of valid pixels and the area of the pixels are computed
+in a single pass. Layers sharing the same grid are read together so that,
+for instance, all the pathways of an activity are scanned in one pass.
+For geographic CRSs, the area of the pixels is computed on the ellipsoid
+for each row of the grid.
+
+Rasters created by a block pipeline can have their areas accumulated while
+they are written and saved in a sidecar file, which is then used instead of
+reading the raster again.
+"""
+
+import dataclasses
+import json
+import os
+import typing
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.core import (
+    Qgis,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransformContext,
+    QgsDistanceArea,
+    QgsGeometry,
+    QgsPointXY,
+    QgsProcessingFeedback,
+    QgsRasterLayer,
+    QgsUnitTypes,
+)
+
+from .blocks import BlockWindow, RasterGrid
+from .pipeline import BlockNode, BlockReducer
+from ...utils import log
+
+
+# Suffix of the file with the areas of a raster, next to the raster.
+AREA_SIDECAR_SUFFIX = ".areas.json"
+
+
+@dataclasses.dataclass
+class RasterAreaInfo:
+    """Pixel counts and areas, in hectares, of a raster band grouped by
+    the pixel value. NoData pixels are excluded.
+    """
+
+    source: str
+    pixel_counts: typing.Dict[float, int] = dataclasses.field(default_factory=dict)
+    pixel_areas: typing.Dict[float, float] = dataclasses.field(default_factory=dict)
+
+    @property
+    def valid_pixel_count(self) -> int:
+        """Returns the number of pixels with a valid value."""
+        return int(sum(self.pixel_counts.values()))
+
+    @property
+    def total_area(self) -> float:
+        """Returns the total area, in hectares, of the valid pixels."""
+        return float(sum(self.pixel_areas.values()))
+
+    def update(self, values: np.ndarray, counts: np.ndarray, areas: np.ndarray):
+        """Adds the counts and areas of the given pixel values.
+
+        :param values: Unique pixel values.
+        :type values: np.ndarray
+
+        :param counts: Number of pixels for each value.
+        :type counts: np.ndarray
+
+        :param areas: Area of the pixels for each value.
+        :type areas: np.ndarray
+        """
+        for value, count, area in zip(values.tolist(), counts.tolist(), areas.tolist()):
+            self.pixel_counts[value] = self.pixel_counts.get(value, 0) + int(count)
+            self.pixel_areas[value] = self.pixel_areas.get(value, 0.0) + float(area)
+
+
+class PixelAreaReducer(BlockReducer):
+    """Accumulates the pixel counts and areas of the values of a node,
+    NaN values are excluded.
+    """
+
+    def __init__(self, node: BlockNode, source: str, row_areas: np.ndarray):
+        """
+        :param node: Node whose values are accumulated.
+        :type node: BlockNode
+
+        :param source: Path of the raster written from the node values.
+        :type source: str
+
+        :param row_areas: Pixel area of each row of the grid, see
+        `pixel_row_areas`.
+        :type row_areas: np.ndarray
+        """
+        super().__init__(node)
+        self.source = source
+        self.row_areas = row_areas
+        self.area_info = None
+
+    def reset(self):
+        self.area_info = RasterAreaInfo(source=self.source)
+
+    def update(self, window: BlockWindow, values: np.ndarray):
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return
+
+        unique_values, inverse = np.unique(values[valid], return_inverse=True)
+        rows = np.nonzero(valid)[0] + window.y_offset
+        self.area_info.update(
+            unique_values,
+            np.bincount(inverse),
+            np.bincount(inverse, weights=self.row_areas[rows]),
+        )
+
+
+def _sidecar_path(path: str, band_number: int) -> str:
+    if band_number == 1:
+        return f"{path}{AREA_SIDECAR_SUFFIX}"
+
+    return f"{path}.band{band_number}{AREA_SIDECAR_SUFFIX}"
+
+
+def write_area_sidecar(area_info: RasterAreaInfo, band_number: int = 1) -> bool:
+    """Saves the areas of a raster in a file next to the raster. The file
+    is only valid as long as the raster is not modified.
+
+    :param area_info: Areas of the raster, the source is the raster path.
+    :type area_info: RasterAreaInfo
+
+    :param band_number: Band of the raster.
+    :type band_number: int
+
+    :returns: True if the file was saved else False.
+    :rtype: bool
+    """
+    try:
+        stat = os.stat(area_info.source)
+        content = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "pixel_counts": [[k, v] for k, v in area_info.pixel_counts.items()],
+            "pixel_areas": [[k, v] for k, v in area_info.pixel_areas.items()],
+        }
+        with open(_sidecar_path(area_info.source, band_number), "w") as f:
+            json.dump(content, f)
+    except (OSError, TypeError, ValueError) as e:
+        log(f"Unable to save the areas of {area_info.source}, {e}", info=False)
+        return False
+
+    return True
+
+
+def read_area_sidecar(
+    path: str, band_number: int = 1
+) -> typing.Optional[RasterAreaInfo]:
+    """Reads the areas of a raster saved by `write_area_sidecar`.
+
+    :param path: Path of the raster.
+    :type path: str
+
+    :param band_number: Band of the raster.
+    :type band_number: int
+
+    :returns: The areas of the raster or None if there is no saved areas
+    or the raster has been modified since they were saved.
+    :rtype: RasterAreaInfo
+    """
+    sidecar_path = _sidecar_path(path, band_number)
+    if not os.path.exists(sidecar_path):
+        return None
+
+    try:
+        stat = os.stat(path)
+        with open(sidecar_path) as f:
+            content = json.load(f)
+        if content["size"] != stat.st_size or content["mtime_ns"] != stat.st_mtime_ns:
+            return None
+
+        return RasterAreaInfo(
+            source=path,
+            pixel_counts={float(k): int(v) for k, v in content["pixel_counts"]},
+            pixel_areas={float(k): float(v) for k, v in content["pixel_areas"]},
+        )
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        log(f"Unable to read the saved areas of {path}, {e}", info=False)
+
+    return None
+
+
+def _hectares_unit():
+    """Returns the hectares area unit for the running QGIS version."""
+    if Qgis.versionInt() < 33000:
+        return QgsUnitTypes.AreaUnit.AreaHectares
+
+    return Qgis.AreaUnit.Hectares
+
+
+def pixel_row_areas(grid: RasterGrid, crs: QgsCoordinateReferenceSystem) -> np.ndarray:
+    """Computes the area, in hectares, of a pixel in each row of the grid.
+
+    For projected CRSs all the rows have the same pixel area whereas for
+    geographic CRSs the area is measured on the ellipsoid of the CRS.
+
+    :param grid: Grid of the raster.
+    :type grid: RasterGrid
+
+    :param crs: CRS of the raster.
+    :type crs: QgsCoordinateReferenceSystem
+
+    :returns: Pixel area of each row of the grid.
+    :rtype: np.ndarray
+    """
+    hectares = _hectares_unit()
+    pixel_width = abs(grid.x_resolution)
+    pixel_height = abs(grid.y_resolution)
+
+    if not crs.isGeographic():
+        area_unit = QgsUnitTypes.distanceToAreaUnit(crs.mapUnits())
+        factor = QgsUnitTypes.fromUnitToUnitFactor(area_unit, hectares)
+        return np.full(grid.height, pixel_width * pixel_height * factor)
+
+    area_calc = QgsDistanceArea()
+    area_calc.setSourceCrs(crs, QgsCoordinateTransformContext())
+    area_calc.setEllipsoid(crs.ellipsoidAcronym() or "EPSG:7030")
+
+    x_min = grid.geotransform[0]
+    y_max = grid.geotransform[3]
+    row_areas = np.empty(grid.height, dtype=np.float64)
+    for row in range(grid.height):
+        top = y_max - row * pixel_height
+        bottom = top - pixel_height
+        pixel = QgsGeometry.fromPolygonXY(
+            [
+                [
+                    QgsPointXY(x_min, top),
+                    QgsPointXY(x_min + pixel_width, top),
+                    QgsPointXY(x_min + pixel_width, bottom),
+                    QgsPointXY(x_min, bottom),
+                    QgsPointXY(x_min, top),
+                ]
+            ]
+        )
+        row_areas[row] = area_calc.convertAreaMeasurement(
+            area_calc.measureArea(pixel), hectares
+        )
+
+    return row_areas
+
+
+def calculate_raster_areas(
+    layers: typing.Sequence[QgsRasterLayer],
+    band_number: int = 1,
+    feedback: QgsProcessingFeedback = None,
+) -> typing.List[typing.Optional[RasterAreaInfo]]:
+    """Calculates the pixel counts and areas of several raster layers.
+
+    Layers on the same grid are read together, window by window, so each
+    pixel of each layer is read only once. Layers with saved areas, see
+    `write_area_sidecar`, are not read.
+
+    :param layers: Raster layers whose areas are to be calculated.
+    :type layers: list
+
+    :param band_number: Band number to compute area, default is band one.
+    :type band_number: int
+
+    :param feedback: Feedback object for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :returns: Area information for each layer, in the same order as the
+    input layers. The item is None if the layer is invalid or could not
+    be read. An empty list is returned if the calculation was cancelled.
+    :rtype: list
+    """
+    results = [None] * len(layers)
+
+    # Group the readable layers by grid
+    groups = {}
+    for index, layer in enumerate(layers):
+        if layer is None or not layer.isValid():
+            log("Invalid layer for raster area calculation.", info=False)
+            continue
+
+        area_info = read_area_sidecar(layer.source(), band_number)
+        if area_info is not None:
+            results[index] = area_info
+            continue
+
+        dataset = gdal.Open(layer.source(), gdal.GA_ReadOnly)
+        if dataset is None or band_number > dataset.RasterCount:
+            log(
+                f"Unable to read band {band_number} of {layer.source()} "
+                f"for raster area calculation.",
+                info=False,
+            )
+            continue
+
+        grid = RasterGrid.from_dataset(dataset)
+        key = (grid.geotransform, grid.width, grid.height, layer.crs().authid())
+        if key not in groups:
+            groups[key] = (grid, layer.crs(), [])
+        groups[key][2].append((index, dataset))
+
+    window_count = sum(grid.window_count() for grid, _, _ in groups.values())
+    processed_windows = 0
+
+    for grid, crs, members in groups.values():
+        row_areas = pixel_row_areas(grid, crs)
+        uniform_area = bool(np.all(row_areas == row_areas[0]))
+
+        bands = []
+        for index, dataset in members:
+            band = dataset.GetRasterBand(band_number)
+            bands.append((index, dataset, band, band.GetNoDataValue()))
+            results[index] = RasterAreaInfo(source=layers[index].source())
+
+        for window in grid.windows():
+            if feedback is not None and feedback.isCanceled():
+                return []
+
+            for index, _, band, nodata in bands:
+                data = band.ReadAsArray(
+                    window.x_offset, window.y_offset, window.width, window.height
+                )
+                valid = np.ones(data.shape, dtype=bool)
+                if nodata is not None:
+                    valid &= data != nodata
+                if np.issubdtype(data.dtype, np.floating):
+                    valid &= ~np.isnan(data)
+
+                values = data[valid].astype(np.float64)
+                if values.size == 0:
+                    continue
+
+                if uniform_area:
+                    unique_values, counts = np.unique(values, return_counts=True)
+                    areas = counts * row_areas[0]
+                else:
+                    unique_values, inverse = np.unique(values, return_inverse=True)
+                    rows = np.nonzero(valid)[0] + window.y_offset
+                    counts = np.bincount(inverse)
+                    areas = np.bincount(inverse, weights=row_areas[rows])
+
+                results[index].update(unique_values, counts, areas)
+
+            processed_windows += 1
+            if feedback is not None:
+                feedback.setProgress(100.0 * processed_windows / window_count)
+
+    return results
+
+
+def calculate_raster_area_info(
+    layer: QgsRasterLayer,
+    band_number: int = 1,
+    feedback: QgsProcessingFeedback = None,
+) -> typing.Optional[RasterAreaInfo]:
+    """Calculates the pixel counts and areas of a single raster layer.
+
+    :param layer: Raster layer whose area is to be calculated.
+    :type layer: QgsRasterLayer
+
+    :param band_number: Band number to compute area, default is band one.
+    :type band_number: int
+
+    :param feedback: Feedback object for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :returns: Area information of the layer or None if the layer is
+    invalid, could not be read or the calculation was cancelled.
+    :rtype: RasterAreaInfo
+    """
+    results = calculate_raster_areas([layer], band_number, feedback)
+    if len(results) == 0:
+        return None
+
+    return results[0]
@@ -0,0 +1,605 @@
+# -*- coding: utf-8 -*-
+"""
+Grid definition and block-wise raster I/O helpers using GDAL and NumPy.
+
+Values read through these helpers are returned as float64 NumPy arrays where
+NoData pixels have been replaced with NaN so that downstream computations do
+not need to track the NoData value of each individual input.
+"""
+
+import dataclasses
+import math
+import os
+import typing
+import uuid
+
+import numpy as np
+from osgeo import gdal, osr
+
+from qgis.core import QgsCoordinateReferenceSystem, QgsRectangle
+
+from ...utils import log
+
+
+# Default edge length (in pixels) of the square windows used when
+# iterating over a grid.
+DEFAULT_BLOCK_SIZE = 512
+
+# Creation options applied to rasters written by the block writer.
+DEFAULT_CREATION_OPTIONS = [
+    "COMPRESS=DEFLATE",
+    "ZLEVEL=6",
+    "TILED=YES",
+    "BIGTIFF=IF_SAFER",
+    "NUM_THREADS=ALL_CPUS",
+]
+
+# Tolerance, as a fraction of the pixel size, when comparing grids.
+_ALIGNMENT_TOLERANCE = 1e-6
+
+
+def srs_wkt(crs: typing.Union[QgsCoordinateReferenceSystem, str]) -> str:
+    """Returns the WKT representation, as understood by GDAL, of the given
+    CRS.
+
+    :param crs: Coordinate reference system or a user input definition
+    such as an authority identifier e.g. EPSG:4326.
+    :type crs: QgsCoordinateReferenceSystem, str
+
+    :returns: WKT of the CRS or an empty string if the CRS is undefined.
+    :rtype: str
+    """
+    if isinstance(crs, QgsCoordinateReferenceSystem):
+        if not crs.isValid():
+            return ""
+        crs = crs.authid() or crs.toWkt()
+
+    if not crs:
+        return ""
+
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.SetFromUserInput(crs)
+
+    return spatial_reference.ExportToWkt()
+
+
+@dataclasses.dataclass(frozen=True)
+class BlockWindow:
+    """Rectangular window, in pixel coordinates, of a raster grid."""
+
+    x_offset: int
+    y_offset: int
+    width: int
+    height: int
+
+    @property
+    def shape(self) -> typing.Tuple[int, int]:
+        """Returns the NumPy shape i.e. (rows, columns) of the window."""
+        return self.height, self.width
+
+    @property
+    def size(self) -> int:
+        """Returns the number of pixels in the window."""
+        return self.width * self.height
+
+
+@dataclasses.dataclass(frozen=True)
+class RasterGrid:
+    """Defines the pixel lattice, size, CRS and NoData value of a raster
+    i.e. the analysis grid all inputs are aligned to.
+    """
+
+    geotransform: typing.Tuple[float, float, float, float, float, float]
+    width: int
+    height: int
+    crs_wkt: str = ""
+    nodata: float = -9999.0
+
+    @classmethod
+    def from_dataset(cls, dataset: gdal.Dataset, nodata: float = None):
+        """Creates a grid matching the given GDAL dataset.
+
+        :param dataset: Source dataset.
+        :type dataset: gdal.Dataset
+
+        :param nodata: NoData value of the grid, if not specified then the
+        NoData value of the first band will be used.
+        :type nodata: float
+
+        :returns: Grid matching the dataset.
+        :rtype: RasterGrid
+        """
+        if nodata is None:
+            nodata = dataset.GetRasterBand(1).GetNoDataValue()
+
+        return cls(
+            geotransform=tuple(dataset.GetGeoTransform()),
+            width=dataset.RasterXSize,
+            height=dataset.RasterYSize,
+            crs_wkt=dataset.GetProjection(),
+            nodata=-9999.0 if nodata is None else float(nodata),
+        )
+
+    @classmethod
+    def from_path(cls, path: str, nodata: float = None):
+        """Creates a grid matching the raster in the given path.
+
+        :param path: Path to the raster file.
+        :type path: str
+
+        :param nodata: NoData value of the grid.
+        :type nodata: float
+
+        :returns: Grid matching the raster or None if the raster
+        could not be opened.
+        :rtype: RasterGrid
+        """
+        dataset = gdal.Open(path, gdal.GA_ReadOnly)
+        if dataset is None:
+            log(f"Unable to open {path} for defining a grid.", info=False)
+            return None
+
+        return cls.from_dataset(dataset, nodata)
+
+    @classmethod
+    def from_extent(
+        cls,
+        extent: QgsRectangle,
+        x_resolution: float,
+        y_resolution: float,
+        crs: typing.Union[QgsCoordinateReferenceSystem, str],
+        nodata: float = -9999.0,
+    ):
+        """Creates a north-up grid covering the given extent. The maximum
+        x and minimum y coordinates are extended, if required, so that the
+        extent is a whole number of pixels.
+
+        :param extent: Extent of the grid.
+        :type extent: QgsRectangle
+
+        :param x_resolution: Pixel width in map units.
+        :type x_resolution: float
+
+        :param y_resolution: Pixel height in map units.
+        :type y_resolution: float
+
+        :param crs: CRS of the grid.
+        :type crs: QgsCoordinateReferenceSystem, str
+
+        :param nodata: NoData value of the grid.
+        :type nodata: float
+
+        :returns: Grid covering the extent.
+        :rtype: RasterGrid
+        """
+        x_resolution = abs(float(x_resolution))
+        y_resolution = abs(float(y_resolution))
+        width = max(1, int(round(extent.width() / x_resolution)))
+        height = max(1, int(round(extent.height() / y_resolution)))
+
+        return cls(
+            geotransform=(
+                extent.xMinimum(),
+                x_resolution,
+                0.0,
+                extent.yMaximum(),
+                0.0,
+                -y_resolution,
+            ),
+            width=width,
+            height=height,
+            crs_wkt=srs_wkt(crs),
+            nodata=float(nodata),
+        )
+
+    @property
+    def x_resolution(self) -> float:
+        """Returns the pixel width in map units."""
+        return self.geotransform[1]
+
+    @property
+    def y_resolution(self) -> float:
+        """Returns the absolute pixel height in map units."""
+        return abs(self.geotransform[5])
+
+    @property
+    def bounds(self) -> typing.Tuple[float, float, float, float]:
+        """Returns the (x_min, y_min, x_max, y_max) bounds of the grid."""
+        x_min = self.geotransform[0]
+        y_max = self.geotransform[3]
+        return (
+            x_min,
+            y_max - self.height * self.y_resolution,
+            x_min + self.width * self.x_resolution,
+            y_max,
+        )
+
+    @property
+    def extent(self) -> QgsRectangle:
+        """Returns the extent of the grid."""
+        x_min, y_min, x_max, y_max = self.bounds
+        return QgsRectangle(x_min, y_min, x_max, y_max)
+
+    @property
+    def pixel_count(self) -> int:
+        """Returns the total number of pixels in the grid."""
+        return self.width * self.height
+
+    def has_same_pixels(self, other: "RasterGrid") -> bool:
+        """Returns True if the other grid has the same geotransform and
+        size, the NoData values of the grids can be different.
+        """
+        return (self.geotransform, self.width, self.height) == (
+            other.geotransform,
+            other.width,
+            other.height,
+        )
+
+    def window_geotransform(self, window: BlockWindow) -> typing.Tuple:
+        """Returns the geotransform of the given window.
+
+        :param window: Window within the grid.
+        :type window: BlockWindow
+
+        :returns: Geotransform of the window.
+        :rtype: tuple
+        """
+        gt = self.geotransform
+        return (
+            gt[0] + window.x_offset * gt[1],
+            gt[1],
+            0.0,
+            gt[3] + window.y_offset * gt[5],
+            0.0,
+            gt[5],
+        )
+
+    def window_bounds(self, window: BlockWindow) -> typing.Tuple:
+        """Returns the (x_min, y_min, x_max, y_max) bounds of the window.
+
+        :param window: Window within the grid.
+        :type window: BlockWindow
+
+        :returns: Bounds of the window.
+        :rtype: tuple
+        """
+        gt = self.window_geotransform(window)
+        return (
+            gt[0],
+            gt[3] - window.height * self.y_resolution,
+            gt[0] + window.width * self.x_resolution,
+            gt[3],
+        )
+
+    def windows(
+        self, block_width: int = None, block_height: int = None
+    ) -> typing.Iterator[BlockWindow]:
+        """Iterates over the grid in row-major order using windows of
+        the given size. Windows at the right and bottom edges are
+        truncated to fit in the grid.
+
+        :param block_width: Width of each window, defaults to
+        DEFAULT_BLOCK_SIZE.
+        :type block_width: int
+
+        :param block_height: Height of each window, defaults to
+        DEFAULT_BLOCK_SIZE.
+        :type block_height: int
+
+        :returns: Iterator of the windows.
+        :rtype: typing.Iterator[BlockWindow]
+        """
+        block_width = max(1, int(block_width or DEFAULT_BLOCK_SIZE))
+        block_height = max(1, int(block_height or DEFAULT_BLOCK_SIZE))
+
+        for y_offset in range(0, self.height, block_height):
+            height = min(block_height, self.height - y_offset)
+            for x_offset in range(0, self.width, block_width):
+                width = min(block_width, self.width - x_offset)
+                yield BlockWindow(x_offset, y_offset, width, height)
+
+    def window_count(self, block_width: int = None, block_height: int = None) -> int:
+        """Returns the number of windows that will be yielded by
+        `windows` for the given block size.
+        """
+        block_width = max(1, int(block_width or DEFAULT_BLOCK_SIZE))
+        block_height = max(1, int(block_height or DEFAULT_BLOCK_SIZE))
+
+        return math.ceil(self.width / block_width) * math.ceil(
+            self.height / block_height
+        )
+
+    def pixel_offset(self, dataset: gdal.Dataset) -> typing.Optional[tuple]:
+        """Returns the integer (column, row) offset of the grid origin in
+        the pixel space of the given dataset if both share the same pixel
+        lattice and CRS.
+
+        :param dataset: Dataset to compare with.
+        :type dataset: gdal.Dataset
+
+        :returns: Offset of the grid in the dataset or None if the dataset
+        is not on the same pixel lattice.
+        :rtype: tuple
+        """
+        gt = dataset.GetGeoTransform()
+        if gt[2] != 0.0 or gt[4] != 0.0:
+            return None
+
+        x_tolerance = abs(self.x_resolution) * _ALIGNMENT_TOLERANCE
+        y_tolerance = abs(self.y_resolution) * _ALIGNMENT_TOLERANCE
+        if (
+            abs(gt[1] - self.geotransform[1]) > x_tolerance
+            or abs(gt[5] - self.geotransform[5]) > y_tolerance
+        ):
+            return None
+
+        if self.crs_wkt and dataset.GetProjection():
+            grid_srs = osr.SpatialReference(wkt=self.crs_wkt)
+            dataset_srs = osr.SpatialReference(wkt=dataset.GetProjection())
+            if not grid_srs.IsSame(dataset_srs):
+                return None
+
+        column = (self.geotransform[0] - gt[0]) / gt[1]
+        row = (self.geotransform[3] - gt[3]) / gt[5]
+        if (
+            abs(column - round(column)) > _ALIGNMENT_TOLERANCE * 10
+            or abs(row - round(row)) > _ALIGNMENT_TOLERANCE * 10
+        ):
+            return None
+
+        return int(round(column)), int(round(row))
+
+
+class AlignedRaster:
+    """Reads windows of a raster band in the pixel space of an analysis
+    grid.
+
+    Rasters that share the pixel lattice and CRS of the grid are read
+    directly with an offset whereas other rasters are warped on-the-fly
+    through an in-memory VRT so no intermediate file is written to disk.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        grid: RasterGrid,
+        band_number: int = 1,
+        resample_algorithm: str = "near",
+    ):
+        self._path = path
+        self._grid = grid
+        self._band_number = band_number
+        self._vrt_path = None
+
+        source = gdal.Open(path, gdal.GA_ReadOnly)
+        if source is None:
+            raise IOError(f"Unable to open raster {path}")
+
+        offset = grid.pixel_offset(source)
+        if offset is None:
+            self._vrt_path = f"/vsimem/cplus_aligned_{uuid.uuid4().hex}.vrt"
+            options = gdal.WarpOptions(
+                format="VRT",
+                outputBounds=grid.bounds,
+                width=grid.width,
+                height=grid.height,
+                dstSRS=grid.crs_wkt or None,
+                resampleAlg=resample_algorithm,
+                multithread=True,
+            )
+            self._dataset = gdal.Warp(self._vrt_path, source, options=options)
+            if self._dataset is None:
+                raise IOError(f"Unable to align raster {path} to the analysis grid")
+            offset = (0, 0)
+        else:
+            self._dataset = source
+
+        self._column_offset, self._row_offset = offset
+        self._band = self._dataset.GetRasterBand(band_number)
+        self._nodata = self._band.GetNoDataValue()
+
+    @property
+    def path(self) -> str:
+        """Returns the source path of the raster."""
+        return self._path
+
+    @property
+    def is_warped(self) -> bool:
+        """Returns True if the raster is read through a warped VRT."""
+        return self._vrt_path is not None
+
+    @property
+    def nodata(self) -> typing.Optional[float]:
+        """Returns the NoData value of the source band."""
+        return self._nodata
+
+    def read(self, window: BlockWindow) -> np.ndarray:
+        """Reads the values of the raster in the given grid window.
+
+        Areas of the window that are outside the raster, as well as
+        NoData pixels, are returned as NaN.
+
+        :param window: Window in the analysis grid.
+        :type window: BlockWindow
+
+        :returns: Float64 array with the shape of the window.
+        :rtype: np.ndarray
+        """
+        values = np.full(window.shape, np.nan, dtype=np.float64)
+
+        x_start = window.x_offset + self._column_offset
+        y_start = window.y_offset + self._row_offset
+        x_end = x_start + window.width
+        y_end = y_start + window.height
+
+        read_x_start = max(0, x_start)
+        read_y_start = max(0, y_start)
+        read_x_end = min(self._dataset.RasterXSize, x_end)
+        read_y_end = min(self._dataset.RasterYSize, y_end)
+        if read_x_end <= read_x_start or read_y_end <= read_y_start:
+            return values
+
+        data = self._band.ReadAsArray(
+            read_x_start,
+            read_y_start,
+            read_x_end - read_x_start,
+            read_y_end - read_y_start,
+        ).astype(np.float64, copy=False)
+
+        if self._nodata is not None and not math.isnan(self._nodata):
+            data[data == self._nodata] = np.nan
+
+        row_start = read_y_start - y_start
+        column_start = read_x_start - x_start
+        values[
+            row_start : row_start + data.shape[0],
+            column_start : column_start + data.shape[1],
+        ] = data
+
+        return values
+
+    def close(self):
+        """Releases the underlying dataset and any in-memory VRT."""
+        self._band = None
+        self._dataset = None
+        if self._vrt_path is not None:
+            gdal.Unlink(self._vrt_path)
+            self._vrt_path = None
+
+
+class BlockRasterWriter:
+    """Creates a single-band GeoTIFF on a grid and writes it window
+    by window. NaN values are written as the NoData value.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        grid: RasterGrid,
+        data_type: int = gdal.GDT_Float32,
+        nodata: float = None,
+        creation_options: typing.List[str] = None,
+    ):
+        self._path = path
+        self._grid = grid
+        self._nodata = grid.nodata if nodata is None else nodata
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        driver = gdal.GetDriverByName("GTiff")
+        self._dataset = driver.Create(
+            path,
+            grid.width,
+            grid.height,
+            1,
+            data_type,
+            creation_options or DEFAULT_CREATION_OPTIONS,
+        )
+        if self._dataset is None:
+            raise IOError(f"Unable to create raster {path}")
+
+        self._dataset.SetGeoTransform(grid.geotransform)
+        if grid.crs_wkt:
+            self._dataset.SetProjection(grid.crs_wkt)
+        self._band = self._dataset.GetRasterBand(1)
+        self._band.SetNoDataValue(self._nodata)
+
+    @property
+    def path(self) -> str:
+        """Returns the output path."""
+        return self._path
+
+    def write(self, window: BlockWindow, values: np.ndarray):
+        """Writes the values into the given grid window.
+
+        :param window: Target window in the grid.
+        :type window: BlockWindow
+
+        :param values: Values to write, NaN values are replaced by
+        the NoData value.
+        :type values: np.ndarray
+        """
+        values = np.where(np.isnan(values), self._nodata, values)
+        self._band.WriteArray(values, window.x_offset, window.y_offset)
+
+    def close(self):
+        """Flushes and closes the output dataset."""
+        if self._dataset is None:
+            return
+        self._band.FlushCache()
+        self._band = None
+        self._dataset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def nan_sum(arrays: typing.Sequence[np.ndarray]) -> np.ndarray:
+    """Sums the arrays ignoring NaN values. Pixels that are NaN in
+    all the arrays remain NaN.
+
+    :param arrays: Arrays with the same shape.
+    :type arrays: typing.Sequence[np.ndarray]
+
+    :returns: Sum of the arrays.
+    :rtype: np.ndarray
+    """
+    total = np.zeros_like(arrays[0])
+    valid = np.zeros(arrays[0].shape, dtype=bool)
+    for array in arrays:
+        array_valid = ~np.isnan(array)
+        total[array_valid] += array[array_valid]
+        valid |= array_valid
+    total[~valid] = np.nan
+
+    return total
+
+
+def rescale(values: np.ndarray, minimum: float, maximum: float) -> np.ndarray:
+    """Rescales the values using (value - minimum) / (maximum - minimum).
+
+    :param values: Values to be rescaled.
+    :type values: np.ndarray
+
+    :param minimum: Minimum value of the layer.
+    :type minimum: float
+
+    :param maximum: Maximum value of the layer.
+    :type maximum: float
+
+    :returns: Rescaled values.
+    :rtype: np.ndarray
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (values - minimum) / (maximum - minimum)
+
+
+def highest_position(arrays: typing.Sequence[np.ndarray]) -> np.ndarray:
+    """Returns the 1-based position of the array with the highest value
+    for each pixel, ignoring NaN values. Ties are resolved in favour of
+    the first array and pixels that are NaN in all arrays remain NaN.
+
+    The arrays are compared one at a time so that only the running
+    maximum is kept in memory instead of a stack of all the arrays.
+
+    :param arrays: Arrays with the same shape.
+    :type arrays: typing.Sequence[np.ndarray]
+
+    :returns: Position of the highest value.
+    :rtype: np.ndarray
+    """
+    maximum = np.full(arrays[0].shape, -np.inf)
+    position = np.full(arrays[0].shape, np.nan)
+    for index, values in enumerate(arrays, 1):
+        # NaN values are never greater than the running maximum
+        with np.errstate(invalid="ignore"):
+            greater = values > maximum
+        maximum[greater] = values[greater]
+        position[greater] = index
+
+    return position
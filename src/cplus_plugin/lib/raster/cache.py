@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the intermediate rasters created during scenario analysis.
+
+Entries are addressed by a hash of the identity of the step inputs and of the
+step parameters. Source files are identified by their absolute path, size and
+modification time while files created by a cached step are identified by the
+key of that step, so a chain of steps is reused across scenario runs even
+though the intermediate file names are different in each run. The cache size
+is bounded and the least recently used entries are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import typing
+
+from ...utils import log
+
+
+# Version of the key format, to be increased when the outputs of the cached
+# steps change so that previous entries are not reused.
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_SIZE_MB = 2048
+
+
+class IntermediateCache:
+    """Size-bounded, content-addressed store of intermediate rasters."""
+
+    def __init__(self, directory: str, max_size_mb: float = DEFAULT_CACHE_SIZE_MB):
+        self._directory = directory
+        self._max_size = int(max_size_mb * 1024 * 1024)
+        # Keys of the files produced or restored by this cache instance
+        self._file_keys: typing.Dict[str, str] = {}
+        # Steps of the scenario analysis can be run concurrently
+        self._lock = threading.RLock()
+
+        os.makedirs(self._directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        """Returns the cache directory."""
+        return self._directory
+
+    def file_identity(self, path: str) -> str:
+        """Returns the identity of a file used when computing keys.
+
+        :param path: File path.
+        :type path: str
+
+        :returns: The key of the step that produced the file, if known,
+        otherwise a combination of the path, size and modification time.
+        :rtype: str
+        """
+        normalized_path = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            if normalized_path in self._file_keys:
+                return self._file_keys[normalized_path]
+
+        try:
+            stat = os.stat(normalized_path)
+        except OSError:
+            return normalized_path
+
+        return f"{normalized_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def key(
+        self,
+        step: str,
+        input_paths: typing.Sequence[str],
+        parameters: typing.Optional[dict] = None,
+    ) -> str:
+        """Computes the key of a processing step.
+
+        :param step: Name of the step.
+        :type step: str
+
+        :param input_paths: Input files of the step.
+        :type input_paths: list
+
+        :param parameters: Parameters of the step, must be JSON serializable.
+        :type parameters: dict
+
+        :returns: Hexadecimal key of the step.
+        :rtype: str
+        """
+        content = {
+            "version": CACHE_VERSION,
+            "step": step,
+            "inputs": [self.file_identity(path) for path in input_paths],
+            "parameters": parameters or {},
+        }
+        serialized = json.dumps(content, sort_keys=True, default=str)
+
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.tif")
+
+    def _register(self, path: str, key: str):
+        with self._lock:
+            self._file_keys[os.path.normcase(os.path.abspath(path))] = key
+
+    def restore(self, key: str, output_path: str) -> bool:
+        """Restores a cached entry into the given output path.
+
+        :param key: Key of the step.
+        :type key: str
+
+        :param output_path: Path where the cached raster will be placed.
+        :type output_path: str
+
+        :returns: True if the entry exists and was restored else False.
+        :rtype: bool
+        """
+        entry_path = self._entry_path(key)
+        if not os.path.exists(entry_path):
+            return False
+
+        try:
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            # The output is copied rather than linked since later steps and
+            # users can modify it in place, which would corrupt the entry.
+            shutil.copyfile(entry_path, output_path)
+            # Mark the entry as recently used
+            os.utime(entry_path)
+        except OSError as e:
+            log(f"Unable to restore cached raster {entry_path}, {e}", info=False)
+            return False
+
+        self._register(output_path, key)
+
+        return True
+
+    def store(self, key: str, path: str) -> bool:
+        """Adds the raster produced by a step to the cache.
+
+        :param key: Key of the step.
+        :type key: str
+
+        :param path: Path of the raster produced by the step.
+        :type path: str
+
+        :returns: True if the raster was added to the cache else False.
+        :rtype: bool
+        """
+        if not os.path.exists(path):
+            return False
+
+        self._register(path, key)
+
+        if os.path.getsize(path) > self._max_size:
+            return False
+
+        entry_path = self._entry_path(key)
+        temporary_path = f"{entry_path}.{threading.get_ident()}.part"
+        try:
+            shutil.copyfile(path, temporary_path)
+            os.replace(temporary_path, entry_path)
+        except OSError as e:
+            log(f"Unable to add {path} to the cache, {e}", info=False)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return False
+
+        self.evict()
+
+        return True
+
+    def size(self) -> int:
+        """Returns the total size, in bytes, of the cache entries."""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self) -> typing.List[os.DirEntry]:
+        with os.scandir(self._directory) as entries:
+            return [
+                entry
+                for entry in entries
+                if entry.is_file() and entry.name.endswith(".tif")
+            ]
+
+    def evict(self):
+        """Removes the least recently used entries until the cache
+        is within its maximum size.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+            total_size = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if total_size <= self._max_size:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    total_size -= size
+                except OSError as e:
+                    log(f"Unable to remove cached raster {entry.path}, {e}", info=False)
+
+    def clear(self):
+        """Removes all the cache entries."""
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                log(f"Unable to remove cached raster {entry.path}, {e}", info=False)
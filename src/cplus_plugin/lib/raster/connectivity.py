@@ -0,0 +1,600 @@
+# -*- coding: utf-8 -*-
+"""
+Connected-component labelling of raster layers.
+
+The positive pixels of a raster are grouped into 8-connected components tile
+by tile and the labels of the components touching across the tile seams are
+then merged, so large rasters are processed with a bounded amount of memory.
+The pixel count and perimeter of each component are derived from the pixel
+adjacencies, which gives the same values as measuring the polygons created
+when polygonizing the raster. The same labels are used to sieve the small
+components of a raster.
+"""
+
+import dataclasses
+import math
+import os
+import typing
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.core import QgsProcessingFeedback
+
+from .blocks import AlignedRaster, BlockRasterWriter, BlockWindow, RasterGrid
+from ...utils import log
+
+
+# Edge length, in pixels, of the tiles labelled in memory.
+DEFAULT_TILE_SIZE = 2048
+
+# Approximate number of 8 byte arrays per pixel of a tile held in memory
+# when labelling, used to derive the tile size from a memory budget.
+LABELLING_ARRAYS_PER_PIXEL = 8
+
+# NoData value of the labels raster, label zero is used for the valid
+# pixels that are not part of a component.
+LABELS_NODATA = 4294967295
+
+
+def resolve_roots(first: np.ndarray, second: np.ndarray, size: int) -> np.ndarray:
+    """Finds the connected components of an undirected graph.
+
+    The edges are processed as arrays, each iteration links the root of
+    the higher node of each edge to the root of the lower node and then
+    compresses the paths until every node points to its root.
+
+    :param first: First node of each edge.
+    :type first: np.ndarray
+
+    :param second: Second node of each edge.
+    :type second: np.ndarray
+
+    :param size: Number of nodes, nodes are numbered from zero.
+    :type size: int
+
+    :returns: The smallest node of the component of each node.
+    :rtype: np.ndarray
+    """
+    parent = np.arange(size, dtype=np.int64)
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+
+    while first.size > 0:
+        first_roots = parent[first]
+        second_roots = parent[second]
+        different = first_roots != second_roots
+        if not different.any():
+            break
+
+        first = first[different]
+        second = second[different]
+        first_roots = first_roots[different]
+        second_roots = second_roots[different]
+        np.minimum.at(
+            parent,
+            np.maximum(first_roots, second_roots),
+            np.minimum(first_roots, second_roots),
+        )
+
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                break
+            parent = grand_parent
+
+    return parent
+
+
+def _neighbour_pairs(
+    values: np.ndarray,
+) -> typing.Iterator[typing.Tuple[np.ndarray, np.ndarray]]:
+    """Yields the values of the pixel pairs that are 8-connected i.e. the
+    right, bottom and the two diagonal neighbours of each pixel.
+    """
+    yield values[:, :-1], values[:, 1:]
+    yield values[:-1, :], values[1:, :]
+    yield values[:-1, :-1], values[1:, 1:]
+    yield values[:-1, 1:], values[1:, :-1]
+
+
+def label_array(foreground: np.ndarray) -> typing.Tuple[np.ndarray, int]:
+    """Labels the 8-connected components of a binary array.
+
+    Labels are numbered in the row-major order of the first pixel of
+    each component.
+
+    :param foreground: Binary array.
+    :type foreground: np.ndarray
+
+    :returns: Array with the label of each pixel, zero for the background,
+    and the number of components.
+    :rtype: tuple
+    """
+    labels = np.zeros(foreground.shape, dtype=np.int64)
+    indices = np.flatnonzero(foreground)
+    if indices.size == 0:
+        return labels, 0
+
+    positions = np.full(foreground.size, -1, dtype=np.int64)
+    positions[indices] = np.arange(indices.size)
+    positions = positions.reshape(foreground.shape)
+
+    first_nodes = []
+    second_nodes = []
+    for first, second in _neighbour_pairs(positions):
+        connected = (first >= 0) & (second >= 0)
+        first_nodes.append(first[connected])
+        second_nodes.append(second[connected])
+
+    roots = resolve_roots(
+        np.concatenate(first_nodes), np.concatenate(second_nodes), indices.size
+    )
+    _, components = np.unique(roots, return_inverse=True)
+    labels.flat[indices] = components + 1
+
+    return labels, int(components.max()) + 1
+
+
+def _seam_pairs(
+    first: np.ndarray, second: np.ndarray
+) -> typing.List[typing.Tuple[np.ndarray, np.ndarray]]:
+    """Returns the labels of the 8-connected pixels of two adjacent lines
+    of pixels, the first item contains the directly adjacent pixels.
+    """
+    pairs = []
+    for first_labels, second_labels in (
+        (first, second),
+        (first[:-1], second[1:]),
+        (first[1:], second[:-1]),
+    ):
+        connected = (first_labels > 0) & (second_labels > 0)
+        pairs.append((first_labels[connected], second_labels[connected]))
+
+    return pairs
+
+
+@dataclasses.dataclass
+class ComponentLabels:
+    """Raster of component labels and the properties of each component.
+
+    The per-label arrays are indexed by the labels stored in the raster,
+    labels of the same component share the values of the component. Pixels
+    of the excluded labels, if defined, are read as NoData.
+    """
+
+    path: str
+    grid: RasterGrid
+    roots: np.ndarray
+    pixel_counts: np.ndarray
+    horizontal_adjacencies: np.ndarray
+    vertical_adjacencies: np.ndarray
+    background_count: int = 0
+    excluded: typing.Optional[np.ndarray] = None
+    _raster: typing.Optional[AlignedRaster] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    @property
+    def label_count(self) -> int:
+        """Returns the number of labels, including the background label."""
+        return int(self.roots.size)
+
+    @property
+    def component_count(self) -> int:
+        """Returns the number of components."""
+        is_root = self.roots == np.arange(self.roots.size)
+        if self.excluded is not None:
+            is_root &= ~self.excluded
+        is_root[0] = False
+
+        return int(np.count_nonzero(is_root))
+
+    def areas(self) -> np.ndarray:
+        """Returns the area, in map units, of the component of each label."""
+        pixel_area = abs(self.grid.x_resolution * self.grid.y_resolution)
+        return self.pixel_counts * pixel_area
+
+    def perimeters(self) -> np.ndarray:
+        """Returns the perimeter, in map units, of the component of each
+        label including the perimeter of its holes.
+        """
+        horizontal_edges = 2 * (self.pixel_counts - self.vertical_adjacencies)
+        vertical_edges = 2 * (self.pixel_counts - self.horizontal_adjacencies)
+
+        return horizontal_edges * abs(self.grid.x_resolution) + vertical_edges * abs(
+            self.grid.y_resolution
+        )
+
+    def read(self, window: BlockWindow) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Reads the labels in the given window.
+
+        :param window: Window in the grid.
+        :type window: BlockWindow
+
+        :returns: Labels as int64 and a mask of the valid pixels.
+        :rtype: tuple
+        """
+        if self._raster is None:
+            self._raster = AlignedRaster(self.path, self.grid)
+        values = self._raster.read(window)
+
+        valid = ~np.isnan(values)
+        labels = np.zeros(window.shape, dtype=np.int64)
+        labels[valid] = values[valid].astype(np.int64)
+        if self.excluded is not None:
+            valid &= ~self.excluded[labels]
+
+        return labels, valid
+
+    def sieved(self, threshold: int) -> "ComponentLabels":
+        """Returns the labels of the components that are kept when sieving
+        with the given threshold, as written by `write_sieved_layer`.
+
+        The background and the removed components are excluded since they
+        are NoData in the sieved layer.
+
+        :param threshold: Minimum number of pixels of the kept components.
+        :type threshold: int
+
+        :returns: Labels of the sieved layer sharing the labels raster.
+        :rtype: ComponentLabels
+        """
+        excluded = self.pixel_counts < threshold
+        excluded[0] = True
+
+        return dataclasses.replace(self, excluded=excluded, background_count=0)
+
+    def close(self):
+        """Closes the labels raster."""
+        if self._raster is not None:
+            self._raster.close()
+            self._raster = None
+
+    def remove(self):
+        """Closes and deletes the labels raster."""
+        self.close()
+        driver = gdal.GetDriverByName("GTiff")
+        if os.path.exists(self.path):
+            driver.Delete(self.path)
+
+
+def label_components(
+    input_path: str,
+    labels_path: str,
+    band_number: int = 1,
+    tile_size: int = None,
+    feedback: QgsProcessingFeedback = None,
+    mask_path: str = None,
+) -> typing.Optional[ComponentLabels]:
+    """Labels the 8-connected components of the positive pixels of a
+    raster.
+
+    :param input_path: Path of the input raster.
+    :type input_path: str
+
+    :param labels_path: Path of the labels raster to be created.
+    :type labels_path: str
+
+    :param band_number: Band of the input raster.
+    :type band_number: int
+
+    :param tile_size: Edge length of the tiles labelled in memory,
+    defaults to DEFAULT_TILE_SIZE.
+    :type tile_size: int
+
+    :param feedback: Feedback for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :param mask_path: Optional raster, pixels where the mask is zero or
+    NoData are not labelled.
+    :type mask_path: str
+
+    :returns: The component labels or None if the raster could not be
+    read or the labelling was cancelled.
+    :rtype: ComponentLabels
+    """
+    tile_size = tile_size or DEFAULT_TILE_SIZE
+    grid = RasterGrid.from_path(input_path)
+    if grid is None:
+        return None
+
+    try:
+        source = AlignedRaster(input_path, grid, band_number)
+        mask = AlignedRaster(mask_path, grid) if mask_path else None
+    except (IOError, RuntimeError) as e:
+        log(f"Unable to read {input_path} for labelling components, {e}", info=False)
+        return None
+
+    pixel_counts = [np.zeros(1, dtype=np.int64)]
+    horizontal_adjacencies = [np.zeros(1, dtype=np.int64)]
+    vertical_adjacencies = [np.zeros(1, dtype=np.int64)]
+    seam_first = []
+    seam_second = []
+    horizontal_seam_labels = []
+    vertical_seam_labels = []
+    background_count = 0
+    label_offset = 0
+
+    # First and last rows of the current row of tiles and the last row
+    # of the previous row of tiles.
+    tiles_top = np.zeros(grid.width, dtype=np.int64)
+    tiles_bottom = np.zeros(grid.width, dtype=np.int64)
+    previous_bottom = None
+    left_column = None
+
+    tile_count = grid.window_count(tile_size, tile_size)
+    try:
+        with BlockRasterWriter(
+            labels_path, grid, gdal.GDT_UInt32, LABELS_NODATA
+        ) as writer:
+            for index, window in enumerate(grid.windows(tile_size, tile_size)):
+                if feedback is not None and feedback.isCanceled():
+                    return None
+
+                values = source.read(window)
+                valid = ~np.isnan(values)
+                if mask is not None:
+                    valid &= np.nan_to_num(mask.read(window)) != 0
+                foreground = np.zeros(window.shape, dtype=bool)
+                foreground[valid] = values[valid] > 0
+                background_count += int(np.count_nonzero(valid & ~foreground))
+
+                tile_labels, count = label_array(foreground)
+                if label_offset + count >= LABELS_NODATA:
+                    log(f"Too many components in {input_path}", info=False)
+                    return None
+
+                pixel_counts.append(
+                    np.bincount(tile_labels.ravel(), minlength=count + 1)[1:]
+                )
+                horizontal_adjacencies.append(
+                    np.bincount(
+                        tile_labels[:, :-1][foreground[:, :-1] & foreground[:, 1:]],
+                        minlength=count + 1,
+                    )[1:]
+                )
+                vertical_adjacencies.append(
+                    np.bincount(
+                        tile_labels[:-1, :][foreground[:-1, :] & foreground[1:, :]],
+                        minlength=count + 1,
+                    )[1:]
+                )
+
+                labels = np.where(tile_labels > 0, tile_labels + label_offset, 0)
+                label_offset += count
+
+                if window.x_offset > 0:
+                    pairs = _seam_pairs(left_column, labels[:, 0])
+                    horizontal_seam_labels.append(pairs[0][0])
+                    for first, second in pairs:
+                        seam_first.append(first)
+                        seam_second.append(second)
+                left_column = labels[:, -1]
+
+                columns = slice(window.x_offset, window.x_offset + window.width)
+                tiles_top[columns] = labels[0, :]
+                tiles_bottom[columns] = labels[-1, :]
+                if window.x_offset + window.width == grid.width:
+                    if previous_bottom is not None:
+                        pairs = _seam_pairs(previous_bottom, tiles_top)
+                        vertical_seam_labels.append(pairs[0][0])
+                        for first, second in pairs:
+                            seam_first.append(first)
+                            seam_second.append(second)
+                    previous_bottom = tiles_bottom.copy()
+
+                output = labels.astype(np.float64)
+                output[~valid] = np.nan
+                writer.write(window, output)
+
+                if feedback is not None:
+                    feedback.setProgress(100.0 * (index + 1) / tile_count)
+    finally:
+        source.close()
+        if mask is not None:
+            mask.close()
+
+    size = label_offset + 1
+    horizontal = np.concatenate(horizontal_adjacencies)
+    vertical = np.concatenate(vertical_adjacencies)
+    if horizontal_seam_labels:
+        horizontal += np.bincount(
+            np.concatenate(horizontal_seam_labels), minlength=size
+        )
+    if vertical_seam_labels:
+        vertical += np.bincount(np.concatenate(vertical_seam_labels), minlength=size)
+
+    roots = resolve_roots(
+        np.concatenate(seam_first) if seam_first else np.empty(0, dtype=np.int64),
+        np.concatenate(seam_second) if seam_second else np.empty(0, dtype=np.int64),
+        size,
+    )
+
+    def component_totals(label_values: np.ndarray) -> np.ndarray:
+        totals = np.bincount(roots, weights=label_values, minlength=size)
+        return totals[roots]
+
+    return ComponentLabels(
+        path=labels_path,
+        grid=grid,
+        roots=roots,
+        pixel_counts=component_totals(np.concatenate(pixel_counts)),
+        horizontal_adjacencies=component_totals(horizontal),
+        vertical_adjacencies=component_totals(vertical),
+        background_count=background_count,
+    )
+
+
+def connectivity_scores(components: ComponentLabels) -> np.ndarray:
+    """Calculates the connectivity score of each label, which is the pixel
+    count of the component multiplied by its compactness
+    i.e. 4 * pi * area / perimeter².
+
+    :param components: Component labels.
+    :type components: ComponentLabels
+
+    :returns: Score of each label, zero for the background label.
+    :rtype: np.ndarray
+    """
+    perimeters = components.perimeters()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = (
+            components.pixel_counts
+            * 4
+            * math.pi
+            * components.areas()
+            / (perimeters * perimeters)
+        )
+    scores[~np.isfinite(scores)] = 0.0
+    scores[0] = 0.0
+
+    return scores
+
+
+def write_connectivity_layer(
+    components: ComponentLabels,
+    output_path: str,
+    feedback: QgsProcessingFeedback = None,
+    tile_size: int = None,
+) -> bool:
+    """Writes the normalized connectivity layer of the labelled components.
+
+    The pixels of a component are set to one plus the connectivity score
+    of the component and the background pixels to zero, the values are
+    then rescaled using the minimum and maximum values of the layer.
+
+    :param components: Component labels.
+    :type components: ComponentLabels
+
+    :param output_path: Path of the connectivity layer.
+    :type output_path: str
+
+    :param feedback: Feedback for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :param tile_size: Edge length of the tiles written at once,
+    defaults to DEFAULT_TILE_SIZE.
+    :type tile_size: int
+
+    :returns: True if the layer was created, False if there are no
+    components or the operation was cancelled.
+    :rtype: bool
+    """
+    included = np.ones(components.label_count, dtype=bool)
+    if components.excluded is not None:
+        included &= ~components.excluded
+    included[0] = False
+    if not included.any():
+        return False
+
+    lookup = 1.0 + connectivity_scores(components)
+    lookup[0] = 0.0
+
+    maximum = float(lookup[included].max())
+    minimum = 0.0 if components.background_count > 0 else float(lookup[included].min())
+    if minimum == maximum:
+        # Constant layer
+        lookup = lookup / minimum
+    else:
+        lookup = (lookup - minimum) / (maximum - minimum)
+
+    grid = components.grid
+    tile_size = tile_size or DEFAULT_TILE_SIZE
+    tile_count = grid.window_count(tile_size, tile_size)
+    try:
+        with BlockRasterWriter(output_path, grid) as writer:
+            for index, window in enumerate(grid.windows(tile_size, tile_size)):
+                if feedback is not None and feedback.isCanceled():
+                    return False
+
+                labels, valid = components.read(window)
+                values = np.full(window.shape, np.nan)
+                values[valid] = lookup[labels[valid]]
+                writer.write(window, values)
+
+                if feedback is not None:
+                    feedback.setProgress(100.0 * (index + 1) / tile_count)
+    finally:
+        components.close()
+
+    return True
+
+
+def write_sieved_layer(
+    components: ComponentLabels,
+    input_path: str,
+    output_path: str,
+    threshold: int,
+    nodata: float = None,
+    band_number: int = 1,
+    feedback: QgsProcessingFeedback = None,
+    tile_size: int = None,
+) -> bool:
+    """Removes the components smaller than the threshold from a raster.
+
+    The positive pixels of the kept components, as well as the positive
+    pixels that were not labelled due to a mask, keep their original
+    values. All the other pixels are set to NoData.
+
+    :param components: Labels of the input raster.
+    :type components: ComponentLabels
+
+    :param input_path: Path of the raster that was labelled.
+    :type input_path: str
+
+    :param output_path: Path of the sieved raster.
+    :type output_path: str
+
+    :param threshold: Minimum number of pixels of the kept components.
+    :type threshold: int
+
+    :param nodata: NoData value of the sieved raster, defaults to the
+    NoData value of the grid.
+    :type nodata: float
+
+    :param band_number: Band of the input raster.
+    :type band_number: int
+
+    :param feedback: Feedback for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :param tile_size: Edge length of the tiles written at once,
+    defaults to DEFAULT_TILE_SIZE.
+    :type tile_size: int
+
+    :returns: True if the sieved raster was created else False.
+    :rtype: bool
+    """
+    grid = components.grid
+    keep = components.pixel_counts >= threshold
+    keep[0] = True
+
+    try:
+        source = AlignedRaster(input_path, grid, band_number)
+    except (IOError, RuntimeError) as e:
+        log(f"Unable to read {input_path} for sieving, {e}", info=False)
+        return False
+
+    tile_size = tile_size or DEFAULT_TILE_SIZE
+    tile_count = grid.window_count(tile_size, tile_size)
+    try:
+        with BlockRasterWriter(output_path, grid, nodata=nodata) as writer:
+            for index, window in enumerate(grid.windows(tile_size, tile_size)):
+                if feedback is not None and feedback.isCanceled():
+                    return False
+
+                values = source.read(window)
+                labels, _ = components.read(window)
+                positive = np.zeros(window.shape, dtype=bool)
+                valid = ~np.isnan(values)
+                positive[valid] = values[valid] > 0
+                writer.write(window, np.where(positive & keep[labels], values, np.nan))
+
+                if feedback is not None:
+                    feedback.setProgress(100.0 * (index + 1) / tile_count)
+    finally:
+        source.close()
+        components.close()
+
+    return True
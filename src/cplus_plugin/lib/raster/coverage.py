@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Reduction of a fine resolution binary raster to the cells of a coarser grid.
+
+For each cell of the coarse grid, the fraction of the fine pixels overlapping
+the cell that have a valid non-zero value is computed. The counts are derived
+from a summed-area table of each window so the reduction does not depend on
+the ratio between the two resolutions nor on the alignment of both grids.
+"""
+
+import math
+import typing
+
+import numpy as np
+from osgeo import gdal
+
+from .blocks import BlockWindow, RasterGrid
+
+# Maximum number of fine pixels, per axis, read for a single window.
+_MAX_FINE_WINDOW_SIZE = 4096
+
+# Tolerance, as a fraction of the fine pixel size, used to ignore
+# overlaps that are only due to floating point errors.
+_EDGE_TOLERANCE = 1e-6
+
+
+def overlap_ranges(
+    cell_start: float,
+    cell_size: float,
+    cell_count: int,
+    pixel_size: float,
+    pixel_count: int,
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Computes, along one axis, the range of fine pixels that overlap
+    each coarse cell.
+
+    Positions are expressed as distances from the origin of the fine
+    raster along the axis i.e. from the left edge for columns and from
+    the top edge for rows.
+
+    :param cell_start: Position of the first cell.
+    :type cell_start: float
+
+    :param cell_size: Size of a cell.
+    :type cell_size: float
+
+    :param cell_count: Number of cells.
+    :type cell_count: int
+
+    :param pixel_size: Size of a fine pixel.
+    :type pixel_size: float
+
+    :param pixel_count: Number of fine pixels.
+    :type pixel_count: int
+
+    :returns: Start (inclusive) and end (exclusive) fine pixel indexes for
+    each cell, clipped to the fine raster.
+    :rtype: tuple
+    """
+    starts = cell_start + np.arange(cell_count, dtype=np.float64) * cell_size
+    lower = np.floor(starts / pixel_size + _EDGE_TOLERANCE).astype(np.int64)
+    upper = np.ceil((starts + cell_size) / pixel_size - _EDGE_TOLERANCE).astype(
+        np.int64
+    )
+
+    lower = np.clip(lower, 0, pixel_count)
+    upper = np.clip(upper, 0, pixel_count)
+
+    return lower, np.maximum(lower, upper)
+
+
+def window_coverage(
+    binary: np.ndarray,
+    row_lower: np.ndarray,
+    row_upper: np.ndarray,
+    column_lower: np.ndarray,
+    column_upper: np.ndarray,
+) -> np.ndarray:
+    """Computes the fraction of set pixels in each cell of a window.
+
+    :param binary: Boolean array of the fine pixels covering the window.
+    :type binary: np.ndarray
+
+    :param row_lower: First fine row of each cell row, relative to the array.
+    :type row_lower: np.ndarray
+
+    :param row_upper: End fine row of each cell row, relative to the array.
+    :type row_upper: np.ndarray
+
+    :param column_lower: First fine column of each cell column, relative to the array.
+    :type column_lower: np.ndarray
+
+    :param column_upper: End fine column of each cell column, relative to the array.
+    :type column_upper: np.ndarray
+
+    :returns: Coverage fraction of each cell, NaN for cells without fine pixels.
+    :rtype: np.ndarray
+    """
+    table = np.zeros((binary.shape[0] + 1, binary.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(binary, axis=0, dtype=np.int64), axis=1, out=table[1:, 1:])
+
+    counts = (
+        table[np.ix_(row_upper, column_upper)]
+        - table[np.ix_(row_lower, column_upper)]
+        - table[np.ix_(row_upper, column_lower)]
+        + table[np.ix_(row_lower, column_lower)]
+    )
+    totals = np.outer(row_upper - row_lower, column_upper - column_lower)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(totals > 0, counts / totals, np.nan)
+
+
+def iter_grid_coverage(
+    binary_path: str, grid: RasterGrid
+) -> typing.Iterator[typing.Tuple[BlockWindow, np.ndarray]]:
+    """Reduces a binary raster to the cells of the grid, window by window.
+
+    A fine pixel is considered set when its value is valid and not zero.
+    Both rasters are expected to be in the same CRS.
+
+    :param binary_path: Path to the fine resolution binary raster.
+    :type binary_path: str
+
+    :param grid: Coarse grid.
+    :type grid: RasterGrid
+
+    :returns: Generator of the grid windows and the coverage fraction of
+    their cells. Cells that are not covered by the binary raster are NaN.
+    :rtype: typing.Iterator
+    """
+    dataset = gdal.Open(binary_path, gdal.GA_ReadOnly)
+    if dataset is None:
+        raise IOError(f"Unable to open raster {binary_path}")
+
+    band = dataset.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    fine_gt = dataset.GetGeoTransform()
+    fine_width = abs(fine_gt[1])
+    fine_height = abs(fine_gt[5])
+
+    row_lower, row_upper = overlap_ranges(
+        fine_gt[3] - grid.geotransform[3],
+        abs(grid.y_resolution),
+        grid.height,
+        fine_height,
+        dataset.RasterYSize,
+    )
+    column_lower, column_upper = overlap_ranges(
+        grid.geotransform[0] - fine_gt[0],
+        abs(grid.x_resolution),
+        grid.width,
+        fine_width,
+        dataset.RasterXSize,
+    )
+
+    # Limit the number of fine pixels read for each window
+    ratio = max(
+        abs(grid.x_resolution) / fine_width, abs(grid.y_resolution) / fine_height
+    )
+    block_size = max(1, int(_MAX_FINE_WINDOW_SIZE / max(1.0, math.ceil(ratio))))
+
+    for window in grid.windows(block_size, block_size):
+        rows = slice(window.y_offset, window.y_offset + window.height)
+        columns = slice(window.x_offset, window.x_offset + window.width)
+        window_row_lower = row_lower[rows]
+        window_row_upper = row_upper[rows]
+        window_column_lower = column_lower[columns]
+        window_column_upper = column_upper[columns]
+
+        read_y = int(window_row_lower.min())
+        read_x = int(window_column_lower.min())
+        read_height = int(window_row_upper.max()) - read_y
+        read_width = int(window_column_upper.max()) - read_x
+        if read_height <= 0 or read_width <= 0:
+            yield window, np.full(window.shape, np.nan)
+            continue
+
+        data = band.ReadAsArray(read_x, read_y, read_width, read_height)
+        binary = data != 0
+        if nodata is not None:
+            binary &= data != nodata
+        if np.issubdtype(data.dtype, np.floating):
+            binary &= ~np.isnan(data)
+
+        yield window, window_coverage(
+            binary,
+            window_row_lower - read_y,
+            window_row_upper - read_y,
+            window_column_lower - read_x,
+            window_column_upper - read_x,
+        )
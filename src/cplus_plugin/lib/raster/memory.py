@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Memory budget of the raster processing.
+
+The analysis grid is processed in windows whose size is derived from the
+memory budget and from the number of arrays held in memory for each pixel
+of a window, so the peak memory of a pass does not depend on the size of
+the analysis extent. The budget also bounds the GDAL block cache.
+"""
+
+import contextlib
+import math
+import os
+import typing
+
+from osgeo import gdal
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from .blocks import RasterGrid
+
+
+# Bounds of the edge length, in pixels, of the windows
+MIN_BLOCK_SIZE = 64
+MAX_BLOCK_SIZE = 4096
+
+# Windows are multiples of the internal tile size of the written rasters
+# when large enough, so that tiles are not read or written twice.
+BLOCK_ALIGNMENT = 256
+
+# Bytes of a float64 value, the type of the arrays of the block pipeline
+VALUE_SIZE = 8
+
+# Share of the budget used by the GDAL block cache
+GDAL_CACHE_SHARE = 0.25
+
+# Share of the budget used by the arrays of the windows being processed,
+# the rest is left for the GDAL cache and the other allocations.
+ARRAYS_SHARE = 0.5
+
+# Budget when the physical memory cannot be determined
+FALLBACK_BUDGET_MB = 4096
+
+
+def physical_memory() -> typing.Optional[int]:
+    """Returns the total physical memory in bytes, if it can be determined."""
+    if psutil is not None:
+        try:
+            return int(psutil.virtual_memory().total)
+        except (AttributeError, OSError):
+            pass
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def budget_bytes(budget_mb: typing.Optional[float]) -> int:
+    """Returns the memory budget in bytes.
+
+    :param budget_mb: Budget in megabytes, zero or None for the automatic
+    budget which is half of the physical memory.
+    :type budget_mb: float
+
+    :returns: Memory budget in bytes.
+    :rtype: int
+    """
+    try:
+        budget_mb = float(budget_mb or 0)
+    except (TypeError, ValueError):
+        budget_mb = 0
+
+    if budget_mb > 0:
+        return int(budget_mb * 1024 * 1024)
+
+    total_memory = physical_memory()
+    if total_memory:
+        return total_memory // 2
+
+    return FALLBACK_BUDGET_MB * 1024 * 1024
+
+
+def block_size_for_budget(
+    budget: int,
+    arrays_per_pixel: float,
+    value_size: int = VALUE_SIZE,
+    maximum: int = MAX_BLOCK_SIZE,
+) -> int:
+    """Returns the edge length of the square windows whose arrays fit
+    in the memory budget.
+
+    :param budget: Memory budget in bytes.
+    :type budget: int
+
+    :param arrays_per_pixel: Number of arrays held in memory for
+    a window, e.g. the number of nodes of a pipeline.
+    :type arrays_per_pixel: float
+
+    :param value_size: Size in bytes of the array values.
+    :type value_size: int
+
+    :param maximum: Maximum edge length.
+    :type maximum: int
+
+    :returns: Edge length of the windows in pixels.
+    :rtype: int
+    """
+    pixels = budget / max(1.0, float(arrays_per_pixel)) / max(1, value_size)
+    size = int(math.sqrt(max(pixels, 0)))
+    if size >= BLOCK_ALIGNMENT:
+        size -= size % BLOCK_ALIGNMENT
+
+    return max(MIN_BLOCK_SIZE, min(maximum, size))
+
+
+def fits_in_budget(grid: RasterGrid, budget: int, layer_count: int = 1) -> bool:
+    """Checks whether whole layers of the grid fit in the memory budget.
+
+    :param grid: Analysis grid.
+    :type grid: RasterGrid
+
+    :param budget: Memory budget in bytes.
+    :type budget: int
+
+    :param layer_count: Number of layers held in memory at the same time.
+    :type layer_count: int
+
+    :returns: True if the layers fit in the budget.
+    :rtype: bool
+    """
+    return grid.pixel_count * VALUE_SIZE * max(1, layer_count) <= budget
+
+
+@contextlib.contextmanager
+def gdal_cache_limit(budget: int):
+    """Bounds the GDAL block cache to a share of the memory budget in
+    the context, the previous limit is restored when leaving it.
+
+    :param budget: Memory budget in bytes.
+    :type budget: int
+    """
+    previous = gdal.GetCacheMax()
+    limit = max(64 * 1024 * 1024, int(budget * GDAL_CACHE_SHARE))
+    if limit < previous:
+        gdal.SetCacheMax(limit)
+    try:
+        yield
+    finally:
+        gdal.SetCacheMax(previous)
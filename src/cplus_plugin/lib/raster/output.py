@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Cloud-optimized GeoTIFF outputs.
+
+Scenario products are rewritten, once complete, as tiled and compressed
+cloud-optimized GeoTIFFs with internal overviews so that they are rendered
+at any scale without reading the full resolution data. The predictor and
+the overview resampling are chosen according to the data type and to
+whether the values are categories, and the values are stored with the
+smallest data type that holds them.
+"""
+
+import os
+import typing
+
+import numpy as np
+from osgeo import gdal
+
+from ...utils import log
+
+
+# Edge length of the internal tiles
+COG_BLOCK_SIZE = 512
+
+COG_CREATION_OPTIONS = [
+    "COMPRESS=DEFLATE",
+    "LEVEL=6",
+    f"BLOCKSIZE={COG_BLOCK_SIZE}",
+    "BIGTIFF=IF_SAFER",
+    "NUM_THREADS=ALL_CPUS",
+]
+
+# Options of the GeoTIFF driver when the COG driver is not available
+TILED_CREATION_OPTIONS = [
+    "COMPRESS=DEFLATE",
+    "ZLEVEL=6",
+    "TILED=YES",
+    f"BLOCKXSIZE={COG_BLOCK_SIZE}",
+    f"BLOCKYSIZE={COG_BLOCK_SIZE}",
+    "BIGTIFF=IF_SAFER",
+    "NUM_THREADS=ALL_CPUS",
+]
+
+# Overviews are built until the smallest one fits in a tile
+MIN_OVERVIEW_SIZE = COG_BLOCK_SIZE
+
+# Integer types ordered by size, with the range of their values
+INTEGER_TYPES = [
+    (gdal.GDT_Byte, np.iinfo(np.uint8)),
+    (gdal.GDT_Int16, np.iinfo(np.int16)),
+    (gdal.GDT_UInt16, np.iinfo(np.uint16)),
+    (gdal.GDT_Int32, np.iinfo(np.int32)),
+    (gdal.GDT_UInt32, np.iinfo(np.uint32)),
+]
+
+FLOAT_TYPES = (gdal.GDT_Float32, gdal.GDT_Float64)
+
+COG_SUFFIX = ".cog.tif"
+
+
+def smallest_integer_type(minimum: float, maximum: float) -> int:
+    """Returns the smallest integer data type that holds the values range.
+
+    :param minimum: Minimum value.
+    :type minimum: float
+
+    :param maximum: Maximum value.
+    :type maximum: float
+
+    :returns: GDAL data type, Float64 if no integer type holds the range.
+    :rtype: int
+    """
+    for data_type, type_info in INTEGER_TYPES:
+        if type_info.min <= minimum and maximum <= type_info.max:
+            return data_type
+
+    return gdal.GDT_Float64
+
+
+def value_fits(data_type: int, value: float) -> bool:
+    """Checks whether a value can be stored without loss in the data type.
+
+    :param data_type: GDAL data type.
+    :type data_type: int
+
+    :param value: Value to be stored.
+    :type value: float
+
+    :returns: True if the value fits in the data type.
+    :rtype: bool
+    """
+    if data_type in FLOAT_TYPES:
+        return data_type == gdal.GDT_Float64 or bool(
+            np.float32(value) == value or np.isnan(value)
+        )
+
+    for integer_type, type_info in INTEGER_TYPES:
+        if integer_type == data_type:
+            return float(value).is_integer() and type_info.min <= value <= type_info.max
+
+    return False
+
+
+def predictor(data_type: int, categorical: bool = False) -> typing.Optional[str]:
+    """Returns the TIFF predictor suited to the data type, horizontal
+    differencing for integers and floating point prediction for floats.
+    Categories are not predictable hence no predictor is used.
+
+    :param data_type: GDAL data type.
+    :type data_type: int
+
+    :param categorical: Whether the values are categories.
+    :type categorical: bool
+
+    :returns: Value of the PREDICTOR creation option or None.
+    :rtype: str
+    """
+    if categorical:
+        return None
+
+    return "3" if data_type in FLOAT_TYPES else "2"
+
+
+def overview_factors(width: int, height: int) -> typing.List[int]:
+    """Returns the decimation factors of the overviews of a raster,
+    down to the first overview that fits in a tile.
+
+    :param width: Raster width in pixels.
+    :type width: int
+
+    :param height: Raster height in pixels.
+    :type height: int
+
+    :returns: Overview factors.
+    :rtype: list
+    """
+    factors = []
+    factor = 2
+    while max(width, height) / (factor // 2) > MIN_OVERVIEW_SIZE:
+        factors.append(factor)
+        factor *= 2
+
+    return factors
+
+
+def write_cloud_optimized(
+    path: str,
+    data_type: int = None,
+    nodata: float = None,
+    categorical: bool = False,
+) -> bool:
+    """Rewrites a raster as a cloud-optimized GeoTIFF with internal
+    overviews. The raster is replaced only once the new file is complete.
+
+    :param path: Path of the raster.
+    :type path: str
+
+    :param data_type: Data type of the output, by default the type of
+    the raster or Float32 for Float64 rasters as the analysis values are
+    single precision.
+    :type data_type: int
+
+    :param nodata: NoData value of the output, by default the one of
+    the raster.
+    :type nodata: float
+
+    :param categorical: Whether the values are categories, overviews then
+    use the most frequent value instead of the average.
+    :type categorical: bool
+
+    :returns: True if the raster was rewritten else False.
+    :rtype: bool
+    """
+    dataset = gdal.Open(path)
+    if dataset is None:
+        log(f"Unable to open {path} to write it as a cloud-optimized GeoTIFF")
+        return False
+
+    band = dataset.GetRasterBand(1)
+    source_type = band.DataType
+    if data_type is None:
+        data_type = gdal.GDT_Float32 if source_type == gdal.GDT_Float64 else source_type
+    if nodata is None:
+        nodata = band.GetNoDataValue()
+    if nodata is not None and not value_fits(data_type, nodata):
+        # Values would be mixed up with the NoData value
+        data_type = source_type
+
+    creation_options = []
+    predictor_value = predictor(data_type, categorical)
+    if predictor_value is not None:
+        creation_options.append(f"PREDICTOR={predictor_value}")
+
+    resampling = "MODE" if categorical else "AVERAGE"
+    temporary_path = f"{path}{COG_SUFFIX}"
+    try:
+        if gdal.GetDriverByName("COG") is not None:
+            output = gdal.Translate(
+                temporary_path,
+                dataset,
+                format="COG",
+                outputType=data_type,
+                noData=nodata,
+                creationOptions=COG_CREATION_OPTIONS
+                + creation_options
+                + [f"OVERVIEW_RESAMPLING={resampling}"],
+            )
+        else:
+            output = gdal.Translate(
+                temporary_path,
+                dataset,
+                format="GTiff",
+                outputType=data_type,
+                noData=nodata,
+                creationOptions=TILED_CREATION_OPTIONS + creation_options,
+            )
+            if output is not None:
+                output.BuildOverviews(
+                    resampling,
+                    overview_factors(output.RasterXSize, output.RasterYSize),
+                )
+
+        if output is None:
+            raise IOError(gdal.GetLastErrorMsg())
+        output.FlushCache()
+        output = None
+        dataset = None
+        band = None
+
+        os.replace(temporary_path, path)
+    except (IOError, OSError, RuntimeError) as e:
+        log(f"Unable to write {path} as a cloud-optimized GeoTIFF, {e}", info=False)
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return False
+
+    return True
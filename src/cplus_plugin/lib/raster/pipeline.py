@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Block-wise raster pipeline engine.
+
+A pipeline is described as a graph of nodes where each node computes the
+values of a window of the analysis grid from the values of its input nodes.
+The graph is evaluated one window at a time so that intermediate results
+only exist as NumPy arrays in memory and only the requested outputs
+(sinks) are written to disk. Reducers are used to collect global
+statistics, such as minimum and maximum values, in the same pass.
+"""
+
+import typing
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.core import QgsProcessingFeedback
+
+from .blocks import AlignedRaster, BlockRasterWriter, BlockWindow, RasterGrid
+from .memory import block_size_for_budget
+from .output import write_cloud_optimized
+from ...utils import log
+
+
+class BlockNode:
+    """Base class for a node in a block pipeline graph."""
+
+    def __init__(self, inputs: typing.Sequence["BlockNode"] = None, name: str = ""):
+        self.inputs = list(inputs or [])
+        self.name = name
+
+    @property
+    def array_count(self) -> int:
+        """Returns the number of arrays, with the shape of a window, of
+        the node values. Used to derive the window size from the memory
+        budget.
+        """
+        return 1
+
+    def open(self, grid: RasterGrid):
+        """Called before a pipeline pass starts. Subclasses can use it to
+        acquire resources such as datasets.
+
+        :param grid: Analysis grid of the pipeline.
+        :type grid: RasterGrid
+        """
+        pass
+
+    def close(self):
+        """Called after a pipeline pass has finished to release any
+        resources acquired in `open`.
+        """
+        pass
+
+    def evaluate(
+        self, window: BlockWindow, values: typing.List[np.ndarray]
+    ) -> np.ndarray:
+        """Computes the values of the node for the given window.
+
+        :param window: Window in the analysis grid.
+        :type window: BlockWindow
+
+        :param values: Values of the input nodes, in the same order as
+        the inputs.
+        :type values: list
+
+        :returns: Values of the node for the window.
+        :rtype: np.ndarray
+        """
+        raise NotImplementedError
+
+
+class RasterSourceNode(BlockNode):
+    """Reads the values of a raster band aligned to the analysis grid."""
+
+    def __init__(self, path: str, band_number: int = 1, name: str = ""):
+        super().__init__(name=name or path)
+        self.path = path
+        self.band_number = band_number
+        self._raster = None
+
+    def open(self, grid: RasterGrid):
+        self._raster = AlignedRaster(self.path, grid, self.band_number)
+
+    def close(self):
+        if self._raster is not None:
+            self._raster.close()
+            self._raster = None
+
+    def evaluate(
+        self, window: BlockWindow, values: typing.List[np.ndarray]
+    ) -> np.ndarray:
+        return self._raster.read(window)
+
+
+class ConstantNode(BlockNode):
+    """Node with the same value for all pixels."""
+
+    def __init__(self, value: float, name: str = ""):
+        super().__init__(name=name or str(value))
+        self.value = float(value)
+
+    def evaluate(
+        self, window: BlockWindow, values: typing.List[np.ndarray]
+    ) -> np.ndarray:
+        return np.full(window.shape, self.value, dtype=np.float64)
+
+
+class FunctionNode(BlockNode):
+    """Applies a function to the values of the input nodes. The function
+    receives one array per input and should return an array with the
+    same shape.
+    """
+
+    def __init__(
+        self,
+        function: typing.Callable[..., np.ndarray],
+        inputs: typing.Sequence[BlockNode],
+        name: str = "",
+    ):
+        super().__init__(inputs, name)
+        self.function = function
+
+    def evaluate(
+        self, window: BlockWindow, values: typing.List[np.ndarray]
+    ) -> np.ndarray:
+        return self.function(*values)
+
+
+class VectorMaskNode(BlockNode):
+    """Rasterizes polygon layers into a boolean mask where True
+    represents the pixels whose centre falls within any of the polygons.
+    The layers need to be in the CRS of the analysis grid.
+    """
+
+    def __init__(self, paths: typing.Sequence[str], name: str = ""):
+        super().__init__(name=name or ",".join(paths))
+        self.paths = list(paths)
+        self._datasets = []
+        self._grid = None
+
+    def open(self, grid: RasterGrid):
+        self._grid = grid
+        self._datasets = []
+        for path in self.paths:
+            dataset = gdal.OpenEx(path, gdal.OF_VECTOR)
+            if dataset is None:
+                log(f"Unable to open mask layer {path}, skipping.", info=False)
+                continue
+            self._datasets.append(dataset)
+
+    def close(self):
+        self._datasets = []
+        self._grid = None
+
+    def evaluate(
+        self, window: BlockWindow, values: typing.List[np.ndarray]
+    ) -> np.ndarray:
+        driver = gdal.GetDriverByName("MEM")
+        target = driver.Create("", window.width, window.height, 1, gdal.GDT_Byte)
+        target.SetGeoTransform(self._grid.window_geotransform(window))
+        if self._grid.crs_wkt:
+            target.SetProjection(self._grid.crs_wkt)
+
+        x_min, y_min, x_max, y_max = self._grid.window_bounds(window)
+        for dataset in self._datasets:
+            for index in range(dataset.GetLayerCount()):
+                layer = dataset.GetLayer(index)
+                layer.SetSpatialFilterRect(x_min, y_min, x_max, y_max)
+                gdal.RasterizeLayer(target, [1], layer, burn_values=[1])
+                layer.SetSpatialFilter(None)
+
+        return target.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+class BlockReducer:
+    """Accumulates a global result from the values of a node."""
+
+    def __init__(self, node: BlockNode):
+        self.node = node
+
+    def reset(self):
+        """Resets the accumulated result before a pass."""
+        pass
+
+    def update(self, window: BlockWindow, values: np.ndarray):
+        """Accumulates the values of the given window.
+
+        :param window: Window in the analysis grid.
+        :type window: BlockWindow
+
+        :param values: Values of the node in the window.
+        :type values: np.ndarray
+        """
+        raise NotImplementedError
+
+
+class MinMaxReducer(BlockReducer):
+    """Computes the minimum and maximum of the valid (non-NaN) values."""
+
+    def reset(self):
+        self.minimum = None
+        self.maximum = None
+
+    def update(self, window: BlockWindow, values: np.ndarray):
+        valid = values[~np.isnan(values)]
+        if valid.size == 0:
+            return
+
+        block_min = float(valid.min())
+        block_max = float(valid.max())
+        self.minimum = (
+            block_min if self.minimum is None else min(self.minimum, block_min)
+        )
+        self.maximum = (
+            block_max if self.maximum is None else max(self.maximum, block_max)
+        )
+
+
+class SumReducer(BlockReducer):
+    """Computes the sum and count of the valid (non-NaN) values."""
+
+    def reset(self):
+        self.sum = 0.0
+        self.count = 0
+
+    def update(self, window: BlockWindow, values: np.ndarray):
+        valid = values[~np.isnan(values)]
+        self.sum += float(valid.sum())
+        self.count += int(valid.size)
+
+
+class RasterSink:
+    """Writes the values of a node into a GeoTIFF on the analysis grid.
+
+    Outputs that are kept after the analysis can be rewritten as
+    cloud-optimized GeoTIFFs once the pass has completed.
+    """
+
+    def __init__(
+        self,
+        node: BlockNode,
+        path: str,
+        data_type: int = gdal.GDT_Float32,
+        nodata: float = None,
+        cloud_optimized: bool = False,
+        categorical: bool = False,
+    ):
+        self.node = node
+        self.path = path
+        self.data_type = data_type
+        self.nodata = nodata
+        self.cloud_optimized = cloud_optimized
+        self.categorical = categorical
+        self._writer = None
+
+    def open(self, grid: RasterGrid):
+        """Creates the output raster."""
+        self._writer = BlockRasterWriter(
+            self.path, grid, data_type=self.data_type, nodata=self.nodata
+        )
+
+    def write(self, window: BlockWindow, values: np.ndarray):
+        """Writes the window values into the output raster."""
+        self._writer.write(window, values)
+
+    def close(self):
+        """Flushes and closes the output raster."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def finalize(self):
+        """Called after the pass has completed, rewrites the output as a
+        cloud-optimized GeoTIFF if requested.
+        """
+        if self.cloud_optimized:
+            write_cloud_optimized(self.path, categorical=self.categorical)
+
+
+class BlockPipeline:
+    """Evaluates a graph of block nodes over the windows of an analysis
+    grid, writing sinks and updating reducers in a single pass.
+
+    Values of nodes that are consumed by more than one node, sink or
+    reducer are computed once per window and reused.
+    """
+
+    def __init__(
+        self,
+        grid: RasterGrid,
+        block_size: int = None,
+        feedback: QgsProcessingFeedback = None,
+        is_cancelled: typing.Callable[[], bool] = None,
+        memory_budget: int = None,
+    ):
+        self.grid = grid
+        self.block_size = block_size
+        # Bytes available for the arrays of a window, used to derive the
+        # window size when the block size is not set.
+        self.memory_budget = memory_budget
+        self.feedback = feedback
+        self._is_cancelled = is_cancelled
+
+    def is_cancelled(self) -> bool:
+        """Checks whether the pipeline execution should be stopped.
+
+        :returns: True if the execution has been cancelled.
+        :rtype: bool
+        """
+        if self.feedback is not None and self.feedback.isCanceled():
+            return True
+
+        if self._is_cancelled is not None and self._is_cancelled():
+            return True
+
+        return False
+
+    @staticmethod
+    def _collect_nodes(
+        targets: typing.List[BlockNode],
+    ) -> typing.Tuple[typing.List[BlockNode], typing.Dict[int, int]]:
+        """Returns the nodes reachable from the targets in dependency
+        order together with the number of consumers of each node.
+        """
+        ordered = []
+        consumers = {}
+        visited = set()
+
+        def visit(node: BlockNode):
+            consumers[id(node)] = consumers.get(id(node), 0) + 1
+            if id(node) in visited:
+                return
+            visited.add(id(node))
+            for input_node in node.inputs:
+                visit(input_node)
+            ordered.append(node)
+
+        for target in targets:
+            visit(target)
+
+        return ordered, consumers
+
+    def run(
+        self,
+        sinks: typing.Sequence[RasterSink] = None,
+        reducers: typing.Sequence[BlockReducer] = None,
+    ) -> bool:
+        """Executes a single pass over the grid.
+
+        :param sinks: Outputs to be written.
+        :type sinks: list
+
+        :param reducers: Global statistics to be computed.
+        :type reducers: list
+
+        :returns: True if the pass completed, False if it was cancelled.
+        :rtype: bool
+        """
+        sinks = list(sinks or [])
+        reducers = list(reducers or [])
+        targets = [sink.node for sink in sinks] + [reducer.node for reducer in reducers]
+        if len(targets) == 0:
+            return True
+
+        nodes, consumers = self._collect_nodes(targets)
+        shared = {node_id for node_id, count in consumers.items() if count > 1}
+
+        for reducer in reducers:
+            reducer.reset()
+
+        block_size = self.block_size
+        if block_size is None and self.memory_budget:
+            # The values of every node can be in memory at once
+            block_size = block_size_for_budget(
+                self.memory_budget,
+                sum(node.array_count for node in nodes) + len(sinks),
+            )
+
+        completed = False
+        opened_nodes = []
+        opened_sinks = []
+        try:
+            for node in nodes:
+                node.open(self.grid)
+                opened_nodes.append(node)
+
+            for sink in sinks:
+                sink.open(self.grid)
+                opened_sinks.append(sink)
+
+            window_count = self.grid.window_count(block_size, block_size)
+            for index, window in enumerate(self.grid.windows(block_size, block_size)):
+                if self.is_cancelled():
+                    return False
+
+                cache = {}
+
+                def evaluate(node: BlockNode) -> np.ndarray:
+                    node_id = id(node)
+                    if node_id in cache:
+                        return cache[node_id]
+                    values = node.evaluate(
+                        window, [evaluate(input_node) for input_node in node.inputs]
+                    )
+                    if node_id in shared:
+                        cache[node_id] = values
+                    return values
+
+                for sink in sinks:
+                    sink.write(window, evaluate(sink.node))
+
+                for reducer in reducers:
+                    reducer.update(window, evaluate(reducer.node))
+
+                if self.feedback is not None:
+                    self.feedback.setProgress(100.0 * (index + 1) / window_count)
+
+            completed = True
+        finally:
+            for sink in opened_sinks:
+                sink.close()
+            for node in opened_nodes:
+                node.close()
+
+        if completed:
+            for sink in sinks:
+                sink.finalize()
+
+        return completed
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Stack of layers read together on the analysis grid.
+
+The layers are composed into a single in-memory VRT with one band per
+layer, layers that are not on the pixel lattice of the grid are first
+wrapped in a warped VRT, so the stack is lazy and no aligned copy of the
+inputs is written to disk. Windows of all the layers are read with one
+request and weighted sums of the layers are evaluated with a single
+multiply-accumulate over the stacked values.
+"""
+
+import math
+import typing
+import uuid
+
+import numpy as np
+from osgeo import gdal
+
+from .blocks import BlockWindow, RasterGrid
+from .pipeline import BlockNode
+
+
+def weighted_sum(
+    values: np.ndarray,
+    weights: typing.Sequence[float],
+    offset: float = 0.0,
+    ignore_nodata: bool = False,
+) -> np.ndarray:
+    """Computes the weighted sum of stacked layer values.
+
+    :param values: Values of the layers with the (layers, rows, columns)
+    shape, NoData values are NaN.
+    :type values: np.ndarray
+
+    :param weights: Weight of each layer.
+    :type weights: typing.Sequence[float]
+
+    :param offset: Constant added to the sum.
+    :type offset: float
+
+    :param ignore_nodata: Whether NaN values are skipped, pixels that are
+    NaN in all the layers remain NaN. Otherwise a NaN value in any layer
+    results in NaN.
+    :type ignore_nodata: bool
+
+    :returns: Weighted sum with the (rows, columns) shape.
+    :rtype: np.ndarray
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if ignore_nodata:
+        valid = ~np.isnan(values)
+        result = np.tensordot(weights, np.where(valid, values, 0.0), axes=1)
+        result[~valid.any(axis=0)] = np.nan
+    else:
+        result = np.tensordot(weights, values, axes=1)
+
+    if offset:
+        result += offset
+
+    return result
+
+
+class LayerStack:
+    """Reads windows of the first band of several rasters in the pixel
+    space of an analysis grid as a single (layers, rows, columns) array.
+    """
+
+    def __init__(
+        self,
+        paths: typing.Sequence[str],
+        grid: RasterGrid,
+        resample_algorithm: str = "near",
+    ):
+        self._paths = list(paths)
+        self._grid = grid
+        self._warped_paths = []
+        # Part of the grid covered by each layer, as
+        # (column start, row start, column end, row end).
+        self._coverages = []
+
+        sources = []
+        try:
+            for path in self._paths:
+                source = gdal.Open(path, gdal.GA_ReadOnly)
+                if source is None:
+                    raise IOError(f"Unable to open raster {path}")
+
+                offset = grid.pixel_offset(source)
+                if offset is None:
+                    warped_path = f"/vsimem/cplus_stack_warp_{uuid.uuid4().hex}.vrt"
+                    options = gdal.WarpOptions(
+                        format="VRT",
+                        outputBounds=grid.bounds,
+                        width=grid.width,
+                        height=grid.height,
+                        dstSRS=grid.crs_wkt or None,
+                        srcBands=[1],
+                        resampleAlg=resample_algorithm,
+                        multithread=True,
+                    )
+                    warped = gdal.Warp(warped_path, source, options=options)
+                    if warped is None:
+                        raise IOError(
+                            f"Unable to align raster {path} to the analysis grid"
+                        )
+                    self._warped_paths.append(warped_path)
+                    # The stack refers to the VRT by its path, closing the
+                    # dataset writes it.
+                    warped = None
+                    source = gdal.Open(warped_path, gdal.GA_ReadOnly)
+                    offset = (0, 0)
+
+                column_offset, row_offset = offset
+                self._coverages.append(
+                    (
+                        max(0, -column_offset),
+                        max(0, -row_offset),
+                        min(grid.width, source.RasterXSize - column_offset),
+                        min(grid.height, source.RasterYSize - row_offset),
+                    )
+                )
+                sources.append(source)
+
+            self._vrt_path = f"/vsimem/cplus_stack_{uuid.uuid4().hex}.vrt"
+            options = gdal.BuildVRTOptions(
+                separate=True,
+                bandList=[1],
+                outputBounds=grid.bounds,
+                resolution="user",
+                xRes=grid.x_resolution,
+                yRes=grid.y_resolution,
+                resampleAlg=resample_algorithm,
+            )
+            self._dataset = gdal.BuildVRT(self._vrt_path, sources, options=options)
+            if self._dataset is None:
+                raise IOError(f"Unable to create the layer stack of {self._paths}")
+        except Exception:
+            self._dataset = None
+            self._vrt_path = None
+            self._unlink()
+            raise
+
+        self._nodata_values = [
+            self._dataset.GetRasterBand(band_number).GetNoDataValue()
+            for band_number in range(1, self._dataset.RasterCount + 1)
+        ]
+
+    @property
+    def paths(self) -> typing.List[str]:
+        """Returns the paths of the layers, in the order of the stack."""
+        return list(self._paths)
+
+    def read(self, window: BlockWindow) -> np.ndarray:
+        """Reads the values of all the layers in the given grid window.
+
+        Areas of the window that are outside a layer, as well as
+        NoData pixels, are returned as NaN.
+
+        :param window: Window in the analysis grid.
+        :type window: BlockWindow
+
+        :returns: Float64 array with the (layers, rows, columns) shape.
+        :rtype: np.ndarray
+        """
+        values = self._dataset.ReadAsArray(
+            window.x_offset, window.y_offset, window.width, window.height
+        ).astype(np.float64, copy=False)
+        values = values.reshape((len(self._paths),) + window.shape)
+
+        for index, nodata in enumerate(self._nodata_values):
+            layer_values = values[index]
+            if nodata is not None and not math.isnan(nodata):
+                layer_values[layer_values == nodata] = np.nan
+
+            column_start, row_start, column_end, row_end = self._coverages[index]
+            if (
+                window.x_offset < column_start
+                or window.y_offset < row_start
+                or window.x_offset + window.width > column_end
+                or window.y_offset + window.height > row_end
+            ):
+                covered = np.zeros(window.shape, dtype=bool)
+                covered[
+                    max(0, row_start - window.y_offset) : max(
+                        0, row_end - window.y_offset
+                    ),
+                    max(0, column_start - window.x_offset) : max(
+                        0, column_end - window.x_offset
+                    ),
+                ] = True
+                layer_values[~covered] = np.nan
+
+        return values
+
+    def _unlink(self):
+        for warped_path in self._warped_paths:
+            gdal.Unlink(warped_path)
+        self._warped_paths = []
+        if self._vrt_path is not None:
+            gdal.Unlink(self._vrt_path)
+            self._vrt_path = None
+
+    def close(self):
+        """Releases the stack dataset and the in-memory VRTs."""
+        self._dataset = None
+        self._unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class LayerStackNode(BlockNode):
+    """Reads the values of a stack of layers, the values of the node are
+    a (layers, rows, columns) array. Layers used by several nodes of a
+    pipeline are read once per window when they share the stack node.
+    """
+
+    def __init__(
+        self,
+        paths: typing.Sequence[str],
+        resample_algorithm: str = "near",
+        name: str = "",
+    ):
+        super().__init__(name=name or "layer_stack")
+        self.paths = []
+        for path in paths:
+            if path not in self.paths:
+                self.paths.append(path)
+        self.resample_algorithm = resample_algorithm
+        self._stack = None
+
+    @property
+    def array_count(self) -> int:
+        return len(self.paths)
+
+    def index(self, path: str) -> int:
+        """Returns the position of a layer in the stack.
+
+        :param path: Layer path.
+        :type path: str
+
+        :returns: Index of the layer in the stacked values.
+        :rtype: int
+        """
+        return self.paths.index(path)
+
+    def open(self, grid: RasterGrid):
+        self._stack = LayerStack(self.paths, grid, self.resample_algorithm)
+
+    def close(self):
+        if self._stack is not None:
+            self._stack.close()
+            self._stack = None
+
+    def evaluate(self, window, values):
+        return self._stack.read(window)
+
+
+class WeightedSumNode(BlockNode):
+    """Computes a weighted sum of the layers of a stack node, optionally
+    multiplied by the values of one of the layers.
+    """
+
+    def __init__(
+        self,
+        stack_node: LayerStackNode,
+        weights: typing.Dict[str, float],
+        offset: float = 0.0,
+        multiplier_path: str = None,
+        ignore_nodata: bool = False,
+        name: str = "",
+    ):
+        """
+        :param stack_node: Node of the stacked layers.
+        :type stack_node: LayerStackNode
+
+        :param weights: Weight of each layer by its path, the layers must
+        be in the stack.
+        :type weights: dict
+
+        :param offset: Constant added to the weighted sum.
+        :type offset: float
+
+        :param multiplier_path: Path of a layer of the stack whose values
+        multiply the weighted sum.
+        :type multiplier_path: str
+
+        :param ignore_nodata: Whether NaN values are skipped in the sum,
+        see `weighted_sum`.
+        :type ignore_nodata: bool
+        """
+        super().__init__([stack_node], name=name)
+        self.indices = [stack_node.index(path) for path in weights]
+        self.weights = list(weights.values())
+        self.offset = offset
+        self.multiplier_index = (
+            stack_node.index(multiplier_path) if multiplier_path else None
+        )
+        self.ignore_nodata = ignore_nodata
+        # Stacked values can be used without selecting the layers
+        self._all_layers = self.indices == list(range(len(stack_node.paths)))
+
+    def evaluate(self, window, values):
+        stacked_values = values[0]
+        layer_values = (
+            stacked_values if self._all_layers else stacked_values[self.indices]
+        )
+        result = weighted_sum(
+            layer_values, self.weights, self.offset, self.ignore_nodata
+        )
+        if self.multiplier_index is not None:
+            result *= stacked_values[self.multiplier_index]
+
+        return result
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the band statistics of rasters.
+
+The minimum, maximum, mean, sum, valid pixel count and optionally a
+histogram of a band are computed in a single block-wise pass and saved,
+so that normalizing and validating unchanged layers does not read them
+again. Entries are identified by the path, size and modification time of
+the raster. Approximate statistics can be computed from the overviews of
+the raster when it has any. The number of saved entries is bounded, entries
+of removed rasters and the least recently used entries are removed first.
+"""
+
+import dataclasses
+import hashlib
+import json
+import os
+import threading
+import typing
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.core import QgsProcessingFeedback
+
+from .blocks import RasterGrid
+from ...conf import settings_manager, Settings
+from ...utils import log
+
+
+# Version of the entries format, to be increased when the way the
+# statistics are computed changes so that previous entries are not reused.
+STATISTICS_VERSION = 1
+
+# Overviews used for approximate statistics should have at least this
+# number of pixels in their largest dimension.
+APPROXIMATE_MIN_SIZE = 1024
+
+DEFAULT_MAX_ENTRIES = 1000
+
+
+@dataclasses.dataclass
+class RasterStatistics:
+    """Statistics of the valid pixels of a raster band."""
+
+    minimum: typing.Optional[float] = None
+    maximum: typing.Optional[float] = None
+    mean: typing.Optional[float] = None
+    sum: float = 0.0
+    valid_count: int = 0
+    approximate: bool = False
+    # Pixel counts of equal intervals between the minimum and maximum
+    histogram: typing.List[int] = dataclasses.field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        """Whether the band has no valid pixels."""
+        return self.valid_count == 0
+
+    def satisfies(self, approximate: bool, histogram_bins: int) -> bool:
+        """Checks whether the statistics can be used for a request.
+
+        :param approximate: Whether approximate statistics are acceptable.
+        :type approximate: bool
+
+        :param histogram_bins: Number of histogram bins required, zero
+        if the histogram is not required.
+        :type histogram_bins: int
+
+        :returns: True if the statistics fulfill the request else False.
+        :rtype: bool
+        """
+        if self.approximate and not approximate:
+            return False
+
+        if histogram_bins > 0 and len(self.histogram) != histogram_bins:
+            return self.is_empty
+
+        return True
+
+
+def _statistics_band(dataset: gdal.Dataset, band_number: int, approximate: bool):
+    """Returns the band to be read and the ratio between the number of
+    pixels of the raster and of the band.
+    """
+    band = dataset.GetRasterBand(band_number)
+    if not approximate:
+        return band, 1.0
+
+    selected = band
+    for index in range(band.GetOverviewCount()):
+        overview = band.GetOverview(index)
+        if overview is None:
+            continue
+        size = max(overview.XSize, overview.YSize)
+        if size >= APPROXIMATE_MIN_SIZE and (
+            overview.XSize * overview.YSize < selected.XSize * selected.YSize
+        ):
+            selected = overview
+
+    ratio = (band.XSize * band.YSize) / float(selected.XSize * selected.YSize)
+
+    return selected, ratio
+
+
+def _valid_blocks(
+    band: gdal.Band,
+    nodata: typing.Optional[float],
+    feedback: QgsProcessingFeedback = None,
+    progress_range: typing.Tuple[float, float] = (0.0, 100.0),
+) -> typing.Iterator[np.ndarray]:
+    """Yields the valid values of each block of the band."""
+    grid = RasterGrid(
+        geotransform=(0.0, 1.0, 0.0, 0.0, 0.0, -1.0),
+        width=band.XSize,
+        height=band.YSize,
+    )
+    window_count = grid.window_count()
+    start, end = progress_range
+    for index, window in enumerate(grid.windows()):
+        if feedback is not None and feedback.isCanceled():
+            return
+
+        data = band.ReadAsArray(
+            window.x_offset, window.y_offset, window.width, window.height
+        )
+        valid = np.ones(data.shape, dtype=bool)
+        if nodata is not None:
+            valid &= data != nodata
+        if np.issubdtype(data.dtype, np.floating):
+            valid &= ~np.isnan(data)
+
+        yield data[valid].astype(np.float64)
+
+        if feedback is not None:
+            feedback.setProgress(start + (end - start) * (index + 1) / window_count)
+
+
+def compute_raster_statistics(
+    path: str,
+    band_number: int = 1,
+    approximate: bool = False,
+    histogram_bins: int = 0,
+    feedback: QgsProcessingFeedback = None,
+) -> typing.Optional[RasterStatistics]:
+    """Computes the statistics of a raster band by reading it block by block.
+
+    :param path: Path of the raster.
+    :type path: str
+
+    :param band_number: Band number, default is band one.
+    :type band_number: int
+
+    :param approximate: Whether the statistics can be computed from an
+    overview of the raster, the valid count and sum are then estimated.
+    :type approximate: bool
+
+    :param histogram_bins: Number of histogram bins between the minimum and
+    maximum, zero to skip the histogram which requires a second pass.
+    :type histogram_bins: int
+
+    :param feedback: Feedback object for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :returns: The band statistics or None if the raster could not be read
+    or the calculation was cancelled.
+    :rtype: RasterStatistics
+    """
+    dataset = gdal.Open(path, gdal.GA_ReadOnly)
+    if dataset is None or band_number > dataset.RasterCount:
+        log(f"Unable to open band {band_number} of {path} for statistics.", info=False)
+        return None
+
+    nodata = dataset.GetRasterBand(band_number).GetNoDataValue()
+    band, ratio = _statistics_band(dataset, band_number, approximate)
+    first_pass = (0.0, 50.0) if histogram_bins > 0 else (0.0, 100.0)
+
+    minimum = np.inf
+    maximum = -np.inf
+    total = 0.0
+    count = 0
+    for values in _valid_blocks(band, nodata, feedback, first_pass):
+        if values.size == 0:
+            continue
+        minimum = min(minimum, float(values.min()))
+        maximum = max(maximum, float(values.max()))
+        total += float(values.sum())
+        count += int(values.size)
+
+    if feedback is not None and feedback.isCanceled():
+        return None
+
+    statistics = RasterStatistics(approximate=ratio != 1.0)
+    if count == 0:
+        return statistics
+
+    statistics.minimum = minimum
+    statistics.maximum = maximum
+    statistics.mean = total / count
+    statistics.sum = total * ratio
+    statistics.valid_count = int(round(count * ratio))
+
+    if histogram_bins > 0:
+        histogram = np.zeros(histogram_bins, dtype=np.int64)
+        for values in _valid_blocks(band, nodata, feedback, (50.0, 100.0)):
+            histogram += np.histogram(
+                values, bins=histogram_bins, range=(minimum, maximum)
+            )[0]
+        if feedback is not None and feedback.isCanceled():
+            return None
+        statistics.histogram = histogram.tolist()
+
+    return statistics
+
+
+class RasterStatisticsCache:
+    """Stores the statistics of raster bands in memory and, if a directory
+    is given, in a JSON file per band so that they are kept across sessions.
+    """
+
+    def __init__(self, directory: str = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._directory = directory
+        self._max_entries = max(1, max_entries)
+        self._entries: typing.Dict[str, dict] = {}
+        # Layers can be normalized concurrently
+        self._lock = threading.RLock()
+
+        if self._directory:
+            os.makedirs(self._directory, exist_ok=True)
+            self.evict(prune=True)
+
+    @property
+    def directory(self) -> typing.Optional[str]:
+        """Returns the directory of the saved entries."""
+        return self._directory
+
+    @staticmethod
+    def _identity(path: str) -> typing.Optional[dict]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return {
+            "version": STATISTICS_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    @staticmethod
+    def _key(path: str, band_number: int) -> str:
+        normalized_path = os.path.normcase(os.path.abspath(path))
+        return hashlib.sha256(
+            f"{normalized_path}:{band_number}".encode("utf-8")
+        ).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+    def _load_entry(self, key: str) -> typing.Optional[dict]:
+        if key in self._entries:
+            return self._entries[key]
+
+        entry_path = self._entry_path(key) if self._directory else None
+        if not entry_path or not os.path.exists(entry_path):
+            return None
+
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+            # Recently used entries are evicted last
+            os.utime(entry_path)
+        except (OSError, ValueError) as e:
+            log(f"Unable to read the saved raster statistics, {e}", info=False)
+            return None
+
+        self._entries[key] = entry
+
+        return entry
+
+    def _save_entry(self, key: str, entry: dict):
+        self._entries[key] = entry
+        if not self._directory:
+            return
+
+        temporary_path = f"{self._entry_path(key)}.{threading.get_ident()}.part"
+        try:
+            with open(temporary_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(temporary_path, self._entry_path(key))
+        except OSError as e:
+            log(f"Unable to save the raster statistics, {e}", info=False)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return
+
+        self.evict()
+
+    def get(
+        self,
+        path: str,
+        band_number: int = 1,
+        approximate: bool = False,
+        histogram_bins: int = 0,
+        feedback: QgsProcessingFeedback = None,
+    ) -> typing.Optional[RasterStatistics]:
+        """Returns the statistics of a raster band, they are only computed
+        if the raster has changed since they were saved or if the saved
+        statistics do not fulfill the request.
+
+        :param path: Path of the raster.
+        :type path: str
+
+        :param band_number: Band number, default is band one.
+        :type band_number: int
+
+        :param approximate: Whether approximate statistics are acceptable.
+        :type approximate: bool
+
+        :param histogram_bins: Number of histogram bins required, zero
+        if the histogram is not required.
+        :type histogram_bins: int
+
+        :param feedback: Feedback object for progress and cancellation.
+        :type feedback: QgsProcessingFeedback
+
+        :returns: The band statistics or None if the raster could not be read
+        or the calculation was cancelled.
+        :rtype: RasterStatistics
+        """
+        identity = self._identity(path)
+        if identity is None:
+            return compute_raster_statistics(
+                path, band_number, approximate, histogram_bins, feedback
+            )
+
+        key = self._key(path, band_number)
+        with self._lock:
+            entry = self._load_entry(key)
+
+        if entry is not None and entry.get("identity") == identity:
+            try:
+                statistics = RasterStatistics(**entry["statistics"])
+            except (KeyError, TypeError):
+                statistics = None
+            if statistics is not None and statistics.satisfies(
+                approximate, histogram_bins
+            ):
+                return statistics
+
+        statistics = compute_raster_statistics(
+            path, band_number, approximate, histogram_bins, feedback
+        )
+        if statistics is None:
+            return None
+
+        with self._lock:
+            self._save_entry(
+                key,
+                {
+                    "path": os.path.abspath(path),
+                    "identity": identity,
+                    "statistics": dataclasses.asdict(statistics),
+                },
+            )
+
+        return statistics
+
+    def _saved_entries(self) -> typing.List[os.DirEntry]:
+        with os.scandir(self._directory) as entries:
+            return [
+                entry
+                for entry in entries
+                if entry.is_file() and entry.name.endswith(".json")
+            ]
+
+    def _remove_saved_entry(self, entry: os.DirEntry):
+        self._entries.pop(entry.name[: -len(".json")], None)
+        try:
+            os.remove(entry.path)
+        except OSError as e:
+            log(
+                f"Unable to remove saved raster statistics {entry.path}, {e}",
+                info=False,
+            )
+
+    def evict(self, prune: bool = False):
+        """Removes the least recently used saved entries until there are
+        no more than the maximum number of entries.
+
+        :param prune: Whether the entries of rasters that no longer
+        exist are removed first.
+        :type prune: bool
+        """
+        if not self._directory:
+            return
+
+        with self._lock:
+            entries = self._saved_entries()
+            if prune:
+                remaining = []
+                for entry in entries:
+                    try:
+                        with open(entry.path) as f:
+                            source_path = json.load(f).get("path")
+                    except (OSError, ValueError, AttributeError):
+                        source_path = None
+                    if source_path and os.path.exists(source_path):
+                        remaining.append(entry)
+                    else:
+                        self._remove_saved_entry(entry)
+                entries = remaining
+
+            if len(entries) <= self._max_entries:
+                return
+
+            entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+            for entry in entries[: len(entries) - self._max_entries]:
+                self._remove_saved_entry(entry)
+
+    def clear(self):
+        """Removes all the entries."""
+        with self._lock:
+            self._entries.clear()
+            if not self._directory:
+                return
+            for entry in self._saved_entries():
+                self._remove_saved_entry(entry)
+
+
+_statistics_cache: typing.Optional[RasterStatisticsCache] = None
+_statistics_cache_lock = threading.Lock()
+
+
+def statistics_cache() -> RasterStatisticsCache:
+    """Returns the shared statistics cache, saved under the base directory
+    when it has been set.
+
+    :returns: The statistics cache.
+    :rtype: RasterStatisticsCache
+    """
+    global _statistics_cache
+
+    base_dir = settings_manager.get_value(Settings.BASE_DIR, default="")
+    directory = (
+        os.path.join(base_dir, "cache", "statistics")
+        if base_dir and os.path.exists(base_dir)
+        else None
+    )
+    with _statistics_cache_lock:
+        if _statistics_cache is None or _statistics_cache.directory != directory:
+            try:
+                _statistics_cache = RasterStatisticsCache(directory)
+            except OSError as e:
+                log(f"Unable to create the raster statistics cache, {e}", info=False)
+                _statistics_cache = RasterStatisticsCache()
+
+    return _statistics_cache
+
+
+def get_raster_statistics(
+    path: str,
+    band_number: int = 1,
+    approximate: bool = False,
+    histogram_bins: int = 0,
+    feedback: QgsProcessingFeedback = None,
+) -> typing.Optional[RasterStatistics]:
+    """Returns the statistics of a raster band from the shared cache,
+    see `RasterStatisticsCache.get`.
+
+    :param path: Path of the raster.
+    :type path: str
+
+    :param band_number: Band number, default is band one.
+    :type band_number: int
+
+    :param approximate: Whether approximate statistics are acceptable.
+    :type approximate: bool
+
+    :param histogram_bins: Number of histogram bins required.
+    :type histogram_bins: int
+
+    :param feedback: Feedback object for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :returns: The band statistics or None if the raster could not be read.
+    :rtype: RasterStatistics
+    """
+    return statistics_cache().get(
+        path, band_number, approximate, histogram_bins, feedback
+    )
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Warping of input layers onto the analysis grid.
+
+Each input is brought onto the CRS, pixel lattice, extent and NoData value
+of the analysis grid with a single warp, which also applies the study area
+cutline, instead of separate snapping, clipping, reprojection and NoData
+replacement passes. Outputs can be lazy VRTs that are only warped when read.
+"""
+
+import typing
+import uuid
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.core import QgsProcessingFeedback
+
+from .blocks import DEFAULT_CREATION_OPTIONS, BlockRasterWriter, RasterGrid
+from ...utils import log
+
+
+# GDAL resampling algorithms in the order of QgsAlignRaster.ResampleAlg,
+# which is the order used by the resampling method setting.
+RESAMPLING_ALGORITHMS = [
+    "near",
+    "bilinear",
+    "cubic",
+    "cubicspline",
+    "lanczos",
+    "average",
+    "mode",
+    "max",
+    "min",
+    "med",
+    "q1",
+    "q3",
+]
+
+
+def resampling_algorithm(method: typing.Union[int, str, None]) -> str:
+    """Returns the GDAL name of a resampling method setting.
+
+    :param method: Index of the method in QgsAlignRaster.ResampleAlg.
+    :type method: int
+
+    :returns: GDAL resampling algorithm, nearest neighbour if the
+    method is not known.
+    :rtype: str
+    """
+    try:
+        return RESAMPLING_ALGORITHMS[int(method)]
+    except (IndexError, TypeError, ValueError):
+        return RESAMPLING_ALGORITHMS[0]
+
+
+def _progress_callback(feedback: typing.Optional[QgsProcessingFeedback]):
+    if feedback is None:
+        return None
+
+    def callback(complete, message, data):
+        feedback.setProgress(complete * 100.0)
+        return 0 if feedback.isCanceled() else 1
+
+    return callback
+
+
+def warp_to_grid(
+    input_path: str,
+    output_path: str,
+    grid: RasterGrid,
+    resample_algorithm: str = "near",
+    cutline_path: str = None,
+    scale: float = None,
+    lazy: bool = False,
+    feedback: QgsProcessingFeedback = None,
+) -> bool:
+    """Warps the first band of a raster onto the analysis grid in one pass.
+
+    The output is a Float32 raster whose NoData value is the grid NoData
+    value, NoData pixels of the input and pixels outside the cutline are
+    set to it.
+
+    :param input_path: Path of the input raster.
+    :type input_path: str
+
+    :param output_path: Path of the output, a GeoTIFF or a VRT if lazy.
+    :type output_path: str
+
+    :param grid: Analysis grid.
+    :type grid: RasterGrid
+
+    :param resample_algorithm: GDAL resampling algorithm.
+    :type resample_algorithm: str
+
+    :param cutline_path: Polygon layer outside which pixels are set
+    to NoData, e.g. the study area.
+    :type cutline_path: str
+
+    :param scale: Factor applied to the valid values after resampling,
+    used to rescale values by the ratio of the pixel areas.
+    :type scale: float
+
+    :param lazy: Whether to write a VRT that is warped when read instead
+    of a GeoTIFF, only supported when there is no scale.
+    :type lazy: bool
+
+    :param feedback: Feedback object for progress and cancellation.
+    :type feedback: QgsProcessingFeedback
+
+    :returns: True if the output was created else False.
+    :rtype: bool
+    """
+    source = gdal.Open(input_path, gdal.GA_ReadOnly)
+    if source is None:
+        log(f"Unable to open {input_path} for warping to the analysis grid.")
+        return False
+
+    rescale = scale is not None and scale != 1.0
+    if rescale or lazy:
+        warp_format = "VRT"
+        warp_path = (
+            output_path
+            if lazy and not rescale
+            else f"/vsimem/cplus_warp_{uuid.uuid4().hex}.vrt"
+        )
+        creation_options = []
+    else:
+        warp_format = "GTiff"
+        warp_path = output_path
+        creation_options = DEFAULT_CREATION_OPTIONS
+
+    options = gdal.WarpOptions(
+        format=warp_format,
+        outputBounds=grid.bounds,
+        width=grid.width,
+        height=grid.height,
+        dstSRS=grid.crs_wkt or None,
+        srcBands=[1],
+        dstNodata=grid.nodata,
+        outputType=gdal.GDT_Float32,
+        resampleAlg=resample_algorithm,
+        cutlineDSName=cutline_path,
+        creationOptions=creation_options,
+        multithread=True,
+        warpOptions=["NUM_THREADS=ALL_CPUS"],
+        callback=None if rescale else _progress_callback(feedback),
+    )
+    dataset = gdal.Warp(warp_path, source, options=options)
+    if dataset is None:
+        log(f"Unable to warp {input_path} to the analysis grid.")
+        return False
+
+    if not rescale:
+        dataset = None
+        return feedback is None or not feedback.isCanceled()
+
+    # Values are rescaled while writing the warped values, so the input
+    # is still read only once.
+    band = dataset.GetRasterBand(1)
+    window_count = grid.window_count()
+    try:
+        with BlockRasterWriter(output_path, grid, nodata=grid.nodata) as writer:
+            for index, window in enumerate(grid.windows()):
+                if feedback is not None and feedback.isCanceled():
+                    return False
+                values = band.ReadAsArray(
+                    window.x_offset, window.y_offset, window.width, window.height
+                ).astype(np.float64)
+                values[values == grid.nodata] = np.nan
+                writer.write(window, values * scale)
+                if feedback is not None:
+                    feedback.setProgress(100.0 * (index + 1) / window_count)
+    finally:
+        band = None
+        dataset = None
+        gdal.Unlink(warp_path)
+
+    return True
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Export of report layouts to PDF in worker processes.
+
+Rendering the map items of a layout and writing the PDF is the most time
+consuming part of a report and has to be done in the main thread of the
+application. Reports are instead exported by a headless QGIS application
+in separate processes, a bounded number of them running at the same time,
+so that the reports of several scenarios are exported concurrently without
+blocking the interface. A layout is exported in the application process
+if a worker process cannot be started or fails.
+"""
+
+import argparse
+from dataclasses import dataclass
+import os
+import sys
+import typing
+
+from qgis.core import (
+    QgsApplication,
+    QgsLayoutExporter,
+    QgsPrintLayout,
+    QgsProject,
+    QgsReadWriteContext,
+)
+from qgis.PyQt import QtCore, QtXml
+
+from ...conf import settings_manager, Settings
+from ...definitions.defaults import DEFAULT_PARALLEL_JOBS, REPORT_FONT_NAME
+from ...utils import contains_font_family, install_font, log
+
+
+# Maximum duration, in milliseconds, of the export of a report
+EXPORT_TIMEOUT = 30 * 60 * 1000
+
+
+@dataclass
+class PdfExportJob:
+    """Layout to be exported to PDF."""
+
+    project_path: str
+    layout_path: str
+    pdf_path: str
+    title: str = ""
+    abstract: str = ""
+    # Exports the layout in the application process, used when the
+    # worker process fails.
+    fallback: typing.Optional[typing.Callable[[], bool]] = None
+    # Whether the layout file is removed once the export is complete
+    temporary_layout: bool = False
+
+
+def python_interpreter() -> typing.Optional[str]:
+    """Returns the Python interpreter of the QGIS installation, the
+    executable of the application is not Python on some platforms.
+
+    :returns: Path of the interpreter or None if it cannot be found.
+    :rtype: str
+    """
+    version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    if sys.platform == "win32":
+        candidates = [
+            sys.executable,
+            os.path.join(sys.exec_prefix, "python.exe"),
+            os.path.join(sys.exec_prefix, "python3.exe"),
+        ]
+    else:
+        candidates = [
+            sys.executable,
+            os.path.join(sys.exec_prefix, "bin", f"python{version}"),
+            os.path.join(sys.exec_prefix, "bin", "python3"),
+        ]
+
+    for candidate in candidates:
+        if (
+            candidate
+            and os.path.basename(candidate).lower().startswith("python")
+            and os.path.isfile(candidate)
+        ):
+            return candidate
+
+    return None
+
+
+def load_layout(
+    layout_path: str, project: QgsProject
+) -> typing.Optional[QgsPrintLayout]:
+    """Loads a layout template in a project.
+
+    :param layout_path: Path of the layout template.
+    :type layout_path: str
+
+    :param project: Project whose layers are used by the layout.
+    :type project: QgsProject
+
+    :returns: The layout or None if it could not be loaded.
+    :rtype: QgsPrintLayout
+    """
+    template_file = QtCore.QFile(layout_path)
+    if not template_file.open(QtCore.QIODevice.OpenModeFlag.ReadOnly):
+        return None
+
+    doc = QtXml.QDomDocument()
+    try:
+        if not doc.setContent(template_file):
+            return None
+    finally:
+        template_file.close()
+
+    layout = QgsPrintLayout(project)
+    _, load_status = layout.loadFromTemplate(doc, QgsReadWriteContext())
+    if not load_status:
+        return None
+
+    return layout
+
+
+def export_layout_to_pdf(job: PdfExportJob) -> bool:
+    """Exports a layout template of a project to PDF, this is run by
+    the worker processes.
+
+    :param job: Layout to be exported.
+    :type job: PdfExportJob
+
+    :returns: True if the PDF was written else False.
+    :rtype: bool
+    """
+    project = QgsProject.instance()
+    if not project.read(job.project_path):
+        print(f"Unable to read the project file {job.project_path}", file=sys.stderr)
+        return False
+
+    metadata = project.metadata()
+    metadata.setAuthor("CPLUS plugin")
+    if job.title:
+        metadata.setTitle(job.title)
+    if job.abstract:
+        metadata.setAbstract(job.abstract)
+    metadata.setCreationDateTime(QtCore.QDateTime.currentDateTime())
+    project.setMetadata(metadata)
+
+    layout = load_layout(job.layout_path, project)
+    if layout is None:
+        print(f"Unable to load the layout {job.layout_path}", file=sys.stderr)
+        return False
+
+    exporter = QgsLayoutExporter(layout)
+    result = exporter.exportToPdf(job.pdf_path, QgsLayoutExporter.PdfExportSettings())
+
+    return result == QgsLayoutExporter.ExportResult.Success
+
+
+def install_report_font() -> bool:
+    """Installs the report font in the worker process, the font is
+    installed by the plugin in the application process only.
+
+    :returns: True if the report font is available else False.
+    :rtype: bool
+    """
+    if contains_font_family(REPORT_FONT_NAME):
+        return True
+
+    return install_font(REPORT_FONT_NAME.lower())
+
+
+def main(argv: typing.List[str] = None) -> int:
+    """Entry point of the worker processes.
+
+    :param argv: Command line arguments.
+    :type argv: list
+
+    :returns: Exit code of the process, zero if the PDF was written
+    using the report font.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description="Exports a report layout to PDF.")
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--layout", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--title", default="")
+    parser.add_argument("--abstract", default="")
+    args = parser.parse_args(argv)
+
+    # Fonts and rendering require a GUI application without showing any window
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QgsApplication([], True)
+    if args.prefix:
+        QgsApplication.setPrefixPath(args.prefix, True)
+    QgsApplication.initQgis()
+
+    try:
+        from .layout_items import CplusMapRepeatItemLayoutItemMetadata
+
+        QgsApplication.layoutItemRegistry().addLayoutItemType(
+            CplusMapRepeatItemLayoutItemMetadata()
+        )
+
+        # The text of the layout would be rendered with a fallback font,
+        # the layout is then exported in the application instead.
+        if install_report_font():
+            success = export_layout_to_pdf(
+                PdfExportJob(
+                    args.project, args.layout, args.output, args.title, args.abstract
+                )
+            )
+        else:
+            print(f"Unable to install the {REPORT_FONT_NAME} font", file=sys.stderr)
+            success = False
+    finally:
+        QgsApplication.exitQgis()
+        del app
+
+    return 0 if success else 1
+
+
+class PdfExportScheduler(QtCore.QObject):
+    """Runs PDF export jobs in a bounded number of worker processes."""
+
+    export_finished = QtCore.pyqtSignal(str, bool)
+
+    def __init__(self, parent: QtCore.QObject = None, max_processes: int = 1):
+        super().__init__(parent)
+        self._max_processes = max(1, max_processes)
+        self._queue: typing.List[PdfExportJob] = []
+        self._processes: typing.Dict[QtCore.QProcess, PdfExportJob] = {}
+        self._interpreter = python_interpreter()
+
+    @property
+    def max_processes(self) -> int:
+        """Returns the maximum number of worker processes."""
+        return self._max_processes
+
+    @max_processes.setter
+    def max_processes(self, value: int):
+        """Sets the maximum number of worker processes."""
+        self._max_processes = max(1, value)
+        self._start_next()
+
+    @property
+    def pending_count(self) -> int:
+        """Returns the number of jobs that are queued or running."""
+        return len(self._queue) + len(self._processes)
+
+    def is_pending(self, pdf_path: str) -> bool:
+        """Checks whether the export of a PDF is queued or running.
+
+        :param pdf_path: Path of the exported PDF.
+        :type pdf_path: str
+
+        :returns: True if the PDF is being exported else False.
+        :rtype: bool
+        """
+        jobs = self._queue + list(self._processes.values())
+        return any(job.pdf_path == pdf_path for job in jobs)
+
+    def submit(self, job: PdfExportJob):
+        """Queues a job, it is started once a worker process is available.
+
+        :param job: Layout to be exported.
+        :type job: PdfExportJob
+        """
+        self._queue.append(job)
+        self._start_next()
+
+    def _start_next(self):
+        while self._queue and len(self._processes) < self._max_processes:
+            job = self._queue.pop(0)
+            if self._interpreter is None:
+                self._finish(job, self._run_fallback(job))
+                continue
+
+            self._start_process(job)
+
+    def _create_process(self) -> QtCore.QProcess:
+        return QtCore.QProcess(self)
+
+    def _start_process(self, job: PdfExportJob):
+        package_name = __name__.split(".")[0]
+        package_dir = os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        )
+        python_path = [package_dir] + [path for path in sys.path if path]
+
+        environment = QtCore.QProcessEnvironment.systemEnvironment()
+        environment.insert("PYTHONPATH", os.pathsep.join(python_path))
+
+        process = self._create_process()
+        process.setProcessEnvironment(environment)
+        process.setProcessChannelMode(QtCore.QProcess.ProcessChannelMode.MergedChannels)
+
+        # Owned by the process so that it is deleted with it
+        timeout_timer = QtCore.QTimer(process)
+        timeout_timer.setSingleShot(True)
+        timeout_timer.timeout.connect(process.kill)
+        process.finished.connect(timeout_timer.stop)
+
+        process.finished.connect(
+            lambda exit_code, exit_status: self._on_process_finished(
+                process, exit_code, exit_status
+            )
+        )
+        process.errorOccurred.connect(
+            lambda error: self._on_process_error(process, error)
+        )
+        self._processes[process] = job
+
+        process.start(
+            self._interpreter,
+            [
+                "-m",
+                f"{package_name}.lib.reports.export",
+                "--prefix",
+                QgsApplication.prefixPath(),
+                "--project",
+                job.project_path,
+                "--layout",
+                job.layout_path,
+                "--output",
+                job.pdf_path,
+                "--title",
+                job.title,
+                "--abstract",
+                job.abstract,
+            ],
+        )
+        # The process is no longer tracked if it failed to start
+        if process in self._processes:
+            timeout_timer.start(EXPORT_TIMEOUT)
+
+    def _on_process_error(self, process: QtCore.QProcess, error):
+        # Other errors are followed by the finished signal
+        if error == QtCore.QProcess.ProcessError.FailedToStart:
+            self._on_process_finished(process, -1, QtCore.QProcess.ExitStatus.CrashExit)
+
+    def _on_process_finished(
+        self, process: QtCore.QProcess, exit_code: int, exit_status
+    ):
+        job = self._processes.pop(process, None)
+        if job is None:
+            return
+
+        success = (
+            exit_status == QtCore.QProcess.ExitStatus.NormalExit
+            and exit_code == 0
+            and os.path.exists(job.pdf_path)
+        )
+        if not success:
+            output = bytes(process.readAll()).decode("utf-8", "replace").strip()
+            log(
+                f"Report export process failed for {job.pdf_path}, "
+                f"exporting in the application. {output}",
+                info=False,
+            )
+            success = self._run_fallback(job)
+
+        process.deleteLater()
+        self._finish(job, success)
+        self._start_next()
+
+    @staticmethod
+    def _run_fallback(job: PdfExportJob) -> bool:
+        if job.fallback is None:
+            return False
+
+        return bool(job.fallback())
+
+    def _finish(self, job: PdfExportJob, success: bool):
+        if job.temporary_layout and os.path.exists(job.layout_path):
+            try:
+                os.remove(job.layout_path)
+            except OSError:
+                pass
+
+        self.export_finished.emit(job.pdf_path, success)
+
+
+_pdf_export_scheduler: typing.Optional[PdfExportScheduler] = None
+
+
+def pdf_export_scheduler() -> PdfExportScheduler:
+    """Returns the shared PDF export scheduler, it must be used from the
+    main thread of the application. The number of worker processes is
+    the number of parallel jobs in the settings.
+
+    :returns: The PDF export scheduler.
+    :rtype: PdfExportScheduler
+    """
+    global _pdf_export_scheduler
+
+    jobs_count = settings_manager.get_value(
+        Settings.PARALLEL_JOBS, default=DEFAULT_PARALLEL_JOBS, setting_type=int
+    )
+    try:
+        jobs_count = max(1, int(jobs_count))
+    except (TypeError, ValueError):
+        jobs_count = DEFAULT_PARALLEL_JOBS
+
+    if _pdf_export_scheduler is None:
+        _pdf_export_scheduler = PdfExportScheduler(
+            QgsApplication.instance(), jobs_count
+        )
+    else:
+        _pdf_export_scheduler.max_processes = jobs_count
+
+    return _pdf_export_scheduler
+
+
+if __name__ == "__main__":
+    sys.exit(main())
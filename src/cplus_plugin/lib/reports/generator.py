@@ -49,12 +49,7 @@ from qgis.core import (
 from qgis.PyQt import QtCore, QtGui, QtXml
 from qgis.PyQt.QtGui import QColor
 
-from ..carbon import (
-    calculate_activity_naturebase_carbon_impact,
-    CarbonImpactManageCalculator,
-    CarbonImpactProtectCalculator,
-    CarbonImpactRestoreCalculator,
-)
+from ..carbon import calculate_activity_naturebase_carbon_impact
 from .comparison_table import ScenarioComparisonTableInfo
 from ...conf import settings_manager, Settings
 from ...definitions.constants import (
@@ -66,6 +61,7 @@ from ...definitions.defaults import (
     ACTIVITY_AREA_TABLE_ID,
     AREA_COMPARISON_TABLE_ID,
     CARBON_IMPACT_HEADER,
+    DEFAULT_PARALLEL_JOBS,
     IMPACT_MATRIX_COLORS,
     IMPACT_MATRIX_TABLE_ID,
     MANAGE_CARBON_IMPACT_HEADER,
@@ -85,8 +81,18 @@ from ...definitions.defaults import (
     PROTECT_CARBON_IMPACT_HEADER,
     TOTAL_CARBON_IMPACT_HEADER,
 )
+from .export import pdf_export_scheduler, PdfExportJob
 from .layout_items import BasicScenarioDetailsItem, CplusMapRepeatItem
-from .metrics import create_metrics_expression_context, evaluate_activity_metric
+from .metrics import (
+    CARBON_IMPACT_RESTORE,
+    FUNC_CARBON_IMPACT_MANAGE,
+    FUNC_CARBON_IMPACT_PROTECT,
+    active_metric_result_cache,
+    activity_metric_result,
+    create_metrics_expression_context,
+    metric_result_cache_scope,
+    MetricExpressionPlan,
+)
 from ...models.base import Activity, NcsPathway
 from ...models.helpers import extent_to_project_crs_extent
 from ...models.report import (
@@ -206,11 +212,19 @@ class BaseScenarioReportGeneratorTask(QgsTask):
 
     def _on_layout_added(self, name: str):
         """Slot raised when a layout has been added to the manager."""
+        # Reports of several scenarios can be generated at the same time
+        if self._generator.layout is None or name != self._generator.layout.name():
+            return
+
+        self.layout_manager.layoutAdded.disconnect(self._on_layout_added)
         self._export_to_pdf()
 
     def _export_to_pdf(self):
         """Export layout to PDF after the extents have been updated to
         the current canvas extents.
+
+        The layout is exported by a worker process so that reports are
+        exported concurrently without blocking the application.
         """
         # We fetch the layout afresh so that the PDF export can contain
         # synced extents.
@@ -223,20 +237,65 @@ class BaseScenarioReportGeneratorTask(QgsTask):
             return
 
         # Set project metadata which will be cascaded to the PDF document
+        title = ""
+        abstract = ""
+        if hasattr(self._context, "scenario"):
+            title = self._context.scenario.name
+            abstract = self._context.scenario.description
         project = QgsProject.instance()
         metadata = project.metadata()
         metadata.setAuthor("CPLUS plugin")
-        if hasattr(self._context, "scenario"):
-            metadata.setTitle(self._context.scenario.name)
-            metadata.setAbstract(self._context.scenario.description)
+        if title:
+            metadata.setTitle(title)
+            metadata.setAbstract(abstract)
         metadata.setCreationDateTime(QtCore.QDateTime.currentDateTime())
         project.setMetadata(metadata)
 
-        exporter = QgsLayoutExporter(layout)
         pdf_path = f"{self._generator.output_dir}/{self._result.base_file_name}.pdf"
-        result = exporter.exportToPdf(pdf_path, QgsLayoutExporter.PdfExportSettings())
-        if result != QgsLayoutExporter.ExportResult.Success:
-            log(f"Could not export {layout_name} layout to PDF.", info=False)
+        layout_manager = self.layout_manager
+
+        def export_in_application() -> bool:
+            current_layout = layout_manager.layoutByName(layout_name)
+            if current_layout is None:
+                return False
+
+            exporter = QgsLayoutExporter(current_layout)
+            result = exporter.exportToPdf(
+                pdf_path, QgsLayoutExporter.PdfExportSettings()
+            )
+            if result != QgsLayoutExporter.ExportResult.Success:
+                log(f"Could not export {layout_name} layout to PDF.", info=False)
+                return False
+
+            return True
+
+        # Layout with the updated map extents and pie chart
+        layout_file = QtCore.QTemporaryFile(
+            os.path.join(QtCore.QDir.tempPath(), "cplus_report_XXXXXX.qpt")
+        )
+        layout_file.setAutoRemove(False)
+        if not layout_file.open():
+            export_in_application()
+            return
+        layout_path = layout_file.fileName()
+        layout_file.close()
+
+        if not layout.saveAsTemplate(layout_path, QgsReadWriteContext()):
+            os.remove(layout_path)
+            export_in_application()
+            return
+
+        job = PdfExportJob(
+            self._context.project_file,
+            layout_path,
+            pdf_path,
+            title,
+            abstract,
+            fallback=export_in_application,
+            temporary_layout=True,
+        )
+        # Submitted once the project has been saved after adding the layout
+        QtCore.QTimer.singleShot(0, lambda: pdf_export_scheduler().submit(job))
 
 
 class ScenarioAnalysisReportGeneratorTask(BaseScenarioReportGeneratorTask):
@@ -600,7 +659,9 @@ class BaseScenarioReportGenerator(QtCore.QObject):
         :rtype: ReportResult
         """
         try:
-            return self._run()
+            # Metric results are shared by the reports being generated
+            with metric_result_cache_scope():
+                return self._run()
         except Exception as ex:
             # Last resort to capture general exceptions.
             exc_info = "".join(traceback.TracebackException.from_exception(ex).format())
@@ -1165,6 +1226,7 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
         self._pixel_area_info = {}
         self._use_custom_metrics = context.custom_metrics
         self._metrics_configuration = None
+        self._metrics_plan = None
         self._setup_metrics_configuration()
         self._activity_pie_html = ""
 
@@ -1184,6 +1246,75 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
         if current_metric_profile:
             self._metrics_configuration = current_metric_profile.config
 
+    def _compile_metrics_plan(self) -> MetricExpressionPlan:
+        """Parses and prepares the metric expressions of the activities.
+
+        :returns: The plan for evaluating the metric expressions.
+        :rtype: MetricExpressionPlan
+        """
+        if self._metrics_plan is not None:
+            return self._metrics_plan
+
+        self._metrics_plan = MetricExpressionPlan(
+            create_metrics_expression_context(self._project)
+        )
+        if self._metrics_configuration is not None:
+            for activity in self._context.scenario.activities:
+                for mc in self._metrics_configuration.metric_columns:
+                    activity_metric = self._metrics_configuration.find(
+                        str(activity.uuid), mc.name
+                    )
+                    if activity_metric is not None:
+                        self._metrics_plan.add(activity_metric.expression)
+
+        return self._metrics_plan
+
+    def _precompute_activity_metrics(self):
+        """Starts the expensive metric calculations of the activities in
+        background threads, the activity area table then fetches their
+        results from the metric result cache.
+        """
+        cache = active_metric_result_cache()
+        if cache is None:
+            return
+
+        calls = []
+        for activity in self._context.scenario.activities:
+            if self._use_custom_metrics:
+                if self._metrics_configuration is None:
+                    break
+
+                metrics_plan = self._compile_metrics_plan()
+                activity_id = str(activity.uuid)
+                for mc in self._metrics_configuration.metric_columns:
+                    activity_metric = self._metrics_configuration.find(
+                        activity_id, mc.name
+                    )
+                    if activity_metric is None:
+                        continue
+
+                    for name, args in metrics_plan.function_calls(
+                        activity_metric.expression
+                    ):
+                        calls.append((activity_id, name, args))
+            else:
+                for name in (
+                    FUNC_CARBON_IMPACT_PROTECT,
+                    FUNC_CARBON_IMPACT_MANAGE,
+                    CARBON_IMPACT_RESTORE,
+                ):
+                    calls.append((activity, name, ()))
+
+        jobs_count = settings_manager.get_value(
+            Settings.PARALLEL_JOBS, default=DEFAULT_PARALLEL_JOBS, setting_type=int
+        )
+        try:
+            jobs_count = max(1, int(jobs_count))
+        except (TypeError, ValueError):
+            jobs_count = DEFAULT_PARALLEL_JOBS
+
+        cache.precompute(calls, jobs_count)
+
     @property
     def repeat_page(self) -> typing.Union[QgsLayoutItemPage, None]:
         """Returns the page item that will be repeated based on the
@@ -2096,7 +2227,9 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
 
         parent_table.setHeaders(columns)
 
-        metrics_context = create_metrics_expression_context(self._project)
+        metrics_plan = (
+            self._compile_metrics_plan() if self._use_custom_metrics else None
+        )
 
         rows_data = []
         for activity in self._context.scenario.activities:
@@ -2135,24 +2268,34 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
                     * num_activities
                 )
 
+                # Evaluate the metrics of all the columns of the activity
+                activity_metrics = [
+                    self._metrics_configuration.find(str(activity.uuid), mc.name)
+                    for mc in self._metrics_configuration.metric_columns
+                ]
+                metric_results = iter(
+                    metrics_plan.evaluate(
+                        activity_context_info,
+                        [
+                            activity_metric.expression
+                            for activity_metric in activity_metrics
+                            if activity_metric is not None
+                        ],
+                    )
+                )
+
                 for i, mc in enumerate(self._metrics_configuration.metric_columns):
                     progress = base_overall_progress + ((i + 1) * progress_increment)
                     tr_msg = f"{tr('Calculating')} {activity.name} {mc.header} metrics"
                     if self._process_check_cancelled_or_set_progress(progress, tr_msg):
                         return self._get_failed_result()
 
-                    activity_metric = self._metrics_configuration.find(
-                        str(activity.uuid), mc.name
-                    )
+                    activity_metric = activity_metrics[i]
                     if activity_metric is None:
                         cell_value = tr("Error fetching metric")
                         highlight_error = True
                     else:
-                        result = evaluate_activity_metric(
-                            metrics_context,
-                            activity_context_info,
-                            activity_metric.expression,
-                        )
+                        result = next(metric_results)
 
                         if not result.success:
                             cell_value = tr("Metric eval error")
@@ -2222,10 +2365,9 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
                 if self._process_check_cancelled_or_set_progress(progress, tr_msg):
                     return self._get_failed_result()
 
-                carbon_impact_protect_calculator = CarbonImpactProtectCalculator(
-                    activity
+                carbon_impact_protect = activity_metric_result(
+                    FUNC_CARBON_IMPACT_PROTECT, activity
                 )
-                carbon_impact_protect = carbon_impact_protect_calculator.run()
                 carbon_impact_protect_cell = QgsTableCell(
                     self.format_number(carbon_impact_protect, True)
                 )
@@ -2243,8 +2385,9 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
                 if self._process_check_cancelled_or_set_progress(progress, tr_msg):
                     return self._get_failed_result()
 
-                carbon_impact_manage_calculator = CarbonImpactManageCalculator(activity)
-                carbon_impact_manage = carbon_impact_manage_calculator.run()
+                carbon_impact_manage = activity_metric_result(
+                    FUNC_CARBON_IMPACT_MANAGE, activity
+                )
                 carbon_impact_manage_cell = QgsTableCell(
                     self.format_number(carbon_impact_manage, True)
                 )
@@ -2262,10 +2405,9 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
                 if self._process_check_cancelled_or_set_progress(progress, tr_msg):
                     return self._get_failed_result()
 
-                carbon_impact_restore_calculator = CarbonImpactRestoreCalculator(
-                    activity
+                carbon_impact_restore = activity_metric_result(
+                    CARBON_IMPACT_RESTORE, activity
                 )
-                carbon_impact_restore = carbon_impact_restore_calculator.run()
                 carbon_impact_restore_cell = QgsTableCell(
                     self.format_number(carbon_impact_restore, True)
                 )
@@ -2494,6 +2636,9 @@ class ScenarioAnalysisReportGenerator(DuplicatableRepeatPageReportGenerator):
         """Runs report generation process."""
         super()._run()
 
+        # Compute the activity metrics while the layout is being prepared
+        self._precompute_activity_metrics()
+
         # Set repeat page
         self._set_repeat_page()
 
@@ -41,6 +41,7 @@ from ...models.report import (
 )
 from ...utils import clean_filename, FileUtils, log, tr
 
+from .export import pdf_export_scheduler
 from .generator import (
     ScenarioAnalysisReportGeneratorTask,
     ScenarioComparisonReportGeneratorTask,
@@ -61,6 +62,10 @@ class ReportManager(QtCore.QObject):
     # Max number of comparison report tasks
     COMPARISON_REPORT_LIMIT = 3
 
+    # Paths of the PDFs to be opened once they have been exported
+    _pdf_paths_to_open = set()
+    _pdf_export_scheduler = None
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -625,18 +630,49 @@ class ReportManager(QtCore.QObject):
         process.
         :type result: ReportResult
 
-        :returns: True if the PDF was successfully loaded, else
-        False if the result from the generation process was False.
+        :returns: True if the PDF was successfully loaded or will be
+        opened once it has been exported, else False if the result from
+        the generation process was False.
         :rtype: bool
         """
         if not result.success:
             return False
 
-        pdf_url = QtCore.QUrl.fromLocalFile(result.pdf_path)
+        scheduler = pdf_export_scheduler()
+        if not os.path.exists(result.pdf_path) and scheduler.is_pending(
+            result.pdf_path
+        ):
+            if cls._pdf_export_scheduler is not scheduler:
+                scheduler.export_finished.connect(cls._on_pdf_exported)
+                cls._pdf_export_scheduler = scheduler
+            cls._pdf_paths_to_open.add(result.pdf_path)
+            log(
+                tr(
+                    "The PDF report is still being exported, it will be "
+                    "opened once the export is complete."
+                )
+            )
+            return True
+
+        return cls._open_pdf(result.pdf_path)
+
+    @classmethod
+    def _open_pdf(cls, pdf_path: str) -> bool:
+        pdf_url = QtCore.QUrl.fromLocalFile(pdf_path)
         if pdf_url.isEmpty():
             return False
 
         return QtGui.QDesktopServices.openUrl(pdf_url)
 
+    @classmethod
+    def _on_pdf_exported(cls, pdf_path: str, success: bool):
+        """Opens a PDF whose viewing was requested during its export."""
+        if pdf_path not in cls._pdf_paths_to_open:
+            return
+
+        cls._pdf_paths_to_open.discard(pdf_path)
+        if not success or not cls._open_pdf(pdf_path):
+            log(tr("Unable to open PDF report."), info=False)
+
 
 report_manager = ReportManager()
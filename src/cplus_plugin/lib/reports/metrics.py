@@ -3,6 +3,10 @@
 Provides variables and functions for custom activity metrics.
 """
 
+import concurrent.futures
+import contextlib
+from numbers import Number
+import threading
 import typing
 
 from qgis.core import (
@@ -11,6 +15,7 @@ from qgis.core import (
     QgsExpressionContextGenerator,
     QgsExpressionContextScope,
     QgsExpressionContextUtils,
+    QgsExpressionNode,
     QgsExpressionNodeFunction,
     QgsProject,
     QgsScopedExpressionFunction,
@@ -19,6 +24,7 @@ from qgis.core import (
 from ...conf import settings_manager
 from ...definitions.defaults import (
     BASE_PLUGIN_NAME,
+    DEFAULT_PARALLEL_JOBS,
     MANAGE_CARBON_IMPACT_EXPRESSION_DESCRIPTION,
     MEAN_BASED_IRRECOVERABLE_CARBON_EXPRESSION_DESCRIPTION,
     NATUREBASE_CARBON_IMPACT_EXPRESSION_DESCRIPTION,
@@ -29,11 +35,14 @@ from ...definitions.defaults import (
 from ..carbon import (
     CarbonImpactProtectCalculator,
     CarbonImpactManageCalculator,
+    CarbonImpactRestoreCalculator,
     IrrecoverableCarbonCalculator,
 )
 from ..financials import calculate_activity_npv
+from ...models.base import Activity
 from ...models.report import ActivityContextInfo, MetricEvalResult
-from ...utils import calculate_raster_area, function_help_to_html, log, tr
+from ..raster.area import calculate_raster_areas
+from ...utils import function_help_to_html, log, tr
 
 # Collection of metric expression functions
 METRICS_LIBRARY = []
@@ -51,8 +60,33 @@ FUNC_PWL_IMPACT = "pwl_impact"
 FUNC_CARBON_IMPACT_PROTECT = "carbon_impact_protect"
 FUNC_CARBON_IMPACT_MANAGE = "carbon_impact_manage"
 
+# Name of the restore carbon impact calculation in the metric result
+# cache, it is not available as an expression function.
+CARBON_IMPACT_RESTORE = "carbon_impact_restore"
 
-class ActivityIrrecoverableCarbonFunction(QgsScopedExpressionFunction):
+
+class BaseActivityMetricFunction(QgsScopedExpressionFunction):
+    """Base class for metric functions whose result depends on the
+    activity variables of the metrics scope.
+    """
+
+    def isStatic(
+        self,
+        node: QgsExpressionNodeFunction,
+        parent: QgsExpression,
+        context: QgsExpressionContext,
+    ) -> bool:
+        """The result of a call depends on the activity being evaluated so
+        it cannot be computed when the expression is prepared, even if the
+        arguments are literal values.
+
+        :returns: False, the function is never static.
+        :rtype: bool
+        """
+        return False
+
+
+class ActivityIrrecoverableCarbonFunction(BaseActivityMetricFunction):
     """Calculates the total irrecoverable carbon of an activity using the
     means-based reference carbon layer."""
 
@@ -94,9 +128,8 @@ class ActivityIrrecoverableCarbonFunction(QgsScopedExpressionFunction):
             return -1.0
 
         activity_id = context.variable(VAR_ACTIVITY_ID)
-        irrecoverable_carbon_calculator = IrrecoverableCarbonCalculator(activity_id)
 
-        return irrecoverable_carbon_calculator.run()
+        return activity_metric_result(FUNC_MEAN_BASED_IC, activity_id)
 
     def clone(self) -> "ActivityIrrecoverableCarbonFunction":
         """Gets a clone of this function.
@@ -107,7 +140,7 @@ class ActivityIrrecoverableCarbonFunction(QgsScopedExpressionFunction):
         return ActivityIrrecoverableCarbonFunction()
 
 
-class ActivityNpvFunction(QgsScopedExpressionFunction):
+class ActivityNpvFunction(BaseActivityMetricFunction):
     """Calculates the financial NPV of an activity by extracting the
     individual NPV values of the pathways in the activity.
     """
@@ -157,7 +190,7 @@ class ActivityNpvFunction(QgsScopedExpressionFunction):
         if not isinstance(activity_area, (float, int)):
             return -1.0
 
-        return calculate_activity_npv(activity_id, activity_area)
+        return activity_metric_result(FUNC_ACTIVITY_NPV, activity_id, activity_area)
 
     def clone(self) -> "ActivityNpvFunction":
         """Gets a clone of this function.
@@ -168,7 +201,7 @@ class ActivityNpvFunction(QgsScopedExpressionFunction):
         return ActivityNpvFunction()
 
 
-class ActivityPwlImpactFunction(QgsScopedExpressionFunction):
+class ActivityPwlImpactFunction(BaseActivityMetricFunction):
     """Calculates the PWL impact an activity."""
 
     def __init__(self):
@@ -234,7 +267,7 @@ class ActivityPwlImpactFunction(QgsScopedExpressionFunction):
         if not isinstance(num_jobs, (float, int)):
             return -1.0
 
-        return calculate_activity_pwl_impact(activity_id, num_jobs)
+        return activity_metric_result(FUNC_PWL_IMPACT, activity_id, num_jobs)
 
     def clone(self) -> "ActivityPwlImpactFunction":
         """Gets a clone of this function.
@@ -245,7 +278,7 @@ class ActivityPwlImpactFunction(QgsScopedExpressionFunction):
         return ActivityPwlImpactFunction()
 
 
-class ActivityProtectCarbonImpactFunction(QgsScopedExpressionFunction):
+class ActivityProtectCarbonImpactFunction(BaseActivityMetricFunction):
     """Calculates the carbon impact of protect NCS pathways
     in an activity using the reference biomass layer.
     """
@@ -292,9 +325,8 @@ class ActivityProtectCarbonImpactFunction(QgsScopedExpressionFunction):
             return -1.0
 
         activity_id = context.variable(VAR_ACTIVITY_ID)
-        protect_carbon_calculator = CarbonImpactProtectCalculator(activity_id)
 
-        return protect_carbon_calculator.run()
+        return activity_metric_result(FUNC_CARBON_IMPACT_PROTECT, activity_id)
 
     def clone(self) -> "ActivityProtectCarbonImpactFunction":
         """Gets a clone of this function.
@@ -305,7 +337,7 @@ class ActivityProtectCarbonImpactFunction(QgsScopedExpressionFunction):
         return ActivityProtectCarbonImpactFunction()
 
 
-class ActivityManageCarbonImpactFunction(QgsScopedExpressionFunction):
+class ActivityManageCarbonImpactFunction(BaseActivityMetricFunction):
     """Calculates the carbon impact of manage NCS pathways in an activity."""
 
     def __init__(self):
@@ -346,9 +378,8 @@ class ActivityManageCarbonImpactFunction(QgsScopedExpressionFunction):
             return -1.0
 
         activity_id = context.variable(VAR_ACTIVITY_ID)
-        manage_carbon_calculator = CarbonImpactManageCalculator(activity_id)
 
-        return manage_carbon_calculator.run()
+        return activity_metric_result(FUNC_CARBON_IMPACT_MANAGE, activity_id)
 
     def clone(self) -> "ActivityManageCarbonImpactFunction":
         """Gets a clone of this function.
@@ -524,11 +555,28 @@ def evaluate_activity_metric(
     :rtype: MetricEvalResult
     """
     # Update context with activity information
+    if not _set_activity_variables(context, activity_info):
+        return MetricEvalResult(False, None)
+
+    expression = QgsExpression(expression_str)
+    expression.prepare(context)
+
+    return _evaluate_expression(expression, context)
+
+
+def _set_activity_variables(
+    context: QgsExpressionContext, activity_info: ActivityContextInfo
+) -> bool:
+    """Updates the variables of the metrics scope of the context with the
+    information of an activity.
+
+    :returns: True if the context has a metrics scope else False.
+    :rtype: bool
+    """
     metrics_scope = context.activeScopeForVariable(VAR_ACTIVITY_AREA)
     if metrics_scope is None:
-        return MetricEvalResult(False, None)
+        return False
 
-    # Update context
     metrics_scope.setVariable(VAR_ACTIVITY_ID, str(activity_info.activity.uuid))
     metrics_scope.setVariable(VAR_ACTIVITY_NAME, activity_info.activity.name)
     metrics_scope.setVariable(VAR_ACTIVITY_AREA, activity_info.area)
@@ -536,8 +584,13 @@ def evaluate_activity_metric(
         VAR_ACTIVITY_NATUREBASE_CARBON_IMPACT, activity_info.total_naturebase_carbon
     )
 
-    expression = QgsExpression(expression_str)
-    expression.prepare(context)
+    return True
+
+
+def _evaluate_expression(
+    expression: QgsExpression, context: QgsExpressionContext
+) -> MetricEvalResult:
+    """Evaluates a prepared metric expression against the context."""
     result = expression.evaluate(context)
 
     if expression.hasEvalError() or expression.hasParserError():
@@ -590,14 +643,22 @@ def calculate_activity_pwl_impact(activity_id: str, number_jobs: float) -> float
     if activity is None or len(activity.pathways) == 0:
         return -1.0
 
-    pathway_areas = []
+    pathways = []
+    pathway_layers = []
     for pathway in activity.pathways:
         pathway_layer = pathway.to_map_layer()
         if pathway_layer is None:
             continue
 
-        area = calculate_raster_area(pathway_layer, 1)
-        if area == -1.0:
+        pathways.append(pathway)
+        pathway_layers.append(pathway_layer)
+
+    # Scan all the pathway layers in one pass
+    area_infos = calculate_raster_areas(pathway_layers, 1)
+
+    pathway_areas = []
+    for pathway, area_info in zip(pathways, area_infos):
+        if area_info is None or area_info.valid_pixel_count == 0:
             log(
                 f"Could not compute the area for {pathway.name} "
                 f"pathway in PWL impact assessment for {activity.name} "
@@ -606,9 +667,408 @@ def calculate_activity_pwl_impact(activity_id: str, number_jobs: float) -> float
             )
             continue
 
-        pathway_areas.append(area)
+        pathway_areas.append(area_info.total_area)
 
     if len(pathway_areas) == 0:
         return -1.0
 
     return float(sum(pathway_areas)) * number_jobs
+
+
+def _activity_id(activity: typing.Union[str, Activity]) -> str:
+    """Returns the ID of an activity or of an activity ID."""
+    if isinstance(activity, Activity):
+        return str(activity.uuid)
+
+    return str(activity)
+
+
+# Calculations behind the metric functions and the default carbon columns
+# of the reports, by name. They take the activity, or its ID, followed by
+# the arguments of the function.
+METRIC_CALCULATIONS = {
+    FUNC_MEAN_BASED_IC: lambda activity: IrrecoverableCarbonCalculator(activity).run(),
+    FUNC_ACTIVITY_NPV: lambda activity, area: calculate_activity_npv(
+        _activity_id(activity), area
+    ),
+    FUNC_PWL_IMPACT: lambda activity, number_jobs: calculate_activity_pwl_impact(
+        _activity_id(activity), number_jobs
+    ),
+    FUNC_CARBON_IMPACT_PROTECT: lambda activity: CarbonImpactProtectCalculator(
+        activity
+    ).run(),
+    FUNC_CARBON_IMPACT_MANAGE: lambda activity: CarbonImpactManageCalculator(
+        activity
+    ).run(),
+    CARBON_IMPACT_RESTORE: lambda activity: CarbonImpactRestoreCalculator(
+        activity
+    ).run(),
+}
+
+# Calculations that merge, warp or scan rasters, these are worth computing
+# in the background before the metrics tables are populated. The NPV only
+# reads the pathway NPV values and depends on the area of the activity.
+EXPENSIVE_METRIC_CALCULATIONS = (
+    FUNC_MEAN_BASED_IC,
+    FUNC_PWL_IMPACT,
+    FUNC_CARBON_IMPACT_PROTECT,
+    FUNC_CARBON_IMPACT_MANAGE,
+    CARBON_IMPACT_RESTORE,
+)
+
+
+class MetricResultCache:
+    """Thread-safe cache of the results of the metric calculations of
+    activities, keyed by the activity ID, the calculation name and its
+    arguments.
+
+    A calculation requested while it is being computed by another thread,
+    e.g. one started by `precompute`, waits for its result instead of
+    being computed twice.
+    """
+
+    def __init__(self):
+        self._results: typing.Dict[tuple, typing.Any] = {}
+        self._lock = threading.Lock()
+        self._pending: typing.Dict[tuple, threading.Event] = {}
+        self._executor = None
+        self._futures = []
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._results)
+
+    def result(
+        self,
+        activity: typing.Union[str, Activity],
+        name: str,
+        args: tuple = (),
+        calculation: typing.Callable[[], typing.Any] = None,
+    ) -> typing.Any:
+        """Returns the result of a calculation, computing it if it is
+        not in the cache.
+
+        :param activity: Activity or activity ID.
+        :type activity: Union[str, Activity]
+
+        :param name: Name of the calculation, see `METRIC_CALCULATIONS`.
+        :type name: str
+
+        :param args: Arguments of the calculation after the activity.
+        :type args: tuple
+
+        :param calculation: Callable computing the result, by default the
+        calculation in `METRIC_CALCULATIONS` is called with the activity
+        and the arguments.
+        :type calculation: Callable
+
+        :returns: Result of the calculation.
+        :rtype: typing.Any
+        """
+        key = (_activity_id(activity), name, tuple(args))
+        while True:
+            with self._lock:
+                if key in self._results:
+                    return self._results[key]
+
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            if calculation is None:
+                value = METRIC_CALCULATIONS[name](activity, *args)
+            else:
+                value = calculation()
+            with self._lock:
+                self._results[key] = value
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+        return value
+
+    def precompute(
+        self,
+        calls: typing.Iterable[typing.Tuple[typing.Union[str, Activity], str, tuple]],
+        max_workers: int = DEFAULT_PARALLEL_JOBS,
+    ):
+        """Computes calculations in background threads, their results are
+        then fetched from the cache.
+
+        :param calls: Activity, calculation name and arguments of each
+        calculation.
+        :type calls: Iterable
+
+        :param max_workers: Maximum number of calculations computed
+        concurrently.
+        :type max_workers: int
+        """
+
+        def compute(activity, name, args):
+            try:
+                self.result(activity, name, args)
+            except Exception as e:
+                # Computed again, and the error reported, when requested
+                log(f"Error precomputing the {name} metric, {e}", info=False)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, max_workers),
+                    thread_name_prefix="cplus_metrics",
+                )
+            for activity, name, args in calls:
+                self._futures.append(
+                    self._executor.submit(compute, activity, name, tuple(args))
+                )
+
+    def close(self):
+        """Cancels the calculations that have not started, waits for the
+        running ones and clears the cache.
+        """
+        with self._lock:
+            executor = self._executor
+            futures = self._futures
+            self._executor = None
+            self._futures = []
+
+        for future in futures:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        with self._lock:
+            self._results = {}
+
+
+_metric_result_cache: typing.Optional[MetricResultCache] = None
+_metric_result_cache_users = 0
+_metric_result_cache_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def metric_result_cache_scope() -> typing.Iterator[MetricResultCache]:
+    """Context in which the results of metric calculations are cached.
+
+    Reports generated at the same time share the cache, which is cleared
+    once the last of them leaves the context so that changes to the
+    activities are taken into account by subsequent reports.
+
+    :returns: The metric result cache.
+    :rtype: MetricResultCache
+    """
+    global _metric_result_cache, _metric_result_cache_users
+
+    with _metric_result_cache_lock:
+        if _metric_result_cache is None:
+            _metric_result_cache = MetricResultCache()
+        _metric_result_cache_users += 1
+        cache = _metric_result_cache
+
+    try:
+        yield cache
+    finally:
+        with _metric_result_cache_lock:
+            _metric_result_cache_users -= 1
+            if _metric_result_cache_users == 0:
+                _metric_result_cache = None
+            else:
+                cache = None
+
+        if cache is not None:
+            cache.close()
+
+
+def active_metric_result_cache() -> typing.Optional[MetricResultCache]:
+    """Returns the metric result cache of the reports being generated.
+
+    :returns: The metric result cache or None if no report is
+    being generated.
+    :rtype: MetricResultCache
+    """
+    with _metric_result_cache_lock:
+        return _metric_result_cache
+
+
+def activity_metric_result(
+    name: str, activity: typing.Union[str, Activity], *args
+) -> typing.Any:
+    """Computes a metric calculation of an activity, the result is
+    fetched from the metric result cache if reports are being generated.
+
+    :param name: Name of the calculation, see `METRIC_CALCULATIONS`.
+    :type name: str
+
+    :param activity: Activity or activity ID.
+    :type activity: Union[str, Activity]
+
+    :returns: Result of the calculation.
+    :rtype: typing.Any
+    """
+    cache = active_metric_result_cache()
+    if cache is None:
+        return METRIC_CALCULATIONS[name](activity, *args)
+
+    return cache.result(activity, name, args)
+
+
+def metric_function_calls(
+    expression: typing.Union[str, QgsExpression],
+) -> typing.List[typing.Tuple[str, tuple]]:
+    """Gets the calls to expensive metric functions in an expression whose
+    arguments are literal values, so that they can be computed before the
+    expression is evaluated.
+
+    :param expression: Metric expression.
+    :type expression: Union[str, QgsExpression]
+
+    :returns: Function name and arguments of each call.
+    :rtype: list
+    """
+    if not isinstance(expression, QgsExpression):
+        expression = QgsExpression(expression)
+    root_node = expression.rootNode()
+    if expression.hasParserError() or root_node is None:
+        return []
+
+    functions = QgsExpression.Functions()
+    calls = []
+    for node in root_node.nodes():
+        if node.nodeType() != QgsExpressionNode.NodeType.ntFunction:
+            continue
+
+        name = functions[node.fnIndex()].name()
+        if name not in EXPENSIVE_METRIC_CALCULATIONS:
+            continue
+
+        arg_nodes = node.args().list() if node.args() is not None else []
+        if any(
+            arg_node.nodeType() != QgsExpressionNode.NodeType.ntLiteral
+            or not isinstance(arg_node.value(), Number)
+            for arg_node in arg_nodes
+        ):
+            continue
+
+        call = (name, tuple(arg_node.value() for arg_node in arg_nodes))
+        if call not in calls:
+            calls.append(call)
+
+    return calls
+
+
+class MetricExpressionPlan:
+    """Metric expressions parsed and prepared once for a report and then
+    evaluated for each activity.
+
+    Columns of a metric profile usually share their expression across
+    activities, so each distinct expression is only compiled once. The
+    plan also exposes the CPLUS functions used by the expressions so that
+    their calculations can be scheduled before the evaluation.
+    """
+
+    def __init__(self, context: QgsExpressionContext):
+        """
+        :param context: Expression context containing the global, project
+        and metrics scopes respectively. It is owned by the plan whose
+        evaluations update its metrics scope.
+        :type context: QgsExpressionContext
+        """
+        self._context = context
+        self._expressions: typing.Dict[str, typing.Optional[QgsExpression]] = {}
+
+    def add(self, expression_str: str) -> bool:
+        """Parses and prepares an expression, if not yet in the plan.
+
+        :param expression_str: Metric expression.
+        :type expression_str: str
+
+        :returns: True if the expression is valid else False.
+        :rtype: bool
+        """
+        if expression_str not in self._expressions:
+            expression = QgsExpression(expression_str)
+            if expression.hasParserError():
+                log(
+                    f"Error parsing activity metric: "
+                    f"{expression.parserErrorString()}",
+                    info=False,
+                )
+                expression = None
+            else:
+                expression.prepare(self._context)
+            self._expressions[expression_str] = expression
+
+        return self._expressions[expression_str] is not None
+
+    def functions(self, expression_str: str) -> typing.Set[str]:
+        """Returns the names of the CPLUS metric functions referenced by
+        an expression of the plan.
+
+        :param expression_str: Metric expression.
+        :type expression_str: str
+
+        :returns: Names of the metric functions.
+        :rtype: set
+        """
+        if not self.add(expression_str):
+            return set()
+
+        return {
+            name
+            for name in self._expressions[expression_str].referencedFunctions()
+            if name in METRIC_CALCULATIONS
+        }
+
+    def function_calls(
+        self, expression_str: str
+    ) -> typing.List[typing.Tuple[str, tuple]]:
+        """Returns the expensive metric function calls of an expression of
+        the plan that can be computed ahead, see `metric_function_calls`.
+
+        :param expression_str: Metric expression.
+        :type expression_str: str
+
+        :returns: Function name and arguments of each call.
+        :rtype: list
+        """
+        if not self.add(expression_str):
+            return []
+
+        return metric_function_calls(self._expressions[expression_str])
+
+    def evaluate(
+        self,
+        activity_info: ActivityContextInfo,
+        expression_strs: typing.Sequence[str],
+    ) -> typing.List[MetricEvalResult]:
+        """Evaluates expressions for an activity, the metrics scope is
+        updated once for all the expressions.
+
+        :param activity_info: Contains information about an activity whose
+        attribute values will be used to evaluate the expressions.
+        :type activity_info: ActivityContextInfo
+
+        :param expression_strs: Metric expressions, added to the plan if
+        they are not in it.
+        :type expression_strs: list
+
+        :returns: The result of each expression, in the same order.
+        :rtype: list
+        """
+        if not _set_activity_variables(self._context, activity_info):
+            return [MetricEvalResult(False, None) for _ in expression_strs]
+
+        results = []
+        for expression_str in expression_strs:
+            if not self.add(expression_str):
+                results.append(MetricEvalResult(False, None))
+                continue
+
+            results.append(
+                _evaluate_expression(self._expressions[expression_str], self._context)
+            )
+
+        return results
@@ -5,6 +5,8 @@ import os
 import tempfile
 import typing
 
+import numpy as np
+
 from qgis.core import (
     QgsProcessingAlgorithm,
     QgsProcessingParameterString,
@@ -20,6 +22,9 @@ from qgis.core import (
 )
 from qgis import processing
 
+from ..raster.blocks import RasterGrid
+from ..raster.pipeline import BlockPipeline, FunctionNode, RasterSink
+from ..raster.stack import LayerStackNode
 from ...conf import settings_manager
 from ...utils import tr, log
 from ...models.base import NcsPathway, NcsPathwayType
@@ -35,26 +40,6 @@ def _tmp_tif() -> str:
     return f.name
 
 
-def _calc(
-    expr: str,
-    a: QgsRasterLayer,
-    out_path: str,
-    b: typing.Optional[QgsRasterLayer] = None,
-    extent: typing.Optional[QgsRectangle] = None,
-) -> str:
-    """Thin wrapper around gdal:rastercalculator using refs a@1 and optional b@1."""
-    params = {
-        "EXPRESSION": expr,
-        "LAYERS": [a] if b is None else [a, b],
-        "CRS": a.crs().authid(),
-        "EXTENT": extent.toString() if extent else a.extent().toString(),
-        "OUTPUT": out_path,
-        "CELLSIZE": a.rasterUnitsPerPixelX(),  # assume square pixels post-warp
-    }
-    processing.run("gdal:rastercalculator", params)
-    return out_path
-
-
 def _warp_clip(
     src: str,
     crs: QgsCoordinateReferenceSystem,
@@ -138,71 +123,135 @@ def _materialize(
     return lyr
 
 
-def _calcN(
-    expr: str,
-    layers: typing.List[QgsRasterLayer],
-    out_path: str,
-    extent: QgsRectangle,
-    crs: QgsCoordinateReferenceSystem,
-    pixel_size: float,
-) -> str:
+# Block-wise evaluation of the decision tree. The values of the aligned
+# pathways are read once per window as a (pathways, rows, columns) stack
+# and NoData values are NaN. As in the raster calculator, a NoData value
+# in any input of an operation results in NoData.
+
+
+def _group_sum(
+    values: np.ndarray, indices: typing.List[int]
+) -> typing.Optional[np.ndarray]:
     """
-    N-ary raster calculator using a@1, b@1, c@1... variable refs.
-    Layers must already be aligned (our _materialize does that).
+    Sum the stacked pathways in the group, preserving magnitude.
+    If only one pathway, just return it.
     """
-    if not layers:
-        raise QgsProcessingException("No layers provided to raster calculator.")
-    params = {
-        "EXPRESSION": expr,
-        "LAYERS": layers,
-        "CRS": crs.authid(),
-        "EXTENT": extent.toString(),
-        "CELLSIZE": pixel_size,
-        "OUTPUT": out_path,
-    }
-    processing.run("gdal:rastercalculator", params)
-    return out_path
-
-
-def _mosaic_sum(
-    layers: typing.List[QgsRasterLayer],
-    crs: QgsCoordinateReferenceSystem,
-    extent: QgsRectangle,
-    pixel: float,
-) -> typing.Optional[QgsRasterLayer]:
+    if not indices:
+        return None
+    if len(indices) == 1:
+        return values[indices[0]]
+    return values[indices].sum(axis=0)
+
+
+def _presence(values: np.ndarray) -> np.ndarray:
+    """
+    1 where values > 0, else 0
     """
-    Sum all input rasters, preserving magnitude (Float32).
-    If only one layer, just return it.
+    with np.errstate(invalid="ignore"):
+        presence = (values > 0).astype(np.float64)
+    presence[np.isnan(values)] = np.nan
+    return presence
+
+
+def _minus(
+    mask: typing.Optional[np.ndarray], by: typing.Optional[np.ndarray]
+) -> typing.Optional[np.ndarray]:
+    """Subtract 'by' mask from 'mask' (1 - (b>0)),
+    preserving magnitude of 'mask'.
     """
-    if not layers:
+    if mask is None:
         return None
-    if len(layers) == 1:
-        return layers[0]
+    if by is None:
+        return mask
+    return mask * (1 - _presence(by))
 
-    # Build "a@1 + b@1 + c@1 + ..."
-    letters = "abcdefghijklmnopqrstuvwxyz"
-    if len(layers) > len(letters):
-        raise QgsProcessingException("Too many layers to sum at once.")
-    expr = " + ".join([f"{letters[i]}@1" for i in range(len(layers))])
 
-    out_path = _tmp_tif()
-    _calcN(expr, layers, out_path, extent, crs, pixel)
-    lyr = QgsRasterLayer(out_path, "sum")
-    return lyr if lyr.isValid() else None
+def _sum_layers(*layers) -> typing.Optional[np.ndarray]:
+    """Sum the given arrays, ignoring missing ones."""
+    arrays = [values for values in layers if values is not None]
+    if not arrays:
+        return None
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.sum(arrays, axis=0)
 
 
-def _presence_mask(
-    layer: QgsRasterLayer,
-    extent: QgsRectangle,
-    crs: QgsCoordinateReferenceSystem,
-    pixel: float,
-) -> QgsRasterLayer:
+def evaluate_decision_tree(
+    values: np.ndarray,
+    groups: typing.Dict[str, typing.List[int]],
+    selected_action: int,
+) -> typing.Optional[np.ndarray]:
     """
-    1 where layer > 0, else 0
+    Apply the NCS enforcement order to a window of stacked pathways and
+    return the values of the selected action.
+
+    :param values: Pathway values with the (pathways, rows, columns)
+    shape, NoData values are NaN.
+    :type values: np.ndarray
+
+    :param groups: Indices of the pathways in each biome (C, W, G),
+    action x biome (e.g. P_c, M_w, R_o) and forest restore
+    (R_for, R_non) group.
+    :type groups: dict
+
+    :param selected_action: Index of the action in
+    `ApplyNcsDecisionTreeAlgorithm.CHOICES_ACTION`.
+    :type selected_action: int
+
+    :returns: Values of the selected action or None if no pathway
+    contributes to it.
+    :rtype: np.ndarray
     """
-    out_path = _tmp_tif()
-    _calcN("(a@1) > 0", [layer], out_path, extent, crs, pixel)
-    return QgsRasterLayer(out_path, "presence")
+
+    def group(name):
+        return _group_sum(values, groups.get(name, []))
+
+    # Presence masks C/W/G from the biome groups
+    C_sum, W_sum, G_sum = group("C"), group("W"), group("G")
+    C = _presence(C_sum) if C_sum is not None else None
+    W = _presence(W_sum) if W_sum is not None else None
+    G = _presence(G_sum) if G_sum is not None else None
+
+    P_c, P_w, P_o = group("P_c"), group("P_w"), group("P_o")
+    M_c, M_w, M_o = group("M_c"), group("M_w"), group("M_o")
+    R_c, R_w, R_o = group("R_c"), group("R_w"), group("R_o")
+    R_for = group("R_for")
+
+    # ---------- ENFORCEMENT ORDER ----------
+    # 1) Cropland supersedes others:
+    #    - keep cropland actions (P_c/M_c/R_c)
+    #    - remove NON-cropland actions wherever C == 1
+    P_after_crop = _sum_layers(P_c, _minus(P_w, C), _minus(P_o, C))
+    M_after_crop = _sum_layers(M_c, _minus(M_w, C), _minus(M_o, C))
+    R_after_crop = _sum_layers(R_c, _minus(R_w, C), _minus(R_o, C))
+
+    # 2) Wetlands supersede remaining others, but NOT croplands.
+    #    From post-crop, remove cropland then wetlands.
+    P_after_wet = _sum_layers(P_c, P_w, _minus(_minus(P_after_crop, P_c), W))
+    M_after_wet = _sum_layers(M_c, M_w, _minus(_minus(M_after_crop, M_c), W))
+    R_after_wet = _sum_layers(R_c, R_w, _minus(_minus(R_after_crop, R_c), W))
+
+    # 3) Biodiversity safeguard (forest restore cannot replace native
+    #    grass/savanna/shrub), remove cropland and wetlands first
+    R_for_after_cropwet = _minus(_minus(R_for, C), W)
+
+    # Apply the G mask to that slice (removing any forest-restore on native G/S/S)
+    R_for_after = _minus(R_for_after_cropwet, G)
+
+    # Recombine: takes R_after_wet, removes the pre-G forest slice
+    # and adds the G-filtered slice back
+    R_after_bio = _sum_layers(_minus(R_after_wet, R_for_after_cropwet), R_for_after)
+
+    # 4) Action hierarchy: Protect > Manage > Restore
+    P_final = P_after_wet
+    if selected_action == 0:
+        return P_final
+
+    M_final = _minus(M_after_wet, P_final)
+    if selected_action == 1:
+        return M_final
+
+    return _minus(_minus(R_after_bio, P_final), M_final)
 
 
 # processing algo
@@ -303,14 +352,9 @@ class ApplyNcsDecisionTreeAlgorithm(QgsProcessingAlgorithm):
                 "No valid pathways provided for decision tree."
             )
 
-        # Materialize + group masks
-        cropland, wetlands, grass_sav_shrub = [], [], []
-
-        P_crops, M_crops, R_crops = [], [], []
-        P_wets, M_wets, R_wets = [], [], []
-        P_other, M_other, R_other = [], [], []
-
-        R_forest, R_nonforest = [], []  # for biodiversity safeguard
+        # Materialize + group the pathways by their position in the stack
+        paths: typing.List[str] = []
+        groups: typing.Dict[str, typing.List[int]] = {}
 
         for p in pathways:
             if feedback.isCanceled():
@@ -321,6 +365,9 @@ class ApplyNcsDecisionTreeAlgorithm(QgsProcessingAlgorithm):
                 log(f"DecisionTree: skip '{p.name}' (no raster)")
                 continue
 
+            index = len(paths)
+            paths.append(lyr.source())
+
             # Biome grouping (prefer metadata; fallback on names)
             biome = (getattr(p, "biome", None) or getattr(p, "name", "")).lower()
             is_crop = "crop" in biome
@@ -328,144 +375,61 @@ class ApplyNcsDecisionTreeAlgorithm(QgsProcessingAlgorithm):
             is_grass_sav_shrub = any(k in biome for k in ("grass", "savanna", "shrub"))
             is_forest = "forest" in biome
 
-            # populate biome lists (used to build presence masks C/W/G)
+            # populate biome groups (used to build presence masks C/W/G)
             if is_crop:
-                cropland.append(lyr)
+                groups.setdefault("C", []).append(index)
             elif is_wet:
-                wetlands.append(lyr)
+                groups.setdefault("W", []).append(index)
             elif is_grass_sav_shrub:
-                grass_sav_shrub.append(lyr)
+                groups.setdefault("G", []).append(index)
 
             ptype = getattr(p, "pathway_type", None)
+            biome_suffix = "c" if is_crop else "w" if is_wet else "o"
 
             # action x biome grouping (keeps magnitudes)
             if ptype == NcsPathwayType.PROTECT:
-                (P_crops if is_crop else P_wets if is_wet else P_other).append(lyr)
+                groups.setdefault(f"P_{biome_suffix}", []).append(index)
             elif ptype == NcsPathwayType.MANAGE:
-                (M_crops if is_crop else M_wets if is_wet else M_other).append(lyr)
+                groups.setdefault(f"M_{biome_suffix}", []).append(index)
             elif ptype == NcsPathwayType.RESTORE:
-                (R_crops if is_crop else R_wets if is_wet else R_other).append(lyr)
+                groups.setdefault(f"R_{biome_suffix}", []).append(index)
                 # track forest restore specifically (for biodiversity rule)
-                (R_forest if is_forest else R_nonforest).append(lyr)
-
-        # Build presence masks C/W/G from populated biome lists
-        C_sum = _mosaic_sum(cropland, tgt_crs, extent, pixel)
-        W_sum = _mosaic_sum(wetlands, tgt_crs, extent, pixel)
-        G_sum = _mosaic_sum(grass_sav_shrub, tgt_crs, extent, pixel)
-
-        C = _presence_mask(C_sum, extent, tgt_crs, pixel) if C_sum else None
-        W = _presence_mask(W_sum, extent, tgt_crs, pixel) if W_sum else None
-        G = _presence_mask(G_sum, extent, tgt_crs, pixel) if G_sum else None
-
-        P_c = _mosaic_sum(P_crops, tgt_crs, extent, pixel)
-        P_w = _mosaic_sum(P_wets, tgt_crs, extent, pixel)
-        P_o = _mosaic_sum(P_other, tgt_crs, extent, pixel)
-
-        M_c = _mosaic_sum(M_crops, tgt_crs, extent, pixel)
-        M_w = _mosaic_sum(M_wets, tgt_crs, extent, pixel)
-        M_o = _mosaic_sum(M_other, tgt_crs, extent, pixel)
-
-        R_c = _mosaic_sum(R_crops, tgt_crs, extent, pixel)
-        R_w = _mosaic_sum(R_wets, tgt_crs, extent, pixel)
-        R_o = _mosaic_sum(R_other, tgt_crs, extent, pixel)
-
-        R_for = _mosaic_sum(R_forest, tgt_crs, extent, pixel)
-        R_non = _mosaic_sum(R_nonforest, tgt_crs, extent, pixel)
+                groups.setdefault("R_for" if is_forest else "R_non", []).append(index)
 
         # Short-circuit if nothing
-        if not any([P_c, P_w, P_o, M_c, M_w, M_o, R_c, R_w, R_o]):
+        action_groups = [f"{action}_{biome}" for action in "PMR" for biome in "cwo"]
+        if not any(groups.get(name) for name in action_groups):
             raise QgsProcessingException(
                 "No action masks could be built (check inputs and pathways)."
             )
 
-        # ---------- ENFORCEMENT ORDER ----------
-        # Helpers
-        def _minus(
-            mask: QgsRasterLayer, by: typing.Optional[QgsRasterLayer]
-        ) -> typing.Optional[QgsRasterLayer]:
-            """Subtract 'by' mask from 'mask' (1 - (b>0)),
-            preserving magnitude of 'mask'.
-            """
-            if mask is None:
-                return None
-            if by is None:
-                return mask
-            out = _tmp_tif()
-            _calc("(a@1) * (1 - (b@1 > 0))", mask, out, b=by, extent=extent)
-            return QgsRasterLayer(out, "tmp")
-
-        # Helper to sum a few aligned rasters
-        def _sum_layers(*layers):
-            L = [lyr for lyr in layers if lyr is not None]
-            return _mosaic_sum(L, tgt_crs, extent, pixel) if L else None
-
-        # 1) Cropland supersedes others:
-        #    - keep cropland actions (P_c/M_c/R_c)
-        #    - remove NON-cropland actions wherever C == 1
-        P_after_crop = _sum_layers(P_c, _minus(P_w, C), _minus(P_o, C))
-        M_after_crop = _sum_layers(M_c, _minus(M_w, C), _minus(M_o, C))
-        R_after_crop = _sum_layers(R_c, _minus(R_w, C), _minus(R_o, C))
-
-        # 2) Wetlands supersede remaining others, but NOT croplands
-        P_after_wet = _sum_layers(
-            P_c,  # keep cropland
-            P_w,  # keep wetlands
-            _minus(
-                _minus(P_after_crop, P_c), W
-            ),  # from post-crop, remove cropland then wetlands
-        )
-
-        M_after_wet = _sum_layers(M_c, M_w, _minus(_minus(M_after_crop, M_c), W))
-
-        R_after_wet = _sum_layers(R_c, R_w, _minus(_minus(R_after_crop, R_c), W))
-
-        # 3) Biodiversity safeguard (forest restore cannot replace native grass/savanna/shrub)
-        R_for_after_cropwet = _sum_layers(_minus(R_for, C), None)  # remove cropland
-        R_for_after_cropwet = (
-            _minus(R_for_after_cropwet, W) if R_for_after_cropwet else None
-        )
-
-        # Apply the G mask to that slice (removing any forest-restore on native G/S/S)
-        R_for_after = _minus(R_for_after_cropwet, G) if R_for_after_cropwet else None
-
-        # Recombine: takes R_after_wet, removes the pre-G forest slice
-        # and adds the G-filtered slice back
-        R_after_bio = _sum_layers(_minus(R_after_wet, R_for_after_cropwet), R_for_after)
-
-        # 4) Action hierarchy: Protect > Manage > Restore
-        P_final = P_after_wet
-        M_final = _minus(M_after_wet, P_final) if M_after_wet else None
-        R_tmp = _minus(R_after_bio, P_final) if R_after_bio else None
-        R_final = _minus(R_tmp, M_final) if (R_tmp and M_final) else R_tmp
-
-        # Select the one action to output
-        if sel_idx == 0:
-            selected_layer = P_final
-        elif sel_idx == 1:
-            selected_layer = M_final
-        else:
-            selected_layer = R_final
-
-        if selected_layer is None:
+        # Whether an action has data only depends on the populated groups
+        if (
+            evaluate_decision_tree(np.zeros((len(paths), 1, 1)), groups, sel_idx)
+            is None
+        ):
             raise QgsProcessingException(
                 f"No data available for selected action: {selected_name}"
             )
 
+        grid = RasterGrid.from_path(paths[0], nodata=float(nodata))
+        if grid is None:
+            raise QgsProcessingException("Unable to define the decision tree grid.")
+
         # Single output path
         out_path = self.parameterAsOutputLayer(params, self.O_SELECTED, context)
 
-        # Save the selected mask (Byte, with NoData)
-        processing.run(
-            "gdal:translate",
-            {
-                "INPUT": selected_layer,
-                "TARGET_CRS": tgt_crs,
-                "NODATA": nodata,
-                "DATA_TYPE": 6,
-                "COPY_SUBDATASETS": False,
-                "OUTPUT": out_path,
-            },
+        # The enforcement order is applied window by window on the stacked
+        # pathways and only the selected mask (Float32, with NoData) is
+        # written.
+        selected_node = FunctionNode(
+            lambda values: evaluate_decision_tree(values, groups, sel_idx),
+            [LayerStackNode(paths)],
+            name=selected_name,
         )
+        pipeline = BlockPipeline(grid, feedback=feedback)
+        if not pipeline.run([RasterSink(selected_node, out_path, nodata=nodata)]):
+            raise QgsProcessingException("Decision tree processing was cancelled.")
 
         log(f"DecisionTree: wrote '{selected_name}' mask to {out_path}")
         return {self.O_SELECTED: out_path}
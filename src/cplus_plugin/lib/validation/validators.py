@@ -28,6 +28,7 @@ from .configs import (
 )
 from .feedback import ValidationFeedback
 from ...models.base import LayerModelComponent, ModelComponentType, NcsPathway
+from ...lib.raster.statistics import get_raster_statistics
 from ...models.validation import (
     RuleConfiguration,
     RuleInfo,
@@ -1096,18 +1097,27 @@ class NormalizedValidator(BaseRuleValidator):
                         invalid_model_components.append(model_component.name)
                         continue
 
-                    raster_provider = layer.dataProvider()
-                    raster_stats = raster_provider.bandStatistics(
-                        1, QgsRasterBandStats.Stats.Min | QgsRasterBandStats.Stats.Max
-                    )
+                    # Saved statistics are used for unchanged file layers
+                    raster_stats = get_raster_statistics(layer.source())
+                    if raster_stats is not None:
+                        min_value = raster_stats.minimum
+                        max_value = raster_stats.maximum
+                    else:
+                        raster_provider = layer.dataProvider()
+                        provider_stats = raster_provider.bandStatistics(
+                            1,
+                            QgsRasterBandStats.Stats.Min | QgsRasterBandStats.Stats.Max,
+                        )
+                        min_value = provider_stats.minimumValue
+                        max_value = provider_stats.maximumValue
+
+                    if min_value is None or max_value is None:
+                        continue
 
-                    if (
-                        raster_stats.minimumValue < 0.0
-                        or raster_stats.maximumValue > 1.0
-                    ):
+                    if min_value < 0.0 or max_value > 1.0:
                         outside_range_model_components[model_component.name] = (
-                            raster_stats.minimumValue,
-                            raster_stats.maximumValue,
+                            min_value,
+                            max_value,
                         )
 
             progress += progress_increment
@@ -3,7 +3,9 @@
  Plugin tasks related to the scenario analysis
 
 """
+import concurrent.futures
 import datetime
+import functools
 import json
 import math
 import os
@@ -12,31 +14,69 @@ import traceback
 import typing
 from pathlib import Path
 
+import numpy as np
+
 from qgis import processing
 from qgis.PyQt import QtCore
 from qgis.core import (
     Qgis,
     QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
     QgsProcessing,
     QgsProcessingContext,
     QgsProcessingFeedback,
+    QgsProcessingUtils,
     QgsRasterLayer,
     QgsRectangle,
     QgsVectorLayer,
     QgsWkbTypes,
-    QgsRasterBandStats,
-    QgsProcessingFeatureSourceDefinition,
-    QgsFeatureRequest,
+    QgsProject,
 )
 from qgis.core import QgsTask
 
 from .conf import settings_manager, Settings
-from .definitions.constants import NO_DATA_VALUE
+from .definitions.constants import CARBON_PATHS_ATTRIBUTE, NO_DATA_VALUE
 from .definitions.defaults import (
     SCENARIO_OUTPUT_FILE_NAME,
     DEFAULT_CRS_ID,
+    DEFAULT_MEMORY_BUDGET_MB,
+    DEFAULT_PARALLEL_JOBS,
 )
 from .lib.constant_raster import constant_raster_registry
+from .lib.profiling import ScenarioProfiler, raster_size
+from .lib.raster.area import PixelAreaReducer, pixel_row_areas, write_area_sidecar
+from .lib.raster.blocks import RasterGrid, highest_position, nan_sum, rescale
+from .lib.raster.cache import DEFAULT_CACHE_SIZE_MB, IntermediateCache
+from .lib.raster.connectivity import (
+    LABELLING_ARRAYS_PER_PIXEL,
+    label_components,
+    write_connectivity_layer,
+    write_sieved_layer,
+)
+from .lib.raster.memory import (
+    ARRAYS_SHARE,
+    block_size_for_budget,
+    budget_bytes,
+    fits_in_budget,
+    gdal_cache_limit,
+)
+from .lib.raster.output import (
+    smallest_integer_type,
+    value_fits,
+    write_cloud_optimized,
+)
+from .lib.raster.stack import LayerStackNode, WeightedSumNode
+from .lib.raster.statistics import get_raster_statistics
+from .lib.raster.warp import resampling_algorithm, warp_to_grid
+from .lib.raster.pipeline import (
+    BlockNode,
+    BlockPipeline,
+    FunctionNode,
+    MinMaxReducer,
+    RasterSink,
+    RasterSourceNode,
+    VectorMaskNode,
+)
 from .models.base import ScenarioResult, Activity, NcsPathway, NcsPathwayType
 from .utils import (
     align_rasters,
@@ -46,10 +86,25 @@ from .utils import (
     FileUtils,
     CustomJsonEncoder,
     todict,
-    normalize_raster,
+    get_plugin_version,
 )
 
 
+def profiled_stage(function):
+    """Records the measurements of a scenario analysis stage in the
+    profiler of the task, see `ScenarioProfiler`.
+    """
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        with self.profiler.measure(function.__name__) as record:
+            result = function(self, *args, **kwargs)
+            record.success = result is not False
+        return result
+
+    return wrapper
+
+
 class ScenarioAnalysisTask(QgsTask):
     """Prepares and runs the scenario analysis"""
 
@@ -101,6 +156,22 @@ class ScenarioAnalysisTask(QgsTask):
             Settings.NCS_NO_DATA_VALUE, NO_DATA_VALUE
         )
 
+        self.intermediate_cache = None
+
+        # Grid the analysis inputs are aligned to
+        self.analysis_grid = None
+
+        # Measurements of the analysis stages and processing algorithms
+        self.profiler = ScenarioProfiler()
+
+        # Paths of the priority layers warped to the analysis grid
+        # with the priority layer UUID as the key.
+        self.priority_layer_paths = {}
+
+        # Cluster labels of the sieved activities that are reused
+        # when creating the connectivity layers.
+        self.activity_components = {}
+
     def get_settings_value(self, name: str, default=None, setting_type=None):
         """Gets value of the setting with the passed name.
 
@@ -194,6 +265,315 @@ class ScenarioAnalysisTask(QgsTask):
         ):
             return reference_layer
 
+    def create_intermediate_cache(self) -> typing.Optional[IntermediateCache]:
+        """Creates the cache of intermediate layers if it has been enabled
+        in the settings. The cache is stored under the base directory.
+
+        :returns: The intermediate layers cache or None if disabled.
+        :rtype: IntermediateCache
+        """
+        cache_enabled = self.get_settings_value(
+            Settings.INTERMEDIATE_CACHE_ENABLED, default=False, setting_type=bool
+        )
+        base_dir = self.get_settings_value(Settings.BASE_DIR, default="")
+        if not cache_enabled or not base_dir or not os.path.exists(base_dir):
+            return None
+
+        cache_size = self.get_settings_value(
+            Settings.INTERMEDIATE_CACHE_SIZE,
+            default=DEFAULT_CACHE_SIZE_MB,
+            setting_type=float,
+        )
+        try:
+            return IntermediateCache(
+                os.path.join(base_dir, "cache", "intermediate"), cache_size
+            )
+        except OSError as e:
+            self.log_message(f"Unable to create the intermediate layers cache, {e}")
+
+        return None
+
+    def cache_key(
+        self,
+        step: str,
+        input_paths: typing.List[str],
+        parameters: dict = None,
+    ) -> typing.Optional[str]:
+        """Gets the key of a processing step in the intermediate layers cache.
+
+        :param step: Name of the processing step
+        :type step: str
+
+        :param input_paths: Paths of the step input layers
+        :type input_paths: list
+
+        :param parameters: Parameters of the step that affect its output
+        :type parameters: dict
+
+        :returns: The key of the step or None if the cache is disabled.
+        :rtype: str
+        """
+        if self.intermediate_cache is None:
+            return None
+
+        return self.intermediate_cache.key(step, input_paths, parameters)
+
+    def restore_cached_output(
+        self, key: typing.Optional[str], output_path: str
+    ) -> bool:
+        """Restores the cached output of a processing step.
+
+        :param key: Key of the step, see `cache_key`
+        :type key: str
+
+        :param output_path: Path where the output layer will be restored
+        :type output_path: str
+
+        :returns: True if the output was found and restored else False.
+        :rtype: bool
+        """
+        if key is None or self.intermediate_cache is None:
+            return False
+
+        restored = self.intermediate_cache.restore(key, output_path)
+        if restored:
+            self.log_message(f"Reusing cached layer for {output_path} \n")
+
+        return restored
+
+    def store_cached_output(self, key: typing.Optional[str], output_path: str):
+        """Adds the output of a processing step to the cache.
+
+        :param key: Key of the step, see `cache_key`
+        :type key: str
+
+        :param output_path: Path of the step output layer
+        :type output_path: str
+        """
+        if key is None or self.intermediate_cache is None:
+            return
+
+        self.intermediate_cache.store(key, output_path)
+
+    def get_parallel_jobs_count(self) -> int:
+        """Gets the maximum number of jobs that are run concurrently
+        when processing activities or pathways.
+
+        :returns: Number of worker threads, at least one.
+        :rtype: int
+        """
+        jobs_count = self.get_settings_value(
+            Settings.PARALLEL_JOBS, default=DEFAULT_PARALLEL_JOBS, setting_type=int
+        )
+        try:
+            return max(1, int(jobs_count))
+        except (TypeError, ValueError):
+            return DEFAULT_PARALLEL_JOBS
+
+    def get_memory_budget(self) -> int:
+        """Gets the memory budget of the raster processing.
+
+        :returns: Memory budget in bytes.
+        :rtype: int
+        """
+        return budget_bytes(
+            self.get_settings_value(
+                Settings.MEMORY_BUDGET,
+                default=DEFAULT_MEMORY_BUDGET_MB,
+                setting_type=float,
+            )
+        )
+
+    def get_arrays_memory_budget(self) -> int:
+        """Gets the share of the memory budget used by the arrays of the
+        windows processed at once.
+
+        :returns: Memory budget of the arrays in bytes.
+        :rtype: int
+        """
+        return int(self.get_memory_budget() * ARRAYS_SHARE)
+
+    def get_component_tile_size(self) -> int:
+        """Gets the size of the tiles used when labelling the clusters of
+        the activities, the budget is shared by the concurrent jobs.
+
+        :returns: Edge length of the tiles in pixels.
+        :rtype: int
+        """
+        return block_size_for_budget(
+            self.get_arrays_memory_budget() // self.get_parallel_jobs_count(),
+            LABELLING_ARRAYS_PER_PIXEL,
+        )
+
+    def cloud_optimize_output(self, path: str, categorical: bool = False) -> bool:
+        """Rewrites a scenario output as a cloud-optimized GeoTIFF with
+        internal overviews, the output is left unchanged if it fails.
+
+        :param path: Path of the output raster
+        :type path: str
+
+        :param categorical: Whether the output values are categories
+        :type categorical: bool
+
+        :returns: True if the output was rewritten else False.
+        :rtype: bool
+        """
+        if not path or not os.path.exists(path):
+            return False
+
+        return write_cloud_optimized(path, categorical=categorical)
+
+    def get_stack_grid(self, reference_path: str) -> typing.Optional[RasterGrid]:
+        """Gets the grid on which layer stacks are evaluated, the analysis
+        grid or the grid of the reference layer when the stage is run
+        without it.
+
+        :param reference_path: Path of the layer defining the grid when
+        there is no analysis grid
+        :type reference_path: str
+
+        :returns: The grid or None if it could not be defined.
+        :rtype: RasterGrid
+        """
+        if self.analysis_grid is not None:
+            return self.analysis_grid
+
+        if not reference_path:
+            return None
+
+        return RasterGrid.from_path(reference_path, nodata=float(self.no_data_value))
+
+    def run_layer_stack_outputs(
+        self,
+        grid: RasterGrid,
+        outputs: typing.List[typing.Tuple[BlockNode, str]],
+        cloud_optimized: bool = True,
+        feedback: QgsProcessingFeedback = None,
+    ) -> bool:
+        """Writes the values of layer stack nodes, such as weighted sums,
+        in a single pass over the grid.
+
+        :param grid: Grid of the outputs
+        :type grid: RasterGrid
+
+        :param outputs: Nodes and the paths their values are written to
+        :type outputs: list
+
+        :param cloud_optimized: Whether the outputs are written as
+        cloud-optimized GeoTIFFs
+        :type cloud_optimized: bool
+
+        :param feedback: Feedback for the progress of the pass
+        :type feedback: QgsProcessingFeedback
+
+        :returns: True if the outputs were written else False.
+        :rtype: bool
+        """
+        if feedback is None:
+            feedback = QgsProcessingFeedback()
+            feedback.progressChanged.connect(self.update_progress)
+
+        pipeline = BlockPipeline(
+            grid,
+            feedback=feedback,
+            is_cancelled=lambda: self.processing_cancelled,
+            memory_budget=self.get_arrays_memory_budget(),
+        )
+        sinks = [
+            RasterSink(
+                node,
+                output_path,
+                nodata=float(self.no_data_value),
+                cloud_optimized=cloud_optimized,
+            )
+            for node, output_path in outputs
+        ]
+
+        return pipeline.run(sinks)
+
+    def run_parallel_jobs(
+        self,
+        items: typing.Sequence,
+        job: typing.Callable[
+            [typing.Any, QgsProcessingContext, QgsProcessingFeedback], bool
+        ],
+    ) -> bool:
+        """Runs a job for each of the items using a bounded pool of
+        worker threads.
+
+        The processing algorithms and GDAL release the GIL so independent
+        items, e.g. activities or pathways, are processed concurrently.
+        Each job gets its own processing context and feedback as these are
+        not thread safe, and must only update its own item. Output paths
+        should be defined before calling this function so that they do not
+        depend on the order in which the jobs complete.
+
+        :param items: Items to be processed
+        :type items: list
+
+        :param job: Callable that processes an item using the given
+        context and feedback and returns True if it was successful.
+        :type job: Callable
+
+        :returns: True if all the jobs were successful, False if a job
+        failed or the processing was cancelled. Exceptions raised by the
+        jobs are propagated after the remaining jobs have been cancelled.
+        :rtype: bool
+        """
+        if len(items) == 0:
+            return True
+
+        def run_job(item, feedback):
+            if self.processing_cancelled or feedback.isCanceled():
+                return False
+            return job(item, QgsProcessingContext(), feedback)
+
+        max_workers = min(self.get_parallel_jobs_count(), len(items))
+        completed = 0
+        success = True
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            for item in items:
+                feedback = QgsProcessingFeedback()
+                pending[executor.submit(run_job, item, feedback)] = feedback
+
+            try:
+                while pending:
+                    done, _ = concurrent.futures.wait(
+                        pending,
+                        timeout=0.5,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                    for future in done:
+                        pending.pop(future)
+                        completed += 1
+                        if not future.result():
+                            success = False
+
+                    if self.processing_cancelled or self.isCanceled():
+                        success = False
+
+                    if not success:
+                        break
+
+                    self.update_progress(100 * completed / len(items))
+            finally:
+                # Stop the running jobs and skip the queued ones
+                for future, feedback in pending.items():
+                    future.cancel()
+                    feedback.cancel()
+
+        return success
+
+    def remove_activity_components(self):
+        """Removes the cluster labels of the sieved activities that were
+        not used when creating the connectivity layers.
+        """
+        for components in self.activity_components.values():
+            components.remove()
+        self.activity_components = {}
+
     def cancel_task(self, exception=None):
         """Cancel current task.
 
@@ -245,13 +625,23 @@ class ScenarioAnalysisTask(QgsTask):
         self.set_status_message(tr(message))
         self.log_message(message)
 
+    @profiled_stage
     def run(self):
-        """Runs the main scenario analysis task operations"""
+        """Runs the main scenario analysis task operations, the GDAL block
+        cache is bounded by the memory budget while running.
+        """
+        with gdal_cache_limit(self.get_memory_budget()):
+            return self.run_analysis()
+
+    def run_analysis(self):
+        """Runs the scenario analysis stages."""
 
         self.scenario_directory = self.get_scenario_directory()
 
         FileUtils.create_new_dir(self.scenario_directory)
 
+        self.intermediate_cache = self.create_intermediate_cache()
+
         selected_pathway = None
         pathway_found = False
 
@@ -302,56 +692,57 @@ class ScenarioAnalysisTask(QgsTask):
         self.log_message(
             "Snapped area of interest extent " f"{snapped_extent.asWktPolygon()} \n"
         )
-        # Run pathways layers snapping using a specified reference layer
-        snapping_enabled = self.get_settings_value(
-            Settings.SNAPPING_ENABLED, default=False, setting_type=bool
-        )
-        reference_layer = self.get_reference_layer()
-        if snapping_enabled and reference_layer:
-            self.snap_analysis_data(
-                self.analysis_activities,
-                extent_string,
-            )
-
-        # Clip to StudyArea
-        if self.clip_to_studyarea and os.path.exists(self.studyarea_path):
-            # Reproject the study area to the EPSG:4326
-            # The validate_vector_layer is successful when the layer is in EPSG:4326
-            studyarea_path = self.reproject_layer(
-                studyarea_path,
-                target_crs=QgsCoordinateReferenceSystem("EPSG:4326"),
-                is_raster=False,
-            )
-
-            # Validate layer geometries
-            validated_path = self.validate_vector_layer(studyarea_path)
-            if not validated_path:
-                self.log_message(f"Invalid studyarea layer: {studyarea_path} ")
-            self.clip_analysis_data(self.studyarea_path)
-
-        # Reproject the pathways and priority layers to the
-        # scenario CRS if it is not the same as the pathways CRS
-
-        if self.analysis_crs is not None:
-            self.reproject_pathways(
-                target_extent=extent_string,
-                target_crs=QgsCoordinateReferenceSystem(self.analysis_crs),
-            )
 
-        # Replace no data value for the pathways and priority layers
         nodata_value = float(
             self.get_settings_value(
                 Settings.NCS_NO_DATA_VALUE, default=NO_DATA_VALUE, setting_type=float
             )
         )
-        self.log_message(
-            f"Replacing nodata value for the pathways and priority layers to {nodata_value}"
+        block_processing_enabled = self.get_settings_value(
+            Settings.BLOCK_PROCESSING_ENABLED, default=False, setting_type=bool
         )
-        self.run_pathways_replace_nodata(nodata_value=nodata_value)
+
+        # Bring the pathways, carbon layers and priority layers onto the
+        # analysis grid with a single warp each. The block processing reads
+        # the inputs window by window so lazy VRTs are used in that case.
+        grid = self.create_analysis_grid(snapped_extent, dest_crs, nodata_value)
+        self.analysis_grid = grid
+
+        # Process the grid window by window when the whole activity
+        # layers do not fit in the memory budget.
+        if (
+            grid is not None
+            and not block_processing_enabled
+            and not fits_in_budget(
+                grid, self.get_memory_budget(), len(self.analysis_activities) + 1
+            )
+        ):
+            self.log_message(
+                f"The analysis grid of {grid.width} x {grid.height} pixels "
+                f"exceeds the memory budget, using the block processing."
+            )
+            block_processing_enabled = True
+
+        if grid is not None:
+            if not self.run_analysis_grid_warp(grid, lazy=block_processing_enabled):
+                return False
+        else:
+            self.log_message(
+                "Unable to define the analysis grid, preparing the layers "
+                "with the separate snapping, clipping and reprojection steps."
+            )
+            self.prepare_analysis_data(extent_string, nodata_value)
+
+        if self.processing_cancelled:
+            return False
 
         # Calculate total carbon mitigation values for the Naturebase pathways
         self.run_pathways_carbon_summation()
 
+        # Run the remaining stages block by block in memory if enabled
+        if block_processing_enabled:
+            return self.run_block_pipeline(grid, dest_crs)
+
         # Weight the pathways using the pathway suitability index
         # and priority group coefficients for the PWLs
         save_output = self.get_settings_value(
@@ -416,6 +807,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         # Investability analysis
         self.run_investability_analysis()
+        self.remove_activity_components()
 
         # The highest position tool analysis
         save_output = self.get_settings_value(
@@ -425,12 +817,67 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    def run_processing(
+        self,
+        algorithm: str,
+        parameters: dict,
+        context: QgsProcessingContext = None,
+        feedback: QgsProcessingFeedback = None,
+        **kwargs,
+    ) -> dict:
+        """Runs a processing algorithm and records its measurements
+        in the task profiler.
+
+        :param algorithm: Processing algorithm id
+        :type algorithm: str
+
+        :param parameters: Algorithm parameters
+        :type parameters: dict
+
+        :param context: Processing context
+        :type context: QgsProcessingContext
+
+        :param feedback: Processing feedback
+        :type feedback: QgsProcessingFeedback
+
+        :returns: The algorithm results.
+        :rtype: dict
+        """
+        with self.profiler.measure(algorithm, "algorithm", algorithm) as record:
+            results = processing.run(
+                algorithm, parameters, context=context, feedback=feedback, **kwargs
+            )
+            if isinstance(results, dict):
+                record.raster_width, record.raster_height = raster_size(
+                    results.get("OUTPUT")
+                )
+
+        return results
+
+    def save_profile(self):
+        """Saves the measurements of the analysis in the scenario directory
+        and logs their summary.
+        """
+        if not self.profiler.records:
+            return
+
+        self.log_message(self.profiler.summary_text(), notify=False)
+        if self.scenario_directory and os.path.exists(self.scenario_directory):
+            metadata = {
+                "plugin_version": get_plugin_version(),
+                "scenario": self.analysis_scenario_name,
+                "scenario_uuid": str(self.scenario.uuid) if self.scenario else "",
+                "parallel_jobs": self.get_parallel_jobs_count(),
+            }
+            self.profiler.write(self.scenario_directory, metadata)
+
     def finished(self, result: bool):
         """Calls the handler responsible for doing post analysis workflow.
 
         :param result: Whether the run() operation finished successfully
         :type result: bool
         """
+        self.save_profile()
         if result:
             self.log_message("Finished from the main task \n")
         else:
@@ -521,58 +968,412 @@ class ScenarioAnalysisTask(QgsTask):
 
         return target_extent
 
-    def replace_nodata(
-        self, layer_path: str, output_path: str, nodata_value: float = -9999.0
-    ):
-        """Adds nodata value info into the layer available
-        in the passed layer_path and saves the layer in the passed output_path.
+    @profiled_stage
+    def prepare_analysis_data(self, extent_string: str, nodata_value: float):
+        """Snaps, clips, reprojects and replaces the nodata value of the
+        pathways and priority layers in separate steps. Used when the
+        analysis grid could not be defined.
 
-        The addition will replace any current nodata value available in
-        the input layer.
+        :param extent_string: Snapped analysis extent with its CRS
+        :type extent_string: str
 
-        :param layer_path: Input layer path. Must be a valid file path to a raster layer.
-        :type layer_path: str
+        :param nodata_value: NoData value of the analysis
+        :type nodata_value: float
+        """
+        # Run pathways layers snapping using a specified reference layer
+        snapping_enabled = self.get_settings_value(
+            Settings.SNAPPING_ENABLED, default=False, setting_type=bool
+        )
+        reference_layer = self.get_reference_layer()
+        if snapping_enabled and reference_layer:
+            self.snap_analysis_data(
+                self.analysis_activities,
+                extent_string,
+            )
 
-        :param output_path: Output layer path. Must be a valid file path where the modified raster will be saved.
-        :type output_path: str
+        # Clip to StudyArea
+        if self.clip_to_studyarea and os.path.exists(self.studyarea_path):
+            self.clip_analysis_data(self.studyarea_path)
 
-        :param nodata_value: No data value to be set in the output layer. Defaults to -9999.0
-        :type nodata_value: float
+        # Reproject the pathways and priority layers to the
+        # scenario CRS if it is not the same as the pathways CRS
+        if self.analysis_crs is not None:
+            self.reproject_pathways(
+                target_extent=extent_string,
+                target_crs=QgsCoordinateReferenceSystem(self.analysis_crs),
+            )
 
-        :returns: Whether the task operations were successful
-        :rtype: bool
+        # Replace no data value for the pathways and priority layers
+        self.log_message(
+            f"Replacing nodata value for the pathways and priority layers to {nodata_value}"
+        )
+        self.run_pathways_replace_nodata(nodata_value=nodata_value)
 
+    def get_studyarea_cutline(
+        self, crs: QgsCoordinateReferenceSystem
+    ) -> typing.Optional[str]:
+        """Gets the study area layer used as the cutline when warping
+        the layers to the analysis grid.
+
+        :param crs: Analysis CRS
+        :type crs: QgsCoordinateReferenceSystem
+
+        :returns: Path to the reprojected and validated study area layer
+        or None if the analysis is not clipped to the study area.
+        :rtype: str
         """
-        self.feedback = QgsProcessingFeedback()
-        self.feedback.progressChanged.connect(self.update_progress)
+        if not self.clip_to_studyarea or not self.studyarea_path:
+            return None
 
-        try:
-            alg_params = {
-                "COPY_SUBDATASETS": False,
-                "DATA_TYPE": 6,  # Float32
-                "EXTRA": "",
-                "INPUT": layer_path,
-                "NODATA": None,
-                "OPTIONS": "",
-                "TARGET_CRS": None,
-                "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
-            }
-            translate_output = processing.run(
-                "gdal:translate",
-                alg_params,
-                context=self.processing_context,
-                feedback=self.feedback,
-                is_child_algorithm=True,
+        if not os.path.exists(self.studyarea_path):
+            return None
+
+        mask_layer = QgsVectorLayer(self.studyarea_path, "mask_layer")
+        if not mask_layer.isValid():
+            self.log_message(
+                f"Invalid mask layer: {self.studyarea_path} "
+                f"Skipping clipping of activity pathways and priority layers\n"
             )
+            return None
 
-            alg_params = {
-                "DATA_TYPE": 0,  # Use Input Layer Data Type
-                "EXTRA": "",
-                "INPUT": translate_output["OUTPUT"],
-                "MULTITHREADING": False,
-                "NODATA": nodata_value,
-                "OPTIONS": "",
-                "RESAMPLING": 0,  # Nearest Neighbour
+        studyarea_path = self.studyarea_path
+        if mask_layer.crs() != crs:
+            studyarea_path = (
+                self.reproject_layer(studyarea_path, crs, is_raster=False)
+                or studyarea_path
+            )
+
+        # Validate layer geometries
+        validated_path = self.validate_vector_layer(studyarea_path)
+        if not validated_path:
+            self.log_message(f"Invalid studyarea layer: {studyarea_path} ")
+            return studyarea_path
+
+        return validated_path
+
+    def pixel_area_ratio(self, path: str, grid: RasterGrid) -> float:
+        """Ratio between the pixel area of the analysis grid and the pixel
+        area of a layer, used to rescale the values of snapped layers.
+
+        :param path: Layer path
+        :type path: str
+
+        :param grid: Analysis grid
+        :type grid: RasterGrid
+
+        :returns: Pixel area ratio, one if the layer is not valid.
+        :rtype: float
+        """
+        layer = QgsRasterLayer(path, "rescale_layer")
+        if not layer.isValid() or layer.width() == 0 or layer.height() == 0:
+            return 1.0
+
+        layer_extent = layer.extent()
+        crs = QgsCoordinateReferenceSystem.fromWkt(grid.crs_wkt)
+        if layer.crs() != crs:
+            transform = QgsCoordinateTransform(layer.crs(), crs, QgsProject.instance())
+            layer_extent = transform.transformBoundingBox(layer_extent)
+
+        layer_pixel_area = (layer_extent.width() / layer.width()) * (
+            layer_extent.height() / layer.height()
+        )
+        if layer_pixel_area == 0:
+            return 1.0
+
+        return (grid.x_resolution * grid.y_resolution) / layer_pixel_area
+
+    @profiled_stage
+    def run_analysis_grid_warp(self, grid: RasterGrid, lazy: bool = False) -> bool:
+        """Warps the pathways, carbon layers and priority layers onto the
+        analysis grid. Each layer is warped once with the snapping
+        resampling, the study area cutline and the nodata value of the
+        analysis, replacing the separate snapping, clipping, reprojection
+        and nodata replacement steps.
+
+        :param grid: Analysis grid
+        :type grid: RasterGrid
+
+        :param lazy: Whether to create VRTs that are warped when read
+        instead of GeoTIFFs.
+        :type lazy: bool
+
+        :returns: True if the task operation was successfully completed else False.
+        :rtype: bool
+        """
+        if self.processing_cancelled:
+            return False
+
+        self.set_status_message(
+            tr(
+                "Aligning the activity pathways, carbon layers and "
+                "priority layers to the analysis grid"
+            )
+        )
+
+        snapping_enabled = (
+            self.get_settings_value(
+                Settings.SNAPPING_ENABLED, default=False, setting_type=bool
+            )
+            and self.get_reference_layer() is not None
+        )
+        resample_algorithm = "near"
+        rescale_values = False
+        if snapping_enabled:
+            resample_algorithm = resampling_algorithm(
+                self.get_settings_value(Settings.RESAMPLING_METHOD, default=0)
+            )
+            rescale_values = self.get_settings_value(
+                Settings.RESCALE_VALUES, default=False, setting_type=bool
+            )
+
+        try:
+            cutline_path = self.get_studyarea_cutline(
+                QgsCoordinateReferenceSystem.fromWkt(grid.crs_wkt)
+            )
+
+            pathways: typing.List[NcsPathway] = []
+            for activity in self.analysis_activities:
+                if not activity.pathways and (
+                    activity.path is None or activity.path == ""
+                ):
+                    self.set_info_message(
+                        tr(
+                            f"No defined activity pathways or "
+                            f" activity layers for the activity {activity.name}"
+                        ),
+                        level=Qgis.MessageLevel.Critical,
+                    )
+                    self.log_message(
+                        f"No defined activity pathways or "
+                        f"activity layers for the activity {activity.name}"
+                    )
+                    return False
+
+                for pathway in activity.pathways:
+                    if pathway is not None and pathway not in pathways:
+                        pathways.append(pathway)
+
+            directories = {
+                "pathway": os.path.join(self.scenario_directory, "pathways", "aligned"),
+                "carbon": os.path.join(
+                    self.scenario_directory, "carbon_layers", "aligned"
+                ),
+                "priority_layer": os.path.join(
+                    self.scenario_directory, "priority_layer", "aligned"
+                ),
+            }
+            for directory in directories.values():
+                FileUtils.create_new_dir(directory)
+
+            # Each input is warped once even if it is used by several pathways
+            warped_paths = {}
+            warp_jobs = []
+
+            def add_warp_job(input_path: str, layer_type: str) -> str:
+                if input_path in warped_paths:
+                    return warped_paths[input_path]
+
+                scale = (
+                    self.pixel_area_ratio(input_path, grid) if rescale_values else None
+                )
+                extension = "vrt" if lazy and scale in (None, 1.0) else "tif"
+                output_path = os.path.join(
+                    directories[layer_type],
+                    f"{Path(input_path).stem}_{str(self.scenario.uuid)[:4]}"
+                    f"_{len(warp_jobs)}.{extension}",
+                )
+                warped_paths[input_path] = output_path
+                warp_jobs.append(
+                    {
+                        "input_path": input_path,
+                        "output_path": output_path,
+                        "scale": scale,
+                    }
+                )
+                return output_path
+
+            for pathway in pathways:
+                if QgsRasterLayer(pathway.path, pathway.name).isValid():
+                    add_warp_job(pathway.path, "pathway")
+                else:
+                    self.log_message(
+                        f"Pathway layer {pathway.name} is not valid, "
+                        f"skipping aligning the layer to the analysis grid."
+                    )
+
+                # Carbon layers are not defined on NcsPathway, only on
+                # pathways that still have the legacy attribute.
+                for carbon_path in getattr(pathway, CARBON_PATHS_ATTRIBUTE, None) or []:
+                    if os.path.exists(carbon_path):
+                        add_warp_job(carbon_path, "carbon")
+
+                for priority_layer in pathway.priority_layers or []:
+                    if priority_layer is None:
+                        continue
+                    settings_layer = self.get_priority_layer(priority_layer.get("uuid"))
+                    if settings_layer is None:
+                        continue
+                    priority_layer_path = settings_layer.get("path")
+                    if priority_layer_path and os.path.exists(priority_layer_path):
+                        add_warp_job(priority_layer_path, "priority_layer")
+
+            self.log_message(
+                f"Aligning {len(warp_jobs)} layers to the analysis grid of "
+                f"{grid.width} x {grid.height} pixels, resolution "
+                f"{grid.x_resolution}, {grid.y_resolution} \n"
+            )
+
+            warped = set()
+
+            def warp_layer(warp_job, context, feedback):
+                input_path = warp_job["input_path"]
+                output_path = warp_job["output_path"]
+
+                cache_key = None
+                if output_path.endswith(".tif"):
+                    cache_key = self.cache_key(
+                        "warp_to_grid",
+                        [input_path] + ([cutline_path] if cutline_path else []),
+                        {
+                            "grid": [
+                                grid.geotransform,
+                                grid.width,
+                                grid.height,
+                                grid.crs_wkt,
+                                grid.nodata,
+                            ],
+                            "resample_algorithm": resample_algorithm,
+                            "scale": warp_job["scale"],
+                        },
+                    )
+                if self.restore_cached_output(cache_key, output_path):
+                    warped.add(input_path)
+                    return True
+
+                if not warp_to_grid(
+                    input_path,
+                    output_path,
+                    grid,
+                    resample_algorithm=resample_algorithm,
+                    cutline_path=cutline_path,
+                    scale=warp_job["scale"],
+                    lazy=output_path.endswith(".vrt"),
+                    feedback=feedback,
+                ):
+                    self.log_message(
+                        f"Problem aligning {input_path} to the analysis grid, "
+                        f"the original layer will be used."
+                    )
+                    return not feedback.isCanceled()
+
+                self.store_cached_output(cache_key, output_path)
+                warped.add(input_path)
+                return True
+
+            if not self.run_parallel_jobs(warp_jobs, warp_layer):
+                return False
+
+            def aligned_path(path: str) -> str:
+                return warped_paths[path] if path in warped else path
+
+            for pathway in pathways:
+                pathway.path = aligned_path(pathway.path)
+                carbon_paths = getattr(pathway, CARBON_PATHS_ATTRIBUTE, None)
+                if carbon_paths:
+                    setattr(
+                        pathway,
+                        CARBON_PATHS_ATTRIBUTE,
+                        [aligned_path(carbon_path) for carbon_path in carbon_paths],
+                    )
+                for priority_layer in pathway.priority_layers or []:
+                    if priority_layer is None:
+                        continue
+                    settings_layer = self.get_priority_layer(priority_layer.get("uuid"))
+                    if settings_layer is None:
+                        continue
+                    priority_layer_path = settings_layer.get("path")
+                    if priority_layer_path in warped:
+                        priority_layer["path"] = warped_paths[priority_layer_path]
+                        self.priority_layer_paths[
+                            priority_layer.get("uuid")
+                        ] = warped_paths[priority_layer_path]
+
+        except Exception as e:
+            self.log_message(f"Problem aligning layers to the analysis grid, {e} \n")
+            self.log_message(traceback.format_exc())
+            self.cancel_task(e)
+            return False
+
+        return True
+
+    def replace_nodata(
+        self,
+        layer_path: str,
+        output_path: str,
+        nodata_value: float = -9999.0,
+        cache_output: bool = True,
+    ):
+        """Adds nodata value info into the layer available
+        in the passed layer_path and saves the layer in the passed output_path.
+
+        The addition will replace any current nodata value available in
+        the input layer.
+
+        :param layer_path: Input layer path. Must be a valid file path to a raster layer.
+        :type layer_path: str
+
+        :param output_path: Output layer path. Must be a valid file path where the modified raster will be saved.
+        :type output_path: str
+
+        :param nodata_value: No data value to be set in the output layer. Defaults to -9999.0
+        :type nodata_value: float
+
+        :param cache_output: Whether to reuse and store the output in the
+        intermediate layers cache, if enabled.
+        :type cache_output: bool
+
+        :returns: Whether the task operations were successful
+        :rtype: bool
+
+        """
+        cache_key = None
+        if cache_output:
+            cache_key = self.cache_key(
+                "replace_nodata", [layer_path], {"nodata_value": nodata_value}
+            )
+        if self.restore_cached_output(cache_key, output_path):
+            return True
+
+        self.feedback = QgsProcessingFeedback()
+        self.feedback.progressChanged.connect(self.update_progress)
+
+        try:
+            alg_params = {
+                "COPY_SUBDATASETS": False,
+                "DATA_TYPE": 6,  # Float32
+                "EXTRA": "",
+                "INPUT": layer_path,
+                "NODATA": None,
+                "OPTIONS": "",
+                "TARGET_CRS": None,
+                "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
+            }
+            translate_output = self.run_processing(
+                "gdal:translate",
+                alg_params,
+                context=self.processing_context,
+                feedback=self.feedback,
+                is_child_algorithm=True,
+            )
+
+            alg_params = {
+                "DATA_TYPE": 0,  # Use Input Layer Data Type
+                "EXTRA": "",
+                "INPUT": translate_output["OUTPUT"],
+                "MULTITHREADING": False,
+                "NODATA": nodata_value,
+                "OPTIONS": "",
+                "RESAMPLING": 0,  # Nearest Neighbour
                 "SOURCE_CRS": None,
                 "TARGET_CRS": None,
                 "TARGET_EXTENT": None,
@@ -580,7 +1381,7 @@ class ScenarioAnalysisTask(QgsTask):
                 "TARGET_RESOLUTION": None,
                 "OUTPUT": output_path,
             }
-            outputs = processing.run(
+            outputs = self.run_processing(
                 "gdal:warpreproject",
                 alg_params,
                 context=self.processing_context,
@@ -588,12 +1389,16 @@ class ScenarioAnalysisTask(QgsTask):
                 is_child_algorithm=True,
             )
 
+            if outputs is not None:
+                self.store_cached_output(cache_key, output_path)
+
             return outputs is not None
         except Exception as e:
             log(f"Problem replacing no data value from a snapping output, {e}")
 
         return False
 
+    @profiled_stage
     def run_pathways_replace_nodata(self, nodata_value: float = -9999.0) -> bool:
         """Replace the nodata value for activity pathways and priority layers.
         :param nodata_value: The nodata value to replace in the pathways and priority layers
@@ -755,6 +1560,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def run_pathways_carbon_summation(self) -> bool:
         """Calculates total carbon mitigation values for the Naturebase pathways.
 
@@ -806,9 +1612,8 @@ class ScenarioAnalysisTask(QgsTask):
                     )
                     continue
 
-                raster_provider = pathway_layer.dataProvider()
-                stats = raster_provider.bandStatistics(1, QgsRasterBandStats.Stats.Sum)
-                if stats is None or stats.sum is None:
+                stats = get_raster_statistics(pathway.path)
+                if stats is None:
                     self.log_message(
                         f"Could not calculate statistics for {pathway.name}, skipping."
                     )
@@ -861,7 +1666,7 @@ class ScenarioAnalysisTask(QgsTask):
                 f" {alg_params} \n"
             )
 
-            result = processing.run(
+            result = self.run_processing(
                 "native:fixgeometries",
                 alg_params,
                 context=self.processing_context,
@@ -990,7 +1795,7 @@ class ScenarioAnalysisTask(QgsTask):
             if self.processing_cancelled:
                 return False
 
-            result = processing.run(
+            result = self.run_processing(
                 "gdal:cliprasterbymasklayer",
                 alg_params,
                 context=self.processing_context,
@@ -1003,6 +1808,7 @@ class ScenarioAnalysisTask(QgsTask):
             self.log_message(f"Problem clipping the layer {e} \n")
         return False
 
+    @profiled_stage
     def clip_analysis_data(self, studyarea_path: str) -> bool:
         """Clips the activity pathways and priority layers by the given study area.
         :param studyarea_path: The path to the study area layer
@@ -1160,6 +1966,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def snap_analysis_data(self, activities, extent):
         """Snaps the passed activities pathways, carbon layers and priority layers
          to align with the reference layer set on the settings
@@ -1387,6 +2194,23 @@ class ScenarioAnalysisTask(QgsTask):
         :type nodata_value: float
 
         """
+        cache_key = self.cache_key(
+            "snap_layer",
+            [input_path, reference_path],
+            {
+                "extent": extent,
+                "rescale_values": rescale_values,
+                "resampling_method": resampling_method,
+                "nodata_value": nodata_value,
+            },
+        )
+        cached_path = os.path.join(
+            directory,
+            "snap_layers",
+            f"{Path(input_path).stem}_{str(uuid.uuid4())[:4]}_final.tif",
+        )
+        if self.restore_cached_output(cache_key, cached_path):
+            return cached_path
 
         input_result_path, reference_result_path = align_rasters(
             input_path,
@@ -1405,7 +2229,10 @@ class ScenarioAnalysisTask(QgsTask):
 
             output_path = os.path.join(directory, f"{name}_final.tif")
 
-            self.replace_nodata(input_result_path, output_path, nodata_value)
+            if self.replace_nodata(
+                input_result_path, output_path, nodata_value, cache_output=False
+            ):
+                self.store_cached_output(cache_key, output_path)
 
         return output_path
 
@@ -1456,6 +2283,17 @@ class ScenarioAnalysisTask(QgsTask):
         if target_extent is not None and target_extent != "":
             alg_params["TARGET_EXTENT"] = target_extent
 
+        # Only raster outputs saved in the scenario directory are cached
+        cache_key = None
+        if output_directory and is_raster:
+            cache_key = self.cache_key(
+                "reproject_layer",
+                [input_path],
+                {"target_crs": target_crs.toWkt(), "target_extent": target_extent},
+            )
+            if self.restore_cached_output(cache_key, output_file):
+                return output_file
+
         self.log_message(f"Used parameters for layer reprojection: " f"{alg_params} \n")
 
         self.feedback = QgsProcessingFeedback()
@@ -1464,14 +2302,17 @@ class ScenarioAnalysisTask(QgsTask):
         if self.processing_cancelled:
             return None
 
-        results = processing.run(
+        results = self.run_processing(
             "gdal:warpreproject" if is_raster else "native:reprojectlayer",
             alg_params,
             context=self.processing_context,
             feedback=self.feedback,
         )
+        self.store_cached_output(cache_key, results["OUTPUT"])
+
         return results["OUTPUT"]
 
+    @profiled_stage
     def reproject_pathways(
         self,
         target_crs: QgsCoordinateReferenceSystem,
@@ -1639,6 +2480,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def run_activities_analysis(self, activities, extent, temporary_output=False):
         """Runs the required activity analysis on the passed
         activities pathways. The analysis is responsible for creating activities
@@ -1664,14 +2506,14 @@ class ScenarioAnalysisTask(QgsTask):
         self.set_status_message(tr("Creating activity layers from pathways"))
 
         try:
-            for activity in activities:
-                activities_directory = os.path.join(
-                    self.scenario_directory, "activities"
-                )
-                FileUtils.create_new_dir(activities_directory)
-                file_name = clean_filename(activity.name.replace(" ", "_"))
+            activities_directory = os.path.join(self.scenario_directory, "activities")
+            FileUtils.create_new_dir(activities_directory)
 
-                layers = []
+            # The activities are the sum of their layers, ignoring NoData
+            # values, and are created in a single pass over a stack of
+            # all the layers.
+            activity_layers = []
+            for activity in activities:
                 if not activity.pathways and (
                     activity.path is None or activity.path == ""
                 ):
@@ -1689,60 +2531,81 @@ class ScenarioAnalysisTask(QgsTask):
 
                     return False
 
-                output_file = os.path.join(
-                    activities_directory, f"{file_name}_{str(uuid.uuid4())[:4]}.tif"
-                )
+                file_name = clean_filename(activity.name.replace(" ", "_"))
+                if temporary_output:
+                    output_file = QgsProcessingUtils.generateTempFilename(
+                        f"{file_name}.tif"
+                    )
+                else:
+                    output_file = os.path.join(
+                        activities_directory,
+                        f"{file_name}_{str(uuid.uuid4())[:4]}.tif",
+                    )
 
                 # Due to the activities base class
                 # activity only one of the following blocks will be executed,
                 # the activity either contain a path or
                 # pathways
+                layers = []
                 if activity.path is not None and activity.path != "":
                     layers = [activity.path]
 
                 for pathway in activity.pathways:
                     layers.append(pathway.path)
 
-                output = (
-                    QgsProcessing.TEMPORARY_OUTPUT if temporary_output else output_file
+                self.log_message(
+                    f"Creating the activity {activity.name} from the layers "
+                    f"{layers}, output {output_file} \n"
                 )
+                activity_layers.append((activity, layers, output_file))
 
-                reference_layer = self.get_reference_layer()
-                if (reference_layer is None or reference_layer == "") and len(
-                    layers
-                ) > 0:
-                    reference_layer = layers[0]
-
-                # Actual processing calculation
-                alg_params = {
-                    "IGNORE_NODATA": True,
-                    "INPUT": layers,
-                    "EXTENT": extent,
-                    "OUTPUT_NODATA_VALUE": settings_manager.get_value(
-                        Settings.NCS_NO_DATA_VALUE, NO_DATA_VALUE
-                    ),
-                    "REFERENCE_LAYER": reference_layer,
-                    "STATISTIC": 0,  # Sum
-                    "OUTPUT": output,
-                }
+            if self.processing_cancelled:
+                return False
 
-                self.log_message(
-                    f"Used parameters for " f"activities generation: {alg_params} \n"
+            # The activities share the analysis grid and are written in a
+            # single pass. Without it, each activity is written on the grid
+            # of the reference layer or of its own first layer, activities
+            # with the same grid sharing a pass.
+            reference_layer = self.get_reference_layer()
+            grid_layers = {}
+            for activity, layers, output_file in activity_layers:
+                if self.analysis_grid is not None:
+                    grid_path = ""
+                else:
+                    grid_path = reference_layer or (layers[0] if layers else "")
+                grid_layers.setdefault(grid_path, []).append(
+                    (activity, layers, output_file)
                 )
 
-                self.feedback = QgsProcessingFeedback()
-                self.feedback.progressChanged.connect(self.update_progress)
-
-                if self.processing_cancelled:
+            for grid_path, grid_activities in grid_layers.items():
+                grid = self.get_stack_grid(grid_path)
+                if grid is None:
+                    self.log_message(
+                        f"Unable to define the grid of the activities "
+                        f"{[activity.name for activity, _, _ in grid_activities]}."
+                    )
                     return False
 
-                results = processing.run(
-                    "native:cellstatistics",
-                    alg_params,
-                    context=self.processing_context,
-                    feedback=self.feedback,
+                stack_node = LayerStackNode(
+                    [path for _, layers, _ in grid_activities for path in layers]
                 )
-                activity.path = results["OUTPUT"]
+                outputs = []
+                for activity, layers, output_file in grid_activities:
+                    weights = {}
+                    for path in layers:
+                        weights[path] = weights.get(path, 0.0) + 1.0
+                    node = WeightedSumNode(
+                        stack_node, weights, ignore_nodata=True, name=activity.name
+                    )
+                    outputs.append((node, output_file))
+
+                if not self.run_layer_stack_outputs(
+                    grid, outputs, cloud_optimized=not temporary_output
+                ):
+                    return False
+
+            for activity, layers, output_file in activity_layers:
+                activity.path = output_file
 
         except Exception as e:
             self.log_message(f"Problem creating activity layers, {e}")
@@ -1751,6 +2614,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def run_activity_normalization(
         self,
     ) -> bool:
@@ -1793,10 +2657,9 @@ class ScenarioAnalysisTask(QgsTask):
                     )
                     continue
 
-                provider = activity_layer.dataProvider()
-                band_statistics = provider.bandStatistics(1)
-                min_value = band_statistics.minimumValue
-                max_value = band_statistics.maximumValue
+                band_statistics = get_raster_statistics(activity.path)
+                min_value = band_statistics.minimum if band_statistics else None
+                max_value = band_statistics.maximum if band_statistics else None
 
                 if min_value is None or max_value is None:
                     self.log_message(
@@ -1838,7 +2701,7 @@ class ScenarioAnalysisTask(QgsTask):
                 if self.processing_cancelled:
                     return False
 
-                result = processing.run(
+                result = self.run_processing(
                     "gdal:rastercalculator",
                     alg_params,
                     context=self.processing_context,
@@ -1858,6 +2721,7 @@ class ScenarioAnalysisTask(QgsTask):
             self.cancel_task(e)
             return False
 
+    @profiled_stage
     def run_activities_masking(
         self, activities, masking_layers, extent, temporary_output=False
     ):
@@ -2012,7 +2876,7 @@ class ScenarioAnalysisTask(QgsTask):
                 if self.processing_cancelled:
                     return False
 
-                results = processing.run(
+                results = self.run_processing(
                     "gdal:cliprasterbymasklayer",
                     alg_params,
                     context=self.processing_context,
@@ -2027,6 +2891,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def run_internal_activities_masking(
         self, activities, extent, temporary_output=False
     ):
@@ -2202,7 +3067,7 @@ class ScenarioAnalysisTask(QgsTask):
                 if self.processing_cancelled:
                     return False
 
-                results = processing.run(
+                results = self.run_processing(
                     "gdal:cliprasterbymasklayer",
                     alg_params,
                     context=self.processing_context,
@@ -2254,7 +3119,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         self.log_message(f"Used parameters for merging mask layers: {alg_params} \n")
 
-        results = processing.run(
+        results = self.run_processing(
             "native:mergevectorlayers",
             alg_params,
             context=self.processing_context,
@@ -2280,7 +3145,7 @@ class ScenarioAnalysisTask(QgsTask):
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
 
-        results = processing.run(
+        results = self.run_processing(
             "native:extenttolayer",
             alg_params,
             context=self.processing_context,
@@ -2311,7 +3176,7 @@ class ScenarioAnalysisTask(QgsTask):
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
 
-        results = processing.run(
+        results = self.run_processing(
             "native:symmetricaldifference",
             alg_params,
             context=self.processing_context,
@@ -2320,11 +3185,13 @@ class ScenarioAnalysisTask(QgsTask):
 
         return results["OUTPUT"]
 
+    @profiled_stage
     def run_activities_sieve(self, activities, temporary_output=False):
         """Runs the sieve functionality analysis on the passed activities layers,
-        removing the activities layer polygons that are smaller than the provided
-        threshold size (in pixels) and replaces them with the pixel value of
-        the largest neighbour polygon.
+        removing the activities layer clusters that are smaller than the provided
+        threshold size (in pixels). The clusters are labelled and sieved in a
+        single tiled pass, the pixels of the removed clusters and the pixels
+        that are not positive are set to no data.
 
         :param activities: List of the analyzed activities.
         :type activities: typing.List[Activity]
@@ -2346,6 +3213,21 @@ class ScenarioAnalysisTask(QgsTask):
         self.set_status_message(tr("Applying sieve function to the activities"))
 
         try:
+            threshold_value = float(
+                self.get_settings_value(Settings.SIEVE_THRESHOLD, default=10)
+            )
+
+            mask_layer = self.get_settings_value(Settings.SIEVE_MASK_PATH, default="")
+
+            no_mask = not (mask_layer and os.path.exists(mask_layer))
+            mask_layer_ref = mask_layer if not no_mask else None
+
+            sieved_activities_directory = os.path.join(
+                self.scenario_directory, "sieved_activities"
+            )
+            FileUtils.create_new_dir(sieved_activities_directory)
+
+            sieve_jobs = []
             for activity in activities:
                 if activity.path is None or activity.path == "":
                     if not self.processing_cancelled:
@@ -2370,10 +3252,6 @@ class ScenarioAnalysisTask(QgsTask):
 
                     return False
 
-                sieved_activities_directory = os.path.join(
-                    self.scenario_directory, "sieved_activities"
-                )
-                FileUtils.create_new_dir(sieved_activities_directory)
                 file_name = clean_filename(activity.name.replace(" ", "_"))
 
                 output_file = os.path.join(
@@ -2381,147 +3259,88 @@ class ScenarioAnalysisTask(QgsTask):
                     f"{file_name}_{str(uuid.uuid4())[:4]}.tif",
                 )
 
-                threshold_value = float(
-                    self.get_settings_value(Settings.SIEVE_THRESHOLD, default=10)
+                if temporary_output:
+                    output_file = QgsProcessingUtils.generateTempFilename(
+                        f"{file_name}.tif"
+                    )
+                labels_file = os.path.join(
+                    sieved_activities_directory,
+                    f"{file_name}_labels_{str(uuid.uuid4())[:4]}.tif",
                 )
+                sieve_jobs.append((activity, output_file, labels_file))
 
-                mask_layer = self.get_settings_value(
-                    Settings.SIEVE_MASK_PATH, default=""
-                )
+            # The labels of the kept clusters are the clusters of the
+            # connectivity layer unless a mask restricts the sieve.
+            reuse_labels = no_mask and self.get_settings_value(
+                Settings.PIXEL_CONNECTIVITY_ENABLED, default=True, setting_type=bool
+            )
 
-                no_mask = not (mask_layer and os.path.exists(mask_layer))
-                mask_layer_ref = mask_layer if not no_mask else None
+            tile_size = self.get_component_tile_size()
 
-                output = (
-                    QgsProcessing.TEMPORARY_OUTPUT if temporary_output else output_file
+            def sieve_activity(sieve_job, context, feedback):
+                activity, output_file, labels_file = sieve_job
+                self.log_message(
+                    f"Sieving activity {activity.name} with a threshold of "
+                    f"{threshold_value} pixels, mask layer: {mask_layer_ref} \n"
                 )
 
-                input_name = os.path.splitext(os.path.basename(activity.path))[0]
+                # Step 1: Label the clusters of the positive pixels
+                components = label_components(
+                    activity.path,
+                    labels_file,
+                    tile_size=tile_size,
+                    feedback=feedback,
+                    mask_path=mask_layer_ref,
+                )
+                if components is None:
+                    if os.path.exists(labels_file):
+                        os.remove(labels_file)
+                    if self.processing_cancelled:
+                        return False
+                    self.log_message(
+                        f"Problem running sieve function "
+                        f"on activity layers, unable to label the "
+                        f"clusters of the activity {activity.name} \n"
+                    )
+                    self.cancel_task()
+                    return False
 
-                # Step 1: Create a binary mask from the original raster
-                binary_mask = processing.run(
-                    "qgis:rastercalculator",
-                    {
-                        "CELLSIZE": 0,
-                        "LAYERS": [activity.path],
-                        "CRS": None,
-                        "EXPRESSION": f"{input_name}@1 > 0",
-                        "OUTPUT": "TEMPORARY_OUTPUT",
-                    },
-                )["OUTPUT"]
-
-                sieve_alg_params = {
-                    "INPUT": binary_mask,
-                    "THRESHOLD": threshold_value,
-                    "EIGHT_CONNECTEDNESS": True,
-                    "NO_MASK": no_mask,
-                    "MASK_LAYER": mask_layer_ref,
-                    "OUTPUT": "TEMPORARY_OUTPUT",
-                }
+                # Step 2: Set the clusters smaller than the threshold and the
+                # values that are not positive to no data
+                sieved = write_sieved_layer(
+                    components,
+                    activity.path,
+                    output_file,
+                    threshold_value,
+                    nodata=float(self.no_data_value),
+                    feedback=feedback,
+                    tile_size=tile_size,
+                )
+                if sieved and reuse_labels:
+                    self.activity_components[str(activity.uuid)] = components.sieved(
+                        threshold_value
+                    )
+                else:
+                    components.remove()
 
-                self.log_message(f"Used parameters for sieving: {sieve_alg_params} \n")
+                if self.processing_cancelled:
+                    return False
 
-                # Step 2: Run sieve analysis from the output of the binary mask
-                sieved_mask = processing.run(
-                    "gdal:sieve",
-                    sieve_alg_params,
-                    context=self.processing_context,
-                    feedback=self.feedback,
-                )["OUTPUT"]
+                if not sieved or not os.path.exists(output_file):
+                    self.log_message(
+                        f"Problem running sieve function "
+                        f"on activity layers, sieved layer not found"
+                        f" \n"
+                    )
+                    self.cancel_task()
+                    return False
 
-                expr = f"({os.path.splitext(os.path.basename(sieved_mask))[0]}@1 > 0) * {os.path.splitext(os.path.basename(sieved_mask))[0]}@1"
+                activity.path = output_file
 
-                # Step 3: Remove and convert any no data value to 0
-                sieved_mask_clean = processing.run(
-                    "qgis:rastercalculator",
-                    {
-                        "CELLSIZE": 0,
-                        "LAYERS": [sieved_mask],
-                        "CRS": None,
-                        "EXPRESSION": expr,
-                        "OUTPUT": "TEMPORARY_OUTPUT",
-                    },
-                    context=self.processing_context,
-                    feedback=self.feedback,
-                )["OUTPUT"]
-
-                expr_2 = f"{input_name}@1 * {os.path.splitext(os.path.basename(sieved_mask_clean))[0]}@1"
-
-                # Step 4: Join the sieved mask with the original input layer to filter out the small areas
-                sieve_output = processing.run(
-                    "qgis:rastercalculator",
-                    {
-                        "CELLSIZE": 0,
-                        "LAYERS": [activity.path, sieved_mask_clean],
-                        "CRS": None,
-                        "EXPRESSION": expr_2,
-                        "OUTPUT": "TEMPORARY_OUTPUT",
-                    },
-                    context=self.processing_context,
-                    feedback=self.feedback,
-                )["OUTPUT"]
-
-                # Step 5. Replace all 0 with NO_DATA_VALUE using if
-                # ("combined@1" <= 0, NO_DATA_VALUE, "combined@1")
-                no_data_replace_exp = (
-                    f"(A > 0)*A + (A <= 0)*{float(self.no_data_value)}"
-                )
-                sieve_output_updated = processing.run(
-                    "gdal:rastercalculator",
-                    {
-                        "INPUT_A": f"{sieve_output}",
-                        "BAND_A": 1,
-                        "FORMULA": no_data_replace_exp,
-                        "NO_DATA": None,
-                        "EXTENT_OPT": 0,
-                        "RTYPE": 5,
-                        "OUTPUT": "TEMPORARY_OUTPUT",
-                    },
-                    context=self.processing_context,
-                    feedback=self.feedback,
-                )["OUTPUT"]
-
-                if not os.path.exists(sieve_output_updated):
-                    self.log_message(
-                        f"Problem running sieve function "
-                        f"on activity layers, sieve intermediate layer not found"
-                        f" \n"
-                    )
-                    self.cancel_task()
-                    return False
-
-                self.feedback = QgsProcessingFeedback()
-                self.feedback.progressChanged.connect(self.update_progress)
-
-                if self.processing_cancelled:
-                    return False
-
-                # Step 6. Run sum statistics with ignore no data values set to false
-                # and no data value
-                results = processing.run(
-                    "native:cellstatistics",
-                    {
-                        "INPUT": [sieve_output_updated],
-                        "STATISTIC": 0,
-                        "IGNORE_NODATA": False,
-                        "REFERENCE_LAYER": sieve_output_updated,
-                        "OUTPUT_NODATA_VALUE": settings_manager.get_value(
-                            Settings.NCS_NO_DATA_VALUE, NO_DATA_VALUE
-                        ),
-                        "OUTPUT": output,
-                    },
-                    context=self.processing_context,
-                    feedback=self.feedback,
-                )
-
-                feedback = QgsProcessingFeedback()
-
-                feedback.progressChanged.connect(self.update_progress)
-
-                if self.processing_cancelled:
-                    return False
+                return True
 
-                activity.path = results["OUTPUT"]
+            if not self.run_parallel_jobs(sieve_jobs, sieve_activity):
+                return False
 
         except Exception as e:
             self.log_message(
@@ -2532,6 +3351,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def run_normalize_pathways_carbon_impact(
         self, pathways: typing.List[NcsPathway]
     ) -> bool:
@@ -2606,6 +3426,145 @@ class ScenarioAnalysisTask(QgsTask):
             self.cancel_task(e)
             return False
 
+    def get_relative_impact_matrix(self) -> dict:
+        """Gets the relative impact matrix of the pathways and
+        priority weighting layers from the settings.
+
+        :returns: Relative impact matrix with the pathway uuids,
+        priority layer uuids and the impact values.
+        :rtype: dict
+        """
+        relative_impact_matrix = dict()
+        impact_matrix = settings_manager.get_value(
+            Settings.SCENARIO_IMPACT_MATRIX, dict()
+        )
+        if len(impact_matrix) > 0:
+            relative_impact_matrix = json.loads(impact_matrix)
+
+        return relative_impact_matrix
+
+    def get_pathway_weighting_terms(
+        self,
+        pathway: NcsPathway,
+        priority_layers_groups,
+        settings_priority_layers: typing.List[dict],
+        relative_impact_matrix: dict,
+    ) -> typing.List[dict]:
+        """Gets the priority weighting layer terms used for weighting
+        the given pathway.
+
+        Each term is a dictionary with the PWL path, the priority group
+        coefficient, whether the PWL should be inverted and the impact
+        multiplier, if any.
+
+        :param pathway: Pathway to be weighted
+        :type pathway: NcsPathway
+
+        :param priority_layers_groups: Used priority layers groups and their values
+        :type priority_layers_groups: dict
+
+        :param settings_priority_layers: Priority layers saved in the settings
+        :type settings_priority_layers: list
+
+        :param relative_impact_matrix: Relative impact matrix of the pathways and PWLs
+        :type relative_impact_matrix: dict
+
+        :returns: Weighting terms for the pathway.
+        :rtype: list
+        """
+        pathway_uuids = relative_impact_matrix.get("pathway_uuids", [])
+        priority_layer_uuids = relative_impact_matrix.get("priority_layer_uuids", [])
+        relative_impact_values = relative_impact_matrix.get("values", [])
+
+        terms = []
+        for layer in pathway.priority_layers:
+            if not any(priority_layers_groups):
+                self.log_message(
+                    f"There are no defined priority layers in groups,"
+                    f" skipping the inclusion of PWLs in pathways "
+                    f"weighting."
+                )
+                break
+
+            if layer is None:
+                continue
+
+            settings_layer = self.get_priority_layer(layer.get("uuid"))
+            if settings_layer is None:
+                continue
+
+            pwl = self.priority_layer_paths.get(
+                layer.get("uuid"), settings_layer.get("path")
+            )
+
+            missing_pwl_message = (
+                f"Path {pwl} for priority "
+                f"weighting layer {layer.get('name')} "
+                f"doesn't exist, skipping the layer "
+                f"from the pathway {pathway.name} weighting."
+            )
+            if pwl is None:
+                self.log_message(missing_pwl_message)
+                continue
+
+            if not Path(pwl).exists():
+                self.log_message(missing_pwl_message)
+                continue
+
+            for priority_layer in settings_priority_layers:
+                if priority_layer.get("name") != layer.get("name"):
+                    continue
+
+                for group in priority_layer.get("groups", []):
+                    impact_value = None
+                    try:
+                        row = pathway_uuids.index(str(pathway.uuid))
+                        col = priority_layer_uuids.index(layer["uuid"])
+                    except ValueError:
+                        self.log_message(
+                            f"Could not find pathway uuid {pathway.uuid} or "
+                            f"priority layer uuid {layer['uuid']} in the relative impact matrix."
+                        )
+                    else:
+                        if row < len(relative_impact_values) and col < len(
+                            relative_impact_values[row]
+                        ):
+                            impact_value = relative_impact_values[row][col]
+                        else:
+                            self.log_message(
+                                f"Index out of range for relative impact "
+                                f"matrix: row={row}, col={col}."
+                            )
+
+                    priority_group_coefficient = float(group.get("value"))
+                    if priority_group_coefficient <= 0:
+                        continue
+
+                    multiplier = None
+                    is_carbon = False
+                    norm_carbon_impact = pathway.type_options.get("norm_carbon_impact")
+                    if layer.get("is_carbon") and norm_carbon_impact is not None:
+                        # For restore and manage pathways, multiply by normalized carbon impact
+                        multiplier = abs(int(impact_value)) * norm_carbon_impact
+                        is_carbon = True
+                    elif impact_value is not None:
+                        # For non-carbon PWLS and and protect pathways,
+                        multiplier = abs(int(impact_value))
+
+                    terms.append(
+                        {
+                            "path": pwl,
+                            "coefficient": priority_group_coefficient,
+                            # Inverse the PWL for negative impacts
+                            "inverse": impact_value is not None and impact_value < 0,
+                            "multiplier": multiplier,
+                            "is_carbon": is_carbon,
+                        }
+                    )
+
+        return terms
+
+    @profiled_stage
     def run_pathways_weighting(
         self,
         activities: typing.List[Activity],
@@ -2650,17 +3609,7 @@ class ScenarioAnalysisTask(QgsTask):
             self.log_message(msg)
             return False
 
-        # Get the relative impact matrix
-        relative_impact_matrix = dict()
-        impact_matrix = settings_manager.get_value(
-            Settings.SCENARIO_IMPACT_MATRIX, dict()
-        )
-        if len(impact_matrix) > 0:
-            relative_impact_matrix = json.loads(impact_matrix)
-
-        pathway_uuids = relative_impact_matrix.get("pathway_uuids", [])
-        priority_layer_uuids = relative_impact_matrix.get("priority_layer_uuids", [])
-        relative_impact_values = relative_impact_matrix.get("values", [])
+        relative_impact_matrix = self.get_relative_impact_matrix()
 
         # Get valid pathways
         pathways: typing.List[NcsPathway] = []
@@ -2705,161 +3654,87 @@ class ScenarioAnalysisTask(QgsTask):
             )
             FileUtils.create_new_dir(weighted_pathways_directory)
 
+            # The pathways are weighted in a single pass over a stack of
+            # the pathways and their PWLs, so that PWLs shared by several
+            # pathways are read once.
+            weighting_jobs = []
             for pathway in pathways:
                 # Skip processing if cancelled
                 if self.processing_cancelled:
                     return False
 
-                base_names = []
-                layers = [pathway.path]
-                run_calculation = False
-
-                # Include suitability index if not zero
-                pathway_basename = Path(pathway.path).stem
-                if pathway.suitability_index > 0:
-                    base_names.append(
-                        f'({pathway.suitability_index}*"{pathway_basename}@1")'
-                    )
-                    run_calculation = True
-                else:
-                    base_names.append(f'("{pathway_basename}@1")')
-
-                for layer in pathway.priority_layers:
-                    if not any(priority_layers_groups):
-                        self.log_message(
-                            f"There are no defined priority layers in groups,"
-                            f" skipping the inclusion of PWLs in pathways "
-                            f"weighting."
-                        )
-                        break
-
-                    if layer is None:
-                        continue
-
-                    settings_layer = self.get_priority_layer(layer.get("uuid"))
-                    if settings_layer is None:
-                        continue
-
-                    pwl = settings_layer.get("path")
-
-                    missing_pwl_message = (
-                        f"Path {pwl} for priority "
-                        f"weighting layer {layer.get('name')} "
-                        f"doesn't exist, skipping the layer "
-                        f"from the pathway {pathway.name} weighting."
-                    )
-                    if pwl is None:
-                        self.log_message(missing_pwl_message)
-                        continue
-
-                    pwl_path = Path(pwl)
-
-                    if not pwl_path.exists():
-                        self.log_message(missing_pwl_message)
-                        continue
-
-                    pwl_path_basename = pwl_path.stem
-
-                    for priority_layer in settings_priority_layers:
-                        if priority_layer.get("name") == layer.get("name"):
-                            for group in priority_layer.get("groups", []):
-                                impact_value = None
-                                try:
-                                    row = pathway_uuids.index(str(pathway.uuid))
-                                    col = priority_layer_uuids.index(layer["uuid"])
-                                except ValueError:
-                                    self.log_message(
-                                        f"Could not find pathway uuid {pathway.uuid} or "
-                                        f"priority layer uuid {layer['uuid']} in the relative impact matrix."
-                                    )
-                                else:
-                                    if row < len(relative_impact_values) and col < len(
-                                        relative_impact_values[row]
-                                    ):
-                                        impact_value = relative_impact_values[row][col]
-                                    else:
-                                        self.log_message(
-                                            f"Index out of range for relative impact "
-                                            f"matrix: row={row}, col={col}."
-                                        )
-
-                                value = group.get("value")
-                                priority_group_coefficient = float(value)
-                                if priority_group_coefficient > 0:
-                                    if pwl not in layers:
-                                        layers.append(pwl)
-
-                                    pwl_expression = (
-                                        f"({priority_group_coefficient}*"
-                                        f'"{pwl_path_basename}@1")'
-                                    )
-
-                                    if impact_value is not None and impact_value < 0:
-                                        # Inverse the PWL
-                                        pwl_expression = (
-                                            f"({priority_group_coefficient}*"
-                                            f'("{pwl_path_basename}@1" - 1) * -1)'
-                                        )
-                                    norm_carbon_impact = pathway.type_options.get(
-                                        "norm_carbon_impact"
-                                    )
-                                    if (
-                                        layer.get("is_carbon")
-                                        and norm_carbon_impact is not None
-                                    ):
-                                        # For restore and manage pathways, multiply by normalized carbon impact
-                                        pwl_expression += f" * {abs(int(impact_value)) * norm_carbon_impact}"
-                                    elif impact_value is not None:
-                                        # For non-carbon PWLS and and protect pathways,
-                                        pwl_expression += f"* {abs(int(impact_value))}"
-
-                                    base_names.append(pwl_expression)
-                                    if not run_calculation:
-                                        run_calculation = True
+                terms = self.get_pathway_weighting_terms(
+                    pathway,
+                    priority_layers_groups,
+                    settings_priority_layers,
+                    relative_impact_matrix,
+                )
 
                 # No need to run the calculation if suitability index is
                 # zero or there are no PWLs in the activity.
-                if not run_calculation:
+                if pathway.suitability_index <= 0 and len(terms) == 0:
                     continue
 
+                layers = [pathway.path]
+                for term in terms:
+                    if term["path"] not in layers:
+                        layers.append(term["path"])
+
                 file_name = clean_filename(pathway.name.replace(" ", "_"))
                 output_file = os.path.join(
                     weighted_pathways_directory,
                     f"{file_name}_{str(uuid.uuid4())[:4]}.tif",
                 )
 
-                expression = f"{base_names[0]}"
-                if len(base_names) > 1:
-                    pwl_calc_expression = " + ".join(base_names[1:])
-                    expression += f" * ({pwl_calc_expression})"
+                # The layer paths differ in each run, so the key uses
+                # their position in the weighting terms instead.
+                cache_key = self.cache_key(
+                    "pathway_weighting",
+                    layers,
+                    {
+                        "suitability_index": pathway.suitability_index,
+                        "terms": [
+                            dict(term, path=layers.index(term["path"]))
+                            for term in terms
+                        ],
+                        "extent": extent,
+                    },
+                )
+                if self.restore_cached_output(cache_key, output_file):
+                    pathway.path = output_file
+                    continue
 
-                # Actual processing calculation
-                alg_params = {
-                    "CELLSIZE": 0,
-                    "CRS": None,
-                    "EXPRESSION": expression,
-                    "EXTENT": extent,
-                    "LAYERS": layers,
-                    "OUTPUT": output_file,
-                }
+                weighting_jobs.append((pathway, terms, layers, output_file, cache_key))
+
+            if len(weighting_jobs) == 0:
+                return True
+
+            stack_node = LayerStackNode(
+                [path for job in weighting_jobs for path in job[2]]
+            )
+            grid = self.get_stack_grid(weighting_jobs[0][0].path)
+            if grid is None:
+                self.log_message("Unable to define the grid of the pathways weighting.")
+                return False
 
+            outputs = []
+            for pathway, terms, layers, output_file, cache_key in weighting_jobs:
                 self.log_message(
-                    f" Used parameters for calculating weighting pathways {alg_params} \n"
+                    f" Weighting pathway {pathway.name} with the terms {terms} \n"
+                )
+                outputs.append(
+                    (
+                        self.weighted_pathway_node(pathway, stack_node, terms),
+                        output_file,
+                    )
                 )
 
-                self.feedback = QgsProcessingFeedback()
-                self.feedback.progressChanged.connect(self.update_progress)
-
-                if self.processing_cancelled:
-                    return False
+            if not self.run_layer_stack_outputs(grid, outputs):
+                return False
 
-                results = processing.run(
-                    "qgis:rastercalculator",
-                    alg_params,
-                    context=self.processing_context,
-                    feedback=self.feedback,
-                )
-                pathway.path = results["OUTPUT"]
+            for pathway, terms, layers, output_file, cache_key in weighting_jobs:
+                pathway.path = output_file
+                self.store_cached_output(cache_key, pathway.path)
 
         except Exception as e:
             self.log_message(f"Problem weighting pathways, {e}\n")
@@ -2868,6 +3743,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def run_activities_cleaning(self, activities, extent=None, temporary_output=False):
         """Cleans the weighted activities replacing
         zero values with no-data as they are not statistical meaningful for the
@@ -2893,6 +3769,7 @@ class ScenarioAnalysisTask(QgsTask):
         self.set_status_message(tr("Updating activity values"))
 
         try:
+            cleaning_jobs = []
             for activity in activities:
                 if activity.path is None or activity.path == "":
                     self.set_info_message(
@@ -2940,24 +3817,29 @@ class ScenarioAnalysisTask(QgsTask):
                     "OUTPUT": output,
                 }
 
+                cleaning_jobs.append((activity, alg_params))
+
+            def clean_activity(cleaning_job, context, feedback):
+                activity, alg_params = cleaning_job
                 self.log_message(
                     f"Used parameters for "
                     f"updates on the cleaned activities: {alg_params} \n"
                 )
 
-                self.feedback = QgsProcessingFeedback()
-                self.feedback.progressChanged.connect(self.update_progress)
-
-                if self.processing_cancelled:
-                    return False
-
-                results = processing.run(
+                results = self.run_processing(
                     "native:cellstatistics",
                     alg_params,
-                    context=self.processing_context,
-                    feedback=self.feedback,
+                    context=context,
+                    feedback=feedback,
                 )
                 activity.path = results["OUTPUT"]
+                if not temporary_output:
+                    self.cloud_optimize_output(activity.path)
+
+                return True
+
+            if not self.run_parallel_jobs(cleaning_jobs, clean_activity):
+                return False
 
         except Exception as e:
             self.log_message(f"Problem cleaning activities, {e}")
@@ -2966,12 +3848,25 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
-    def create_activity_connectivity_layer(self, activity: Activity):
-        """Create an activity connectivity layer for investability analysis
+    def create_activity_connectivity_layer(
+        self,
+        activity: Activity,
+        feedback: QgsProcessingFeedback = None,
+    ):
+        """Create an activity connectivity layer for investability analysis.
+
+        The positive pixels of the activity are grouped into 8-connected
+        clusters, each cluster is scored using its pixel count multiplied by
+        its compactness (4 * pi * area / perimeter²) and the scores, added
+        to the binary activity, are normalized.
 
         :param activity: Activity
         :type activity: Activity
 
+        :param feedback: Processing feedback, a new feedback connected to the
+        task progress is used if not specified
+        :type feedback: QgsProcessingFeedback
+
         :returns: The path to the connectivity layer or None if the process failed
         :rtype: str | None
         """
@@ -3003,105 +3898,58 @@ class ScenarioAnalysisTask(QgsTask):
             f"{Path(activity.path).stem}_connectivity_{str(uuid.uuid4())[:4]}.tif",
         )
 
+        labels_path = os.path.join(
+            f"{output_directory}",
+            f"{Path(activity.path).stem}_labels_{str(uuid.uuid4())[:4]}.tif",
+        )
+
+        components = None
         try:
             if self.processing_cancelled:
                 return None
 
-            self.feedback = QgsProcessingFeedback()
-            self.feedback.progressChanged.connect(self.update_progress)
-
-            # 1. Creating a binary raster
-            binary = processing.run(
-                "qgis:rastercalculator",
-                {
-                    "CELLSIZE": 0,
-                    "LAYERS": [activity.path],
-                    "CRS": None,
-                    "EXPRESSION": f"{Path(activity.path).stem}@1 > 0",
-                    "OUTPUT": "TEMPORARY_OUTPUT",
-                },
-                context=self.processing_context,
-                feedback=self.feedback,
-            )["OUTPUT"]
-
-            # 2. Polygonize the binary to get polygon clusters
-            binary_polygonize = processing.run(
-                "gdal:polygonize",
-                {
-                    "INPUT": binary,
-                    "BAND": 1,
-                    "FIELD": "DN",
-                    "EIGHT_CONNECTEDNESS": True,
-                    "EXTRA": "",
-                    "OUTPUT": "TEMPORARY_OUTPUT",
-                },
-                context=self.processing_context,
-                feedback=self.feedback,
-            )["OUTPUT"]
-
-            if self.processing_cancelled:
+            if feedback is None:
+                self.feedback = QgsProcessingFeedback()
+                self.feedback.progressChanged.connect(self.update_progress)
+                feedback = self.feedback
+
+            # 1. Label the clusters of the binary activity, computing the
+            # pixel count and perimeter of each cluster. The labels of the
+            # sieve are reused if the activity is on the same grid.
+            tile_size = self.get_component_tile_size()
+            components = self.activity_components.pop(str(activity.uuid), None)
+            activity_grid = RasterGrid.from_path(activity.path)
+            if components is not None and (
+                activity_grid is None
+                or not activity_grid.has_same_pixels(components.grid)
+            ):
+                components.remove()
+                components = None
+
+            if components is None:
+                components = label_components(
+                    activity.path,
+                    labels_path,
+                    tile_size=tile_size,
+                    feedback=feedback,
+                )
+            if components is None:
+                self.log_message(
+                    f"Problem labelling the clusters of the activity {activity.name}"
+                )
                 return None
 
-            # 3. Create a zonal statistics to find the number of pixels in each cluster
-            zonal_statistics = processing.run(
-                "native:zonalstatisticsfb",
-                {
-                    "INPUT": QgsProcessingFeatureSourceDefinition(
-                        binary_polygonize,
-                        selectedFeaturesOnly=False,
-                        featureLimit=-1,
-                        flags=QgsProcessingFeatureSourceDefinition.Flag.FlagOverrideDefaultGeometryCheck
-                        | QgsProcessingFeatureSourceDefinition.Flag.FlagCreateIndividualOutputPerInputFeature,
-                        geometryCheck=QgsFeatureRequest.InvalidGeometryCheck.GeometryNoCheck,
-                    ),
-                    "INPUT_RASTER": binary,
-                    "RASTER_BAND": 1,
-                    "COLUMN_PREFIX": "_",
-                    "STATISTICS": [1],  # sum
-                    "OUTPUT": "TEMPORARY_OUTPUT",
-                },
-                context=self.processing_context,
-                feedback=self.feedback,
-            )["OUTPUT"]
-
-            # 4. Caculate connectivity score = count of pixels in cluster * compactness
-            score = processing.run(
-                "native:fieldcalculator",
-                {
-                    "INPUT": zonal_statistics,
-                    "FIELD_NAME": "score",
-                    "FIELD_TYPE": 0,
-                    "FIELD_LENGTH": 0,
-                    "FIELD_PRECISION": 0,
-                    "FORMULA": '"_sum"  * 4* pi() *  $area  /($perimeter * $perimeter)',
-                    "OUTPUT": "TEMPORARY_OUTPUT",
-                },
-                context=self.processing_context,
-                feedback=self.feedback,
-            )["OUTPUT"]
-
             if self.processing_cancelled:
                 return None
 
-            # 5. Rasterize the score vector
-            processing.run(
-                "gdal:rasterize_over",
-                {
-                    "INPUT": score,
-                    "INPUT_RASTER": binary,
-                    "FIELD": "score",
-                    "ADD": True,
-                    "EXTRA": "",
-                },
-                context=self.processing_context,
-                feedback=self.feedback,
+            # 2. Write the normalized connectivity scores
+            ok = write_connectivity_layer(
+                components, output_path, feedback, tile_size=tile_size
             )
-
-            # 6. Normalize the raster
-            ok, message = normalize_raster(
-                binary, output_path, self.processing_context, self.feedback
+            self.log_message(
+                f"Found {components.component_count} clusters in the activity "
+                f"{activity.name}"
             )
-            self.log_message(message)
 
             if ok and os.path.exists(output_path):
                 return output_path
@@ -3118,8 +3966,14 @@ class ScenarioAnalysisTask(QgsTask):
             )
             self.log_message(traceback.format_exc())
             self.cancel_task(e)
+        finally:
+            if components is not None:
+                components.remove()
+            elif os.path.exists(labels_path):
+                os.remove(labels_path)
         return None
 
+    @profiled_stage
     def run_investability_analysis(self) -> bool:
         """Run activity investability analysis
 
@@ -3136,10 +3990,12 @@ class ScenarioAnalysisTask(QgsTask):
         )
         FileUtils.create_new_dir(investable_activities)
 
-        self.feedback = QgsProcessingFeedback()
-        self.feedback.progressChanged.connect(self.update_progress)
+        connectivity_enabled = self.get_settings_value(
+            Settings.PIXEL_CONNECTIVITY_ENABLED, default=True, setting_type=bool
+        )
 
         try:
+            investability_jobs = []
             for activity in self.analysis_activities:
                 if activity.path is None or activity.path == "":
                     self.log_message(
@@ -3156,11 +4012,6 @@ class ScenarioAnalysisTask(QgsTask):
                     )
                     return False
 
-                layers = [activity.path]
-
-                activity_basename = Path(activity.path).stem
-                expression_items = [f'("{activity_basename}@1")']
-
                 constant_raster_components = (
                     constant_raster_registry.activity_components(
                         activity_identifier=str(activity.uuid)
@@ -3185,15 +4036,19 @@ class ScenarioAnalysisTask(QgsTask):
                 if constant_rasters is None:
                     constant_rasters = []
 
-                if self.processing_cancelled:
-                    return False
+                output_path = os.path.join(
+                    f"{investable_activities}",
+                    f"{Path(activity.path).stem}_invest_{str(uuid.uuid4())[:4]}.tif",
+                )
+                investability_jobs.append((activity, constant_rasters, output_path))
 
-                if self.get_settings_value(
-                    Settings.PIXEL_CONNECTIVITY_ENABLED, default=True, setting_type=bool
-                ):
+            def calculate_investability(investability_job, context, feedback):
+                activity, constant_rasters, output_path = investability_job
+
+                if connectivity_enabled:
                     # Add connectivity layer
                     connectivity_path = self.create_activity_connectivity_layer(
-                        activity=activity
+                        activity=activity, feedback=feedback
                     )
                     if connectivity_path and os.path.exists(connectivity_path):
                         constant_rasters.append(
@@ -3208,6 +4063,9 @@ class ScenarioAnalysisTask(QgsTask):
                             f"Invalid path for connectivity layer of activity {activity.name}"
                         )
 
+                if self.processing_cancelled:
+                    return False
+
                 nr_constant_rasters = len(constant_rasters)
 
                 if nr_constant_rasters == 0:
@@ -3215,12 +4073,14 @@ class ScenarioAnalysisTask(QgsTask):
                         f"No defined constant rasters, "
                         f"Skipping investability analysis for the activity {activity.name}"
                     )
-                    continue
+                    return True
 
+                constant_value = 0.0
+                raster_paths = []
                 for constant_raster in constant_rasters:
                     if "normalized" in constant_raster:
-                        expression_items.append(
-                            str(constant_raster.get("normalized") / nr_constant_rasters)
+                        constant_value += (
+                            constant_raster.get("normalized") / nr_constant_rasters
                         )
                     else:
                         path = constant_raster.get("path", "")
@@ -3230,70 +4090,44 @@ class ScenarioAnalysisTask(QgsTask):
                                 f"Skipping from the investability analysis for the activity {activity.name}"
                             )
                             continue
+                        raster_paths.append(path)
 
-                        normalized_path = os.path.join(
-                            f"{investable_activities}",
-                            f"{Path(path).stem}_norm_{str(uuid.uuid4())[:4]}.tif",
-                        )
-
-                        if self.processing_cancelled:
-                            return False
-
-                        ok, log = normalize_raster(
-                            input_raster_path=path,
-                            output_raster_path=normalized_path,
-                            processing_context=self.processing_context,
-                            feedback=self.feedback,
-                        )
-                        self.log_message(log)
-                        if not ok:
-                            self.log_message(
-                                f"Skipping {path} from the investability analysis for the activity {activity.name}"
-                            )
-                            continue
-
-                        if os.path.exists(normalized_path):
-                            path = normalized_path
-
-                        layers.append(path)
-                        expression_items.append(
-                            f'("{Path(path).stem}@1" / {nr_constant_rasters})'
-                        )
+                grid = self.get_stack_grid(activity.path)
+                if grid is None:
+                    self.log_message(
+                        f"Unable to define the grid of the investability "
+                        f"analysis for activity {activity.name}"
+                    )
+                    return False
 
-                output_path = os.path.join(
-                    f"{investable_activities}",
-                    f"{Path(activity.path).stem}_invest_{str(uuid.uuid4())[:4]}.tif",
+                node = self.investability_node(
+                    activity, constant_value, raster_paths, nr_constant_rasters
                 )
-
-                alg_params = {
-                    "CELLSIZE": 0,
-                    "CRS": None,
-                    "EXPRESSION": " + ".join(expression_items),
-                    "LAYERS": layers,
-                    "OUTPUT": output_path,
-                }
-
                 self.log_message(
-                    f" Used parameters for calculating investability for activity {activity.name}, "
-                    f"{alg_params} \n"
+                    f" Calculating investability for activity {activity.name} "
+                    f"from the layers {node.inputs[0].paths} and the constant "
+                    f"value {constant_value} \n"
                 )
 
                 if self.processing_cancelled:
                     return False
 
-                result = processing.run(
-                    "qgis:rastercalculator",
-                    alg_params,
-                    context=self.processing_context,
-                    feedback=self.feedback,
-                )
-
-                if result.get("OUTPUT"):
-                    activity.path = result.get("OUTPUT")
+                if self.run_layer_stack_outputs(
+                    grid, [(node, output_path)], feedback=feedback
+                ):
+                    activity.path = output_path
+                elif self.processing_cancelled:
+                    return False
                 else:
                     self.log_message(
                         f"Problem calculating investability for activity {activity.name}"
                     )
+
+                return True
+
+            if not self.run_parallel_jobs(investability_jobs, calculate_investability):
+                return False
+
         except Exception as e:
             self.log_message(f"Problem calculating activity investability, {e} \n")
             self.log_message(traceback.format_exc())
@@ -3302,6 +4136,7 @@ class ScenarioAnalysisTask(QgsTask):
 
         return True
 
+    @profiled_stage
     def run_highest_position_analysis(self, temporary_output=False):
         """Runs the highest position analysis which is last step
         in scenario analysis. Uses the activities set by the current ongoing
@@ -3319,14 +4154,6 @@ class ScenarioAnalysisTask(QgsTask):
             # Will not proceed if processing has been cancelled by the user
             return False
 
-        passed_extent_box = self.analysis_extent.bbox
-        passed_extent = QgsRectangle(
-            passed_extent_box[0],
-            passed_extent_box[2],
-            passed_extent_box[1],
-            passed_extent_box[3],
-        )
-
         # We explicitly set the created_date since the current implementation
         # of the data model means that the attribute value is set only once when
         # the class is loaded hence subsequent instances will have the same value.
@@ -3351,15 +4178,6 @@ class ScenarioAnalysisTask(QgsTask):
                     for pathway in activity.pathways:
                         layers[activity.name] = QgsRasterLayer(pathway.path)
 
-            source_crs = QgsCoordinateReferenceSystem.fromEpsgId(DEFAULT_CRS_ID)
-            dest_crs = list(layers.values())[0].crs() if len(layers) > 0 else source_crs
-
-            extent_string = (
-                f"{passed_extent.xMinimum()},{passed_extent.xMaximum()},"
-                f"{passed_extent.yMinimum()},{passed_extent.yMaximum()}"
-                f" [{dest_crs.authid()}]"
-            )
-
             output_file = os.path.join(
                 self.scenario_directory,
                 f"{SCENARIO_OUTPUT_FILE_NAME}_{str(self.scenario.uuid)[:4]}.tif",
@@ -3385,23 +4203,25 @@ class ScenarioAnalysisTask(QgsTask):
                 f"Layers sources {[Path(source).stem for source in sources]}"
             )
 
-            output_file = (
-                QgsProcessing.TEMPORARY_OUTPUT if temporary_output else output_file
-            )
+            if temporary_output:
+                output_file = QgsProcessingUtils.generateTempFilename(
+                    os.path.basename(output_file)
+                )
 
-            alg_params = {
-                "IGNORE_NODATA": True,
-                "INPUT_RASTERS": sources,
-                "EXTENT": extent_string,
-                "OUTPUT_NODATA_VALUE": self.no_data_value,
-                "REFERENCE_LAYER": list(layers.values())[0]
-                if len(layers) >= 1
-                else None,
-                "OUTPUT": output_file,
-            }
+            # The output covers the snapped analysis extent of the analysis
+            # grid. When the layers were prepared without it, the grid of
+            # the first activity layer is used, which matches the extent of
+            # the snapped and clipped layers.
+            grid = self.get_stack_grid(sources[0] if sources else None)
+            if grid is None:
+                self.log_message(
+                    "Unable to define the grid of the highest position analysis."
+                )
+                return False
 
             self.log_message(
-                f"Used parameters for highest position analysis {alg_params} \n"
+                f"Highest position analysis on a grid of {grid.width} x {grid.height} "
+                f"pixels, output {output_file} \n"
             )
 
             self.feedback = QgsProcessingFeedback()
@@ -3410,12 +4230,21 @@ class ScenarioAnalysisTask(QgsTask):
             if self.processing_cancelled:
                 return False
 
-            self.output = processing.run(
-                "native:highestpositioninrasterstack",
-                alg_params,
-                context=self.processing_context,
+            sink, area_reducer = self.highest_position_outputs(
+                grid, [RasterSourceNode(source) for source in sources], output_file
+            )
+            pipeline = BlockPipeline(
+                grid,
                 feedback=self.feedback,
+                is_cancelled=lambda: self.processing_cancelled,
+                memory_budget=self.get_arrays_memory_budget(),
             )
+            if not pipeline.run([sink], [area_reducer]):
+                return False
+
+            write_area_sidecar(area_reducer.area_info)
+
+            self.output = {"OUTPUT": output_file}
 
         except Exception as err:
             self.log_message(
@@ -3428,3 +4257,724 @@ class ScenarioAnalysisTask(QgsTask):
             return False
 
         return True
+
+    def create_analysis_grid(
+        self,
+        extent: QgsRectangle,
+        crs: QgsCoordinateReferenceSystem,
+        nodata_value: float,
+    ) -> typing.Optional[RasterGrid]:
+        """Creates the grid used by the block processing. The grid covers
+        the given extent and uses the resolution of the reference layer,
+        if snapping is enabled, or the first valid pathway or activity layer.
+
+        :param extent: Snapped analysis extent
+        :type extent: QgsRectangle
+
+        :param crs: Analysis CRS
+        :type crs: QgsCoordinateReferenceSystem
+
+        :param nodata_value: NoData value of the grid
+        :type nodata_value: float
+
+        :returns: The analysis grid or None if there is no valid layer
+        to get the resolution from.
+        :rtype: RasterGrid
+        """
+        reference_layer = self.get_reference_layer()
+        paths = [reference_layer] if reference_layer else []
+        for activity in self.analysis_activities:
+            if activity.path:
+                paths.append(activity.path)
+            paths.extend(
+                [pathway.path for pathway in activity.pathways if pathway is not None]
+            )
+
+        for path in paths:
+            layer = QgsRasterLayer(path, "grid_reference")
+            if not layer.isValid() or layer.width() == 0 or layer.height() == 0:
+                continue
+
+            layer_extent = layer.extent()
+            if layer.crs() != crs:
+                transform = QgsCoordinateTransform(
+                    layer.crs(), crs, QgsProject.instance()
+                )
+                layer_extent = transform.transformBoundingBox(layer_extent)
+
+            return RasterGrid.from_extent(
+                extent,
+                layer_extent.width() / layer.width(),
+                layer_extent.height() / layer.height(),
+                crs,
+                nodata_value,
+            )
+
+        return None
+
+    def get_block_mask_paths(
+        self, mask_paths: typing.List[str], crs: QgsCoordinateReferenceSystem
+    ) -> typing.List[str]:
+        """Gets the mask layers that can be rasterized on the analysis grid.
+        Similar to the masking stages, invalid, non-polygon and layers
+        with a different CRS from the analysis are skipped.
+
+        :param mask_paths: Paths to the mask layers
+        :type mask_paths: list
+
+        :param crs: Analysis CRS
+        :type crs: QgsCoordinateReferenceSystem
+
+        :returns: Paths to the mask datasets to be used.
+        :rtype: list
+        """
+        valid_paths = []
+        for mask_path in mask_paths:
+            mask_layer = QgsVectorLayer(mask_path, "mask", "ogr")
+            if not mask_layer.isValid():
+                self.log_message(
+                    f"Skipping masking using layer {mask_path}, not a valid layer."
+                )
+                continue
+
+            # see https://qgis.org/pyqgis/master/core/Qgis.html#qgis.core.Qgis.GeometryType
+            if Qgis.versionInt() < 33000:
+                layer_check = (
+                    mask_layer.geometryType()
+                    == QgsWkbTypes.GeometryType.PolygonGeometry
+                )
+            else:
+                layer_check = mask_layer.geometryType() == Qgis.GeometryType.Polygon
+
+            if not layer_check:
+                self.log_message(
+                    f"Skipping masking using layer {mask_path}, not a polygon layer."
+                )
+                continue
+
+            if mask_layer.crs() != crs:
+                self.log_message(
+                    f"Skipping masking using layer {mask_path}, the mask layer"
+                    f" crs does not match the scenario crs."
+                )
+                continue
+
+            valid_paths.append(mask_path.split("|")[0])
+
+        return valid_paths
+
+    @profiled_stage
+    def run_block_pipeline(
+        self,
+        grid: typing.Optional[RasterGrid],
+        crs: QgsCoordinateReferenceSystem,
+    ) -> bool:
+        """Runs the scenario analysis stages after the data preparation
+        (weighting, activity creation, normalization, masking, cleaning,
+        investability and the highest position) block by block in memory.
+
+        Stages are fused into a few passes over the analysis grid so that
+        the intermediate layers are not written to disk. The sieve and the
+        connectivity layer require the whole activity layer hence they
+        are run using the processing algorithms in between the passes.
+
+        :param grid: Analysis grid created from the snapped analysis extent
+        :type grid: RasterGrid
+
+        :param crs: Analysis CRS
+        :type crs: QgsCoordinateReferenceSystem
+
+        :returns: Whether the task operations was successful
+        :rtype: bool
+        """
+        if self.processing_cancelled:
+            return False
+
+        self.set_status_message(tr("Running the scenario analysis in memory"))
+
+        nodata_value = float(
+            self.get_settings_value(
+                Settings.NCS_NO_DATA_VALUE, default=NO_DATA_VALUE, setting_type=float
+            )
+        )
+
+        if grid is None:
+            self.log_message(
+                "Unable to create the analysis grid, no valid pathway "
+                "or activity layer found for the block processing."
+            )
+            return False
+
+        self.log_message(
+            f"Running block processing on a grid of {grid.width} x {grid.height} "
+            f"pixels, resolution {grid.x_resolution}, {grid.y_resolution} \n"
+        )
+
+        pipeline = BlockPipeline(
+            grid,
+            is_cancelled=lambda: self.processing_cancelled,
+            memory_budget=self.get_arrays_memory_budget(),
+        )
+
+        def run_pass(sinks, reducers=None) -> bool:
+            self.feedback = QgsProcessingFeedback()
+            self.feedback.progressChanged.connect(self.update_progress)
+            pipeline.feedback = self.feedback
+
+            return pipeline.run(sinks, reducers)
+
+        try:
+            # Weighting of the pathways and creation of the activities
+            self.set_status_message(tr("Weighting of pathways and creating activities"))
+
+            pathways: typing.List[NcsPathway] = []
+            for activity in self.analysis_activities:
+                if not activity.pathways and not activity.path:
+                    msg = (
+                        f"No defined activity pathways or an "
+                        f"activity layer for the activity {activity.name}"
+                    )
+                    self.set_info_message(tr(msg), level=Qgis.MessageLevel.Critical)
+                    self.log_message(msg)
+                    return False
+
+                for pathway in activity.pathways:
+                    if pathway not in pathways:
+                        pathways.append(pathway)
+
+            if len(pathways) > 0:
+                self.run_normalize_pathways_carbon_impact(pathways)
+
+            relative_impact_matrix = self.get_relative_impact_matrix()
+            settings_priority_layers = self.get_priority_layers()
+            save_weighted = self.get_settings_value(
+                Settings.NCS_WEIGHTED, default=True, setting_type=bool
+            )
+            weighted_pathways_directory = os.path.join(
+                self.scenario_directory, "weighted_pathways"
+            )
+            FileUtils.create_new_dir(weighted_pathways_directory)
+
+            pathway_terms = {
+                str(pathway.uuid): self.get_pathway_weighting_terms(
+                    pathway,
+                    self.analysis_priority_layers_groups,
+                    settings_priority_layers,
+                    relative_impact_matrix,
+                )
+                for pathway in pathways
+            }
+            # The pathways and PWLs are read once per window from one stack
+            stack_node = LayerStackNode(
+                [pathway.path for pathway in pathways]
+                + [term["path"] for terms in pathway_terms.values() for term in terms]
+                + [
+                    activity.path
+                    for activity in self.analysis_activities
+                    if activity.path
+                ]
+            )
+
+            sinks = []
+            pathway_nodes = {}
+            pathway_outputs = []
+            for pathway in pathways:
+                node = WeightedSumNode(
+                    stack_node, {pathway.path: 1.0}, name=pathway.name
+                )
+                terms = pathway_terms[str(pathway.uuid)]
+                if terms or pathway.suitability_index > 0:
+                    node = self.weighted_pathway_node(pathway, stack_node, terms)
+                    if save_weighted:
+                        file_name = clean_filename(pathway.name.replace(" ", "_"))
+                        output_file = os.path.join(
+                            weighted_pathways_directory,
+                            f"{file_name}_{str(uuid.uuid4())[:4]}.tif",
+                        )
+                        sinks.append(
+                            RasterSink(
+                                node,
+                                output_file,
+                                nodata=nodata_value,
+                                cloud_optimized=True,
+                            )
+                        )
+                        pathway_outputs.append((pathway, output_file))
+                pathway_nodes[str(pathway.uuid)] = node
+
+            save_activities = self.get_settings_value(
+                Settings.LANDUSE_PROJECT, default=True, setting_type=bool
+            )
+            activities_directory = os.path.join(self.scenario_directory, "activities")
+            FileUtils.create_new_dir(activities_directory)
+
+            activity_nodes = {}
+            reducers = {}
+            activity_outputs = []
+            for activity in self.analysis_activities:
+                inputs = []
+                if activity.path:
+                    inputs.append(WeightedSumNode(stack_node, {activity.path: 1.0}))
+                for pathway in activity.pathways:
+                    inputs.append(pathway_nodes[str(pathway.uuid)])
+
+                node = FunctionNode(lambda *arrays: nan_sum(arrays), inputs)
+                activity_nodes[str(activity.uuid)] = node
+                reducers[str(activity.uuid)] = MinMaxReducer(node)
+
+                if save_activities:
+                    file_name = clean_filename(activity.name.replace(" ", "_"))
+                    output_file = os.path.join(
+                        activities_directory, f"{file_name}_{str(uuid.uuid4())[:4]}.tif"
+                    )
+                    sinks.append(
+                        RasterSink(
+                            node, output_file, nodata=nodata_value, cloud_optimized=True
+                        )
+                    )
+                    activity_outputs.append((activity, output_file))
+
+            if not run_pass(sinks, list(reducers.values())):
+                return False
+
+            for pathway, output_file in pathway_outputs:
+                pathway.path = output_file
+
+            for activity, output_file in activity_outputs:
+                activity.path = output_file
+                # Read the saved activity instead of recomputing it
+                activity_nodes[str(activity.uuid)] = RasterSourceNode(output_file)
+
+            # Normalization and masking of the activities
+            self.set_status_message(tr("Normalizing and masking activities"))
+
+            sieve_enabled = self.get_settings_value(
+                Settings.SIEVE_ENABLED, default=False, setting_type=bool
+            )
+            global_mask_paths = self.get_block_mask_paths(
+                self.get_masking_layers(), crs
+            )
+            global_mask_node = (
+                VectorMaskNode(global_mask_paths) if global_mask_paths else None
+            )
+
+            sinks = []
+            masked_outputs = []
+            for activity in self.analysis_activities:
+                node = activity_nodes[str(activity.uuid)]
+                reducer = reducers[str(activity.uuid)]
+                if reducer.minimum is None or reducer.maximum is None:
+                    self.log_message(
+                        f"Activity layer {activity.name} has no valid "
+                        f"statistics, skipping the layer from normalization."
+                    )
+                elif reducer.minimum >= 0 and reducer.maximum <= 1:
+                    self.log_message(
+                        f"Activity layer {activity.name} is already normalized "
+                        f"(min={reducer.minimum}, max={reducer.maximum}), "
+                        f"skipping the layer from normalization."
+                    )
+                else:
+                    self.log_message(f"Normalizing {activity.name} activity layer \n")
+                    node = FunctionNode(
+                        lambda values, minimum=reducer.minimum, maximum=reducer.maximum: rescale(
+                            values, minimum, maximum
+                        ),
+                        [node],
+                    )
+
+                mask_nodes = [global_mask_node] if global_mask_node else []
+                activity_mask_paths = self.get_block_mask_paths(
+                    activity.mask_paths, crs
+                )
+                if activity_mask_paths:
+                    mask_nodes.append(VectorMaskNode(activity_mask_paths))
+                if mask_nodes:
+                    node = FunctionNode(
+                        lambda values, *masks: np.where(
+                            np.logical_or.reduce(masks), np.nan, values
+                        ),
+                        [node] + mask_nodes,
+                    )
+
+                file_name = clean_filename(activity.name.replace(" ", "_"))
+                if sieve_enabled:
+                    output_file = os.path.join(
+                        self.scenario_directory,
+                        "final_masked_activities",
+                        f"{file_name}_{str(uuid.uuid4())[:4]}.tif",
+                    )
+                    sinks.append(RasterSink(node, output_file, nodata=nodata_value))
+                else:
+                    output_file = os.path.join(
+                        weighted_pathways_directory,
+                        f"{file_name}_{str(uuid.uuid4())[:4]}_cleaned.tif",
+                    )
+                    sinks.append(
+                        RasterSink(
+                            self.cleaned_activity_node(node),
+                            output_file,
+                            nodata=0,
+                            cloud_optimized=True,
+                        )
+                    )
+                masked_outputs.append((activity, output_file))
+
+            if not run_pass(sinks):
+                return False
+
+            for activity, output_file in masked_outputs:
+                activity.path = output_file
+
+            if sieve_enabled:
+                # The sieve requires the whole activity layer
+                self.run_activities_sieve(self.analysis_activities)
+
+                self.set_status_message(tr("Updating activity values"))
+                sinks = []
+                cleaned_outputs = []
+                for activity in self.analysis_activities:
+                    file_name = clean_filename(activity.name.replace(" ", "_"))
+                    output_file = os.path.join(
+                        weighted_pathways_directory,
+                        f"{file_name}_{str(uuid.uuid4())[:4]}_cleaned.tif",
+                    )
+                    node = self.cleaned_activity_node(RasterSourceNode(activity.path))
+                    sinks.append(
+                        RasterSink(node, output_file, nodata=0, cloud_optimized=True)
+                    )
+                    cleaned_outputs.append((activity, output_file))
+
+                if not run_pass(sinks):
+                    return False
+
+                for activity, output_file in cleaned_outputs:
+                    activity.path = output_file
+
+            # Investability and the highest position analysis
+            investability_nodes = {}
+            sinks = []
+            investable_outputs = []
+            for activity in self.analysis_activities:
+                if self.processing_cancelled:
+                    return False
+
+                node, output_file = self.investable_activity_node(activity)
+                if output_file is not None:
+                    sinks.append(
+                        RasterSink(
+                            node, output_file, nodata=nodata_value, cloud_optimized=True
+                        )
+                    )
+                    investable_outputs.append((activity, output_file))
+                investability_nodes[str(activity.uuid)] = node
+
+            self.remove_activity_components()
+
+            self.set_status_message(tr("Calculating the highest position"))
+
+            # We explicitly set the created_date since the current implementation
+            # of the data model means that the attribute value is set only once when
+            # the class is loaded hence subsequent instances will have the same value.
+            self.scenario_result = ScenarioResult(
+                scenario=self.scenario,
+                scenario_directory=self.scenario_directory,
+                created_date=datetime.datetime.now(),
+            )
+
+            all_activities = sorted(
+                self.analysis_activities,
+                key=lambda activity_instance: activity_instance.style_pixel_value,
+            )
+            for index, activity in enumerate(all_activities):
+                activity.style_pixel_value = index + 1
+
+            output_file = os.path.join(
+                self.scenario_directory,
+                f"{SCENARIO_OUTPUT_FILE_NAME}_{str(self.scenario.uuid)[:4]}.tif",
+            )
+            highest_position_sink, area_reducer = self.highest_position_outputs(
+                grid,
+                [
+                    investability_nodes[str(activity.uuid)]
+                    for activity in all_activities
+                ],
+                output_file,
+            )
+            sinks.append(highest_position_sink)
+
+            if not run_pass(sinks, [area_reducer]):
+                return False
+
+            write_area_sidecar(area_reducer.area_info)
+
+            for activity, investable_output in investable_outputs:
+                activity.path = investable_output
+
+            self.output = {"OUTPUT": output_file}
+
+        except Exception as e:
+            self.log_message(f"Problem running the block processing, {e} \n")
+            self.log_message(traceback.format_exc())
+            self.cancel_task(e)
+            return False
+
+        return True
+
+    def highest_position_outputs(
+        self,
+        grid: RasterGrid,
+        activity_nodes: typing.List[BlockNode],
+        output_file: str,
+    ) -> typing.Tuple[RasterSink, PixelAreaReducer]:
+        """Creates the sink of the highest position output and the reducer
+        that accumulates the area of each activity while it is written.
+
+        :param grid: Analysis grid
+        :type grid: RasterGrid
+
+        :param activity_nodes: Activity nodes ordered by the style pixel value
+        :type activity_nodes: list
+
+        :param output_file: Path of the highest position output
+        :type output_file: str
+
+        :returns: The output sink and the area reducer.
+        :rtype: tuple
+        """
+        highest_position_node = FunctionNode(
+            lambda *arrays: highest_position(arrays), activity_nodes
+        )
+        # Positions start at 1, zero is used as the NoData value when
+        # the configured one does not fit in the output data type.
+        data_type = smallest_integer_type(0, len(activity_nodes))
+        nodata = float(self.no_data_value)
+        if not value_fits(data_type, nodata):
+            nodata = 0.0
+        sink = RasterSink(
+            highest_position_node,
+            output_file,
+            data_type=data_type,
+            nodata=nodata,
+            cloud_optimized=True,
+            categorical=True,
+        )
+        crs = QgsCoordinateReferenceSystem.fromWkt(grid.crs_wkt)
+        area_reducer = PixelAreaReducer(
+            highest_position_node, output_file, pixel_row_areas(grid, crs)
+        )
+
+        return sink, area_reducer
+
+    @staticmethod
+    def weighted_pathway_node(
+        pathway: NcsPathway, stack_node: LayerStackNode, terms: typing.List[dict]
+    ) -> BlockNode:
+        """Creates the block node that weights the pathway with the formula
+        (suitability_index * pathway) * (sum of the weighting terms).
+
+        The terms are linear in the PWLs, an inverted term
+        coefficient * (PWL - 1) * -1 being coefficient - coefficient * PWL,
+        hence they are evaluated as one weighted sum of the stacked PWLs.
+
+        :param pathway: Pathway to be weighted
+        :type pathway: NcsPathway
+
+        :param stack_node: Stack node with the pathway and PWL layers
+        :type stack_node: LayerStackNode
+
+        :param terms: Weighting terms from `get_pathway_weighting_terms`
+        :type terms: list
+
+        :returns: Weighted pathway node.
+        :rtype: BlockNode
+        """
+        factor = pathway.suitability_index if pathway.suitability_index > 0 else 1.0
+        if len(terms) == 0:
+            return WeightedSumNode(
+                stack_node, {pathway.path: factor}, name=pathway.name
+            )
+
+        weights = {}
+        offset = 0.0
+        for term in terms:
+            weight = term["coefficient"]
+            if term["multiplier"] is not None:
+                weight *= term["multiplier"]
+            if term["inverse"]:
+                offset += weight
+                weight = -weight
+            weights[term["path"]] = weights.get(term["path"], 0.0) + weight
+
+        return WeightedSumNode(
+            stack_node,
+            {path: factor * weight for path, weight in weights.items()},
+            offset=factor * offset,
+            multiplier_path=pathway.path,
+            name=pathway.name,
+        )
+
+    @staticmethod
+    def cleaned_activity_node(activity_node: BlockNode) -> BlockNode:
+        """Creates the block node that replaces the zero values of the
+        activity with nodata, similar to `run_activities_cleaning`.
+
+        :param activity_node: Node with the activity values
+        :type activity_node: BlockNode
+
+        :returns: Cleaned activity node.
+        :rtype: BlockNode
+        """
+        return FunctionNode(
+            lambda values: np.where(values == 0, np.nan, values), [activity_node]
+        )
+
+    def investable_activity_node(
+        self, activity: Activity
+    ) -> typing.Tuple[BlockNode, typing.Optional[str]]:
+        """Creates the block node that calculates the activity
+        investability using the same formula as `run_investability_analysis`.
+
+        :param activity: Cleaned activity
+        :type activity: Activity
+
+        :returns: The investability node and its output path. If the
+        activity has no constant rasters, the activity node and None
+        are returned.
+        :rtype: tuple
+        """
+        activity_node = RasterSourceNode(activity.path)
+
+        investable_activities = os.path.join(
+            self.scenario_directory, "investable_activities"
+        )
+        FileUtils.create_new_dir(investable_activities)
+
+        constant_raster_components = constant_raster_registry.activity_components(
+            activity_identifier=str(activity.uuid)
+        )
+        # Registry components are added as constant values
+        normalized_values = [
+            component.value_info.normalized for component in constant_raster_components
+        ]
+        raster_paths = []
+
+        if self.get_settings_value(
+            Settings.PIXEL_CONNECTIVITY_ENABLED, default=True, setting_type=bool
+        ):
+            # The connectivity layer requires the whole activity layer
+            connectivity_path = self.create_activity_connectivity_layer(
+                activity=activity
+            )
+            if connectivity_path and os.path.exists(connectivity_path):
+                raster_paths.append(connectivity_path)
+            else:
+                self.log_message(
+                    f"Invalid path for connectivity layer of activity {activity.name}"
+                )
+
+        nr_constant_rasters = len(normalized_values) + len(raster_paths)
+        if nr_constant_rasters == 0:
+            self.log_message(
+                f"No defined constant rasters, "
+                f"Skipping investability analysis for the activity {activity.name}"
+            )
+            return activity_node, None
+
+        constant_value = sum(normalized_values) / nr_constant_rasters
+
+        output_path = os.path.join(
+            f"{investable_activities}",
+            f"{Path(activity.path).stem}_invest_{str(uuid.uuid4())[:4]}.tif",
+        )
+
+        return (
+            self.investability_node(
+                activity, constant_value, raster_paths, nr_constant_rasters
+            ),
+            output_path,
+        )
+
+    def investability_node(
+        self,
+        activity: Activity,
+        constant_value: float,
+        raster_paths: typing.List[str],
+        nr_constant_rasters: int,
+    ) -> BlockNode:
+        """Creates the block node of the activity investability, the sum
+        of the activity, the constant value and the normalized rasters
+        divided by the number of constant rasters.
+
+        The normalization is linear so the investability is evaluated as
+        one weighted sum of a stack of the activity and the rasters.
+
+        :param activity: Cleaned activity
+        :type activity: Activity
+
+        :param constant_value: Sum of the normalized constant values
+        divided by the number of constant rasters
+        :type constant_value: float
+
+        :param raster_paths: Paths of the rasters to be normalized
+        :type raster_paths: list
+
+        :param nr_constant_rasters: Number of constant values and rasters
+        :type nr_constant_rasters: int
+
+        :returns: Investability node.
+        :rtype: BlockNode
+        """
+        weights = {activity.path: 1.0}
+        offset = constant_value
+        for path in raster_paths:
+            coefficients = self.normalization_coefficients(path)
+            if coefficients is None:
+                self.log_message(
+                    f"Skipping {path} from the investability analysis for the activity {activity.name}"
+                )
+                continue
+
+            scale, shift = coefficients
+            weights[path] = weights.get(path, 0.0) + scale / nr_constant_rasters
+            offset += shift / nr_constant_rasters
+
+        return WeightedSumNode(
+            LayerStackNode(list(weights.keys())),
+            weights,
+            offset=offset,
+            name=activity.name,
+        )
+
+    @staticmethod
+    def normalization_coefficients(
+        path: str,
+    ) -> typing.Optional[typing.Tuple[float, float]]:
+        """Gets the scale and offset that normalize the raster values
+        using the raster statistics, as done by `normalize_raster`.
+
+        :param path: Raster path
+        :type path: str
+
+        :returns: The (scale, offset) of the normalized values
+        scale * value + offset or None if the raster has no valid
+        statistics.
+        :rtype: tuple
+        """
+        band_statistics = get_raster_statistics(path)
+        if band_statistics is None or band_statistics.is_empty:
+            return None
+
+        min_value = band_statistics.minimum
+        max_value = band_statistics.maximum
+        if min_value is None or max_value is None or max_value < min_value:
+            return None
+
+        if min_value >= 0 and max_value <= 1:
+            return 1.0, 0.0
+
+        if min_value == max_value:
+            # Treat layer as a constant raster when min and max value is equal
+            return 1.0 / min_value, 0.0
+
+        return 1.0 / (max_value - min_value), -min_value / (max_value - min_value)
@@ -12,7 +12,6 @@
 """
 import dataclasses
 import gzip
-import hashlib
 import json
 import os
 import typing
@@ -34,6 +33,7 @@ from .constants import TIMEOUT
 from .logger import log
 from .worker import AbstractWorker
 from .worker import start_worker
+from ..lib.fingerprint import file_fingerprint
 
 
 @dataclasses.dataclass()
@@ -95,7 +95,7 @@ class tr_download:
 
 def local_check_hash_against_etag(path: Path, expected: str) -> bool:
     try:
-        path_hash = hashlib.md5(path.read_bytes()).hexdigest()
+        path_hash = file_fingerprint(str(path), "md5")
     except FileNotFoundError:
         result = False
     else:
@@ -124,8 +124,7 @@ def check_hash_against_etag(url, filename, expected=None):
             else:
                 raise NotImplementedError
 
-    with open(filename, "rb") as f:
-        md5hash = hashlib.md5(f.read()).hexdigest()
+    md5hash = file_fingerprint(filename, "md5")
 
     if md5hash == expected:
         log("File hash verified for {}".format(filename))
@@ -3,7 +3,6 @@
     Plugin utilities
 """
 
-import hashlib
 import json
 import math
 import os
@@ -24,15 +23,11 @@ from qgis.core import (
     Qgis,
     QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
-    QgsCoordinateTransformContext,
-    QgsDistanceArea,
     QgsMessageLog,
     QgsProcessingFeedback,
     QgsProcessingContext,
     QgsProject,
-    QgsProcessing,
     QgsRasterLayer,
-    QgsUnitTypes,
     Qgis,
 )
 
@@ -371,53 +366,19 @@ def calculate_raster_area_by_pixel_value(
     or if it is empty.
     :rtype: float
     """
+    # Imported here as the raster helpers depend on this module
+    from .lib.raster.area import calculate_raster_area_info
+
     if not layer.isValid():
         log("Invalid layer for raster area calculation.", info=False)
         return {}
 
-    algorithm_name = "native:rasterlayeruniquevaluesreport"
-    params = {
-        "INPUT": layer,
-        "BAND": band_number,
-        "OUTPUT_TABLE": "TEMPORARY_OUTPUT",
-        "OUTPUT_HTML_FILE": QgsProcessing.TEMPORARY_OUTPUT,
-    }
-
-    algorithm_result = processing.run(algorithm_name, params, feedback=feedback)
-
-    # Get number of pixels with values
-    total_pixel_count = algorithm_result["TOTAL_PIXEL_COUNT"]
-    if total_pixel_count == 0:
+    area_info = calculate_raster_area_info(layer, band_number, feedback)
+    if area_info is None or area_info.valid_pixel_count == 0:
         log("Input layer for raster area calculation is empty.", info=False)
         return {}
 
-    output_table = algorithm_result["OUTPUT_TABLE"]
-    if output_table is None:
-        log("Unique values raster table could not be retrieved.", info=False)
-        return {}
-
-    area_calc = QgsDistanceArea()
-    crs = layer.crs()
-    area_calc.setSourceCrs(crs, QgsCoordinateTransformContext())
-    if crs is not None:
-        # Use ellipsoid calculation if available
-        area_calc.setEllipsoid(crs.ellipsoidAcronym())
-
-    version = Qgis.versionInt()
-    if version < 33000:
-        unit_type = QgsUnitTypes.AreaUnit.AreaHectares
-    else:
-        unit_type = Qgis.AreaUnit.Hectares
-
-    pixel_areas = {}
-    features = output_table.getFeatures()
-    for f in features:
-        pixel_value = f.attribute(0)
-        area = f.attribute(2)
-        pixel_value_area = area_calc.convertAreaMeasurement(area, unit_type)
-        pixel_areas[pixel_value] = pixel_value_area
-
-    return pixel_areas
+    return area_info.pixel_areas
 
 
 def calculate_raster_area(
@@ -452,13 +413,6 @@ def calculate_raster_area(
     if len(area_by_pixel_value) == 0:
         return -1.0
 
-    # Remove NoData pixels from the computation, just in case the process
-    # calculation might have sneaked it in.
-    if layer.dataProvider().sourceHasNoDataValue(band_number):
-        no_data_value = layer.dataProvider().sourceNoDataValue(band_number)
-        if no_data_value in area_by_pixel_value:
-            del area_by_pixel_value[no_data_value]
-
     return float(sum(area_by_pixel_value.values()))
 
 
@@ -891,13 +845,12 @@ def todict(obj, classkey=None):
 
 def md5(fname):
     """
-    Get md5 checksum off a file
+    Get md5 checksum off a file, the checksum is only computed
+    again if the file has changed.
     """
-    hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    from .lib.fingerprint import file_fingerprint
+
+    return file_fingerprint(fname, "md5")
 
 
 def get_layer_type(file_path: str):
@@ -1208,16 +1161,21 @@ def normalize_raster(
     :param feedback: Qgis processing feedback
     :type feedback: QgsProcessingFeedback
     """
+    # Imported here as the raster helpers depend on this module
+    from .lib.raster.statistics import get_raster_statistics
+
     try:
         input_raster_layer = QgsRasterLayer(input_raster_path, "Input Raster")
 
         if not input_raster_layer.isValid():
             return False, f"Invalid raster layer {input_raster_path}"
 
-        provider = input_raster_layer.dataProvider()
-        band_statistics = provider.bandStatistics(1)
-        min_value = band_statistics.minimumValue
-        max_value = band_statistics.maximumValue
+        band_statistics = get_raster_statistics(input_raster_path)
+        if band_statistics is None or band_statistics.is_empty:
+            return False, f"Raster layer has no valid statistics, {input_raster_path}"
+
+        min_value = band_statistics.minimum
+        max_value = band_statistics.maximum
 
         if min_value is None or max_value is None:
             return False, f"Raster layer has no valid statistics, {input_raster_path}"
@@ -0,0 +1,667 @@
+# coding=utf-8
+"""Headless benchmarks of the scenario analysis.
+
+Runs the scenario analysis task, the carbon calculations and the report
+metrics on synthetic inputs of the given sizes and reports, for each
+stage, the throughput in analysis grid pixels per second and the peak
+memory. Results are saved as JSON per run and appended to a CSV file so
+that runs of different plugin versions can be compared.
+
+Run from the repository root in a QGIS Python environment e.g.
+
+    PYTHONPATH=src:. python3 -m test.benchmarks.scenario_benchmark \
+        --sizes 1000 5000 --activities 5 20 --output-dir /tmp/cplus_benchmarks
+
+The plugin settings used by the analysis are set for the duration of each
+run and restored afterwards.
+"""
+
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import typing
+import uuid
+
+from osgeo import gdal
+
+from qgis.core import Qgis, QgsApplication, QgsRasterLayer
+
+from cplus_plugin.conf import settings_manager, Settings
+from cplus_plugin.definitions.constants import CARBON_IMPACT_ATTRIBUTE
+from cplus_plugin.lib.carbon import (
+    CarbonImpactManageCalculator,
+    CarbonImpactProtectCalculator,
+    CarbonImpactRestoreCalculator,
+)
+from cplus_plugin.lib.profiling import ScenarioProfiler
+from cplus_plugin.lib.raster.area import calculate_raster_areas
+from cplus_plugin.lib.reports.metrics import (
+    FUNC_CARBON_IMPACT_MANAGE,
+    FUNC_CARBON_IMPACT_PROTECT,
+    VAR_ACTIVITY_AREA,
+    create_metrics_expression_context,
+    evaluate_activity_metric,
+    register_metric_functions,
+    unregister_metric_functions,
+)
+from cplus_plugin.models.base import (
+    Activity,
+    NcsPathway,
+    NcsPathwayType,
+    Scenario,
+    SpatialExtent,
+)
+from cplus_plugin.models.report import ActivityContextInfo
+from cplus_plugin.tasks import ScenarioAnalysisTask
+from cplus_plugin.utils import get_plugin_version
+
+from .synthetic import SyntheticDataset, create_synthetic_dataset
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+RESULTS_CSV_FILE_NAME = "benchmark_results.csv"
+
+RESULT_FIELDS = [
+    "timestamp",
+    "plugin_version",
+    "size",
+    "activities",
+    "block_processing",
+    "kind",
+    "name",
+    "count",
+    "wall_time",
+    "cpu_time",
+    "pixels_per_second",
+    "peak_memory_mb",
+]
+
+# Settings changed by the benchmarks and restored after each run
+BENCHMARK_SETTINGS = [
+    Settings.BASE_DIR,
+    Settings.SCENARIO_IMPACT_MATRIX,
+    Settings.MASK_LAYERS_PATHS,
+    Settings.STORED_CARBON_BIOMASS_PATH,
+    Settings.BLOCK_PROCESSING_ENABLED,
+    Settings.INTERMEDIATE_CACHE_ENABLED,
+    Settings.MEMORY_BUDGET,
+]
+
+METRIC_EXPRESSIONS = [
+    f"@{VAR_ACTIVITY_AREA} * 1.5",
+    f"{FUNC_CARBON_IMPACT_MANAGE}()",
+    f"{FUNC_CARBON_IMPACT_PROTECT}()",
+]
+
+MEGABYTE = 1048576.0
+
+
+def current_rss() -> typing.Optional[int]:
+    """Returns the resident memory of the process in bytes."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemorySampler:
+    """Samples the resident memory of the process in a background thread
+    so that the peak memory of each stage can be determined.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self._interval = interval
+        self._samples: typing.List[typing.Tuple[float, int]] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = current_rss()
+            if rss is None:
+                return
+            self._samples.append((time.time(), rss))
+            self._stop.wait(self._interval)
+
+    def __enter__(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+    def peak(self, start: float, end: float) -> typing.Optional[int]:
+        """Returns the peak memory sampled between the given times."""
+        values = [
+            rss
+            for sample_time, rss in self._samples
+            if start <= sample_time <= end + self._interval
+        ]
+        return max(values) if values else None
+
+
+def save_setting(name: Settings, value):
+    """Sets a plugin setting or removes it if the value is None."""
+    if value is None:
+        settings_manager.remove(name)
+    else:
+        settings_manager.set_value(name, value)
+
+
+@contextlib.contextmanager
+def benchmark_settings(values: dict):
+    """Sets the given plugin settings and restores them on exit."""
+    previous = {name: settings_manager.get_value(name) for name in BENCHMARK_SETTINGS}
+    try:
+        for name, value in values.items():
+            save_setting(name, value)
+        yield
+    finally:
+        for name, value in previous.items():
+            save_setting(name, value)
+
+
+def create_scenario_inputs(dataset: SyntheticDataset) -> dict:
+    """Creates the priority layers, pathways, activities and scenario of
+    a synthetic dataset. The pathway types alternate between protect,
+    restore and manage and each pathway is weighted by all the
+    priority layers.
+    """
+    priority_group = {
+        "uuid": str(uuid.uuid4()),
+        "name": "Benchmark group",
+        "description": "Priority group of the benchmarks",
+        "value": 5,
+    }
+    priority_layers = [
+        {
+            "uuid": str(uuid.uuid4()),
+            "name": f"Benchmark priority layer {index + 1}",
+            "description": "Synthetic priority weighting layer",
+            "selected": False,
+            "path": path,
+            "groups": [priority_group],
+        }
+        for index, path in enumerate(dataset.priority_layer_paths)
+    ]
+
+    pathway_types = [
+        NcsPathwayType.PROTECT,
+        NcsPathwayType.RESTORE,
+        NcsPathwayType.MANAGE,
+    ]
+    pathways = []
+    activities = []
+    for index, path in enumerate(dataset.pathway_paths):
+        pathway_type = pathway_types[index % len(pathway_types)]
+        type_options = {}
+        if pathway_type != NcsPathwayType.PROTECT:
+            type_options[CARBON_IMPACT_ATTRIBUTE] = 2.5 + index
+
+        pathway = NcsPathway(
+            uuid=uuid.uuid4(),
+            name=f"Benchmark pathway {index + 1}",
+            description="Synthetic NCS pathway",
+            path=path,
+            pathway_type=pathway_type,
+            priority_layers=[
+                {"uuid": layer["uuid"], "name": layer["name"]}
+                for layer in priority_layers
+            ],
+            suitability_index=0.5,
+            type_options=type_options,
+        )
+        pathways.append(pathway)
+        activities.append(
+            Activity(
+                uuid=uuid.uuid4(),
+                name=f"Benchmark activity {index + 1}",
+                description="Synthetic activity",
+                pathways=[pathway],
+                style_pixel_value=index + 1,
+            )
+        )
+
+    impact_matrix = {
+        "pathway_uuids": [str(pathway.uuid) for pathway in pathways],
+        "priority_layer_uuids": [layer["uuid"] for layer in priority_layers],
+        "values": [
+            [1 if (row + column) % 4 else -1 for column in range(len(priority_layers))]
+            for row in range(len(pathways))
+        ],
+    }
+
+    x_min, x_max, y_min, y_max = dataset.extent
+    scenario = Scenario(
+        uuid=uuid.uuid4(),
+        name=f"Benchmark {dataset.size}x{dataset.size}",
+        description="Scenario of the benchmarks",
+        extent=SpatialExtent(bbox=[x_min, x_max, y_min, y_max], crs=dataset.crs),
+        activities=activities,
+        priority_layer_groups=[priority_group],
+        crs=dataset.crs,
+    )
+
+    return {
+        "priority_group": priority_group,
+        "priority_layers": priority_layers,
+        "pathways": pathways,
+        "activities": activities,
+        "impact_matrix": impact_matrix,
+        "scenario": scenario,
+    }
+
+
+@contextlib.contextmanager
+def saved_scenario_inputs(inputs: dict):
+    """Saves the scenario inputs in the settings, as the analysis and
+    the metrics look them up there, and removes them on exit.
+    """
+    settings_manager.save_priority_group(inputs["priority_group"])
+    for layer in inputs["priority_layers"]:
+        settings_manager.save_priority_layer(layer)
+    for pathway in inputs["pathways"]:
+        settings_manager.save_ncs_pathway(pathway)
+    for activity in inputs["activities"]:
+        settings_manager.save_activity(activity)
+
+    try:
+        yield
+    finally:
+        for activity in inputs["activities"]:
+            settings_manager.remove_activity(str(activity.uuid))
+        for pathway in inputs["pathways"]:
+            settings_manager.remove_ncs_pathway(str(pathway.uuid))
+        for layer in inputs["priority_layers"]:
+            settings_manager.delete_priority_layer(layer["uuid"])
+        settings_manager.delete_priority_group(inputs["priority_group"]["uuid"])
+
+
+def run_carbon_benchmark(activities: typing.List[Activity], profiler: ScenarioProfiler):
+    """Measures the carbon calculations of the activities."""
+    calculators = [
+        ("carbon_impact_protect", CarbonImpactProtectCalculator),
+        ("carbon_impact_restore", CarbonImpactRestoreCalculator),
+        ("carbon_impact_manage", CarbonImpactManageCalculator),
+    ]
+    for name, calculator in calculators:
+        for activity in activities:
+            with profiler.measure(name, "carbon"):
+                calculator(activity).run()
+
+
+def run_metrics_benchmark(
+    activities: typing.List[Activity], profiler: ScenarioProfiler
+):
+    """Measures the calculation of the activity areas and the evaluation
+    of the report metrics of the activities.
+    """
+    layers = [
+        QgsRasterLayer(activity.path, activity.name)
+        for activity in activities
+        if activity.path and os.path.exists(activity.path)
+    ]
+    with profiler.measure("calculate_raster_areas", "metrics"):
+        area_infos = calculate_raster_areas(layers, 1)
+
+    register_metric_functions()
+    try:
+        context = create_metrics_expression_context()
+        for activity, area_info in zip(activities, area_infos):
+            area = area_info.total_area if area_info is not None else 0.0
+            activity_info = ActivityContextInfo(activity, area)
+            for expression in METRIC_EXPRESSIONS:
+                with profiler.measure(expression, "metrics"):
+                    evaluate_activity_metric(context, activity_info, expression)
+    finally:
+        unregister_metric_functions()
+
+
+def record_time(started: str) -> float:
+    """Returns the timestamp of the start time of a profile record."""
+    return datetime.datetime.fromisoformat(started).timestamp()
+
+
+def stage_results(
+    profiler: ScenarioProfiler,
+    sampler: MemorySampler,
+    pixel_count: int,
+) -> typing.List[dict]:
+    """Aggregates the records of the analysis stages, carbon calculations
+    and metrics by name.
+    """
+    results = {}
+    for record in profiler.records:
+        # Only the stages run directly by the task are reported, the
+        # processing algorithms are aggregated separately.
+        if record.kind == "stage" and record.parent not in ("", "run"):
+            continue
+
+        start = record_time(record.started)
+        peak = sampler.peak(start, start + record.wall_time)
+        if peak is None:
+            peak = record.peak_rss
+
+        result = results.setdefault(
+            (record.kind, record.algorithm or record.name),
+            {
+                "kind": record.kind,
+                "name": record.algorithm or record.name,
+                "count": 0,
+                "wall_time": 0.0,
+                "cpu_time": 0.0,
+                "peak_memory": 0,
+            },
+        )
+        result["count"] += 1
+        result["wall_time"] += record.wall_time
+        result["cpu_time"] += record.cpu_time
+        result["peak_memory"] = max(result["peak_memory"], peak or 0)
+
+    rows = []
+    for result in results.values():
+        wall_time = result["wall_time"]
+        pixels_per_second = None
+        if wall_time > 0:
+            pixels_per_second = round(pixel_count * result["count"] / wall_time, 1)
+
+        rows.append(
+            {
+                "kind": result["kind"],
+                "name": result["name"],
+                "count": result["count"],
+                "wall_time": round(wall_time, 4),
+                "cpu_time": round(result["cpu_time"], 4),
+                "pixels_per_second": pixels_per_second,
+                "peak_memory_mb": round(result["peak_memory"] / MEGABYTE, 1),
+            }
+        )
+
+    return rows
+
+
+def run_benchmark(
+    dataset: SyntheticDataset,
+    output_directory: str,
+    block_processing: bool,
+    memory_budget: int = 0,
+) -> typing.List[dict]:
+    """Runs the scenario analysis, carbon calculations and metrics on a
+    synthetic dataset.
+
+    :param dataset: Synthetic inputs.
+    :type dataset: SyntheticDataset
+
+    :param output_directory: Base directory of the scenario outputs.
+    :type output_directory: str
+
+    :param block_processing: Whether to enable the block processing.
+    :type block_processing: bool
+
+    :param memory_budget: Memory budget in megabytes, zero for automatic.
+    :type memory_budget: int
+
+    :returns: Results of the stages.
+    :rtype: list
+    """
+    inputs = create_scenario_inputs(dataset)
+    settings = {
+        Settings.BASE_DIR: output_directory,
+        Settings.SCENARIO_IMPACT_MATRIX: json.dumps(inputs["impact_matrix"]),
+        Settings.MASK_LAYERS_PATHS: dataset.mask_path,
+        Settings.STORED_CARBON_BIOMASS_PATH: dataset.carbon_path,
+        Settings.BLOCK_PROCESSING_ENABLED: block_processing,
+        Settings.MEMORY_BUDGET: memory_budget,
+        # Cached outputs of previous runs would hide the cost of the stages
+        Settings.INTERMEDIATE_CACHE_ENABLED: False,
+    }
+
+    with benchmark_settings(settings), saved_scenario_inputs(inputs):
+        scenario = inputs["scenario"]
+        task = ScenarioAnalysisTask(
+            scenario.name,
+            scenario.description,
+            inputs["activities"],
+            scenario.priority_layer_groups,
+            scenario.extent,
+            scenario,
+        )
+        with MemorySampler() as sampler:
+            result = task.run()
+            task.finished(result)
+            run_carbon_benchmark(task.analysis_activities, task.profiler)
+            run_metrics_benchmark(task.analysis_activities, task.profiler)
+
+    if not result:
+        print(f"Scenario analysis failed, {task.error}", file=sys.stderr)
+
+    return stage_results(task.profiler, sampler, dataset.pixel_count)
+
+
+def environment_metadata() -> dict:
+    """Returns the versions and the platform the benchmarks ran on."""
+    return {
+        "plugin_version": get_plugin_version(),
+        "qgis_version": Qgis.QGIS_VERSION,
+        "gdal_version": gdal.VersionInfo("RELEASE_NAME"),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(
+    output_directory: str, metadata: dict, rows: typing.List[dict]
+) -> str:
+    """Saves the results of a benchmark run as JSON and appends them to
+    the CSV file of all the runs.
+
+    :returns: Path of the JSON file.
+    :rtype: str
+    """
+    timestamp = metadata["timestamp"]
+    json_path = os.path.join(
+        output_directory,
+        f"benchmark_{timestamp.replace(':', '').replace('-', '')}.json",
+    )
+    with open(json_path, "w") as f:
+        json.dump({"metadata": metadata, "results": rows}, f, indent=2)
+
+    csv_path = os.path.join(output_directory, RESULTS_CSV_FILE_NAME)
+    write_header = not os.path.exists(csv_path)
+    with open(csv_path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+        if write_header:
+            writer.writeheader()
+        for row in rows:
+            writer.writerow(
+                {
+                    "timestamp": timestamp,
+                    "plugin_version": metadata["plugin_version"],
+                    **row,
+                }
+            )
+
+    return json_path
+
+
+def result_key(row: dict) -> tuple:
+    return (
+        row["size"],
+        row["activities"],
+        row["block_processing"],
+        row["kind"],
+        row["name"],
+    )
+
+
+def compare_results(rows: typing.List[dict], baseline_path: str):
+    """Prints the speedup of each stage relative to a previous run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    baseline_rows = {result_key(row): row for row in baseline.get("results", [])}
+    print(
+        f"Speedup relative to version "
+        f"{baseline.get('metadata', {}).get('plugin_version')}:"
+    )
+    for row in rows:
+        previous = baseline_rows.get(result_key(row))
+        if previous is None or not row["wall_time"]:
+            continue
+        print(
+            f"  {row['size']:>6} {row['activities']:>3} {row['name']:<45} "
+            f"{previous['wall_time'] / row['wall_time']:6.2f}x"
+        )
+
+
+def print_results(rows: typing.List[dict]):
+    for row in rows:
+        pixels_per_second = row["pixels_per_second"] or 0
+        print(
+            f"  {row['size']:>6} {row['activities']:>3} {row['kind']:<8} "
+            f"{row['name']:<45} wall {row['wall_time']:9.2f}s "
+            f"{pixels_per_second / 1e6:9.2f} Mpx/s "
+            f"peak {row['peak_memory_mb']:9.1f}MB"
+        )
+
+
+def parse_arguments(arguments: typing.List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the scenario analysis on synthetic rasters."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000],
+        help="Number of pixels of each side of the rasters, e.g. 1000 to 20000.",
+    )
+    parser.add_argument(
+        "--activities",
+        type=int,
+        nargs="+",
+        default=[5],
+        help="Number of activities, each with one pathway, e.g. 5 to 50.",
+    )
+    parser.add_argument(
+        "--priority-layers",
+        type=int,
+        default=5,
+        help="Number of priority weighting layers.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--block-processing",
+        action="store_true",
+        help="Run the analysis with the block processing enabled.",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=0,
+        help="Memory budget of the raster processing in MB, zero for automatic.",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=None,
+        help="Directory of the synthetic inputs, reused across runs. "
+        "Defaults to a data folder in the output directory.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        help="Directory of the scenario outputs and benchmark results.",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="JSON results of a previous run to compare with.",
+    )
+
+    return parser.parse_args(arguments)
+
+
+def main(arguments: typing.List[str] = None) -> int:
+    options = parse_arguments(sys.argv[1:] if arguments is None else arguments)
+
+    application = QgsApplication([], False)
+    application.initQgis()
+
+    from processing.core.Processing import Processing
+
+    Processing.initialize()
+
+    output_directory = os.path.abspath(options.output_dir)
+    data_directory = options.data_dir or os.path.join(output_directory, "data")
+    os.makedirs(output_directory, exist_ok=True)
+
+    metadata = environment_metadata()
+    metadata["timestamp"] = datetime.datetime.now().isoformat(timespec="seconds")
+    metadata["options"] = vars(options)
+
+    rows = []
+    for size in options.sizes:
+        for activity_count in options.activities:
+            print(f"Creating synthetic inputs of {size}x{size} pixels...")
+            dataset = create_synthetic_dataset(
+                data_directory,
+                size,
+                activity_count,
+                options.priority_layers,
+                options.seed,
+            )
+
+            print(f"Running the benchmark with {activity_count} activities...")
+            scenario_directory = os.path.join(
+                output_directory, "scenarios", f"{size}_{activity_count}"
+            )
+            os.makedirs(scenario_directory, exist_ok=True)
+            results = run_benchmark(
+                dataset,
+                scenario_directory,
+                options.block_processing,
+                options.memory_budget,
+            )
+            for result in results:
+                result.update(
+                    {
+                        "size": size,
+                        "activities": activity_count,
+                        "block_processing": options.block_processing,
+                    }
+                )
+            print_results(results)
+            rows.extend(results)
+
+    json_path = write_results(output_directory, metadata, rows)
+    print(f"Results saved in {json_path}")
+
+    if options.baseline:
+        compare_results(rows, options.baseline)
+
+    application.exitQgis()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
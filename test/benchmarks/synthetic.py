@@ -0,0 +1,290 @@
+# coding=utf-8
+"""Synthetic scenario inputs for the benchmarks.
+
+Rasters are smooth random fields written block by block so that inputs
+of tens of thousands of pixels a side can be created without holding them
+in memory. The same seed always produces the same dataset.
+"""
+
+import dataclasses
+import json
+import math
+import os
+import typing
+
+import numpy as np
+from osgeo import ogr, osr
+
+from cplus_plugin.lib.raster.blocks import BlockRasterWriter, RasterGrid
+
+
+MANIFEST_FILE_NAME = "dataset.json"
+
+# UTM zone 35S, pixel areas are therefore meaningful in hectares
+DEFAULT_CRS = "EPSG:32735"
+DEFAULT_ORIGIN = (300000.0, 7400000.0)
+DEFAULT_PIXEL_SIZE = 30.0
+DEFAULT_NODATA = -9999.0
+
+# Share of the pathway pixels set to NoData, creating patches
+# that exercise the sieve and the connectivity calculations.
+PATHWAY_NODATA_THRESHOLD = 0.35
+
+
+@dataclasses.dataclass
+class SyntheticDataset:
+    """Paths and definition of the synthetic inputs of a scenario."""
+
+    directory: str
+    size: int
+    activity_count: int
+    priority_layer_count: int
+    seed: int
+    crs: str = DEFAULT_CRS
+    pixel_size: float = DEFAULT_PIXEL_SIZE
+    nodata: float = DEFAULT_NODATA
+    pathway_paths: typing.List[str] = dataclasses.field(default_factory=list)
+    priority_layer_paths: typing.List[str] = dataclasses.field(default_factory=list)
+    carbon_path: str = ""
+    mask_path: str = ""
+
+    @property
+    def extent(self) -> typing.Tuple[float, float, float, float]:
+        """Returns the extent as xmin, xmax, ymin and ymax."""
+        x_min, y_max = DEFAULT_ORIGIN
+        length = self.size * self.pixel_size
+        return x_min, x_min + length, y_max - length, y_max
+
+    @property
+    def pixel_count(self) -> int:
+        """Returns the number of pixels of each raster."""
+        return self.size * self.size
+
+    def grid(self) -> RasterGrid:
+        """Returns the grid of the synthetic rasters."""
+        x_min, _, _, y_max = self.extent
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(self.crs)
+
+        return RasterGrid(
+            geotransform=(x_min, self.pixel_size, 0.0, y_max, 0.0, -self.pixel_size),
+            width=self.size,
+            height=self.size,
+            crs_wkt=srs.ExportToWkt(),
+            nodata=self.nodata,
+        )
+
+    def matches(self, other: "SyntheticDataset") -> bool:
+        """Checks whether both datasets were created with the same definition."""
+        return (
+            self.size,
+            self.activity_count,
+            self.priority_layer_count,
+            self.seed,
+            self.crs,
+            self.pixel_size,
+        ) == (
+            other.size,
+            other.activity_count,
+            other.priority_layer_count,
+            other.seed,
+            other.crs,
+            other.pixel_size,
+        )
+
+    def exists(self) -> bool:
+        """Checks whether all the files of the dataset exist."""
+        paths = self.pathway_paths + self.priority_layer_paths
+        paths += [self.carbon_path, self.mask_path]
+
+        return len(paths) > 2 and all(path and os.path.exists(path) for path in paths)
+
+
+def smooth_field(
+    x_offset: int,
+    y_offset: int,
+    width: int,
+    height: int,
+    size: int,
+    seed: int,
+    noise: float = 0.05,
+) -> np.ndarray:
+    """Returns the values in [0, 1] of a window of a smooth random field.
+
+    The field is a sum of sinusoids of the grid coordinates so windows
+    computed separately are continuous, the noise only depends on the
+    window position.
+    """
+    rng = np.random.default_rng(seed)
+    features = 6
+    frequencies = rng.uniform(1.0, 8.0, (features, 2))
+    phases = rng.uniform(0.0, 2.0 * math.pi, (features, 2))
+
+    x = (np.arange(x_offset, x_offset + width, dtype=np.float64) / size)[None, :]
+    y = (np.arange(y_offset, y_offset + height, dtype=np.float64) / size)[:, None]
+
+    field = np.zeros((height, width), dtype=np.float64)
+    for (x_frequency, y_frequency), (x_phase, y_phase) in zip(frequencies, phases):
+        field += np.sin(2.0 * math.pi * x_frequency * x + x_phase) * np.sin(
+            2.0 * math.pi * y_frequency * y + y_phase
+        )
+    field = 0.5 + 0.5 * field / features
+
+    if noise > 0:
+        window_rng = np.random.default_rng((seed, x_offset, y_offset))
+        field += window_rng.normal(0.0, noise, field.shape)
+
+    return np.clip(field, 0.0, 1.0)
+
+
+def write_field_raster(
+    path: str,
+    grid: RasterGrid,
+    seed: int,
+    scale: float = 1.0,
+    nodata_threshold: float = None,
+):
+    """Writes a smooth random field raster block by block.
+
+    :param path: Output path.
+    :type path: str
+
+    :param grid: Grid of the raster.
+    :type grid: RasterGrid
+
+    :param seed: Seed of the field.
+    :type seed: int
+
+    :param scale: Factor applied to the [0, 1] field values.
+    :type scale: float
+
+    :param nodata_threshold: Field values below which pixels are NoData.
+    :type nodata_threshold: float
+    """
+    with BlockRasterWriter(path, grid) as writer:
+        for window in grid.windows():
+            values = smooth_field(
+                window.x_offset,
+                window.y_offset,
+                window.width,
+                window.height,
+                grid.width,
+                seed,
+            )
+            if nodata_threshold is not None:
+                values[values < nodata_threshold] = np.nan
+            writer.write(window, values * scale)
+
+
+def write_mask_layer(path: str, dataset: SyntheticDataset, count: int = 4):
+    """Writes a polygon layer whose squares cover about a tenth of the extent."""
+    x_min, x_max, y_min, y_max = dataset.extent
+    length = x_max - x_min
+    side = length * math.sqrt(0.1 / count)
+
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(dataset.crs)
+
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    data_source = driver.CreateDataSource(path)
+    layer = data_source.CreateLayer("mask", srs, ogr.wkbPolygon)
+
+    rng = np.random.default_rng(dataset.seed)
+    for _ in range(count):
+        x = x_min + rng.uniform(0.0, length - side)
+        y = y_min + rng.uniform(0.0, length - side)
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for point_x, point_y in (
+            (x, y),
+            (x + side, y),
+            (x + side, y + side),
+            (x, y + side),
+            (x, y),
+        ):
+            ring.AddPoint_2D(point_x, point_y)
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+        polygon.AddGeometry(ring)
+
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(polygon)
+        layer.CreateFeature(feature)
+        feature = None
+
+    data_source = None
+
+
+def create_synthetic_dataset(
+    directory: str,
+    size: int,
+    activity_count: int,
+    priority_layer_count: int = 5,
+    seed: int = 0,
+) -> SyntheticDataset:
+    """Creates, or reuses if it already exists, a synthetic dataset with
+    a pathway per activity, the priority weighting layers, a carbon
+    reference layer and a mask layer.
+
+    :param directory: Root directory of the synthetic datasets.
+    :type directory: str
+
+    :param size: Number of pixels of each side of the rasters.
+    :type size: int
+
+    :param activity_count: Number of activities and pathways.
+    :type activity_count: int
+
+    :param priority_layer_count: Number of priority weighting layers.
+    :type priority_layer_count: int
+
+    :param seed: Seed of the random fields.
+    :type seed: int
+
+    :returns: The synthetic dataset.
+    :rtype: SyntheticDataset
+    """
+    dataset_directory = os.path.join(
+        directory, f"synthetic_{size}_{activity_count}_{priority_layer_count}_{seed}"
+    )
+    dataset = SyntheticDataset(
+        directory=dataset_directory,
+        size=size,
+        activity_count=activity_count,
+        priority_layer_count=priority_layer_count,
+        seed=seed,
+    )
+
+    manifest_path = os.path.join(dataset_directory, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            existing = SyntheticDataset(**json.load(f))
+        if existing.matches(dataset) and existing.exists():
+            return existing
+
+    os.makedirs(dataset_directory, exist_ok=True)
+    grid = dataset.grid()
+
+    for index in range(activity_count):
+        path = os.path.join(dataset_directory, "pathways", f"pathway_{index + 1}.tif")
+        write_field_raster(
+            path, grid, seed + index, nodata_threshold=PATHWAY_NODATA_THRESHOLD
+        )
+        dataset.pathway_paths.append(path)
+
+    for index in range(priority_layer_count):
+        path = os.path.join(dataset_directory, "priority", f"priority_{index + 1}.tif")
+        write_field_raster(path, grid, seed + 1000 + index)
+        dataset.priority_layer_paths.append(path)
+
+    dataset.carbon_path = os.path.join(dataset_directory, "carbon", "biomass.tif")
+    write_field_raster(dataset.carbon_path, grid, seed + 2000, scale=200.0)
+
+    dataset.mask_path = os.path.join(dataset_directory, "masks", "mask.gpkg")
+    os.makedirs(os.path.dirname(dataset.mask_path), exist_ok=True)
+    write_mask_layer(dataset.mask_path, dataset)
+
+    with open(manifest_path, "w") as f:
+        json.dump(dataclasses.asdict(dataset), f, indent=2)
+
+    return dataset
@@ -8,7 +8,7 @@ from unittest.mock import patch, MagicMock
 from PyQt5 import QtCore
 from PyQt5.QtCore import QCoreApplication, QIODevice, QByteArray
 
-from qgis.core import QgsRasterLayer, QgsTask
+from qgis.core import QgsNetworkAccessManager, QgsRasterLayer, QgsTask
 from qgis.PyQt.QtNetwork import QNetworkReply
 from cplus_plugin.api.request import (
     CplusApiRequestError,
@@ -16,6 +16,8 @@ from cplus_plugin.api.request import (
     JOB_COMPLETED_STATUS,
     CplusApiUrl,
     CplusApiRequest,
+    PARTIAL_DOWNLOAD_SUFFIX,
+    status_poller,
 )
 from cplus_plugin.api.carbon import IrrecoverableCarbonDownloadTask
 from cplus_plugin.conf import settings_manager, Settings
@@ -58,6 +60,8 @@ class MockQNetworkReply(QNetworkReply):
 class TestCplusApiPooling(unittest.TestCase):
     @patch("cplus_plugin.api.request.CplusApiRequest")
     def setUp(self, mock_base_api_client):
+        # The status poller is shared by all the pollers
+        status_poller.reset()
         self.mock_context = mock_base_api_client.return_value
         self.url = "http://example.com"
         self.pooling = CplusApiPooling(
@@ -66,6 +70,9 @@ class TestCplusApiPooling(unittest.TestCase):
             method="GET",
         )
 
+    def tearDown(self):
+        status_poller.reset()
+
     def test_call_api_get(self):
         self.mock_context.get.return_value = ({"status": JOB_COMPLETED_STATUS}, 200)
         response, status_code = self.pooling._CplusApiPooling__call_api()
@@ -97,6 +104,47 @@ class TestCplusApiPooling(unittest.TestCase):
         with self.assertRaises(CplusApiRequestError):
             self.pooling.results()
 
+    @patch("time.sleep", return_value=None)
+    def test_results_backoff(self, mock_sleep):
+        self.pooling.limit = 500
+        self.pooling.max_interval = 8
+        self.mock_context.get.return_value = ({"status": "JOB_RUNNING"}, 200)
+        with self.assertRaises(CplusApiRequestError):
+            self.pooling.results()
+        self.assertEqual(self.pooling.current_repeat, 500)
+        self.assertLessEqual(self.pooling.next_interval(), 8 * 1.2)
+        self.assertGreaterEqual(self.pooling.next_interval(), 8 * 0.8)
+
+    def test_poll_not_modified(self):
+        def get(url, etag=None, response_headers=None):
+            if etag:
+                return {}, 304
+            response_headers["etag"] = '"1"'
+            return {"status": "JOB_RUNNING"}, 200
+
+        callback = MagicMock()
+        self.pooling.on_response_fetched = callback
+        self.mock_context.get.side_effect = get
+        first = self.pooling.poll_once()
+        second = self.pooling.poll_once()
+        self.assertEqual(first, {"status": "JOB_RUNNING"})
+        self.assertEqual(second, first)
+        self.assertEqual(callback.call_count, 1)
+
+    def test_results_untracked_on_error(self):
+        self.mock_context.get.return_value = ({"status": "JOB_RUNNING"}, 200)
+        self.pooling.wait = MagicMock(side_effect=RuntimeError("Interrupted"))
+        with self.assertRaises(RuntimeError):
+            self.pooling.results()
+        self.assertEqual(status_poller.tracked_count, 0)
+
+    @patch("time.sleep", return_value=None)
+    def test_results_cancel_check(self, mock_sleep):
+        self.mock_context.get.return_value = ({"status": "JOB_RUNNING"}, 200)
+        self.pooling.cancel_check = lambda: self.pooling.current_repeat >= 2
+        response = self.pooling.results()
+        self.assertEqual(response["status"], "Cancelled")
+
 
 class TestCplusApiUrl(unittest.TestCase):
     @patch("cplus_plugin.conf.settings_manager.get_value")
@@ -384,6 +432,107 @@ class TestCplusApiRequest(unittest.TestCase):
         )
 
 
+class TestCplusApiRequestDownload(unittest.TestCase):
+    CONTENT = b"0123456789"
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "output.tif")
+        self.partial_path = f"{self.file_path}{PARTIAL_DOWNLOAD_SUFFIX}"
+        self.api_request = CplusApiRequest()
+
+        patcher = patch.object(CplusApiRequest, "_make_request")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch.object(QgsNetworkAccessManager, "instance")
+        self.mock_nam = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def mock_reply(
+        self,
+        data: bytes,
+        status_code: int,
+        error=QNetworkReply.NetworkError.NoError,
+        content_range: bytes = b"",
+    ):
+        reply = MagicMock()
+        reply.attribute.return_value = status_code
+        reply.readAll.return_value = QByteArray(data)
+        reply.error.return_value = error
+        reply.errorString.return_value = ""
+        reply.header.return_value = len(data)
+        reply.rawHeader.return_value = QByteArray(content_range)
+        self.mock_nam.get.return_value = reply
+
+        return reply
+
+    def write_partial_file(self, data: bytes):
+        with open(self.partial_path, "wb") as f:
+            f.write(data)
+
+    def requested_range(self) -> bytes:
+        request = self.mock_nam.get.call_args[0][0]
+        return bytes(request.rawHeader(b"Range"))
+
+    def downloaded_content(self) -> bytes:
+        with open(self.file_path, "rb") as f:
+            return f.read()
+
+    def test_download_resumed(self):
+        self.write_partial_file(self.CONTENT[:4])
+        self.mock_reply(self.CONTENT[4:], 206)
+
+        self.assertTrue(self.api_request.download_file("url", self.file_path))
+        self.assertEqual(self.requested_range(), b"bytes=4-")
+        self.assertEqual(self.downloaded_content(), self.CONTENT)
+        self.assertFalse(os.path.exists(self.partial_path))
+
+    def test_download_complete_partial_file(self):
+        self.write_partial_file(self.CONTENT)
+        self.mock_reply(
+            b"",
+            416,
+            QNetworkReply.NetworkError.UnknownContentError,
+            b"bytes */10",
+        )
+
+        self.assertTrue(self.api_request.download_file("url", self.file_path))
+        self.assertEqual(self.requested_range(), b"bytes=10-")
+        self.assertEqual(self.downloaded_content(), self.CONTENT)
+        self.assertFalse(os.path.exists(self.partial_path))
+
+    def test_download_invalid_partial_file(self):
+        self.write_partial_file(self.CONTENT)
+        self.mock_reply(
+            b"",
+            416,
+            QNetworkReply.NetworkError.UnknownContentError,
+            b"bytes */8",
+        )
+
+        # The partial file is removed so that the next attempt starts again
+        self.assertFalse(self.api_request.download_file("url", self.file_path))
+        self.assertFalse(os.path.exists(self.partial_path))
+        self.assertFalse(os.path.exists(self.file_path))
+
+    def test_download_range_ignored(self):
+        self.write_partial_file(b"stale")
+        self.mock_reply(self.CONTENT, 200)
+
+        self.assertTrue(
+            self.api_request.download_file(
+                "url", self.file_path, expected_size=len(self.CONTENT)
+            )
+        )
+        self.assertEqual(self.requested_range(), b"bytes=5-")
+        # The partial content is replaced by the whole content
+        self.assertEqual(self.downloaded_content(), self.CONTENT)
+
+
 class TestIrrecoverableCarbonDownloader(unittest.TestCase):
     """Tests for the IrrecoverableCarbonDownloadTask."""
 
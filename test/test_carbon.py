@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for carbon calculations.
+"""
+
+import os
+import tempfile
+import unittest
+
+from cplus_plugin.lib.carbon import (
+    clear_prepared_protect_layers,
+    prepared_protect_pathways_path,
+)
+
+from utilities_for_testing import get_qgis_app
+
+
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+
+class TestPreparedProtectPathways(unittest.TestCase):
+    """Tests for the reuse of prepared protect pathway layers."""
+
+    def setUp(self):
+        clear_prepared_protect_layers()
+        self.directory = tempfile.mkdtemp()
+        self.pathway_path = os.path.join(self.directory, "protect.tif")
+        with open(self.pathway_path, "wb") as f:
+            f.write(b"a")
+        self.prepared = []
+
+    def prepare(self, data_sources):
+        path = os.path.join(self.directory, f"prepared_{len(self.prepared)}.tif")
+        with open(path, "wb") as f:
+            f.write(b"b")
+        self.prepared.append(data_sources)
+
+        return path
+
+    def test_prepared_layer_reused(self):
+        """Test the protect pathways layer is prepared once."""
+        first_path = prepared_protect_pathways_path([self.pathway_path], self.prepare)
+        second_path = prepared_protect_pathways_path([self.pathway_path], self.prepare)
+
+        self.assertEqual(first_path, second_path)
+        self.assertEqual(len(self.prepared), 1)
+
+    def test_prepared_layer_invalidated(self):
+        """Test the protect pathways layer is prepared again when
+        a pathway layer is modified.
+        """
+        first_path = prepared_protect_pathways_path([self.pathway_path], self.prepare)
+
+        with open(self.pathway_path, "ab") as f:
+            f.write(b"c")
+        second_path = prepared_protect_pathways_path([self.pathway_path], self.prepare)
+
+        self.assertNotEqual(first_path, second_path)
+        self.assertEqual(len(self.prepared), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
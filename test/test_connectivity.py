@@ -0,0 +1,181 @@
+# coding=utf-8
+"""Tests for the raster connected-component labelling.
+
+"""
+
+import math
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal, osr
+
+from cplus_plugin.lib.raster.connectivity import (
+    connectivity_scores,
+    label_array,
+    label_components,
+    resolve_roots,
+    write_connectivity_layer,
+    write_sieved_layer,
+)
+
+
+def write_raster(path: str, values: np.ndarray, pixel_size: float = 10.0) -> str:
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform((0.0, pixel_size, 0.0, 0.0, 0.0, -pixel_size))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32735)
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(-9999.0)
+    band.WriteArray(np.where(np.isnan(values), -9999.0, values))
+    band.FlushCache()
+    dataset = None
+
+    return path
+
+
+def read_array(path: str) -> np.ndarray:
+    dataset = gdal.Open(path)
+    band = dataset.GetRasterBand(1)
+    values = band.ReadAsArray().astype(np.float64)
+    values[values == band.GetNoDataValue()] = np.nan
+
+    return values
+
+
+class ConnectivityTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+
+        # A ring of 8 pixels with a hole, a diagonal pair and a single pixel
+        self.values = np.array(
+            [
+                [1.0, 1.0, 1.0, 0.0, 0.0, 0.0],
+                [1.0, 0.0, 1.0, 0.0, 2.0, 0.0],
+                [1.0, 1.0, 1.0, 0.0, 0.0, 3.0],
+                [0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [np.nan, 0.0, 0.0, 0.0, 0.0, 5.0],
+            ]
+        )
+        self.input_path = write_raster(
+            os.path.join(self.directory, "activity.tif"), self.values
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_resolve_roots(self):
+        roots = resolve_roots(np.array([4, 2, 1]), np.array([2, 0, 3]), 6)
+        np.testing.assert_array_equal(roots, np.array([0, 1, 0, 1, 0, 5]))
+
+    def test_label_array(self):
+        labels, count = label_array(np.nan_to_num(self.values) > 0)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(labels[1, 4], labels[2, 5])
+        self.assertEqual(labels[0, 0], 1)
+        self.assertEqual(labels[1, 1], 0)
+
+    def test_tiled_labelling(self):
+        expected = label_components(
+            self.input_path, os.path.join(self.directory, "labels.tif")
+        )
+        tiled = label_components(
+            self.input_path,
+            os.path.join(self.directory, "tiled_labels.tif"),
+            tile_size=2,
+        )
+
+        self.assertEqual(expected.component_count, 3)
+        self.assertEqual(tiled.component_count, 3)
+        self.assertEqual(expected.background_count, 18)
+
+        expected_labels, _ = expected.read(self._full_window(expected.grid))
+        tiled_labels, _ = tiled.read(self._full_window(tiled.grid))
+        expected_counts = expected.pixel_counts[expected_labels]
+        tiled_counts = tiled.pixel_counts[tiled_labels]
+        np.testing.assert_array_equal(expected_counts, tiled_counts)
+        np.testing.assert_allclose(
+            expected.perimeters()[expected_labels], tiled.perimeters()[tiled_labels]
+        )
+
+        expected.remove()
+        tiled.remove()
+
+    def test_connectivity_scores(self):
+        components = label_components(
+            self.input_path,
+            os.path.join(self.directory, "labels.tif"),
+            tile_size=3,
+        )
+        labels, _ = components.read(self._full_window(components.grid))
+        scores = connectivity_scores(components)
+
+        # Ring: 8 pixels, area 800, outer and hole perimeter of 120 + 40
+        ring_score = 8 * 4 * math.pi * 800 / (160 * 160)
+        self.assertAlmostEqual(scores[labels[0, 0]], ring_score)
+
+        # Diagonal pair: 2 pixels, area 200, perimeter 80
+        pair_score = 2 * 4 * math.pi * 200 / (80 * 80)
+        self.assertAlmostEqual(scores[labels[1, 4]], pair_score)
+
+        output_path = os.path.join(self.directory, "connectivity.tif")
+        self.assertTrue(write_connectivity_layer(components, output_path))
+        components.remove()
+
+        output = read_array(output_path)
+        self.assertTrue(np.isnan(output[4, 0]))
+        self.assertEqual(np.nanmin(output), 0.0)
+        self.assertAlmostEqual(np.nanmax(output), 1.0, places=6)
+        self.assertAlmostEqual(
+            output[1, 4], (1 + pair_score) / (1 + ring_score), places=6
+        )
+
+    def test_sieve(self):
+        components = label_components(
+            self.input_path, os.path.join(self.directory, "labels.tif")
+        )
+        output_path = os.path.join(self.directory, "sieved.tif")
+        self.assertTrue(
+            write_sieved_layer(
+                components, self.input_path, output_path, threshold=2, nodata=-9999.0
+            )
+        )
+
+        # The single pixel is removed and the values that are not
+        # positive are set to nodata.
+        output = read_array(output_path)
+        expected = np.where(np.nan_to_num(self.values) > 0, self.values, np.nan)
+        expected[4, 5] = np.nan
+        np.testing.assert_array_equal(output, expected)
+
+        # The labels are reused for the connectivity of the sieved layer
+        sieved_components = components.sieved(2)
+        self.assertEqual(sieved_components.component_count, 2)
+        self.assertEqual(sieved_components.background_count, 0)
+
+        reused_path = os.path.join(self.directory, "reused_connectivity.tif")
+        self.assertTrue(write_connectivity_layer(sieved_components, reused_path))
+        relabelled = label_components(
+            output_path, os.path.join(self.directory, "sieved_labels.tif")
+        )
+        relabelled_path = os.path.join(self.directory, "connectivity.tif")
+        self.assertTrue(write_connectivity_layer(relabelled, relabelled_path))
+        np.testing.assert_allclose(
+            read_array(reused_path), read_array(relabelled_path), equal_nan=True
+        )
+
+        components.remove()
+        relabelled.remove()
+
+    @staticmethod
+    def _full_window(grid):
+        return next(grid.windows(grid.width, grid.height))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cplus_plugin.lib import fingerprint
+from cplus_plugin.lib.fingerprint import FingerprintIndex, file_digest
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "layer.tif")
+        self.content = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.path, "wb") as f:
+            f.write(self.content)
+
+    def test_file_digest(self):
+        with patch.object(fingerprint, "READ_BUFFER_SIZE", 1024 * 1024):
+            self.assertEqual(
+                file_digest(self.path, "md5"), hashlib.md5(self.content).hexdigest()
+            )
+            self.assertEqual(
+                file_digest(self.path, "sha256"),
+                hashlib.sha256(self.content).hexdigest(),
+            )
+        empty_path = os.path.join(self.directory, "empty.tif")
+        open(empty_path, "wb").close()
+        self.assertEqual(file_digest(empty_path, "md5"), hashlib.md5().hexdigest())
+
+    def test_index_reuses_digests(self):
+        index_path = os.path.join(self.directory, "cache", "fingerprints.json")
+        index = FingerprintIndex(index_path)
+        digest = index.fingerprint(self.path, "md5")
+        self.assertEqual(digest, hashlib.md5(self.content).hexdigest())
+        index.flush()
+
+        # Saved digests are used without reading the file again
+        reloaded_index = FingerprintIndex(index_path)
+        with patch.object(fingerprint, "file_digest") as mock_digest:
+            self.assertEqual(reloaded_index.fingerprint(self.path, "md5"), digest)
+            mock_digest.assert_not_called()
+
+    def test_index_batches_saves(self):
+        index_path = os.path.join(self.directory, "cache", "fingerprints.json")
+        index = FingerprintIndex(index_path)
+        with patch.object(index, "save", wraps=index.save) as mock_save:
+            index.fingerprint(self.path, "md5")
+            index.fingerprint(self.path, "sha256")
+            mock_save.assert_not_called()
+
+            index.flush()
+            mock_save.assert_called_once()
+            index.flush()
+            mock_save.assert_called_once()
+
+        self.assertEqual(
+            FingerprintIndex(index_path).fingerprint(self.path, "sha256"),
+            hashlib.sha256(self.content).hexdigest(),
+        )
+
+    def test_index_detects_changes(self):
+        index = FingerprintIndex()
+        digest = index.fingerprint(self.path)
+        with open(self.path, "ab") as f:
+            f.write(b"changed")
+        self.assertNotEqual(index.fingerprint(self.path), digest)
+        self.assertTrue(index.is_unchanged(self.path, index.fingerprint(self.path)))
+        self.assertFalse(
+            index.is_unchanged(os.path.join(self.directory, "missing.tif"), digest)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
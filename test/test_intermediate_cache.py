@@ -0,0 +1,81 @@
+# coding=utf-8
+"""Tests for the intermediate layers cache.
+
+"""
+
+import os
+import tempfile
+import unittest
+
+from cplus_plugin.lib.raster.cache import IntermediateCache
+
+
+def write_file(path: str, size: int) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"0" * size)
+
+    return path
+
+
+class IntermediateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+        self.cache_directory = os.path.join(self.directory, "cache")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_restore_chained_steps(self):
+        source = write_file(os.path.join(self.directory, "pathway.tif"), 100)
+
+        # First run
+        cache = IntermediateCache(self.cache_directory)
+        replace_key = cache.key("replace_nodata", [source], {"nodata_value": -9999})
+        first_output = write_file(os.path.join(self.directory, "run_1", "a.tif"), 50)
+        self.assertTrue(cache.store(replace_key, first_output))
+        weighting_key = cache.key("pathway_weighting", [first_output], {"index": 1})
+
+        # Second run, the intermediate file has a different name
+        cache = IntermediateCache(self.cache_directory)
+        second_output = os.path.join(self.directory, "run_2", "b.tif")
+        replace_key = cache.key("replace_nodata", [source], {"nodata_value": -9999})
+        self.assertTrue(cache.restore(replace_key, second_output))
+        self.assertTrue(os.path.exists(second_output))
+        self.assertEqual(
+            cache.key("pathway_weighting", [second_output], {"index": 1}),
+            weighting_key,
+        )
+
+        # Changed parameters
+        other_key = cache.key("replace_nodata", [source], {"nodata_value": 0})
+        self.assertFalse(cache.restore(other_key, second_output))
+
+    def test_restored_output_modified(self):
+        source = write_file(os.path.join(self.directory, "pathway.tif"), 100)
+        cache = IntermediateCache(self.cache_directory)
+        key = cache.key("replace_nodata", [source], {"nodata_value": -9999})
+        cache.store(key, write_file(os.path.join(self.directory, "a.tif"), 50))
+
+        output = os.path.join(self.directory, "b.tif")
+        self.assertTrue(cache.restore(key, output))
+        with open(output, "ab") as f:
+            f.write(b"1")
+
+        # Changes of the restored output do not affect the cache entry
+        other_output = os.path.join(self.directory, "c.tif")
+        self.assertTrue(cache.restore(key, other_output))
+        self.assertEqual(os.path.getsize(other_output), 50)
+
+    def test_eviction(self):
+        cache = IntermediateCache(self.cache_directory, max_size_mb=0.002)
+        for index in range(3):
+            path = write_file(os.path.join(self.directory, f"{index}.tif"), 900)
+            cache.store(cache.key("step", [path], {"index": index}), path)
+
+        self.assertLessEqual(cache.size(), 0.002 * 1024 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,8 +3,11 @@
 Unit tests for metrics operations.
 """
 
+import dataclasses
 import unittest
+import uuid
 from unittest import TestCase
+from unittest.mock import patch
 
 from qgis.core import QgsExpression
 
@@ -15,11 +18,17 @@ from cplus_plugin.definitions.defaults import BASE_PLUGIN_NAME
 from cplus_plugin.gui.metrics_builder_dialog import ActivityMetricsBuilder
 from cplus_plugin.gui.metrics_builder_model import MetricColumnListItem
 from cplus_plugin.lib.reports.metrics import (
+    FUNC_CARBON_IMPACT_PROTECT,
+    active_metric_result_cache,
     create_metrics_expression_context,
     evaluate_activity_metric,
     FUNC_ACTIVITY_NPV,
     FUNC_PWL_IMPACT,
     FUNC_MEAN_BASED_IC,
+    METRIC_CALCULATIONS,
+    MetricExpressionPlan,
+    metric_function_calls,
+    metric_result_cache_scope,
     register_metric_functions,
     unregister_metric_functions,
 )
@@ -224,3 +233,110 @@ class TestMetricExpressions(TestCase):
 
         self.assertTrue(result.success)
         self.assertEqual(result.value, 1224)
+
+    def test_metric_result_cache(self):
+        """Test metric calculations are computed once per report."""
+        calls = []
+
+        def calculation(activity_id, number_jobs):
+            calls.append((activity_id, number_jobs))
+            return number_jobs * 2
+
+        register_metric_functions()
+        context = create_metrics_expression_context()
+        activity_context_info = ActivityContextInfo(self.activity, 2000)
+        with patch.dict(METRIC_CALCULATIONS, {FUNC_PWL_IMPACT: calculation}):
+            with metric_result_cache_scope() as cache:
+                cache.precompute([(ACTIVITY_UUID_STR, FUNC_PWL_IMPACT, (1.5,))])
+                for _ in range(2):
+                    result = evaluate_activity_metric(
+                        context, activity_context_info, f"{FUNC_PWL_IMPACT}(1.5)"
+                    )
+                    self.assertEqual(result.value, 3.0)
+
+                # Nested reports share the cache
+                with metric_result_cache_scope() as nested_cache:
+                    self.assertIs(nested_cache, cache)
+
+                self.assertIs(active_metric_result_cache(), cache)
+
+        self.assertEqual(calls, [(ACTIVITY_UUID_STR, 1.5)])
+        self.assertIsNone(active_metric_result_cache())
+
+    def test_metric_function_calls(self):
+        """Test the extraction of the expensive function calls of
+        a metric expression.
+        """
+        register_metric_functions()
+
+        calls = metric_function_calls(
+            f"{FUNC_PWL_IMPACT}(1.5) + {FUNC_MEAN_BASED_IC}() "
+            f"+ {FUNC_PWL_IMPACT}(1.5) + {FUNC_PWL_IMPACT}(@jobs) "
+            f"+ {FUNC_ACTIVITY_NPV}()"
+        )
+
+        self.assertCountEqual(
+            calls, [(FUNC_PWL_IMPACT, (1.5,)), (FUNC_MEAN_BASED_IC, ())]
+        )
+
+    def test_metric_expression_plan(self):
+        """Test the evaluation of compiled metric expressions."""
+        register_metric_functions()
+        plan = MetricExpressionPlan(create_metrics_expression_context())
+        area_expression = "@cplus_activity_area * 2"
+        pwl_expression = f"{FUNC_PWL_IMPACT}(1.5) + 1"
+
+        self.assertTrue(plan.add(area_expression))
+        self.assertFalse(plan.add("1 +"))
+        self.assertEqual(plan.functions(pwl_expression), {FUNC_PWL_IMPACT})
+        self.assertEqual(
+            plan.function_calls(pwl_expression), [(FUNC_PWL_IMPACT, (1.5,))]
+        )
+
+        with patch.dict(
+            METRIC_CALCULATIONS, {FUNC_PWL_IMPACT: lambda activity_id, jobs: jobs * 2}
+        ):
+            for area in (100, 200):
+                results = plan.evaluate(
+                    ActivityContextInfo(self.activity, area),
+                    [area_expression, pwl_expression, "1 +"],
+                )
+                self.assertEqual(
+                    [result.value for result in results], [area * 2, 4.0, None]
+                )
+                self.assertEqual(
+                    [result.success for result in results], [True, True, False]
+                )
+
+    def test_metric_expression_plan_activities(self):
+        """Test a compiled metric expression is evaluated for each activity
+        rather than folded when it is prepared.
+        """
+        register_metric_functions()
+        plan = MetricExpressionPlan(create_metrics_expression_context())
+        other_activity = dataclasses.replace(self.activity, uuid=uuid.uuid4())
+        activity_values = {str(self.activity.uuid): 1.0, str(other_activity.uuid): 2.0}
+        expressions = [f"{FUNC_PWL_IMPACT}(1.5)", f"{FUNC_CARBON_IMPACT_PROTECT}()"]
+        for expression in expressions:
+            self.assertTrue(plan.add(expression))
+
+        with patch.dict(
+            METRIC_CALCULATIONS,
+            {
+                FUNC_PWL_IMPACT: lambda activity_id, jobs: activity_values[activity_id]
+                * jobs,
+                FUNC_CARBON_IMPACT_PROTECT: lambda activity_id: activity_values[
+                    activity_id
+                ]
+                * 10,
+            },
+        ):
+            first_results = plan.evaluate(
+                ActivityContextInfo(self.activity, 100), expressions
+            )
+            second_results = plan.evaluate(
+                ActivityContextInfo(other_activity, 100), expressions
+            )
+
+        self.assertEqual([result.value for result in first_results], [1.5, 10.0])
+        self.assertEqual([result.value for result in second_results], [3.0, 20.0])
@@ -0,0 +1,57 @@
+# coding=utf-8
+"""Tests for the block-wise evaluation of the NCS decision tree.
+
+"""
+
+import unittest
+
+import numpy as np
+
+from cplus_plugin.lib.validation.ncs_decision_tree import evaluate_decision_tree
+
+
+class NcsDecisionTreeTest(unittest.TestCase):
+    def setUp(self):
+        # Cropland protect, wetland restore, forest restore and
+        # grassland protect pathways.
+        self.values = np.array(
+            [
+                [[1.0, 0.0, 0.0, np.nan]],
+                [[2.0, 2.0, 0.0, 0.0]],
+                [[3.0, 3.0, 3.0, 3.0]],
+                [[0.0, 0.0, 4.0, 0.0]],
+            ]
+        )
+        self.groups = {
+            "C": [0],
+            "P_c": [0],
+            "W": [1],
+            "R_w": [1],
+            "R_o": [2],
+            "R_for": [2],
+            "G": [3],
+            "P_o": [3],
+        }
+
+    def test_enforcement_order(self):
+        protect = evaluate_decision_tree(self.values, self.groups, 0)
+        np.testing.assert_array_equal(protect, np.array([[1.0, 0.0, 4.0, np.nan]]))
+
+        # No manage pathway
+        self.assertIsNone(evaluate_decision_tree(self.values, self.groups, 1))
+
+        # Cropland and protect supersede restore, forest restore is
+        # removed on native grassland.
+        restore = evaluate_decision_tree(self.values, self.groups, 2)
+        np.testing.assert_array_equal(restore, np.array([[0.0, 2.0, 0.0, np.nan]]))
+
+    def test_many_layers(self):
+        values = np.ones((40, 2, 2))
+        groups = {"P_o": list(range(40))}
+        np.testing.assert_array_equal(
+            evaluate_decision_tree(values, groups, 0), np.full((2, 2), 40.0)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# coding=utf-8
+"""Tests for the scenario analysis profiler.
+
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from cplus_plugin.lib.profiling import PROFILE_FILE_NAME, ScenarioProfiler
+
+
+class ScenarioProfilerTest(unittest.TestCase):
+    def test_nested_measurements(self):
+        profiler = ScenarioProfiler()
+        with profiler.measure("run_pathways_weighting"):
+            for _ in range(2):
+                with profiler.measure(
+                    "native:rastercalc", "algorithm", "native:rastercalc"
+                ):
+                    pass
+
+        records = profiler.records
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0].parent, "run_pathways_weighting")
+        self.assertEqual(records[-1].parent, "")
+
+        summary = {item["name"]: item for item in profiler.summary()}
+        self.assertEqual(summary["native:rastercalc"]["count"], 2)
+        self.assertEqual(summary["run_pathways_weighting"]["kind"], "stage")
+
+    def test_failed_measurement(self):
+        profiler = ScenarioProfiler()
+        with self.assertRaises(ValueError):
+            with profiler.measure("run_activities_analysis"):
+                raise ValueError()
+
+        self.assertFalse(profiler.records[0].success)
+
+    def test_write_profile(self):
+        profiler = ScenarioProfiler()
+        with profiler.measure("run_activities_analysis"):
+            pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = profiler.write(directory, {"plugin_version": "1.0"})
+            self.assertEqual(len(paths), 2)
+            with open(os.path.join(directory, f"{PROFILE_FILE_NAME}.json")) as f:
+                profile = json.load(f)
+
+        self.assertEqual(profile["metadata"]["plugin_version"], "1.0")
+        self.assertEqual(profile["records"][0]["name"], "run_activities_analysis")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,362 @@
+# coding=utf-8
+"""Tests for the block-wise raster pipeline.
+
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.core import QgsCoordinateReferenceSystem, QgsRasterLayer
+
+from cplus_plugin.lib.raster.area import (
+    PixelAreaReducer,
+    calculate_raster_areas,
+    pixel_row_areas,
+    read_area_sidecar,
+    write_area_sidecar,
+)
+from cplus_plugin.lib.raster.blocks import (
+    AlignedRaster,
+    RasterGrid,
+    highest_position,
+    nan_sum,
+)
+from cplus_plugin.lib.raster.coverage import overlap_ranges, window_coverage
+from cplus_plugin.lib.raster.memory import (
+    MIN_BLOCK_SIZE,
+    block_size_for_budget,
+    budget_bytes,
+    fits_in_budget,
+)
+from cplus_plugin.lib.raster.output import (
+    overview_factors,
+    smallest_integer_type,
+    value_fits,
+)
+from cplus_plugin.lib.raster.stack import (
+    LayerStack,
+    LayerStackNode,
+    WeightedSumNode,
+    weighted_sum,
+)
+from cplus_plugin.lib.raster.warp import resampling_algorithm, warp_to_grid
+from cplus_plugin.lib.raster.pipeline import (
+    BlockPipeline,
+    FunctionNode,
+    MinMaxReducer,
+    RasterSink,
+    RasterSourceNode,
+)
+
+
+PATHWAY_LAYERS_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "pathways", "layers"
+)
+
+
+def read_array(path: str) -> np.ndarray:
+    dataset = gdal.Open(path)
+    band = dataset.GetRasterBand(1)
+    values = band.ReadAsArray().astype(np.float64)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        values[values == nodata] = np.nan
+
+    return values
+
+
+class RasterPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.pathway_path_1 = os.path.join(
+            PATHWAY_LAYERS_DIRECTORY, "test_pathway_1.tif"
+        )
+        self.pathway_path_2 = os.path.join(
+            PATHWAY_LAYERS_DIRECTORY, "test_pathway_2.tif"
+        )
+        self.grid = RasterGrid.from_path(self.pathway_path_1)
+
+    def test_aligned_raster_read(self):
+        raster = AlignedRaster(self.pathway_path_1, self.grid)
+        windows = list(self.grid.windows(3, 3))
+        values = np.vstack(
+            [
+                np.hstack([raster.read(w) for w in windows if w.y_offset == y])
+                for y in sorted({w.y_offset for w in windows})
+            ]
+        )
+        raster.close()
+
+        self.assertFalse(raster.is_warped)
+        np.testing.assert_array_equal(values, read_array(self.pathway_path_1))
+
+    def test_pipeline_sum_and_min_max(self):
+        sum_node = FunctionNode(
+            lambda *arrays: nan_sum(arrays),
+            [
+                RasterSourceNode(self.pathway_path_1),
+                RasterSourceNode(self.pathway_path_2),
+            ],
+        )
+        reducer = MinMaxReducer(sum_node)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "sum.tif")
+            pipeline = BlockPipeline(self.grid, block_size=4)
+            completed = pipeline.run(
+                [RasterSink(sum_node, output_path, nodata=-9999.0)], [reducer]
+            )
+            self.assertTrue(completed)
+
+            expected = nan_sum(
+                [read_array(self.pathway_path_1), read_array(self.pathway_path_2)]
+            )
+            np.testing.assert_allclose(read_array(output_path), expected, rtol=1e-6)
+            self.assertAlmostEqual(reducer.minimum, np.nanmin(expected), places=5)
+            self.assertAlmostEqual(reducer.maximum, np.nanmax(expected), places=5)
+
+    def test_memory_budget(self):
+        budget = 64 * 1024 * 1024
+        block_size = block_size_for_budget(budget, 10)
+        self.assertEqual(block_size % 256, 0)
+        self.assertLessEqual(block_size * block_size * 8 * 10, budget)
+        self.assertEqual(block_size_for_budget(1024, 10), MIN_BLOCK_SIZE)
+        self.assertEqual(budget_bytes(512), 512 * 1024 * 1024)
+        self.assertGreater(budget_bytes(0), 0)
+
+        self.assertTrue(fits_in_budget(self.grid, budget))
+        self.assertFalse(fits_in_budget(self.grid, self.grid.pixel_count * 8, 2))
+
+        node = RasterSourceNode(self.pathway_path_1)
+        reducer = MinMaxReducer(node)
+        pipeline = BlockPipeline(self.grid, memory_budget=1024)
+        self.assertTrue(pipeline.run(reducers=[reducer]))
+        expected = read_array(self.pathway_path_1)
+        self.assertAlmostEqual(reducer.minimum, np.nanmin(expected), places=5)
+        self.assertAlmostEqual(reducer.maximum, np.nanmax(expected), places=5)
+
+    def test_pipeline_cancel(self):
+        node = RasterSourceNode(self.pathway_path_1)
+        pipeline = BlockPipeline(self.grid, is_cancelled=lambda: True)
+        self.assertFalse(pipeline.run(reducers=[MinMaxReducer(node)]))
+
+    def test_highest_position(self):
+        first = np.array([[1.0, np.nan], [np.nan, 2.0]])
+        second = np.array([[3.0, np.nan], [1.0, 2.0]])
+        result = highest_position([first, second])
+
+        np.testing.assert_array_equal(result, np.array([[2.0, np.nan], [2.0, 1.0]]))
+
+    def test_window_coverage(self):
+        # Fine pixels of size 1 reduced to cells of size 2 shifted by half a pixel
+        binary = np.zeros((4, 4), dtype=bool)
+        binary[0, 0] = True
+        row_lower, row_upper = overlap_ranges(0.5, 2.0, 2, 1.0, 4)
+        column_lower, column_upper = overlap_ranges(0.5, 2.0, 2, 1.0, 4)
+
+        np.testing.assert_array_equal(row_lower, np.array([0, 2]))
+        np.testing.assert_array_equal(row_upper, np.array([3, 4]))
+
+        coverage = window_coverage(
+            binary, row_lower, row_upper, column_lower, column_upper
+        )
+        self.assertAlmostEqual(coverage[0, 0], 1.0 / 9.0)
+        self.assertEqual(coverage[1, 1], 0.0)
+
+    def test_calculate_raster_areas(self):
+        layers = [
+            QgsRasterLayer(self.pathway_path_1, "pathway_1"),
+            QgsRasterLayer(self.pathway_path_2, "pathway_2"),
+        ]
+        area_infos = calculate_raster_areas(layers)
+
+        self.assertEqual(len(area_infos), 2)
+        for path, area_info in zip(
+            [self.pathway_path_1, self.pathway_path_2], area_infos
+        ):
+            values = read_array(path)
+            self.assertEqual(
+                area_info.valid_pixel_count, int(np.count_nonzero(~np.isnan(values)))
+            )
+            self.assertGreater(area_info.total_area, 0.0)
+
+    def test_highest_position_areas(self):
+        node = FunctionNode(
+            lambda *arrays: highest_position(arrays),
+            [
+                RasterSourceNode(self.pathway_path_1),
+                RasterSourceNode(self.pathway_path_2),
+            ],
+        )
+        crs = QgsCoordinateReferenceSystem.fromWkt(self.grid.crs_wkt)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "highest_position.tif")
+            reducer = PixelAreaReducer(
+                node, output_path, pixel_row_areas(self.grid, crs)
+            )
+            pipeline = BlockPipeline(self.grid, block_size=4)
+            completed = pipeline.run(
+                [
+                    RasterSink(
+                        node, output_path, data_type=gdal.GDT_Int32, nodata=-9999.0
+                    )
+                ],
+                [reducer],
+            )
+            self.assertTrue(completed)
+
+            # The areas accumulated while writing match a scan of the output
+            layer = QgsRasterLayer(output_path, "highest_position")
+            expected = calculate_raster_areas([layer])[0]
+            self.assertEqual(reducer.area_info.pixel_counts, expected.pixel_counts)
+            for value, area in expected.pixel_areas.items():
+                self.assertAlmostEqual(reducer.area_info.pixel_areas[value], area)
+
+            self.assertTrue(write_area_sidecar(reducer.area_info))
+            saved = read_area_sidecar(output_path)
+            self.assertEqual(saved.pixel_counts, expected.pixel_counts)
+
+            # Modified rasters do not use the saved areas
+            os.utime(output_path, ns=(0, 0))
+            self.assertIsNone(read_area_sidecar(output_path))
+
+    def test_layer_stack(self):
+        first = read_array(self.pathway_path_1)
+        second = read_array(self.pathway_path_2)
+
+        with LayerStack([self.pathway_path_1, self.pathway_path_2], self.grid) as stack:
+            window = next(self.grid.windows(3, 3))
+            values = stack.read(window)
+            self.assertEqual(values.shape, (2,) + window.shape)
+            np.testing.assert_array_equal(values[0], first[:3, :3])
+            np.testing.assert_array_equal(values[1], second[:3, :3])
+
+        values = np.array([[[1.0, np.nan]], [[np.nan, np.nan]]])
+        np.testing.assert_array_equal(
+            weighted_sum(values, [2.0, 1.0], 1.0, ignore_nodata=True),
+            np.array([[3.0, np.nan]]),
+        )
+
+        stack_node = LayerStackNode(
+            [self.pathway_path_1, self.pathway_path_2, self.pathway_path_1]
+        )
+        self.assertEqual(stack_node.array_count, 2)
+        sum_node = WeightedSumNode(
+            stack_node,
+            {self.pathway_path_2: 0.5},
+            offset=1.0,
+            multiplier_path=self.pathway_path_1,
+        )
+        reducer = MinMaxReducer(sum_node)
+        pipeline = BlockPipeline(self.grid, block_size=4)
+        self.assertTrue(pipeline.run(reducers=[reducer]))
+
+        expected = (0.5 * second + 1.0) * first
+        self.assertAlmostEqual(reducer.minimum, np.nanmin(expected), places=5)
+        self.assertAlmostEqual(reducer.maximum, np.nanmax(expected), places=5)
+
+    def test_cloud_optimized_output(self):
+        self.assertEqual(smallest_integer_type(0, 12), gdal.GDT_Byte)
+        self.assertEqual(smallest_integer_type(0, 300), gdal.GDT_Int16)
+        self.assertEqual(smallest_integer_type(-1, 1e10), gdal.GDT_Float64)
+        self.assertFalse(value_fits(gdal.GDT_Byte, -9999.0))
+        self.assertTrue(value_fits(gdal.GDT_Float32, -9999.0))
+        self.assertEqual(overview_factors(2000, 1000), [2, 4])
+        self.assertEqual(overview_factors(256, 256), [])
+
+        node = FunctionNode(
+            lambda *arrays: highest_position(arrays),
+            [
+                RasterSourceNode(self.pathway_path_1),
+                RasterSourceNode(self.pathway_path_2),
+            ],
+        )
+        sum_node = FunctionNode(lambda *arrays: nan_sum(arrays), list(node.inputs))
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "highest_position.tif")
+            sum_path = os.path.join(directory, "sum.tif")
+            pipeline = BlockPipeline(self.grid, block_size=4)
+            completed = pipeline.run(
+                [
+                    RasterSink(
+                        node,
+                        output_path,
+                        data_type=smallest_integer_type(0, 2),
+                        nodata=0,
+                        cloud_optimized=True,
+                        categorical=True,
+                    ),
+                    RasterSink(
+                        sum_node, sum_path, nodata=-9999.0, cloud_optimized=True
+                    ),
+                ]
+            )
+            self.assertTrue(completed)
+            # The outputs are replaced, no temporary file is left
+            self.assertEqual(
+                sorted(os.listdir(directory)), ["highest_position.tif", "sum.tif"]
+            )
+
+            dataset = gdal.Open(output_path)
+            band = dataset.GetRasterBand(1)
+            self.assertEqual(band.DataType, gdal.GDT_Byte)
+            self.assertEqual(band.GetNoDataValue(), 0)
+            self.assertEqual(
+                dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE"), "DEFLATE"
+            )
+            dataset = None
+
+            expected = highest_position(
+                [read_array(self.pathway_path_1), read_array(self.pathway_path_2)]
+            )
+            np.testing.assert_array_equal(read_array(output_path), expected)
+
+            expected = nan_sum(
+                [read_array(self.pathway_path_1), read_array(self.pathway_path_2)]
+            )
+            np.testing.assert_allclose(read_array(sum_path), expected, rtol=1e-6)
+
+    def test_warp_to_grid(self):
+        self.assertEqual(resampling_algorithm(1), "bilinear")
+        self.assertEqual(resampling_algorithm(None), "near")
+
+        grid = RasterGrid(
+            geotransform=self.grid.geotransform,
+            width=self.grid.width,
+            height=self.grid.height,
+            crs_wkt=self.grid.crs_wkt,
+            nodata=-1.0,
+        )
+        expected = read_array(self.pathway_path_1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "aligned.tif")
+            self.assertTrue(warp_to_grid(self.pathway_path_1, output_path, grid))
+            dataset = gdal.Open(output_path)
+            self.assertEqual(dataset.GetRasterBand(1).GetNoDataValue(), -1.0)
+            self.assertEqual(dataset.GetGeoTransform(), grid.geotransform)
+            dataset = None
+            np.testing.assert_allclose(read_array(output_path), expected, rtol=1e-6)
+
+            lazy_path = os.path.join(directory, "aligned.vrt")
+            self.assertTrue(
+                warp_to_grid(self.pathway_path_1, lazy_path, grid, lazy=True)
+            )
+            np.testing.assert_allclose(read_array(lazy_path), expected, rtol=1e-6)
+
+            scaled_path = os.path.join(directory, "scaled.tif")
+            self.assertTrue(
+                warp_to_grid(self.pathway_path_1, scaled_path, grid, scale=2.0)
+            )
+            np.testing.assert_allclose(
+                read_array(scaled_path), expected * 2.0, rtol=1e-6
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Tests for the raster statistics cache.
+
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from osgeo import gdal
+
+from cplus_plugin.lib.raster import statistics
+from cplus_plugin.lib.raster.statistics import (
+    RasterStatisticsCache,
+    compute_raster_statistics,
+)
+
+
+PATHWAY_LAYERS_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "pathways", "layers"
+)
+
+
+def valid_values(path: str) -> np.ndarray:
+    dataset = gdal.Open(path)
+    band = dataset.GetRasterBand(1)
+    values = band.ReadAsArray().astype(np.float64)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        values = values[values != nodata]
+
+    return values[~np.isnan(values)]
+
+
+class RasterStatisticsTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pathway_path = os.path.join(PATHWAY_LAYERS_DIRECTORY, "test_pathway_1.tif")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_compute_raster_statistics(self):
+        result = compute_raster_statistics(self.pathway_path, histogram_bins=10)
+        values = valid_values(self.pathway_path)
+
+        self.assertFalse(result.approximate)
+        self.assertEqual(result.valid_count, values.size)
+        self.assertAlmostEqual(result.minimum, values.min(), places=5)
+        self.assertAlmostEqual(result.maximum, values.max(), places=5)
+        self.assertAlmostEqual(result.mean, values.mean(), places=5)
+        self.assertEqual(sum(result.histogram), values.size)
+
+    def test_cached_statistics(self):
+        cache_directory = os.path.join(self.temp_dir.name, "statistics")
+        expected = RasterStatisticsCache(cache_directory).get(self.pathway_path)
+
+        # Saved statistics of unchanged rasters are not computed again
+        with mock.patch.object(statistics, "compute_raster_statistics") as compute_mock:
+            result = RasterStatisticsCache(cache_directory).get(self.pathway_path)
+            compute_mock.assert_not_called()
+
+        self.assertEqual(result, expected)
+
+    def test_evicted_statistics(self):
+        cache_directory = os.path.join(self.temp_dir.name, "statistics")
+        cache = RasterStatisticsCache(cache_directory, max_entries=2)
+        layer_paths = [
+            os.path.join(PATHWAY_LAYERS_DIRECTORY, f"test_pathway_{number}.tif")
+            for number in range(1, 4)
+        ]
+        for age, path in enumerate(layer_paths[:2]):
+            cache.get(path)
+            # Entries saved in the same second would have the same age
+            for entry in os.scandir(cache_directory):
+                if entry.stat().st_mtime > 10:
+                    os.utime(entry.path, (age + 1, age + 1))
+        cache.get(layer_paths[2])
+
+        # Only the most recently used entries are kept
+        self.assertEqual(len(os.listdir(cache_directory)), 2)
+        with mock.patch.object(statistics, "compute_raster_statistics") as compute_mock:
+            RasterStatisticsCache(cache_directory, max_entries=2).get(layer_paths[-1])
+            compute_mock.assert_not_called()
+
+    def test_pruned_statistics(self):
+        cache_directory = os.path.join(self.temp_dir.name, "statistics")
+        removed_path = os.path.join(self.temp_dir.name, "removed.tif")
+        gdal.Translate(removed_path, self.pathway_path)
+        cache = RasterStatisticsCache(cache_directory)
+        cache.get(self.pathway_path)
+        cache.get(removed_path)
+        self.assertEqual(len(os.listdir(cache_directory)), 2)
+
+        # Entries of rasters that no longer exist are removed when the
+        # saved entries are loaded again.
+        os.remove(removed_path)
+        RasterStatisticsCache(cache_directory)
+        self.assertEqual(len(os.listdir(cache_directory)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
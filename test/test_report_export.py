@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the export of reports to PDF.
+"""
+
+import os
+import tempfile
+import unittest
+import uuid
+from unittest.mock import patch
+
+from qgis.PyQt import QtCore
+
+from cplus_plugin.lib.reports import export, manager
+from cplus_plugin.lib.reports.export import (
+    EXPORT_TIMEOUT,
+    PdfExportJob,
+    PdfExportScheduler,
+    install_report_font,
+    python_interpreter,
+)
+from cplus_plugin.lib.reports.manager import ReportManager
+from cplus_plugin.models.report import ReportResult
+
+from utilities_for_testing import get_qgis_app
+
+
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+
+class MockProcess(QtCore.QObject):
+    """Worker process that records its arguments instead of running."""
+
+    finished = QtCore.pyqtSignal(int, QtCore.QProcess.ExitStatus)
+    errorOccurred = QtCore.pyqtSignal(QtCore.QProcess.ProcessError)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.program = None
+        self.arguments = []
+        self.killed = False
+
+    def setProcessEnvironment(self, environment):
+        pass
+
+    def setProcessChannelMode(self, mode):
+        pass
+
+    def start(self, program, arguments):
+        self.program = program
+        self.arguments = arguments
+
+    def kill(self):
+        self.killed = True
+
+    def readAll(self):
+        return QtCore.QByteArray(b"Export failed")
+
+    def timeout_timer(self) -> QtCore.QTimer:
+        return self.findChildren(QtCore.QTimer)[0]
+
+
+class TestPdfExportScheduler(unittest.TestCase):
+    """Tests for the scheduling of PDF exports."""
+
+    def test_python_interpreter(self):
+        """Test the Python interpreter used by the worker processes."""
+        interpreter = python_interpreter()
+        if interpreter is not None:
+            self.assertTrue(os.path.isfile(interpreter))
+
+    def test_install_report_font(self):
+        """Test the report font is installed in the worker processes."""
+        with patch.object(
+            export, "contains_font_family", return_value=False
+        ), patch.object(export, "install_font", return_value=True) as install_mock:
+            self.assertTrue(install_report_font())
+            install_mock.assert_called_once_with("proxima nova")
+
+        with patch.object(
+            export, "contains_font_family", return_value=False
+        ), patch.object(export, "install_font", return_value=False):
+            self.assertFalse(install_report_font())
+
+        with patch.object(
+            export, "contains_font_family", return_value=True
+        ), patch.object(export, "install_font") as install_mock:
+            self.assertTrue(install_report_font())
+            install_mock.assert_not_called()
+
+    def test_export_fallback(self):
+        """Test layouts are exported in the application without
+        worker processes.
+        """
+        layout_path = tempfile.mkstemp(suffix=".qpt")[1]
+        exported = []
+        finished = []
+
+        scheduler = PdfExportScheduler(max_processes=2)
+        scheduler._interpreter = None
+        scheduler.export_finished.connect(
+            lambda pdf_path, success: finished.append((pdf_path, success))
+        )
+        scheduler.submit(
+            PdfExportJob(
+                "project.qgz",
+                layout_path,
+                "report.pdf",
+                fallback=lambda: exported.append(True) or True,
+                temporary_layout=True,
+            )
+        )
+
+        self.assertEqual(exported, [True])
+        self.assertEqual(finished, [("report.pdf", True)])
+        self.assertEqual(scheduler.pending_count, 0)
+        self.assertFalse(os.path.exists(layout_path))
+
+    def create_scheduler(self, processes: list) -> PdfExportScheduler:
+        scheduler = PdfExportScheduler(max_processes=1)
+        scheduler._interpreter = "python3"
+
+        def create_process():
+            process = MockProcess(scheduler)
+            processes.append(process)
+            return process
+
+        scheduler._create_process = create_process
+
+        return scheduler
+
+    def test_export_process(self):
+        """Test layouts are exported by worker processes, one at a time."""
+        output_dir = tempfile.mkdtemp()
+        pdf_paths = [os.path.join(output_dir, f"report_{i}.pdf") for i in range(2)]
+        processes = []
+        finished = []
+        exported = []
+
+        scheduler = self.create_scheduler(processes)
+        scheduler.export_finished.connect(
+            lambda pdf_path, success: finished.append((pdf_path, success))
+        )
+        for pdf_path in pdf_paths:
+            scheduler.submit(
+                PdfExportJob(
+                    "project.qgz",
+                    "layout.qpt",
+                    pdf_path,
+                    fallback=lambda: exported.append(True) or True,
+                )
+            )
+
+        self.assertEqual(len(processes), 1)
+        self.assertEqual(scheduler.pending_count, 2)
+        self.assertTrue(scheduler.is_pending(pdf_paths[1]))
+        process = processes[0]
+        self.assertEqual(process.program, "python3")
+        self.assertIn(pdf_paths[0], process.arguments)
+        self.assertTrue(process.timeout_timer().isActive())
+        self.assertEqual(process.timeout_timer().interval(), EXPORT_TIMEOUT)
+
+        open(pdf_paths[0], "wb").close()
+        process.finished.emit(0, QtCore.QProcess.ExitStatus.NormalExit)
+
+        # The timeout of a finished process is stopped
+        self.assertFalse(process.timeout_timer().isActive())
+        self.assertEqual(finished, [(pdf_paths[0], True)])
+        self.assertEqual(len(processes), 2)
+        self.assertIn(pdf_paths[1], processes[1].arguments)
+
+        # The layout is exported in the application when the process fails
+        processes[1].finished.emit(1, QtCore.QProcess.ExitStatus.NormalExit)
+        self.assertEqual(exported, [True])
+        self.assertEqual(finished[-1], (pdf_paths[1], True))
+        self.assertEqual(scheduler.pending_count, 0)
+
+    def test_export_process_failed_to_start(self):
+        """Test layouts are exported in the application when the worker
+        process cannot be started.
+        """
+        processes = []
+        finished = []
+        scheduler = self.create_scheduler(processes)
+        scheduler.export_finished.connect(
+            lambda pdf_path, success: finished.append((pdf_path, success))
+        )
+        scheduler.submit(PdfExportJob("project.qgz", "layout.qpt", "report.pdf"))
+
+        processes[0].errorOccurred.emit(QtCore.QProcess.ProcessError.FailedToStart)
+
+        self.assertEqual(finished, [("report.pdf", False)])
+        self.assertEqual(scheduler.pending_count, 0)
+
+    def test_view_pdf_after_export(self):
+        """Test a PDF whose export is running is opened once exported."""
+        output_dir = tempfile.mkdtemp()
+        result = ReportResult(True, uuid.uuid4(), output_dir, base_file_name="report")
+        processes = []
+        scheduler = self.create_scheduler(processes)
+        scheduler.submit(PdfExportJob("project.qgz", "layout.qpt", result.pdf_path))
+
+        with patch.object(
+            manager, "pdf_export_scheduler", return_value=scheduler
+        ), patch.object(ReportManager, "_open_pdf", return_value=True) as open_mock:
+            self.assertTrue(ReportManager.view_pdf(result))
+            open_mock.assert_not_called()
+
+            open(result.pdf_path, "wb").close()
+            processes[0].finished.emit(0, QtCore.QProcess.ExitStatus.NormalExit)
+            open_mock.assert_called_once_with(result.pdf_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
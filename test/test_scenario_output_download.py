@@ -0,0 +1,109 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from cplus_plugin.api.base import (
+    BaseFetchScenarioOutput,
+    DOWNLOAD_MANIFEST_FILE_NAME,
+)
+
+from utilities_for_testing import get_qgis_app
+
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+
+CONTENT = {"final.tif": b"a" * 100, "activity.tif": b"b" * 50}
+
+
+class FakeFetchScenarioOutput(BaseFetchScenarioOutput):
+    """Writes the output content instead of downloading it."""
+
+    def __init__(self, failures=None):
+        super().__init__()
+        self.downloads = []
+        self.failures = failures or {}
+
+    def download_file(self, url, file_path, expected_size=None):
+        self.downloads.append(url)
+        if self.failures.get(url, 0) > 0:
+            self.failures[url] -= 1
+            return False
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(CONTENT[os.path.basename(file_path)])
+        return True
+
+
+class TestFetchScenarioOutput(unittest.TestCase):
+    def setUp(self):
+        self.scenario_directory = tempfile.mkdtemp()
+        self.output_list = {
+            "results": [
+                {
+                    "url": "http://example.com/final",
+                    "filename": "final.tif",
+                    "is_final_output": True,
+                    "output_meta": {},
+                    "size": 100,
+                    "md5": hashlib.md5(CONTENT["final.tif"]).hexdigest(),
+                },
+                {
+                    "url": "http://example.com/activity",
+                    "filename": "activity.tif",
+                    "is_final_output": False,
+                    "group": "activities",
+                },
+            ]
+        }
+
+    def fetch(self, fetcher):
+        return fetcher.fetch_scenario_output(
+            MagicMock(), {"activities": []}, self.output_list, self.scenario_directory
+        )
+
+    def test_retry_failed_downloads(self):
+        fetcher = FakeFetchScenarioOutput({"http://example.com/activity": 1})
+        scenario, scenario_result = self.fetch(fetcher)
+
+        self.assertIsNotNone(scenario)
+        self.assertEqual(fetcher.downloads.count("http://example.com/activity"), 2)
+        # Retried outputs are counted once
+        self.assertEqual(fetcher.downloaded_output, 2)
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.scenario_directory, DOWNLOAD_MANIFEST_FILE_NAME)
+            )
+        )
+
+    def test_skip_verified_outputs(self):
+        self.fetch(FakeFetchScenarioOutput())
+
+        fetcher = FakeFetchScenarioOutput()
+        scenario, scenario_result = self.fetch(fetcher)
+        self.assertIsNotNone(scenario)
+        self.assertEqual(fetcher.downloads, [])
+
+        # A modified output is downloaded again
+        with open(
+            os.path.join(self.scenario_directory, "activities", "activity.tif"), "ab"
+        ) as f:
+            f.write(b"c")
+        fetcher = FakeFetchScenarioOutput()
+        self.fetch(fetcher)
+        self.assertEqual(fetcher.downloads, ["http://example.com/activity"])
+
+    def test_checksum_mismatch(self):
+        self.output_list["results"][0]["md5"] = "0" * 32
+        fetcher = FakeFetchScenarioOutput()
+        scenario, scenario_result = self.fetch(fetcher)
+
+        self.assertIsNone(scenario)
+        self.assertEqual(fetcher.downloads.count("http://example.com/final"), 3)
+        # Outputs are only counted once their checksum is verified
+        self.assertEqual(fetcher.downloaded_output, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+# coding=utf-8
+"""Tests for the resumable upload of the scenario analysis API client.
+
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from cplus_plugin.api import scenario_task_api_client
+from cplus_plugin.api.scenario_task_api_client import ScenarioAnalysisTaskApiClient
+from cplus_plugin.conf import settings_manager
+from cplus_plugin.lib.fingerprint import file_fingerprint
+
+from utilities_for_testing import get_qgis_app
+
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+FILE_CONTENT = b"0123456789ab"
+PART_SIZE = 4
+
+
+def uploaded_part(url, chunk, part_number):
+    if url.startswith("expired"):
+        return None
+
+    return {"part_number": part_number, "etag": f"etag-{part_number}"}
+
+
+class ScenarioAnalysisTaskApiClientTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "pathway.tif")
+        with open(self.file_path, "wb") as f:
+            f.write(FILE_CONTENT)
+        self.identifier = self.file_path.replace(os.sep, "--")
+
+        # Layer mapping settings are kept in memory
+        self.layer_mapping = {}
+        for name, side_effect in [
+            ("get_layer_mapping", self.get_layer_mapping),
+            ("get_all_layer_mapping", self.get_all_layer_mapping),
+            ("save_layer_mapping", self.save_layer_mapping),
+            ("remove_layer_mapping", self.remove_layer_mapping),
+        ]:
+            patcher = patch.object(settings_manager, name, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = patch.object(scenario_task_api_client, "CHUNK_SIZE", PART_SIZE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.task = ScenarioAnalysisTaskApiClient(
+            "Scenario", "Scenario description", [], [], [], MagicMock(), None
+        )
+        self.task.request = MagicMock()
+        self.task.request.upload_file_part.side_effect = uploaded_part
+        self.task.request.start_upload_layer.return_value = {
+            "uuid": "new-layer",
+            "multipart_upload_id": "new-upload",
+            "upload_urls": [
+                {"url": f"new-{number}", "part_number": number}
+                for number in range(1, 4)
+            ],
+        }
+        self.task.request.finish_upload_layer.return_value = {
+            "uuid": "uploaded-layer",
+            "name": "pathway.tif",
+        }
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_layer_mapping(self, identifier):
+        return json.loads(self.layer_mapping.get(identifier, "{}"))
+
+    def get_all_layer_mapping(self):
+        return {key: json.loads(value) for key, value in self.layer_mapping.items()}
+
+    def save_layer_mapping(self, input_layer, identifier=None):
+        if not identifier:
+            identifier = input_layer["path"].replace(os.sep, "--")
+        self.layer_mapping[identifier] = json.dumps(input_layer)
+
+    def remove_layer_mapping(self, identifier):
+        self.layer_mapping.pop(identifier, None)
+
+    def save_unfinished_upload(self, url_prefix="old", modified_time=None, digest=None):
+        stat = os.stat(self.file_path)
+        if modified_time is None:
+            modified_time = stat.st_mtime_ns
+        self.save_layer_mapping(
+            {
+                "uuid": "old-layer",
+                "size": stat.st_size,
+                "mtime_ns": modified_time,
+                "digest": digest,
+                "name": "pathway.tif",
+                "upload_id": "old-upload",
+                "upload_urls": [
+                    {"url": f"{url_prefix}-{number}", "part_number": number}
+                    for number in range(1, 4)
+                ],
+                "component_type": "ncs_pathway",
+                "parts": [{"part_number": 1, "etag": "etag-1"}],
+                "path": self.file_path,
+            }
+        )
+
+    def test_resumed_upload_skips_confirmed_parts(self):
+        self.save_unfinished_upload()
+
+        result = self.task.run_parallel_upload({self.file_path: "ncs_pathway"})
+
+        self.assertEqual(result, [{"uuid": "uploaded-layer", "name": "pathway.tif"}])
+        self.task.request.start_upload_layer.assert_not_called()
+        uploaded = sorted(
+            (call.args[2], call.args[1])
+            for call in self.task.request.upload_file_part.call_args_list
+        )
+        self.assertEqual(uploaded, [(2, b"4567"), (3, b"89ab")])
+        self.task.request.finish_upload_layer.assert_called_once_with(
+            "old-layer",
+            "old-upload",
+            [
+                {"part_number": number, "etag": f"etag-{number}"}
+                for number in range(1, 4)
+            ],
+        )
+
+    def test_expired_upload_restarted(self):
+        self.save_unfinished_upload(url_prefix="expired")
+
+        result = self.task.run_parallel_upload({self.file_path: "ncs_pathway"})
+
+        # The digest of the new upload is kept to detect changes of the layer
+        self.assertEqual(
+            result,
+            [
+                {
+                    "uuid": "uploaded-layer",
+                    "name": "pathway.tif",
+                    "digest": file_fingerprint(self.file_path),
+                }
+            ],
+        )
+        self.task.request.abort_upload_layer.assert_called_once_with(
+            "old-layer", "old-upload"
+        )
+        self.task.request.start_upload_layer.assert_called_once_with(
+            self.file_path, "ncs_pathway"
+        )
+        # The restarted upload does not reuse the parts of the aborted one
+        self.task.request.finish_upload_layer.assert_called_once_with(
+            "new-layer",
+            "new-upload",
+            [
+                {"part_number": number, "etag": f"etag-{number}"}
+                for number in range(1, 4)
+            ],
+        )
+
+    def test_failed_new_upload_raises(self):
+        self.task.request.upload_file_part.side_effect = lambda *args: None
+
+        with self.assertRaises(Exception):
+            self.task.run_parallel_upload({self.file_path: "ncs_pathway"})
+
+        self.task.request.finish_upload_layer.assert_not_called()
+
+    def test_changed_file_upload_aborted(self):
+        self.save_unfinished_upload(modified_time=0)
+
+        upload_state = self.task.prepare_upload(self.file_path, "ncs_pathway")
+
+        self.task.request.abort_upload_layer.assert_called_once_with(
+            "old-layer", "old-upload"
+        )
+        self.assertEqual(upload_state["uuid"], "new-layer")
+        self.assertEqual(upload_state["parts"], [])
+        self.assertEqual(
+            self.get_layer_mapping(self.identifier)["upload_id"], "new-upload"
+        )
+
+    def test_unchanged_content_upload_resumed(self):
+        self.save_unfinished_upload(
+            modified_time=0, digest=file_fingerprint(self.file_path)
+        )
+
+        upload_state = self.task.prepare_upload(self.file_path, "ncs_pathway")
+
+        self.task.request.abort_upload_layer.assert_not_called()
+        self.task.request.start_upload_layer.assert_not_called()
+        self.assertEqual(upload_state["uuid"], "old-layer")
+        self.assertEqual(
+            self.get_layer_mapping(self.identifier)["mtime_ns"],
+            os.stat(self.file_path).st_mtime_ns,
+        )
+
+    def test_uploads_kept_on_error(self):
+        self.save_unfinished_upload()
+        self.task.error = Exception("Network error")
+
+        self.task.on_terminated()
+
+        self.task.request.abort_upload_layer.assert_not_called()
+        self.assertIn(self.identifier, self.layer_mapping)
+
+    def test_uploads_aborted_on_cancel(self):
+        self.save_unfinished_upload()
+
+        self.task.on_terminated()
+
+        self.task.request.abort_upload_layer.assert_called_once_with(
+            "old-layer", "old-upload"
+        )
+        self.assertNotIn(self.identifier, self.layer_mapping)
+
+    def test_check_layer_uploaded(self):
+        self.save_unfinished_upload()
+        uploaded_path = os.path.join(self.temp_dir.name, "carbon.tif")
+        self.save_layer_mapping(
+            {"uuid": "carbon-layer", "name": "carbon.tif", "path": uploaded_path}
+        )
+        self.task.request.check_layer.return_value = {
+            "available": ["carbon-layer"],
+            "unavailable": [],
+            "invalid": [],
+        }
+
+        output = self.task.check_layer_uploaded(
+            {self.file_path: "ncs_pathway", uploaded_path: "ncs_carbon"}
+        )
+
+        # Unfinished uploads are resumed without checking the server
+        self.assertEqual(output, {self.file_path: "ncs_pathway"})
+        self.task.request.check_layer.assert_called_once_with(["carbon-layer"])
+
+    def test_changed_layer_uploaded_again(self):
+        self.save_layer_mapping(
+            {
+                "uuid": "pathway-layer",
+                "name": "pathway.tif",
+                "path": self.file_path,
+                "digest": file_fingerprint(self.file_path),
+            }
+        )
+        self.task.request.check_layer.return_value = {
+            "available": ["pathway-layer"],
+            "unavailable": [],
+            "invalid": [],
+        }
+        self.assertEqual(
+            self.task.check_layer_uploaded({self.file_path: "ncs_pathway"}), {}
+        )
+
+        with open(self.file_path, "ab") as f:
+            f.write(b"changed")
+
+        self.assertEqual(
+            self.task.check_layer_uploaded({self.file_path: "ncs_pathway"}),
+            {self.file_path: "ncs_pathway"},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,12 +9,14 @@ import os
 import uuid
 import processing
 import datetime
+import tempfile
 
 from processing.core.Processing import Processing
 
 from qgis.core import QgsRasterLayer
 
 from cplus_plugin.conf import settings_manager, Settings
+from cplus_plugin.lib.raster.blocks import RasterGrid
 
 from cplus_plugin.tasks import ScenarioAnalysisTask
 from cplus_plugin.utils import FileUtils
@@ -1114,5 +1116,85 @@ class ScenarioAnalysisTaskTest(unittest.TestCase):
         self.assertEqual(result_stat.minimumValue, 0.0)
         self.assertEqual(result_stat.maximumValue, 1.0)
 
+    def test_scenario_analysis_grid_warp(self):
+        """Test warping pathways without carbon layers to the analysis grid"""
+        pathway_layer_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "data",
+            "pathways",
+            "layers",
+            "test_pathway_1.tif",
+        )
+        test_pathway = NcsPathway(
+            uuid=uuid.uuid4(),
+            name="test_pathway",
+            description="test_description",
+            path=pathway_layer_path,
+        )
+        test_activity = Activity(
+            uuid=uuid.uuid4(),
+            name="test_activity",
+            description="test_description",
+            pathways=[test_pathway],
+        )
+        scenario = Scenario(
+            uuid=uuid.uuid4(),
+            name="Scenario",
+            description="Scenario description",
+            activities=[test_activity],
+            extent=SpatialExtent([]),
+            priority_layer_groups=[],
+        )
+        analysis_task = ScenarioAnalysisTask(
+            "test_scenario_analysis_grid_warp",
+            "test_scenario_analysis_grid_warp_description",
+            [test_activity],
+            [],
+            None,
+            scenario,
+        )
+        scenario_directory = tempfile.mkdtemp()
+        analysis_task.scenario_directory = scenario_directory
+
+        grid = RasterGrid.from_path(pathway_layer_path, nodata=-9999.0)
+        self.assertTrue(analysis_task.run_analysis_grid_warp(grid))
+        self.assertFalse(analysis_task.processing_cancelled)
+
+        self.assertTrue(test_pathway.path.startswith(scenario_directory))
+        self.assertTrue(os.path.exists(test_pathway.path))
+        self.assertFalse(hasattr(test_pathway, "carbon_paths"))
+
+    def test_run_parallel_jobs(self):
+        """Test running the per-item jobs using the worker pool"""
+        analysis_task = ScenarioAnalysisTask(
+            "test_run_parallel_jobs",
+            "test_run_parallel_jobs_description",
+            [],
+            [],
+            None,
+            None,
+        )
+        settings_manager.set_value(Settings.PARALLEL_JOBS, 4)
+
+        items = [{"index": index} for index in range(10)]
+
+        def job(item, context, feedback):
+            self.assertIsNotNone(context)
+            item["result"] = item["index"] * 2
+            return True
+
+        self.assertTrue(analysis_task.run_parallel_jobs(items, job))
+        self.assertEqual(
+            [item["result"] for item in items], [index * 2 for index in range(10)]
+        )
+
+        def failing_job(item, context, feedback):
+            return item["index"] != 3
+
+        self.assertFalse(analysis_task.run_parallel_jobs(items, failing_job))
+
+        analysis_task.processing_cancelled = True
+        self.assertFalse(analysis_task.run_parallel_jobs(items, job))
+
     def tearDown(self):
         pass
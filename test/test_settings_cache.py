@@ -0,0 +1,93 @@
+# coding=utf-8
+"""Tests for the cache of the models saved in the plugin settings.
+
+"""
+
+import unittest
+from unittest import mock
+
+from cplus_plugin.conf import settings_manager
+
+from model_data_for_testing import get_activity, get_valid_ncs_pathway
+
+
+class SettingsCacheTest(unittest.TestCase):
+    """Tests the cached lookups of the settings manager."""
+
+    def setUp(self):
+        self.pathway = get_valid_ncs_pathway()
+        self.activity = get_activity()
+        self.activity.add_ncs_pathway(self.pathway)
+        self.priority_layer = {
+            "uuid": "c931282f-db2d-4644-9786-6720b3ab206a",
+            "name": "Cached priority layer",
+            "description": "Priority layer of the cache tests",
+            "selected": False,
+            "path": "",
+            "groups": [],
+        }
+
+        settings_manager.save_ncs_pathway(self.pathway)
+        settings_manager.save_activity(self.activity)
+        settings_manager.save_priority_layer(self.priority_layer)
+
+    def test_cached_lookups(self):
+        settings_manager.clear_cache()
+        # Load the entries in bulk
+        settings_manager.get_all_activities()
+        settings_manager.get_priority_layers()
+
+        with mock.patch.object(settings_manager, "_load_activities") as load_mock:
+            activity = settings_manager.get_activity(str(self.activity.uuid))
+            load_mock.assert_not_called()
+
+        self.assertEqual(activity.name, self.activity.name)
+        self.assertEqual(len(activity.pathways), 1)
+        self.assertEqual(activity.pathways[0].uuid, self.pathway.uuid)
+
+        priority_layer = settings_manager.get_priority_layer(
+            self.priority_layer["uuid"]
+        )
+        self.assertEqual(priority_layer["name"], self.priority_layer["name"])
+
+    def test_returned_models_are_copies(self):
+        pathway = settings_manager.get_ncs_pathway(str(self.pathway.uuid))
+        pathway.name = "Changed name"
+        priority_layer = settings_manager.get_priority_layer(
+            self.priority_layer["uuid"]
+        )
+        priority_layer["groups"].append({"name": "Changed group"})
+
+        self.assertEqual(
+            settings_manager.get_ncs_pathway(str(self.pathway.uuid)).name,
+            self.pathway.name,
+        )
+        self.assertEqual(
+            settings_manager.get_priority_layer(self.priority_layer["uuid"])["groups"],
+            [],
+        )
+
+    def test_cache_updated_on_save_and_remove(self):
+        self.pathway.name = "Updated NCS Pathway"
+        settings_manager.save_ncs_pathway(self.pathway)
+        self.assertEqual(
+            settings_manager.get_ncs_pathway(str(self.pathway.uuid)).name,
+            "Updated NCS Pathway",
+        )
+
+        settings_manager.remove_activity(str(self.activity.uuid))
+        self.assertIsNone(settings_manager.get_activity(str(self.activity.uuid)))
+
+        settings_manager.delete_priority_layer(self.priority_layer["uuid"])
+        self.assertIsNone(
+            settings_manager.get_priority_layer(self.priority_layer["uuid"])
+        )
+
+    def tearDown(self):
+        settings_manager.remove_activity(str(self.activity.uuid))
+        settings_manager.remove_ncs_pathway(str(self.pathway.uuid))
+        settings_manager.delete_priority_layer(self.priority_layer["uuid"])
+
+
+if __name__ == "__main__":
+    unittest.main()